@@ -0,0 +1,355 @@
+"""
+Coordinación de agentes de escaneo distribuidos por segmento de red.
+
+Cada agente (descubrir_shelly.py --agente) corre en un host de un segmento,
+declara las subredes que alcanza y consulta periódicamente si tiene tareas. Un
+trabajo de descubrimiento se divide en una tarea por agente: cada subred va al
+agente vivo cuyo segmento la contiene (el más específico). Las subredes que
+ningún agente cubre quedan informadas en el trabajo.
+
+Los agentes envían el progreso y los dispositivos encontrados por lotes; cada
+lote se guarda con un único INSERT ... ON CONFLICT. La tasa global de sondeos
+(TASA_GLOBAL) se reparte entre los agentes con tareas en curso en proporción a
+las IPs que les faltan, y se recalcula en cada respuesta. Si un agente deja de
+reportar por más de AGENTE_TIMEOUT, su tarea vuelve a la cola.
+"""
+
+import ipaddress
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de los agentes
+TASA_GLOBAL = float(os.environ.get("SHELLY_TASA_SONDEOS", "500"))   # Sondeos por segundo entre todos los agentes
+TASA_MINIMA = 5.0               # Ningún agente activo baja de esta tasa
+AGENTE_TIMEOUT = 60             # Segundos sin noticias para dar un agente por perdido
+MAX_TRABAJOS = 50               # Trabajos terminados que se conservan
+
+SQL_UPSERT = (
+    "INSERT INTO dispositivos (ip, tipo, nombre) VALUES %s "
+    "ON CONFLICT (ip) DO UPDATE SET nombre = EXCLUDED.nombre, tipo = EXCLUDED.tipo "
+    "WHERE (dispositivos.nombre, dispositivos.tipo) IS DISTINCT FROM (EXCLUDED.nombre, EXCLUDED.tipo) "
+    "RETURNING (xmax = 0)"
+)
+
+
+def _red(texto: str) -> ipaddress.IPv4Network:
+    try:
+        return ipaddress.IPv4Network(str(texto).strip(), strict=False)
+    except ValueError:
+        raise ValueError(f"Subred inválida: {texto}")
+
+
+class CoordinadorAgentes:
+    """
+    Registro de agentes, reparto de trabajos de descubrimiento y agregación del progreso
+    """
+    def __init__(self, conectar: Callable[[], Any], tasa_global: float = TASA_GLOBAL):
+        """
+        Args:
+            conectar: Devuelve una conexión psycopg2
+            tasa_global: Sondeos por segundo a repartir entre los agentes
+        """
+        self.conectar = conectar
+        self.tasa_global = tasa_global
+        self.agentes: Dict[str, Dict[str, Any]] = {}
+        self.trabajos: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.tareas: Dict[str, Dict[str, Any]] = {}
+        self.event_listeners = {'progreso': [], 'tareaFinalizada': []}
+        self._lock = Lock()
+
+    def add_event_listener(self, event_type: str, callback):
+        if event_type in self.event_listeners:
+            self.event_listeners[event_type].append(callback)
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for callback in self.event_listeners.get(event_type, []):
+            try:
+                callback(data)
+            except Exception as e:
+                logger.error(f"Error en listener {event_type}: {e}")
+
+    # ===========================
+    # Agentes
+    # ===========================
+    def registrar_agente(self, nombre: str, segmentos: Sequence[str], version: int = 1) -> Dict[str, Any]:
+        """
+        Alta o actualización de un agente
+
+        Raises:
+            ValueError: si falta el nombre o algún segmento es inválido
+        """
+        if not nombre or not segmentos:
+            raise ValueError("El agente debe indicar nombre y segmentos")
+        redes = [_red(segmento) for segmento in segmentos]
+        with self._lock:
+            agente = self.agentes.setdefault(nombre, {"nombre": nombre, "registrado": time.time()})
+            agente.update(segmentos=redes, version=version, visto=time.time())
+        logger.info(f"Agente de escaneo {nombre} registrado: {', '.join(map(str, redes))}")
+        return self._agente_publico(agente)
+
+    def _vivo(self, agente: Dict[str, Any], ahora: float) -> bool:
+        return ahora - agente["visto"] <= AGENTE_TIMEOUT
+
+    def _agente_publico(self, agente: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "nombre": agente["nombre"],
+            "segmentos": [str(red) for red in agente["segmentos"]],
+            "version": agente.get("version"),
+            "visto": agente["visto"],
+            "vivo": self._vivo(agente, time.time()),
+            "tasa": self._tasa(agente["nombre"]),
+        }
+
+    def listar_agentes(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._agente_publico(agente) for agente in self.agentes.values()]
+
+    def _agente_para(self, red: ipaddress.IPv4Network, ahora: float, excluir: Optional[str] = None) -> Optional[str]:
+        # El segmento más específico que contiene la subred, entre los agentes vivos
+        candidatos = [(segmento.prefixlen, agente["nombre"]) for agente in self.agentes.values()
+                      if agente["nombre"] != excluir and self._vivo(agente, ahora)
+                      for segmento in agente["segmentos"] if red.subnet_of(segmento)]
+        return max(candidatos)[1] if candidatos else None
+
+    # ===========================
+    # Trabajos
+    # ===========================
+    def crear_trabajo(self, subredes: Sequence[str], incremental: bool = False,
+                      usuario_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Reparte las subredes entre los agentes que las alcanzan
+
+        Raises:
+            ValueError: si no hay subredes o alguna es inválida
+        """
+        if not subredes:
+            raise ValueError("Debe proporcionar una lista de subredes")
+        redes = [_red(subred) for subred in subredes]
+        conocidos = self._conocidos() if incremental else {}
+        ahora = time.time()
+        trabajo = {"id": uuid.uuid4().hex, "creado": ahora, "terminado": None, "usuario_id": usuario_id,
+                   "incremental": incremental, "subredes": [str(red) for red in redes],
+                   "sin_agente": [], "tareas": []}
+        with self._lock:
+            por_agente: Dict[str, List[ipaddress.IPv4Network]] = {}
+            for red in redes:
+                nombre = self._agente_para(red, ahora)
+                if nombre is None:
+                    trabajo["sin_agente"].append(str(red))
+                else:
+                    por_agente.setdefault(nombre, []).append(red)
+            for nombre, asignadas in por_agente.items():
+                tarea = {
+                    "id": uuid.uuid4().hex, "trabajo_id": trabajo["id"], "agente": nombre,
+                    "subredes": [str(red) for red in asignadas], "incremental": incremental,
+                    "conocidos": {ip: datos for ip, datos in conocidos.items()
+                                  if any(ipaddress.IPv4Address(ip) in red for red in asignadas)},
+                    "estado": "pendiente", "hechas": 0, "total": sum(red.num_addresses for red in asignadas),
+                    "encontrados": 0, "agregados": 0, "actualizados": 0, "visto": None, "error": None,
+                }
+                self.tareas[tarea["id"]] = tarea
+                trabajo["tareas"].append(tarea["id"])
+            if not trabajo["tareas"]:
+                trabajo["terminado"] = ahora
+            self.trabajos[trabajo["id"]] = trabajo
+            while len(self.trabajos) > MAX_TRABAJOS:
+                _, viejo = self.trabajos.popitem(last=False)
+                for tarea_id in viejo["tareas"]:
+                    self.tareas.pop(tarea_id, None)
+            return self._trabajo_publico(trabajo)
+
+    def _conocidos(self) -> Dict[str, List[Any]]:
+        conn = self.conectar()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ip, tipo, nombre, shelly_id FROM dispositivos")
+            filas = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        conocidos = {}
+        for ip, tipo, nombre, shelly_id in filas:
+            try:
+                ipaddress.IPv4Address(ip)
+            except ValueError:
+                continue
+            conocidos[ip] = [tipo, nombre, shelly_id]
+        return conocidos
+
+    def _trabajo_publico(self, trabajo: Dict[str, Any]) -> Dict[str, Any]:
+        tareas = [self.tareas[tarea_id] for tarea_id in trabajo["tareas"] if tarea_id in self.tareas]
+        total = sum(t["total"] for t in tareas)
+        hechas = sum(t["hechas"] for t in tareas)
+        activas = [t for t in tareas if t["estado"] in ("pendiente", "ejecutando")]
+        if activas:
+            estado = "ejecutando"
+        else:
+            estado = "cancelado" if any(t["estado"] == "cancelada" for t in tareas) else "completado"
+        return {
+            "id": trabajo["id"],
+            "creado": trabajo["creado"],
+            "terminado": trabajo["terminado"],
+            "estado": estado,
+            "incremental": trabajo["incremental"],
+            "subredes": trabajo["subredes"],
+            "sin_agente": trabajo["sin_agente"],
+            "progreso": round(hechas / total, 4) if total else 1.0,
+            "hechas": hechas,
+            "total": total,
+            "encontrados": sum(t["encontrados"] for t in tareas),
+            "agregados": sum(t["agregados"] for t in tareas),
+            "actualizados": sum(t["actualizados"] for t in tareas),
+            "tareas": [{c: t[c] for c in ("id", "agente", "subredes", "estado", "hechas", "total", "encontrados",
+                                          "agregados", "actualizados", "visto", "error")} for t in tareas],
+        }
+
+    def trabajo(self, trabajo_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._revisar()
+            trabajo = self.trabajos.get(trabajo_id)
+            return self._trabajo_publico(trabajo) if trabajo else None
+
+    def cancelar_trabajo(self, trabajo_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancela las tareas que no terminaron; los agentes se enteran en su próximo envío
+        """
+        with self._lock:
+            trabajo = self.trabajos.get(trabajo_id)
+            if trabajo is None:
+                return None
+            for tarea_id in trabajo["tareas"]:
+                tarea = self.tareas.get(tarea_id)
+                if tarea and tarea["estado"] in ("pendiente", "ejecutando"):
+                    tarea.update(estado="cancelada", conocidos={})
+            if trabajo["terminado"] is None:
+                trabajo["terminado"] = time.time()
+            return self._trabajo_publico(trabajo)
+
+    def listar_trabajos(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._revisar()
+            return [self._trabajo_publico(trabajo) for trabajo in reversed(self.trabajos.values())]
+
+    # ===========================
+    # Protocolo de los agentes
+    # ===========================
+    def siguiente_tarea(self, nombre: str) -> Optional[Dict[str, Any]]:
+        """
+        Próxima tarea pendiente del agente (la marca en ejecución)
+
+        Raises:
+            KeyError: si el agente no está registrado
+        """
+        with self._lock:
+            agente = self.agentes[nombre]
+            agente["visto"] = time.time()
+            self._revisar()
+            for tarea in self.tareas.values():
+                if tarea["agente"] == nombre and tarea["estado"] == "pendiente":
+                    tarea.update(estado="ejecutando", visto=time.time())
+                    return {"id": tarea["id"], "subredes": tarea["subredes"], "incremental": tarea["incremental"],
+                            "conocidos": tarea["conocidos"], "tasa": self._tasa(nombre)}
+            return None
+
+    def reportar(self, tarea_id: str, nombre: str, datos: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Registra un lote de progreso de un agente y guarda los dispositivos encontrados
+
+        Raises:
+            KeyError: si la tarea no existe
+            PermissionError: si la tarea ya no pertenece a ese agente (fue reasignada o terminó)
+        """
+        with self._lock:
+            tarea = self.tareas[tarea_id]
+            if tarea["agente"] == nombre and tarea["estado"] == "cancelada":
+                return {"tasa": 0, "cancelada": True}
+            if tarea["agente"] != nombre or tarea["estado"] != "ejecutando":
+                raise PermissionError("La tarea fue reasignada o ya terminó")
+            ahora = time.time()
+            tarea["visto"] = ahora
+            if nombre in self.agentes:
+                self.agentes[nombre]["visto"] = ahora
+
+        dispositivos = [(str(ip), str(modelo), str(nombre_dispositivo) or "SIN_NOMBRE")
+                        for ip, modelo, nombre_dispositivo in datos.get("dispositivos") or []]
+        agregados = actualizados = 0
+        if dispositivos:
+            agregados, actualizados = self._guardar(dispositivos)
+
+        with self._lock:
+            tarea["hechas"] = min(int(datos.get("hechas", tarea["hechas"])), tarea["total"])
+            tarea["encontrados"] += len(dispositivos)
+            tarea["agregados"] += agregados
+            tarea["actualizados"] += actualizados
+            if datos.get("fin"):
+                tarea.update(estado="completada", hechas=tarea["total"], conocidos={})
+            trabajo = self.trabajos.get(tarea["trabajo_id"])
+            vista = self._trabajo_publico(trabajo) if trabajo else None
+            if vista and vista["estado"] == "completado" and trabajo["terminado"] is None:
+                trabajo["terminado"] = vista["terminado"] = time.time()
+            respuesta = {"tasa": self._tasa(nombre), "cancelada": False}
+
+        if vista:
+            self._notify_listeners('progreso', vista)
+        if datos.get("fin"):
+            self._notify_listeners('tareaFinalizada', dict(tarea, estadisticas=datos.get("estadisticas") or {}))
+        return respuesta
+
+    def _guardar(self, dispositivos: List[tuple]) -> tuple:
+        # Un lote, una sentencia: las filas sin cambios no se reescriben ni se devuelven
+        conn = self.conectar()
+        try:
+            cursor = conn.cursor()
+            filas = psycopg2.extras.execute_values(cursor, SQL_UPSERT, dispositivos, fetch=True)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        agregados = sum(1 for (insertado,) in filas if insertado)
+        return agregados, len(filas) - agregados
+
+    # ===========================
+    # Tasa de sondeos y agentes perdidos
+    # ===========================
+    def _tasa(self, nombre: str) -> float:
+        """
+        Parte de la tasa global que le toca al agente, según las IPs que le faltan
+        """
+        pendientes: Dict[str, int] = {}
+        for tarea in self.tareas.values():
+            if tarea["estado"] == "ejecutando":
+                pendientes[tarea["agente"]] = pendientes.get(tarea["agente"], 0) + tarea["total"] - tarea["hechas"]
+        total = sum(pendientes.values())
+        if not total or nombre not in pendientes:
+            return self.tasa_global
+        return round(max(TASA_MINIMA, self.tasa_global * pendientes[nombre] / total), 1)
+
+    def _revisar(self):
+        """
+        Reasigna las tareas de agentes que dejaron de reportar (se llama con el lock tomado)
+        """
+        ahora = time.time()
+        for tarea in self.tareas.values():
+            agente = self.agentes.get(tarea["agente"])
+            if tarea["estado"] == "ejecutando":
+                if ahora - (tarea["visto"] or 0) <= AGENTE_TIMEOUT:
+                    continue
+            elif tarea["estado"] != "pendiente" or (agente is not None and self._vivo(agente, ahora)):
+                continue
+            candidatos = {self._agente_para(_red(subred), ahora, excluir=tarea["agente"]) for subred in tarea["subredes"]}
+            reemplazo = candidatos.pop() if len(candidatos) == 1 and None not in candidatos else None
+            if tarea["estado"] == "pendiente" and reemplazo is None:
+                continue
+            logger.warning(f"Agente {tarea['agente']} sin noticias: tarea {tarea['id']} "
+                           f"{'reasignada a ' + reemplazo if reemplazo else 'vuelve a la cola'}")
+            tarea.update(estado="pendiente", agente=reemplazo or tarea["agente"], hechas=0,
+                         error=f"Sin noticias de {tarea['agente']}")
@@ -0,0 +1,288 @@
+"""
+Alertas sobre el flujo de potencia en vivo.
+
+- Umbrales por dispositivo o habitación con histéresis, evaluados en cada
+  actualización (sólo los umbrales del ámbito afectado).
+- Detección de anomalías periódica con NumPy: el historial reciente de toda la
+  flota vive en una matriz circular (dispositivos x minutos) y la media y el
+  desvío de todos los dispositivos se calculan en una sola pasada.
+
+Las alertas se deduplican por (tipo, ámbito, id): se notifican al activarse y
+al resolverse, no en cada evento.
+"""
+
+import json
+import logging
+import struct
+import time
+from collections import defaultdict, deque
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de alertas
+RESOLUCION = 60                 # Segundos por columna del historial
+VENTANA = 240                   # Columnas de historial (4 horas)
+MIN_MUESTRAS = 30               # Muestras mínimas para puntuar un dispositivo
+Z_UMBRAL = 4.0                  # Desvíos para considerar una lectura anómala
+DESVIO_MINIMO = 5.0             # W; evita alertas en dispositivos casi constantes
+INTERVALO_ANOMALIAS = 60        # Segundos entre pasadas de detección
+HISTORIAL_ALERTAS = 500         # Alertas resueltas que se conservan en memoria
+
+Clave = Tuple[str, int]
+
+
+class HistorialPotencia:
+    """
+    Matriz circular de potencia (float32) con una fila por dispositivo y una columna por minuto
+    """
+    def __init__(self, capacidad: int = 1024, ventana: int = VENTANA, resolucion: int = RESOLUCION):
+        self.ventana = ventana
+        self.resolucion = resolucion
+        self.datos = np.full((capacidad, ventana), np.nan, dtype=np.float32)
+        self.filas: Dict[Any, int] = {}
+        self.ids: List[Any] = []
+        self._columna_actual = int(time.time() // resolucion)
+
+    def _avanzar(self, ahora: float):
+        columna = int(ahora // self.resolucion)
+        if columna == self._columna_actual:
+            return
+        # Las actualizaciones sólo llegan cuando algo cambia: cada columna nueva arranca
+        # con el último valor conocido de cada dispositivo (como mucho la ventana completa)
+        anterior = self.datos[:, self._columna_actual % self.ventana].copy()
+        pasos = min(columna - self._columna_actual, self.ventana)
+        for c in range(columna - pasos + 1, columna + 1):
+            self.datos[:, c % self.ventana] = anterior
+        self._columna_actual = columna
+
+    def registrar(self, dispositivo_id: Any, potencia: float, ahora: Optional[float] = None):
+        ahora = ahora if ahora is not None else time.time()
+        self._avanzar(ahora)
+        fila = self.filas.get(dispositivo_id)
+        if fila is None:
+            fila = len(self.ids)
+            if fila >= self.datos.shape[0]:
+                extra = np.full_like(self.datos, np.nan)
+                self.datos = np.vstack([self.datos, extra])
+            self.filas[dispositivo_id] = fila
+            self.ids.append(dispositivo_id)
+        self.datos[fila, self._columna_actual % self.ventana] = potencia
+
+    def exportar(self) -> bytes:
+        """
+        Serializa el historial: largo de la cabecera (uint32), cabecera JSON y las filas en float32
+        """
+        cabecera = json.dumps({"ids": self.ids, "columna": self._columna_actual,
+                               "ventana": self.ventana, "resolucion": self.resolucion}).encode("utf-8")
+        # Las filas quedan alineadas a 8 bytes para poder leerlas del archivo mapeado
+        cabecera += b" " * (-(4 + len(cabecera)) % 8)
+        return struct.pack("<I", len(cabecera)) + cabecera + self.datos[:len(self.ids)].tobytes()
+
+    def restaurar(self, datos: bytes) -> bool:
+        """
+        Carga un historial exportado si la configuración coincide y todavía no hay datos propios
+        """
+        largo, = struct.unpack_from("<I", datos)
+        cabecera = json.loads(datos[4:4 + largo])
+        if self.ids or cabecera["ventana"] != self.ventana or cabecera["resolucion"] != self.resolucion:
+            return False
+        n = len(cabecera["ids"])
+        filas = np.frombuffer(datos, dtype=np.float32, count=n * self.ventana, offset=4 + largo)
+        self.datos = np.full((max(n, self.datos.shape[0]), self.ventana), np.nan, dtype=np.float32)
+        self.datos[:n] = filas.reshape(n, self.ventana)
+        self.ids = list(cabecera["ids"])
+        self.filas = {dispositivo_id: fila for fila, dispositivo_id in enumerate(self.ids)}
+        self._columna_actual = cabecera["columna"]
+        return True
+
+    def puntuar(self, ahora: Optional[float] = None) -> Tuple[List[Any], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Calcula el z-score de la última lectura de cada dispositivo contra su ventana previa
+
+        Returns:
+            (ids, z, media, ultima) para los dispositivos con suficientes muestras
+        """
+        self._avanzar(ahora if ahora is not None else time.time())
+        n = len(self.ids)
+        if n == 0:
+            return [], np.empty(0), np.empty(0), np.empty(0)
+        actual = self._columna_actual % self.ventana
+        datos = self.datos[:n]
+        ultima = datos[:, actual]
+        # Historial sin la columna actual
+        previa = np.delete(datos, actual, axis=1)
+        muestras = np.sum(~np.isnan(previa), axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media = np.nanmean(previa, axis=1)
+            desvio = np.maximum(np.nanstd(previa, axis=1), DESVIO_MINIMO)
+            z = (ultima - media) / desvio
+        validos = (muestras >= MIN_MUESTRAS) & ~np.isnan(ultima)
+        indices = np.nonzero(validos)[0]
+        return [self.ids[i] for i in indices], z[indices], media[indices], ultima[indices]
+
+
+class GestorAlertas:
+    """
+    Umbrales con histéresis, anomalías vectorizadas y deduplicación de alertas
+    """
+    def __init__(self, cargar_umbrales: Callable[[], List[Dict[str, Any]]],
+                 valores_afectados: Callable[[Dict[str, Any]], List[Tuple[Clave, float]]]):
+        """
+        Args:
+            cargar_umbrales: Devuelve los umbrales activos (id, ambito, ambito_id, limite, histeresis)
+            valores_afectados: Para una actualización devuelve [((ambito, id), potencia)] del
+                               dispositivo y su habitación (agregados del motor de reglas)
+        """
+        self.cargar_umbrales = cargar_umbrales
+        self.valores_afectados = valores_afectados
+        self.historial = HistorialPotencia()
+        self.umbrales: Dict[Clave, List[Dict[str, Any]]] = defaultdict(list)
+        self.activas: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+        self.resueltas = deque(maxlen=HISTORIAL_ALERTAS)
+        self.event_listeners = []
+        self._lock = Lock()
+
+    def add_event_listener(self, event_type: str, callback):
+        """
+        Agrega un listener para eventos de alertas ('alert', 'alertResolved')
+
+        Args:
+            event_type: Tipo de evento a escuchar
+            callback: Función a llamar cuando ocurra el evento
+        """
+        self.event_listeners.append((event_type, callback))
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for listener_type, callback in self.event_listeners:
+            if listener_type == event_type:
+                try:
+                    callback(data)
+                except Exception as e:
+                    logger.error(f"Error en event listener: {e}")
+
+    def iniciar(self):
+        """
+        Carga los umbrales y lanza el thread de detección de anomalías
+        """
+        self.recargar_umbrales()
+
+        def detector():
+            while True:
+                time.sleep(INTERVALO_ANOMALIAS)
+                try:
+                    self.detectar_anomalias()
+                except Exception as e:
+                    logger.error(f"Error en la detección de anomalías: {e}")
+
+        thread = Thread(target=detector, daemon=True)
+        thread.start()
+
+    def exportar_historial(self) -> bytes:
+        with self._lock:
+            return self.historial.exportar()
+
+    def restaurar_historial(self, datos: bytes):
+        with self._lock:
+            self.historial.restaurar(datos)
+
+    def recargar_umbrales(self):
+        umbrales = defaultdict(list)
+        for umbral in self.cargar_umbrales():
+            umbrales[(umbral["ambito"], umbral["ambito_id"])].append(umbral)
+        with self._lock:
+            self.umbrales = umbrales
+
+    # ===========================
+    # Umbrales
+    # ===========================
+    def procesar_actualizacion(self, device: Dict[str, Any]):
+        """
+        Listener de 'deviceUpdate': registra la potencia y evalúa los umbrales afectados
+        """
+        eventos = []
+        with self._lock:
+            for clave, valor in self.valores_afectados(device):
+                if clave[0] == "dispositivo":
+                    self.historial.registrar(clave[1], valor)
+                for umbral in self.umbrales.get(clave, ()):
+                    eventos.append(self._evaluar_umbral(umbral, clave, valor))
+        for evento in eventos:
+            if evento:
+                self._notify_listeners(*evento)
+
+    def _evaluar_umbral(self, umbral: Dict[str, Any], clave: Clave, valor: float):
+        id_alerta = (f"umbral:{umbral['id']}", clave[0], clave[1])
+        activa = id_alerta in self.activas
+        if not activa and valor > umbral["limite"]:
+            return self._activar(id_alerta, {
+                "tipo": "umbral",
+                "umbral_id": umbral["id"],
+                "limite": umbral["limite"],
+                "valor": valor,
+            })
+        # Histéresis: la alerta se resuelve recién por debajo de limite - histeresis
+        if activa and valor < umbral["limite"] - (umbral.get("histeresis") or 0):
+            return self._resolver(id_alerta, valor)
+        if activa:
+            self.activas[id_alerta]["valor"] = valor
+        return None
+
+    # ===========================
+    # Anomalías
+    # ===========================
+    def detectar_anomalias(self) -> int:
+        """
+        Puntúa toda la flota en una pasada vectorizada
+
+        Returns:
+            Cantidad de anomalías activas tras la pasada
+        """
+        eventos = []
+        with self._lock:
+            ids, z, media, ultima = self.historial.puntuar()
+            anomalos = set()
+            for i in np.nonzero(np.abs(z) > Z_UMBRAL)[0]:
+                id_alerta = ("anomalia", "dispositivo", ids[i])
+                anomalos.add(id_alerta)
+                if id_alerta not in self.activas:
+                    eventos.append(self._activar(id_alerta, {
+                        "tipo": "anomalia",
+                        "valor": float(ultima[i]),
+                        "media": float(media[i]),
+                        "z": float(z[i]),
+                    }))
+            puntuados = set(ids)
+            for id_alerta in [a for a in self.activas if a[0] == "anomalia"]:
+                if id_alerta not in anomalos and id_alerta[2] in puntuados:
+                    eventos.append(self._resolver(id_alerta, None))
+            total = sum(1 for a in self.activas if a[0] == "anomalia")
+        for evento in eventos:
+            self._notify_listeners(*evento)
+        return total
+
+    # ===========================
+    # Estado de alertas
+    # ===========================
+    def _activar(self, id_alerta, datos: Dict[str, Any]):
+        alerta = dict(datos, id=":".join(str(p) for p in id_alerta), ambito=id_alerta[1],
+                      ambito_id=id_alerta[2], desde=time.time())
+        self.activas[id_alerta] = alerta
+        return "alert", dict(alerta)
+
+    def _resolver(self, id_alerta, valor: Optional[float]):
+        alerta = dict(self.activas.pop(id_alerta), resuelta=time.time())
+        if valor is not None:
+            alerta["valor"] = valor
+        self.resueltas.append(alerta)
+        return "alertResolved", alerta
+
+    def get_alertas(self, incluir_resueltas: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            resultado = {"activas": list(self.activas.values())}
+            if incluir_resueltas:
+                resultado["resueltas"] = list(self.resueltas)
+        return resultado
@@ -1,29 +1,72 @@
-from flask import Flask, jsonify, request, Response, stream_with_context, redirect, url_for, session
+import os
+import modo_asincrono
+
+# El modo eventlet parchea la librería estándar: tiene que ocurrir antes de importar Flask y psycopg2
+ASYNC_MODE = modo_asincrono.modo_configurado()
+modo_asincrono.preparar(ASYNC_MODE)
+
+from flask import Flask, jsonify, request, Response, stream_with_context, redirect, url_for, session, send_file
 from flask_cors import CORS
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room
 from flask_sqlalchemy import SQLAlchemy
 import bcrypt
 import jwt
-import os
 import logging
+import logging.handlers
 import subprocess
 import time
 import psycopg2
+import requests
 import psycopg2.extras
 import json
+import queue
+from datetime import datetime, timezone
 from threading import Thread
 import functools
-from shelly_interface import ShellyInterface
+import hmac
+from shelly_interface import shared_interface
 from routes_firmware import firmware_bp
-
-# Inicializar interfaz Shelly
-shelly_interface = ShellyInterface()
+from descubrimiento_pasivo import DescubrimientoPasivo
+from agentes_descubrimiento import CoordinadorAgentes
+from sondeo_dispositivos import SondeoDirecto
+from salud_dispositivos import SaludDispositivos
+from programador import Programador, compilar, ExpresionInvalida
+from motor_reglas import MotorReglas, validar_regla, ReglaInvalida
+from alertas import GestorAlertas
+from cache_jerarquia import CacheJerarquia
+import json_rapido
+import perfil_sql
+from perfil_sql import presupuesto_sql
+from sqlalchemy import or_, tuple_
+from seguidor_logs import SeguidorLog
+from archivo_logs import AlmacenLogs
+from cola_comandos import ColaComandos, estados_reportados
+from diario_eventos import DiarioEventos, TIPOS as TIPOS_EVENTO
+import espejo_firmware
+import indice_dispositivos
+from indice_dispositivos import IndiceDispositivos
+import estadisticas_flota
+from estadisticas_flota import EstadisticasFlota
+from instantanea_estado import InstantaneaEstado
+import protocolo_delta
+from protocolo_delta import CodificadorDelta
+import exportacion
+from registro_consumos import RegistroConsumos, energia_contador
+from facturacion import MotorFacturacion
+from espejo_firmware import espejo_compartido, FirmwareInvalido
+
+# Inicializar interfaz Shelly (el sondeo de los adaptadores se lanza tras restaurar la instantánea)
+shelly_interface = shared_interface()
+
+# Espejo local de firmware (compartido con el blueprint de OTA)
+espejo = espejo_compartido()
 
 # Configuración del backend Flask
 app = Flask(__name__)
+app.json = json_rapido.ProveedorJSON(app)  # orjson si está instalado
 app.secret_key = os.urandom(24)  # Llave secreta para manejar sesiones
 jwt_secret_key = os.environ.get('JWT_SECRET_KEY', 'your_jwt_secret_key')  # Llave secreta para JWT
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
 CORS(app, resources={r"/api/*": {"origins": "*"}})  # Habilita CORS en todas las rutas con configuración explícita
 
 # Configuración de PostgreSQL
@@ -31,6 +74,9 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://shelly_user:shelly_pass@lo
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+# Cantidad y tiempo de las sentencias SQL por request (encabezados X-SQL-* y presupuestos por endpoint)
+perfil_sql.instalar(app)
+
 # Conexión directa para algunas operaciones de BD
 def get_db_connection():
     return psycopg2.connect(
@@ -38,18 +84,33 @@ def get_db_connection():
         port=5432,
         dbname="shelly_db",
         user="shelly_user",
-        password="shelly_pass"
+        password="shelly_pass",
+        connection_factory=perfil_sql.ConexionMedida
     )
 
 # Configuración de logs
 LOG_PATH = "/opt/shelly_monitoring/backend.log"
+LOG_DESCUBRIMIENTO_PATH = "/var/log/shelly_discovery.log"
 logging.basicConfig(
-    filename=LOG_PATH, 
+    # Vuelve a abrir el archivo cuando la rotación lo renombra
+    handlers=[logging.handlers.WatchedFileHandler(LOG_PATH)],
     level=logging.DEBUG, 
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 logging.getLogger().setLevel(logging.DEBUG)
-logging.info("🔧 Backend Flask iniciado.")
+logging.info(f"🔧 Backend Flask iniciado (modo {ASYNC_MODE}).")
+
+# Un único lector del log de descubrimiento compartido por todos los visores SSE
+seguidor_log_descubrimiento = SeguidorLog(LOG_DESCUBRIMIENTO_PATH)
+
+# Rotación con segmentos comprimidos e indexados por tiempo, para buscar en el historial de los logs
+almacenes_logs = {
+    'backend': AlmacenLogs(LOG_PATH),
+    'descubrimiento': AlmacenLogs(LOG_DESCUBRIMIENTO_PATH),
+}
+if os.environ.get('SHELLY_ROTACION_LOGS', '1') == '1':
+    for almacen in almacenes_logs.values():
+        almacen.iniciar()
 
 # Diccionario de roles y permisos
 roles_permissions = {
@@ -59,7 +120,8 @@ roles_permissions = {
         'update_room_order', 'start_discovery', 'view_logs', 'edit_dashboard',
         'create_user', 'create_tablero', 'delete_dashboard', 'delete_habitacion',
         'create_habitacion', 'rename_tablero', 'stream_logs', 'view_statistics', 'delete_habitacion',
-        'discover_devices', 'manage_users', 'view_consumption', 'update_device_order', 'control_devices', 'manage_devices'
+        'discover_devices', 'manage_users', 'view_consumption', 'update_device_order', 'control_devices', 'manage_devices',
+        'manage_schedules', 'manage_rules', 'manage_alerts'
     ],
     'user': ['view_devices', 'toggle_device', 'view_rooms']
 }
@@ -71,23 +133,89 @@ app.register_blueprint(firmware_bp)
 def handle_device_update(device):
     device_id = device.get('id')
     if device_id:
-        # Actualizar estado en la base de datos
-        db_device = Dispositivos.query.filter_by(id=device_id).first()
-        if db_device:
-            db_device.estado = device.get('state', False)
-            db_device.ultimo_consumo = device.get('meters', [{}])[0].get('power', 0)
-            db.session.commit()
-            
-            # Emitir evento por Socket.IO
-            socketio.emit('device_update', {
-                'id': device_id,
-                'state': device.get('state', False),
-                'power': device.get('meters', [{}])[0].get('power', 0)
-            })
+        # Los eventos llegan desde threads propios (adaptador, sondeo), fuera de cualquier request
+        with app.app_context():
+            # Actualizar estado en la base de datos
+            db_device = Dispositivos.query.filter_by(id=device_id).first()
+            if db_device:
+                estado = device.get('state', False)
+                consumo = device.get('meters', [{}])[0].get('power', 0)
+                # Cambios sólo de otros campos (online, adaptador) no requieren escribir la fila
+                if db_device.estado != estado or db_device.ultimo_consumo != consumo:
+                    db_device.estado = estado
+                    db_device.ultimo_consumo = consumo
+                    db.session.commit()
+
+                # Emitir evento por Socket.IO
+                socketio.emit('device_update', {
+                    'id': device_id,
+                    'state': device.get('state', False),
+                    'power': device.get('meters', [{}])[0].get('power', 0),
+                    'online': device.get('online', True)
+                })
 
 # Registrar el manejador de eventos
 shelly_interface.add_event_listener('deviceUpdate', handle_device_update)
 
+# Protocolo binario de deltas (opcional por cliente); 'device_update' en JSON se mantiene
+codificador_delta = CodificadorDelta()
+
+def handle_device_delta(device):
+    codificador_delta.registrar(device.get('id'), device.get('state', False), device.get('online', True),
+                                (device.get('meters') or [{}])[0].get('power', 0))
+
+@socketio.on('delta_subscribe')
+def delta_subscribe(datos=None):
+    version = (datos or {}).get('version', protocolo_delta.VERSION)
+    if version != protocolo_delta.VERSION:
+        return {"error": f"Versión de protocolo no soportada: {version}", "version": protocolo_delta.VERSION}
+    join_room(protocolo_delta.SALA)
+    emit('device_delta', codificador_delta.suscribir(request.sid))
+    return {"version": protocolo_delta.VERSION, "intervalo": codificador_delta.intervalo,
+            "max_retraso": protocolo_delta.MAX_RETRASO}
+
+@socketio.on('delta_ack')
+def delta_ack(datos):
+    codificador_delta.confirmar(request.sid, (datos or {}).get('seq', 0))
+
+@socketio.on('delta_resync')
+def delta_resync(datos=None):
+    keyframe = codificador_delta.suscribir(request.sid)
+    emit('device_delta', keyframe)
+
+@socketio.on('disconnect')
+def delta_disconnect(*args):
+    codificador_delta.baja(request.sid)
+
+if os.environ.get('SHELLY_DELTA', '1') == '1':
+    shelly_interface.add_event_listener('deviceUpdate', handle_device_delta)
+    shelly_interface.add_event_listener('deviceRestored', handle_device_delta)
+    codificador_delta.iniciar(
+        difundir=lambda trama: socketio.emit('device_delta', trama, to=protocolo_delta.SALA),
+        enviar=lambda sid, trama: socketio.emit('device_delta', trama, to=sid))
+
+# Salud de la flota: última vez visto por cualquier fuente y detección de caídas
+salud_dispositivos = SaludDispositivos()
+shelly_interface.estado_salud = salud_dispositivos.esta_online
+
+def handle_device_seen(device):
+    salud_dispositivos.registrar_visto(device.get('ip'), device.get('source', 'adapter'), device.get('online', True))
+
+def handle_device_health(estado):
+    socketio.emit('device_health', estado)
+
+shelly_interface.add_event_listener('deviceSeen', handle_device_seen)
+salud_dispositivos.add_event_listener('deviceOnline', handle_device_health)
+salud_dispositivos.add_event_listener('deviceOffline', handle_device_health)
+salud_dispositivos.iniciar()
+
+# Salud de cada adaptador (shard) del Shelly.ioAdapter
+def handle_adapter_health(estado):
+    socketio.emit('adapter_health', estado)
+
+shelly_interface.add_event_listener('adapterOnline', handle_adapter_health)
+shelly_interface.add_event_listener('adapterOffline', handle_adapter_health)
+
 # Middleware para proteger rutas
 def require_jwt(f):
     @functools.wraps(f)
@@ -131,6 +259,19 @@ def require_permission(permission):
         return decorated_function
     return decorator
 
+# Token compartido de los agentes de escaneo (descubrir_shelly.py --agente); sin token no se aceptan agentes
+AGENTES_TOKEN = os.environ.get('SHELLY_AGENTES_TOKEN', '')
+
+def require_agente(f):
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization', '')
+        token = auth_header.split(' ', 1)[1] if auth_header.startswith('Bearer ') else ''
+        if not AGENTES_TOKEN or not hmac.compare_digest(token.encode('utf-8'), AGENTES_TOKEN.encode('utf-8')):
+            return jsonify({"error": "Agente no autorizado"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
 
 # Definición de modelos
 class User(db.Model):
@@ -142,11 +283,13 @@ class User(db.Model):
     role = db.Column(db.String(20), nullable=False)
     nombre = db.Column(db.String(100), nullable=False)
 
+    # bcrypt es deliberadamente lento: en modo eventlet se ejecuta fuera del hub
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = modo_asincrono.en_hilo_nativo(
+            bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return modo_asincrono.en_hilo_nativo(bcrypt.checkpw, password.encode('utf-8'), self.password_hash.encode('utf-8'))
 
 class Tableros(db.Model):
     __tablename__ = 'tableros'
@@ -156,6 +299,8 @@ class Tableros(db.Model):
 
 class Habitaciones(db.Model):
     __tablename__ = 'habitaciones'
+    # Habitaciones de un tablero ya en el orden del dashboard
+    __table_args__ = (db.Index('habitaciones_tablero_orden_idx', 'tablero_id', 'orden', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), unique=True, nullable=False)
     tablero_id = db.Column(db.Integer, db.ForeignKey('tableros.id'), nullable=False)
@@ -163,6 +308,8 @@ class Habitaciones(db.Model):
 
 class Dispositivos(db.Model):
     __tablename__ = 'dispositivos'
+    # Dispositivos de una habitación ya en el orden del dashboard
+    __table_args__ = (db.Index('dispositivos_habitacion_orden_idx', 'habitacion_id', 'orden', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     ip = db.Column(db.String(15), unique=True, nullable=False)
@@ -171,18 +318,534 @@ class Dispositivos(db.Model):
     ultimo_consumo = db.Column(db.Float, default=0)
     estado = db.Column(db.Boolean, default=False)  # Cambiado a Boolean para compatibilidad
     orden = db.Column(db.Integer, default=0)  # Añadida columna orden para dispositivos
+    shelly_id = db.Column(db.String(64), unique=True, nullable=True)  # ID/MAC anunciado por el dispositivo
+
+class Programaciones(db.Model):
+    __tablename__ = 'programaciones'
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    objetivo_tipo = db.Column(db.String(20), nullable=False)  # dispositivo, habitacion o tablero
+    objetivo_id = db.Column(db.Integer, nullable=False)
+    accion = db.Column(db.String(10), nullable=False)  # on u off
+    tipo = db.Column(db.String(10), nullable=False)  # cron o solar
+    expresion = db.Column(db.String(100), nullable=False)
+    activa = db.Column(db.Boolean, nullable=False, default=True)
+    ultima_ejecucion = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "nombre": self.nombre,
+            "objetivo_tipo": self.objetivo_tipo,
+            "objetivo_id": self.objetivo_id,
+            "accion": self.accion,
+            "tipo": self.tipo,
+            "expresion": self.expresion,
+            "activa": self.activa,
+            "ultima_ejecucion": self.ultima_ejecucion
+        }
+
+class Reglas(db.Model):
+    __tablename__ = 'reglas'
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    ambito = db.Column(db.String(20), nullable=False)  # dispositivo, habitacion o tablero
+    ambito_id = db.Column(db.Integer, nullable=False)
+    metrica = db.Column(db.String(20), nullable=False)  # potencia, estado o encendidos
+    operador = db.Column(db.String(2), nullable=False)
+    valor = db.Column(db.Float, nullable=False)
+    durante = db.Column(db.Integer, nullable=False, default=0)  # Segundos que debe mantenerse la condición
+    accion_objetivo_tipo = db.Column(db.String(20), nullable=False)
+    accion_objetivo_id = db.Column(db.Integer, nullable=False)
+    accion_estado = db.Column(db.Boolean, nullable=False)
+    enfriamiento = db.Column(db.Integer, nullable=False, default=60)  # Segundos mínimos entre disparos
+    activa = db.Column(db.Boolean, nullable=False, default=True)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+class UmbralesAlerta(db.Model):
+    __tablename__ = 'umbrales_alerta'
+    id = db.Column(db.Integer, primary_key=True)
+    ambito = db.Column(db.String(20), nullable=False)  # dispositivo, habitacion o tablero
+    ambito_id = db.Column(db.Integer, nullable=False)
+    limite = db.Column(db.Float, nullable=False)  # W
+    histeresis = db.Column(db.Float, nullable=False, default=0)  # W por debajo del límite para resolver
+    activo = db.Column(db.Boolean, nullable=False, default=True)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+class Comandos(db.Model):
+    __tablename__ = 'comandos'
+    id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(64), nullable=False)  # IP o ID del adaptador
+    canal = db.Column(db.Integer, nullable=False, default=0)
+    estado = db.Column(db.Boolean, nullable=False)
+    dispositivo_id = db.Column(db.Integer, nullable=True)
+    origen = db.Column(db.String(20), nullable=True)  # usuario, programacion, regla...
+    usuario_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(12), nullable=False)  # pendiente, enviado, confirmado, reemplazado o fallido
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    ultimo_error = db.Column(db.Text, nullable=True)
+    creado = db.Column(db.DateTime, nullable=False)
+    actualizado = db.Column(db.DateTime, nullable=False)
+
+class Consumos(db.Model):
+    __tablename__ = 'consumos'
+    # Una muestra por dispositivo y minuto; la clave primaria sirve a las consultas por dispositivo y rango
+    dispositivo_id = db.Column(db.Integer, primary_key=True)
+    instante = db.Column(db.DateTime(timezone=True), primary_key=True)
+    potencia = db.Column(db.REAL, nullable=False)
+    estado = db.Column(db.Boolean, nullable=True)
+    energia = db.Column(db.Float, nullable=True)  # Contador de energía del dispositivo (Wh), si lo reporta
 
 class UserRoomPermission(db.Model):
     __tablename__ = 'user_room_permissions'
+    # Un permiso por par; el índice único sirve también a las búsquedas por usuario
+    __table_args__ = (
+        db.Index('user_room_permissions_usuario_habitacion_key', 'user_id', 'room_id', unique=True),
+        db.Index('user_room_permissions_habitacion_idx', 'room_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     room_id = db.Column(db.Integer, db.ForeignKey('habitaciones.id'), nullable=False)
 
+# Migraciones idempotentes para tablas ya existentes (create_all no altera columnas)
+MIGRACIONES = [
+    "ALTER TABLE dispositivos ADD COLUMN IF NOT EXISTS shelly_id VARCHAR(64)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS dispositivos_shelly_id_key ON dispositivos (shelly_id)",
+    "ALTER TABLE comandos ADD COLUMN IF NOT EXISTS usuario_id INTEGER",
+    "CREATE INDEX IF NOT EXISTS comandos_activos_idx ON comandos (clave, canal) WHERE status IN ('pendiente', 'enviado')",
+    # Las muestras se agregan en orden de tiempo: BRIN ocupa muy poco para consultas por rango de toda la flota
+    "CREATE INDEX IF NOT EXISTS consumos_instante_brin ON consumos USING brin (instante)",
+    "ALTER TABLE consumos ADD COLUMN IF NOT EXISTS energia DOUBLE PRECISION",
+    # Claves foráneas sin índice: cada filtro por habitación, tablero o usuario recorría la tabla
+    "CREATE INDEX IF NOT EXISTS dispositivos_habitacion_orden_idx ON dispositivos (habitacion_id, orden, id)",
+    "CREATE INDEX IF NOT EXISTS habitaciones_tablero_orden_idx ON habitaciones (tablero_id, orden, id)",
+    "DELETE FROM user_room_permissions a USING user_room_permissions b "
+    "WHERE a.user_id = b.user_id AND a.room_id = b.room_id AND a.id > b.id",
+    "CREATE UNIQUE INDEX IF NOT EXISTS user_room_permissions_usuario_habitacion_key ON user_room_permissions (user_id, room_id)",
+    "CREATE INDEX IF NOT EXISTS user_room_permissions_habitacion_idx ON user_room_permissions (room_id)",
+] + indice_dispositivos.TRIGGER_SQL
+
 # Crear base de datos si no existe
 with app.app_context():
     db.create_all()
+    for sentencia in MIGRACIONES:
+        db.session.execute(db.text(sentencia))
     db.session.commit()
 
+# Descubrimiento pasivo por anuncios CoIoT (Gen1) y mDNS (Gen2)
+descubrimiento_pasivo = DescubrimientoPasivo(conectar=get_db_connection)
+
+def handle_device_announced(anuncio):
+    socketio.emit('device_discovered', {
+        'shelly_id': anuncio['shelly_id'],
+        'ip': anuncio['ip'],
+        'tipo': anuncio.get('tipo'),
+        'ip_anterior': anuncio.get('ip_anterior')
+    })
+
+descubrimiento_pasivo.add_event_listener('dispositivoNuevo', handle_device_announced)
+descubrimiento_pasivo.add_event_listener('cambioIp', handle_device_announced)
+descubrimiento_pasivo.add_event_listener('anuncio', lambda anuncio: salud_dispositivos.registrar_visto(
+    anuncio['ip'], 'coiot' if anuncio.get('gen') == 1 else 'mdns'))
+if os.environ.get('SHELLY_DESCUBRIMIENTO_PASIVO', '1') == '1':
+    descubrimiento_pasivo.iniciar()
+
+# Sondeo directo de los dispositivos que el adaptador no reporta
+def dispositivos_para_sondeo():
+    # Sólo lo que los adaptadores reportan en su último sondeo: `devices` también contiene lo que
+    # publica el sondeo directo y lo restaurado de la instantánea
+    ips_adaptador = {d.get('ip') for adapter in shelly_interface.adapters for d in list(adapter.devices)}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, ip, tipo FROM dispositivos")
+        filas = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return [
+        # Los modelos Plus/Pro son Gen2; el resto se detecta en el primer sondeo
+        {"id": id_dispositivo, "ip": ip, "gen": 2 if (tipo or '').startswith(('PLUS', 'PRO')) else None}
+        for id_dispositivo, ip, tipo in filas if ip not in ips_adaptador
+    ]
+
+# Control masivo de todos los dispositivos de un dispositivo, habitación o tablero
+CONSULTAS_OBJETIVO = {
+    'dispositivo': "SELECT id, ip FROM dispositivos WHERE id = %s",
+    'habitacion': "SELECT id, ip FROM dispositivos WHERE habitacion_id = %s",
+    'tablero': "SELECT d.id, d.ip FROM dispositivos d JOIN habitaciones h ON d.habitacion_id = h.id WHERE h.tablero_id = %s",
+}
+
+def dispositivos_de_objetivo(objetivo_tipo, objetivo_id):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(CONSULTAS_OBJETIVO[objetivo_tipo], (objetivo_id,))
+        filas = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return filas
+
+# Cola persistente de comandos: las órdenes se aceptan al instante y se aplican en segundo plano
+def leer_estado_reportado(clave, canal):
+    dispositivo = shelly_interface.devices.get(clave)
+    if dispositivo is None:
+        dispositivo = next((d for d in list(shelly_interface.devices.values()) if d.get('ip') == clave), None)
+    return estados_reportados(dispositivo).get(canal) if dispositivo else None
+
+def handle_command_update(comando):
+    if comando['status'] == 'confirmado' and comando['dispositivo_id'] is not None:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE dispositivos SET estado = %s WHERE id = %s", (comando['estado'], comando['dispositivo_id']))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        socketio.emit('update_device', {"id": comando['dispositivo_id'], "estado": comando['estado']})
+    socketio.emit('command_status', comando)
+
+cola_comandos = ColaComandos(conectar=get_db_connection, enviar=shelly_interface.control_device,
+                             leer_estado=leer_estado_reportado)
+cola_comandos.add_event_listener('comandoActualizado', handle_command_update)
+shelly_interface.add_event_listener('deviceUpdate', cola_comandos.confirmar)
+if os.environ.get('SHELLY_COLA_COMANDOS', '1') == '1':
+    cola_comandos.iniciar()
+
+# Índice de búsqueda de dispositivos, sincronizado por NOTIFY desde la tabla
+indice = IndiceDispositivos()
+
+def filas_dispositivos():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute("SELECT * FROM dispositivos")
+        filas = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return filas
+
+if os.environ.get('SHELLY_INDICE', '1') == '1':
+    indice.iniciar(conectar=get_db_connection, cargar=filas_dispositivos)
+    def handle_indice_vivo(device):
+        medidor = (device.get('meters') or [{}])[0]
+        indice.actualizar_vivo(device.get('ip'), online=device.get('online', True), estado=device.get('state'),
+                               ultimo_consumo=medidor.get('power'), energia=energia_contador(medidor))
+
+    shelly_interface.add_event_listener('deviceUpdate', handle_indice_vivo)
+    # Estado sembrado desde la instantánea al arrancar: sólo actualiza la vista en memoria
+    shelly_interface.add_event_listener('deviceRestored', handle_indice_vivo)
+    salud_dispositivos.add_event_listener('deviceOnline', lambda estado: indice.actualizar_vivo(estado['ip'], online=True))
+    salud_dispositivos.add_event_listener('deviceOffline', lambda estado: indice.actualizar_vivo(estado['ip'], online=False))
+
+# Historial de consumo por minuto, muestreado desde la vista en vivo del índice.
+# Sólo los dispositivos que se sabe online: con estado desconocido (p. ej. tras reiniciar sin
+# instantánea) se deja un hueco en lugar de repetir el último consumo guardado en la base
+def muestras_consumo():
+    return [(d['id'], d.get('ultimo_consumo') or 0, d.get('estado'), d.get('energia'))
+            for d in list(indice.dispositivos.values()) if d.get('online') is True]
+
+registro_consumos = RegistroConsumos(conectar=get_db_connection, muestrear=muestras_consumo)
+if os.environ.get('SHELLY_REGISTRO_CONSUMOS', '1') == '1':
+    registro_consumos.iniciar()
+
+# Reportes de facturación: se calculan en un pool de procesos a partir del historial de consumo
+TARIFA_ARCHIVO = os.environ.get('SHELLY_TARIFA', '/opt/shelly_monitoring/tarifa.json')
+motor_facturacion = MotorFacturacion(conectar=get_db_connection)
+motor_facturacion.add_event_listener('finalizado', lambda trabajo: socketio.emit('billing_report', trabajo))
+
+def tarifa_configurada():
+    # Se lee en cada pedido: un cambio de tarifa no requiere reiniciar
+    try:
+        with open(TARIFA_ARCHIVO, 'rb') as f:
+            return json_rapido.decodificar(f.read())
+    except FileNotFoundError:
+        return None
+
+# Estadísticas de la flota, mantenidas con los cambios que publica el índice
+estadisticas = EstadisticasFlota()
+
+def cargar_tableros_estadisticas():
+    try:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, tablero_id FROM habitaciones")
+            estadisticas.fijar_tableros(cursor.fetchall())
+            cursor.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logging.error(f"Error cargando tableros para estadísticas: {e}")
+
+if os.environ.get('SHELLY_ESTADISTICAS', '1') == '1':
+    indice.add_event_listener('cargado', estadisticas.cargar)
+    indice.add_event_listener('actualizado', estadisticas.actualizar)
+    indice.add_event_listener('eliminado', estadisticas.eliminar)
+    Thread(target=cargar_tableros_estadisticas, daemon=True).start()
+    estadisticas.iniciar(emitir=lambda resumen: socketio.emit('fleet_stats', resumen))
+
+# Diario de eventos: historial de cambios de estado, comandos, caídas y descubrimientos
+diario_eventos = DiarioEventos(os.environ.get('SHELLY_DIARIO_DIR', '/opt/shelly_monitoring/diario'))
+
+def registrar_comando(comando):
+    diario_eventos.registrar('comando', comando['dispositivo'], {
+        'comando_id': comando['id'], 'status': comando['status'], 'estado': comando['estado'], 'canal': comando['canal'],
+        'origen': comando['origen'], 'usuario_id': comando['usuario_id'], 'error': comando['ultimo_error']})
+
+def registrar_salud(estado):
+    diario_eventos.registrar('online' if estado['online'] else 'offline', estado['ip'], {'fuente': estado['fuente']})
+
+def registrar_descubrimiento(anuncio):
+    tipo = 'cambio_ip' if anuncio.get('ip_anterior') else 'descubierto'
+    diario_eventos.registrar(tipo, anuncio['ip'], {
+        'shelly_id': anuncio['shelly_id'], 'tipo': anuncio.get('tipo'), 'ip_anterior': anuncio.get('ip_anterior')})
+
+if os.environ.get('SHELLY_DIARIO', '1') == '1':
+    diario_eventos.iniciar()
+    shelly_interface.add_event_listener('deviceUpdate', diario_eventos.registrar_estado)
+    cola_comandos.add_event_listener('comandoActualizado', registrar_comando)
+    salud_dispositivos.add_event_listener('deviceOnline', registrar_salud)
+    salud_dispositivos.add_event_listener('deviceOffline', registrar_salud)
+    descubrimiento_pasivo.add_event_listener('dispositivoNuevo', registrar_descubrimiento)
+    descubrimiento_pasivo.add_event_listener('cambioIp', registrar_descubrimiento)
+
+def controlar_objetivo(objetivo_tipo, objetivo_id, estado, origen=None, usuario_id=None):
+    dispositivos = dispositivos_de_objetivo(objetivo_tipo, objetivo_id)
+    comandos = cola_comandos.encolar_varios([(ip, id_dispositivo) for id_dispositivo, ip in dispositivos], 0, estado,
+                                            origen, usuario_id)
+    return {"total": len(dispositivos), "encolados": len(comandos), "comandos": [c['id'] for c in comandos]}
+
+# Programador de acciones
+def cargar_programaciones():
+    with app.app_context():
+        return [p.to_dict() for p in Programaciones.query.filter_by(activa=True).all()]
+
+def ejecutar_programacion(programacion):
+    resultado = controlar_objetivo(programacion['objetivo_tipo'], programacion['objetivo_id'], programacion['accion'] == 'on',
+                                   origen='programacion')
+    logging.info(f"Programación {programacion['id']} ({programacion['nombre']}) ejecutada: {resultado}")
+
+def registrar_ejecucion(programacion_id, instante):
+    with app.app_context():
+        Programaciones.query.filter_by(id=programacion_id).update({"ultima_ejecucion": instante})
+        db.session.commit()
+
+programador = Programador(cargar=cargar_programaciones, ejecutar=ejecutar_programacion, registrar_ejecucion=registrar_ejecucion)
+if os.environ.get('SHELLY_PROGRAMADOR', '1') == '1':
+    programador.iniciar()
+
+# Motor de reglas sobre las actualizaciones de dispositivos
+def cargar_reglas():
+    with app.app_context():
+        return [r.to_dict() for r in Reglas.query.filter_by(activa=True).all()]
+
+def cargar_topologia():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, ip, habitacion_id, estado, ultimo_consumo FROM dispositivos")
+        dispositivos = cursor.fetchall()
+        cursor.execute("SELECT id, tablero_id FROM habitaciones")
+        habitaciones = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return dispositivos, habitaciones
+
+motor_reglas = MotorReglas(cargar_reglas=cargar_reglas, cargar_topologia=cargar_topologia,
+                           ejecutar=lambda *accion: controlar_objetivo(*accion, origen='regla'))
+MOTOR_REGLAS_ACTIVO = os.environ.get('SHELLY_MOTOR_REGLAS', '1') == '1'
+if MOTOR_REGLAS_ACTIVO:
+    motor_reglas.iniciar()
+    shelly_interface.add_event_listener('deviceUpdate', motor_reglas.procesar_actualizacion)
+
+# Alertas de umbral y anomalías sobre la potencia en vivo
+def cargar_umbrales():
+    with app.app_context():
+        return [u.to_dict() for u in UmbralesAlerta.query.filter_by(activo=True).all()]
+
+# Con el motor de reglas desactivado, las alertas mantienen sus propios agregados (un motor sin reglas)
+agregados_alertas = motor_reglas if MOTOR_REGLAS_ACTIVO else MotorReglas(
+    cargar_reglas=lambda: [], cargar_topologia=cargar_topologia, ejecutar=lambda *accion: None)
+
+gestor_alertas = GestorAlertas(cargar_umbrales=cargar_umbrales, valores_afectados=agregados_alertas.valores_afectados)
+gestor_alertas.add_event_listener('alert', lambda alerta: socketio.emit('alert', alerta))
+gestor_alertas.add_event_listener('alertResolved', lambda alerta: socketio.emit('alert_resolved', alerta))
+if os.environ.get('SHELLY_ALERTAS', '1') == '1':
+    if not MOTOR_REGLAS_ACTIVO:
+        agregados_alertas.iniciar()
+        shelly_interface.add_event_listener('deviceUpdate', agregados_alertas.procesar_actualizacion)
+    gestor_alertas.iniciar()
+    # Se registra después del motor de reglas para leer los agregados ya actualizados
+    shelly_interface.add_event_listener('deviceUpdate', gestor_alertas.procesar_actualizacion)
+
+sondeo_directo = SondeoDirecto(
+    publicar=shelly_interface.update_device,
+    proveedor=dispositivos_para_sondeo,
+    visto=lambda ip: salud_dispositivos.registrar_visto(ip, 'poll')
+)
+if os.environ.get('SHELLY_SONDEO_DIRECTO', '1') == '1':
+    sondeo_directo.iniciar()
+
+# Caché de la jerarquía del dashboard, invalidada por versión global
+cache_jerarquia = CacheJerarquia()
+
+def jerarquia_modificada(topologia=False):
+    cache_jerarquia.invalidar()
+    if topologia:
+        # Cambió la pertenencia de dispositivos/habitaciones: el motor de reglas agrega por ella
+        motor_reglas.recargar_topologia()
+        if agregados_alertas is not motor_reglas:
+            agregados_alertas.recargar_topologia()
+        cargar_tableros_estadisticas()
+
+# Instantánea del estado en memoria: al reiniciar se retoma la vista previa y el primer
+# sondeo sólo propaga (a la base y a los clientes) lo que realmente cambió
+instantanea = InstantaneaEstado(os.environ.get('SHELLY_INSTANTANEA_RUTA', '/opt/shelly_monitoring/estado.snap'))
+instantanea.registrar('salud', salud_dispositivos.exportar_estado, salud_dispositivos.restaurar_estado)
+instantanea.registrar('dispositivos', shelly_interface.exportar_estado, shelly_interface.restaurar_estado)
+instantanea.registrar('jerarquia', cache_jerarquia.exportar_estado, cache_jerarquia.restaurar_estado)
+instantanea.registrar('historial_potencia', gestor_alertas.exportar_historial, gestor_alertas.restaurar_historial)
+if os.environ.get('SHELLY_INSTANTANEA', '1') == '1':
+    instantanea.restaurar()
+    instantanea.iniciar()
+# El sondeo de los adaptadores arranca recién ahora, con la vista previa ya restaurada
+shelly_interface.iniciar()
+
+def construir_dashboard(room_ids=None):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, nombre, orden FROM tableros ORDER BY orden, id")
+        tableros = cursor.fetchall()
+        if room_ids is None:
+            cursor.execute("SELECT id, nombre, tablero_id, orden FROM habitaciones ORDER BY orden, id")
+        else:
+            cursor.execute("SELECT id, nombre, tablero_id, orden FROM habitaciones WHERE id = ANY(%s) ORDER BY orden, id",
+                           (list(room_ids),))
+        habitaciones = cursor.fetchall()
+        cursor.execute(
+            "SELECT id, nombre, ip, tipo, habitacion_id, ultimo_consumo, estado, orden FROM dispositivos "
+            "WHERE habitacion_id = ANY(%s) ORDER BY orden, id",
+            ([h[0] for h in habitaciones],)
+        )
+        dispositivos = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    dispositivos_por_habitacion = {}
+    for id_dispositivo, nombre, ip, tipo, habitacion_id, ultimo_consumo, estado, orden in dispositivos:
+        dispositivos_por_habitacion.setdefault(habitacion_id, []).append({
+            "id": id_dispositivo, "nombre": nombre, "ip": ip, "tipo": tipo, "habitacion_id": habitacion_id,
+            "ultimo_consumo": ultimo_consumo, "estado": estado, "orden": orden
+        })
+    habitaciones_por_tablero = {}
+    for id_habitacion, nombre, tablero_id, orden in habitaciones:
+        habitaciones_por_tablero.setdefault(tablero_id, []).append({
+            "id": id_habitacion, "nombre": nombre, "tablero_id": tablero_id, "orden": orden,
+            "dispositivos": dispositivos_por_habitacion.get(id_habitacion, [])
+        })
+    return [
+        {"id": id_tablero, "nombre": nombre, "orden": orden, "habitaciones": habitaciones_por_tablero.get(id_tablero, [])}
+        for id_tablero, nombre, orden in tableros
+        # Los usuarios sin rol admin sólo ven los tableros con alguna habitación permitida
+        if room_ids is None or id_tablero in habitaciones_por_tablero
+    ]
+
+descubrimiento_pasivo.add_event_listener('cambioIp', lambda anuncio: jerarquia_modificada())
+
+# Listas grandes: selección de campos (?fields=), paginación por cursor (?limit=&cursor=) y streaming
+PAGINA_DEFECTO = 100
+PAGINA_MAXIMA = 1000
+
+def parametros_lista(campos_validos=None):
+    """
+    Lee ?fields=, ?limit= y ?cursor= de la petición
+
+    Args:
+        campos_validos: Campos que se pueden pedir (None acepta cualquiera)
+
+    Returns:
+        (campos o None para todos, límite o None para la colección completa, clave del cursor o None)
+
+    Raises:
+        ValueError: si algún parámetro no es válido
+    """
+    campos = None
+    if request.args.get('fields'):
+        campos = tuple(c.strip() for c in request.args['fields'].split(',') if c.strip())
+        desconocidos = [c for c in campos if campos_validos is not None and c not in campos_validos]
+        if desconocidos:
+            raise ValueError(f"Campos desconocidos: {', '.join(desconocidos)}")
+
+    limite = None
+    if request.args.get('limit'):
+        try:
+            limite = int(request.args['limit'])
+        except ValueError:
+            raise ValueError("limit debe ser un entero")
+        if not 1 <= limite <= PAGINA_MAXIMA:
+            raise ValueError(f"limit debe estar entre 1 y {PAGINA_MAXIMA}")
+
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = json_rapido.decodificar_cursor(request.args['cursor'])
+        limite = limite or PAGINA_DEFECTO
+    return campos, limite, cursor
+
+def respuesta_lista(consulta, orden, clave, serializar, limite, cursor):
+    """
+    Sin límite devuelve la colección completa codificada en streaming (cursor del lado del servidor);
+    con límite devuelve una página {"items", "next_cursor"} paginada por clave de orden
+
+    Args:
+        consulta: Consulta SQLAlchemy ya ordenada por `orden`
+        orden: Expresiones de orden (la última debe ser única, p. ej. el id)
+        clave: Función fila -> tupla con los valores de `orden`
+        serializar: Función fila -> dict
+    """
+    if cursor is not None:
+        if len(cursor) != len(orden):
+            return jsonify({"error": "Cursor inválido"}), 400
+        consulta = consulta.filter(tuple_(*orden) > tuple_(*cursor))
+
+    if limite is None:
+        filas = consulta.yield_per(json_rapido.LOTE)
+        return Response(stream_with_context(json_rapido.iterar_lista(filas, serializar)), mimetype='application/json')
+
+    filas = consulta.limit(limite + 1).all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = json_rapido.codificar_cursor(clave(filas[-1]))
+    return jsonify({"items": [serializar(f) for f in filas], "next_cursor": siguiente})
+
+def respuesta_lista_memoria(elementos, clave, campos, limite, cursor):
+    """
+    Igual que respuesta_lista() para colecciones que ya están en memoria (p. ej. las del adaptador)
+    """
+    def serializar(elemento):
+        return elemento if campos is None else {c: elemento.get(c) for c in campos}
+
+    if limite is None and cursor is None:
+        return Response(json_rapido.iterar_lista(elementos, serializar), mimetype='application/json')
+
+    elementos = sorted(elementos, key=clave)
+    if cursor is not None:
+        elementos = [e for e in elementos if clave(e) > cursor]
+    pagina = elementos[:limite]
+    siguiente = json_rapido.codificar_cursor(clave(pagina[-1])) if len(elementos) > limite else None
+    return jsonify({"items": [serializar(e) for e in pagina], "next_cursor": siguiente})
+
 # API: Login
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -232,42 +895,109 @@ def get_role_permissions(role):
     return jsonify({"permissions": permissions})
 
 # API: Obtener dispositivos
+CAMPOS_DISPOSITIVO = ("id", "nombre", "ip", "tipo", "habitacion_id", "ultimo_consumo", "estado", "orden")
+CAMPOS_DISPOSITIVO_VIVO = ("online", "fw_version", "meters")
+
 @app.route('/api/dispositivos', methods=['GET'])
 @require_jwt
 def get_dispositivos():
-    # Obtener dispositivos de la base de datos
-    db_devices = Dispositivos.query.all()
-    
-    # Obtener estado actual de los dispositivos
-    current_devices = shelly_interface.get_devices()
-    current_states = {d['id']: d for d in current_devices}
-    
+    try:
+        campos, limite, cursor = parametros_lista(CAMPOS_DISPOSITIVO + CAMPOS_DISPOSITIVO_VIVO)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    campos = campos or CAMPOS_DISPOSITIVO + CAMPOS_DISPOSITIVO_VIVO
+    campos_db = [c for c in campos if c in CAMPOS_DISPOSITIVO]
+    campos_vivo = [c for c in campos if c in CAMPOS_DISPOSITIVO_VIVO]
+
+    # Obtener estado actual de los dispositivos (adaptador y sondeo directo, por IP) sólo si se pidió
+    current_states = {}
+    if campos_vivo:
+        current_devices = shelly_interface.get_devices()
+        current_states = sondeo_directo.get_estados()
+        current_states.update({d['ip']: d for d in current_devices if d.get('ip')})
+
+    # Obtener de la base de datos sólo las columnas necesarias
+    columnas = {'id', 'ip'} | set(campos_db)
+    consulta = db.session.query(*[getattr(Dispositivos, c) for c in CAMPOS_DISPOSITIVO if c in columnas]).order_by(Dispositivos.id)
+
     # Combinar información
-    result = []
-    for db_device in db_devices:
-        device_info = {
-            "id": db_device.id,
-            "nombre": db_device.nombre,
-            "ip": db_device.ip,
-            "tipo": db_device.tipo,
-            "habitacion_id": db_device.habitacion_id,
-            "ultimo_consumo": db_device.ultimo_consumo,
-            "estado": db_device.estado,
-            "orden": db_device.orden
-        }
-        
+    def serializar(db_device):
+        device_info = {c: getattr(db_device, c) for c in campos_db}
+
         # Agregar información actual si está disponible
-        if db_device.ip in current_states:
-            current = current_states[db_device.ip]
-            device_info.update({
+        current = current_states.get(db_device.ip)
+        if current is not None:
+            actual = {
                 "online": current.get('online', True),
                 "fw_version": current.get('fw_version'),
                 "meters": current.get('meters', [])
-            })
-        
-        result.append(device_info)
-    
-    return jsonify(result)
+            }
+            device_info.update({c: actual[c] for c in campos_vivo})
+        return device_info
+
+    return respuesta_lista(consulta, [Dispositivos.id], lambda d: (d.id,), serializar, limite, cursor)
+
+def bool_parametro(nombre):
+    valor = request.args.get(nombre)
+    if valor is None or valor == '':
+        return None
+    if valor.lower() in ('true', '1'):
+        return True
+    if valor.lower() in ('false', '0'):
+        return False
+    raise ValueError(f"{nombre} debe ser true o false")
+
+# API: Búsqueda de dispositivos (typeahead y filtros combinados) sobre el índice en memoria
+@app.route('/api/dispositivos/buscar', methods=['GET'])
+@require_jwt
+def buscar_dispositivos():
+    user = User.query.get(request.user_id)
+    if not user:
+        return jsonify({"error": "Usuario no encontrado"}), 404
+    habitaciones = None
+    if user.role != 'admin':
+        habitaciones = {p.room_id for p in UserRoomPermission.query.filter_by(user_id=user.id).all()}
+
+    orden = request.args.get('sort', 'orden')
+    try:
+        _, limite, cursor = parametros_lista()
+        habitacion_id = request.args.get('habitacion_id')
+        items, siguiente = indice.buscar(
+            texto=request.args.get('q'),
+            tipo=request.args.get('tipo') or None,
+            habitacion_id=int(habitacion_id) if habitacion_id else None,
+            online=bool_parametro('online'),
+            estado=bool_parametro('estado'),
+            ip=request.args.get('ip') or None,
+            habitaciones=habitaciones,
+            orden=orden.lstrip('-'),
+            descendente=orden.startswith('-'),
+            limite=limite or indice_dispositivos.LIMITE,
+            cursor=cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "items": items,
+        "next_cursor": json_rapido.codificar_cursor(siguiente) if siguiente else None
+    })
+
+# API: Estadísticas de la flota (contadores, histogramas por tipo y mayores consumidores)
+@app.route('/api/estadisticas', methods=['GET'])
+@require_jwt
+@require_permission('view_statistics')
+def get_estadisticas():
+    try:
+        k = min(int(request.args.get('top', estadisticas_flota.TOP_K)), estadisticas_flota.TOP_K_MAXIMO)
+    except ValueError:
+        return jsonify({"error": "top debe ser un entero"}), 400
+    return jsonify(estadisticas.resumen(k=max(k, 1)))
+
+# API: Salud de los dispositivos (última vez visto, offline, flapping y disponibilidad)
+@app.route('/api/health/devices', methods=['GET'])
+@require_jwt
+def get_health_devices():
+    solo_offline = request.args.get('offline', '').lower() in ('1', 'true')
+    return jsonify(salud_dispositivos.resumen(solo_offline=solo_offline))
 
 # API: Cambiar estado de un dispositivo
 @app.route('/api/toggle_device/<int:device_id>', methods=['POST'])
@@ -275,24 +1005,277 @@ def get_dispositivos():
 def toggle_device(device_id):
     device = Dispositivos.query.get(device_id)
     if device:
-        # Obtener el estado actual
-        current_state = device.estado
-        
-        # Controlar el dispositivo a través del adaptador
-        success = shelly_interface.control_device(device.ip, 0, not current_state)
-        
-        if success:
-            device.estado = not current_state
-            db.session.commit()
-            socketio.emit('update_device', {"id": device.id, "estado": device.estado})
-            return jsonify({"message": "Estado cambiado"}), 200
-        else:
-            return jsonify({"error": "Error al controlar el dispositivo"}), 500
+        # Se invierte el último estado pedido, no el de la base: varios toggles seguidos se encadenan
+        deseado = cola_comandos.estado_deseado(device.ip, 0)
+        nuevo_estado = not (device.estado if deseado is None else deseado)
+
+        # El comando se aplica en segundo plano; el resultado llega por 'command_status'
+        comando = cola_comandos.encolar(device.ip, 0, nuevo_estado, dispositivo_id=device.id, origen='usuario',
+                                        usuario_id=request.user_id)
+        return jsonify({"message": "Comando encolado", "estado": nuevo_estado, "comando": comando}), 202
     return jsonify({"error": "Dispositivo no encontrado"}), 404
 
+# API: Controlar todos los dispositivos de un dispositivo, habitación o tablero
+@app.route('/api/control_masivo', methods=['POST'])
+@require_jwt
+@require_permission('control_devices')
+def control_masivo():
+    data = request.get_json() or {}
+    objetivo_tipo = data.get('objetivo_tipo')
+    objetivo_id = data.get('objetivo_id')
+
+    if objetivo_tipo not in CONSULTAS_OBJETIVO or objetivo_id is None or 'estado' not in data:
+        return jsonify({"error": "objetivo_tipo, objetivo_id y estado son obligatorios"}), 400
+
+    return jsonify(controlar_objetivo(objetivo_tipo, objetivo_id, bool(data['estado']), origen='usuario',
+                                      usuario_id=request.user_id)), 202
+
+# API: Órdenes en curso de la cola de comandos
+@app.route('/api/comandos', methods=['GET'])
+@require_jwt
+@require_permission('control_devices')
+def get_comandos():
+    return jsonify(cola_comandos.activos())
+
+# API: Estado de una orden (pendiente, enviado, confirmado, reemplazado o fallido)
+@app.route('/api/comandos/<int:comando_id>', methods=['GET'])
+@require_jwt
+def get_comando(comando_id):
+    comando = cola_comandos.obtener(comando_id)
+    if comando is None:
+        return jsonify({"error": "Comando no encontrado"}), 404
+    return jsonify(comando)
+
+# API: Listar programaciones
+@app.route('/api/programaciones', methods=['GET'])
+@require_jwt
+@require_permission('manage_schedules')
+def get_programaciones():
+    proximas = {p['id']: p['proxima_ejecucion'] for p in programador.proximas(limite=len(programador.programaciones))}
+    return jsonify([
+        dict(p.to_dict(), proxima_ejecucion=proximas.get(p.id))
+        for p in Programaciones.query.order_by(Programaciones.id).all()
+    ])
+
+def validar_programacion(data):
+    if data.get('objetivo_tipo') not in CONSULTAS_OBJETIVO:
+        return "objetivo_tipo debe ser dispositivo, habitacion o tablero"
+    if data.get('objetivo_id') is None:
+        return "El objetivo_id es requerido"
+    if data.get('accion') not in ('on', 'off'):
+        return "La acción debe ser on u off"
+    try:
+        # Compila y además busca la próxima ejecución: hay expresiones válidas que nunca se cumplen
+        compilar(data.get('tipo'), data.get('expresion') or '').siguiente(datetime.now())
+    except ExpresionInvalida as e:
+        return f"Expresión inválida: {e}"
+    return None
+
+# API: Crear una programación
+@app.route('/api/programaciones', methods=['POST'])
+@require_jwt
+@require_permission('manage_schedules')
+def crear_programacion():
+    data = request.get_json() or {}
+    error = validar_programacion(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    programacion = Programaciones(
+        nombre=data.get('nombre') or f"{data['accion']} {data['objetivo_tipo']} {data['objetivo_id']}",
+        objetivo_tipo=data['objetivo_tipo'],
+        objetivo_id=data['objetivo_id'],
+        accion=data['accion'],
+        tipo=data['tipo'],
+        expresion=data['expresion'],
+        activa=bool(data.get('activa', True))
+    )
+    db.session.add(programacion)
+    db.session.commit()
+    programador.actualizar(programacion.to_dict())
+    return jsonify(programacion.to_dict()), 201
+
+# API: Modificar una programación
+@app.route('/api/programaciones/<int:programacion_id>', methods=['PUT'])
+@require_jwt
+@require_permission('manage_schedules')
+def actualizar_programacion(programacion_id):
+    programacion = Programaciones.query.get(programacion_id)
+    if not programacion:
+        return jsonify({"error": "Programación no encontrada"}), 404
+
+    data = dict(programacion.to_dict(), **(request.get_json() or {}))
+    error = validar_programacion(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    for campo in ('nombre', 'objetivo_tipo', 'objetivo_id', 'accion', 'tipo', 'expresion'):
+        setattr(programacion, campo, data[campo])
+    programacion.activa = bool(data['activa'])
+    db.session.commit()
+    programador.actualizar(programacion.to_dict())
+    return jsonify(programacion.to_dict()), 200
+
+# API: Eliminar una programación
+@app.route('/api/programaciones/<int:programacion_id>', methods=['DELETE'])
+@require_jwt
+@require_permission('manage_schedules')
+def eliminar_programacion(programacion_id):
+    programacion = Programaciones.query.get(programacion_id)
+    if not programacion:
+        return jsonify({"error": "Programación no encontrada"}), 404
+    db.session.delete(programacion)
+    db.session.commit()
+    programador.eliminar(programacion_id)
+    return jsonify({"message": "Programación eliminada correctamente"}), 200
+
+# API: Listar reglas
+@app.route('/api/reglas', methods=['GET'])
+@require_jwt
+@require_permission('manage_rules')
+def get_reglas():
+    return jsonify([r.to_dict() for r in Reglas.query.order_by(Reglas.id).all()])
+
+# API: Potencia y encendidos por habitación y tablero (agregados del motor de reglas)
+@app.route('/api/reglas/agregados', methods=['GET'])
+@require_jwt
+def get_agregados_reglas():
+    return jsonify(motor_reglas.get_agregados())
+
+CAMPOS_REGLA = ('nombre', 'ambito', 'ambito_id', 'metrica', 'operador', 'valor', 'durante',
+                'accion_objetivo_tipo', 'accion_objetivo_id', 'accion_estado', 'enfriamiento', 'activa')
+
+# API: Crear una regla
+@app.route('/api/reglas', methods=['POST'])
+@require_jwt
+@require_permission('manage_rules')
+def crear_regla():
+    data = request.get_json() or {}
+    try:
+        validar_regla(data)
+    except ReglaInvalida as e:
+        return jsonify({"error": str(e)}), 400
+
+    regla = Reglas(**{campo: data[campo] for campo in CAMPOS_REGLA if campo in data})
+    if not regla.nombre:
+        regla.nombre = f"{data['ambito']} {data['ambito_id']} {data['metrica']} {data['operador']} {data['valor']}"
+    db.session.add(regla)
+    db.session.commit()
+    motor_reglas.actualizar_regla(regla.to_dict())
+    return jsonify(regla.to_dict()), 201
+
+# API: Modificar una regla
+@app.route('/api/reglas/<int:regla_id>', methods=['PUT'])
+@require_jwt
+@require_permission('manage_rules')
+def actualizar_regla(regla_id):
+    regla = Reglas.query.get(regla_id)
+    if not regla:
+        return jsonify({"error": "Regla no encontrada"}), 404
+
+    data = dict(regla.to_dict(), **(request.get_json() or {}))
+    try:
+        validar_regla(data)
+    except ReglaInvalida as e:
+        return jsonify({"error": str(e)}), 400
+
+    for campo in CAMPOS_REGLA:
+        setattr(regla, campo, data[campo])
+    db.session.commit()
+    motor_reglas.actualizar_regla(regla.to_dict())
+    return jsonify(regla.to_dict()), 200
+
+# API: Eliminar una regla
+@app.route('/api/reglas/<int:regla_id>', methods=['DELETE'])
+@require_jwt
+@require_permission('manage_rules')
+def eliminar_regla(regla_id):
+    regla = Reglas.query.get(regla_id)
+    if not regla:
+        return jsonify({"error": "Regla no encontrada"}), 404
+    db.session.delete(regla)
+    db.session.commit()
+    motor_reglas.eliminar_regla(regla_id)
+    return jsonify({"message": "Regla eliminada correctamente"}), 200
+
+# API: Alertas activas (y opcionalmente las resueltas recientes)
+@app.route('/api/alertas', methods=['GET'])
+@require_jwt
+def get_alertas():
+    incluir_resueltas = request.args.get('resueltas', '').lower() in ('1', 'true')
+    return jsonify(gestor_alertas.get_alertas(incluir_resueltas=incluir_resueltas))
+
+# API: Listar umbrales de alerta
+@app.route('/api/alertas/umbrales', methods=['GET'])
+@require_jwt
+@require_permission('manage_alerts')
+def get_umbrales_alerta():
+    return jsonify([u.to_dict() for u in UmbralesAlerta.query.order_by(UmbralesAlerta.id).all()])
+
+# API: Crear un umbral de alerta
+@app.route('/api/alertas/umbrales', methods=['POST'])
+@require_jwt
+@require_permission('manage_alerts')
+def crear_umbral_alerta():
+    data = request.get_json() or {}
+    if data.get('ambito') not in CONSULTAS_OBJETIVO or data.get('ambito_id') is None:
+        return jsonify({"error": "ambito debe ser dispositivo, habitacion o tablero, con ambito_id"}), 400
+    try:
+        limite = float(data.get('limite'))
+        histeresis = float(data.get('histeresis') or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "limite e histeresis deben ser numéricos"}), 400
+
+    umbral = UmbralesAlerta(ambito=data['ambito'], ambito_id=data['ambito_id'], limite=limite,
+                            histeresis=histeresis, activo=bool(data.get('activo', True)))
+    db.session.add(umbral)
+    db.session.commit()
+    gestor_alertas.recargar_umbrales()
+    return jsonify(umbral.to_dict()), 201
+
+# API: Eliminar un umbral de alerta
+@app.route('/api/alertas/umbrales/<int:umbral_id>', methods=['DELETE'])
+@require_jwt
+@require_permission('manage_alerts')
+def eliminar_umbral_alerta(umbral_id):
+    umbral = UmbralesAlerta.query.get(umbral_id)
+    if not umbral:
+        return jsonify({"error": "Umbral no encontrado"}), 404
+    db.session.delete(umbral)
+    db.session.commit()
+    gestor_alertas.recargar_umbrales()
+    return jsonify({"message": "Umbral eliminado correctamente"}), 200
+
+# API: Jerarquía completa del dashboard (tableros → habitaciones → dispositivos) en una sola respuesta
+@app.route('/api/dashboard', methods=['GET'])
+@require_jwt
+@presupuesto_sql(5)
+def get_dashboard():
+    """
+    Devuelve el árbol filtrado por permisos, ordenado por `orden` en cada nivel.
+    El estado y consumo de los dispositivos son los de la última reconstrucción;
+    los valores en vivo llegan por Socket.IO ('device_update').
+    """
+    user = User.query.get(request.user_id)
+    if not user:
+        return jsonify({"error": "Usuario no encontrado"}), 404
+
+    if user.role == 'admin':
+        clave, room_ids = 'admin', None
+    else:
+        room_ids = frozenset(p.room_id for p in UserRoomPermission.query.filter_by(user_id=user.id).all())
+        clave = room_ids
+
+    etag, cuerpo = cache_jerarquia.obtener(clave, lambda: construir_dashboard(room_ids))
+    respuesta = Response(cuerpo, mimetype='application/json')
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta.make_conditional(request)
+
 # API: Obtener habitaciones con permisos del usuario
 @app.route('/api/habitaciones', methods=['GET'])
 @require_jwt
+@presupuesto_sql(2)
 def get_habitaciones():
     user_id = request.user_id
     user = User.query.get(user_id)
@@ -300,15 +1283,15 @@ def get_habitaciones():
     if user.role == 'admin':
         habitaciones = Habitaciones.query.all()
     else:
-        permisos = UserRoomPermission.query.filter_by(user_id=user_id).all()
-        room_ids = [permiso.room_id for permiso in permisos]
-        habitaciones = Habitaciones.query.filter(Habitaciones.id.in_(room_ids)).all()
+        habitaciones = Habitaciones.query.join(UserRoomPermission, UserRoomPermission.room_id == Habitaciones.id) \
+            .filter(UserRoomPermission.user_id == user_id).all()
 
     return jsonify([{ "id": h.id, "nombre": h.nombre, "tablero_id": h.tablero_id } for h in habitaciones])
 
 # API: Obtener habitaciones por tablero
 @app.route('/api/tableros/<int:tablero_id>/habitaciones', methods=['GET'])
 @require_jwt
+@presupuesto_sql(1)
 def get_habitaciones_by_tablero(tablero_id):
     habitaciones = Habitaciones.query.filter_by(tablero_id=tablero_id).all()
     return jsonify([{ "id": h.id, "nombre": h.nombre, "tablero_id": h.tablero_id } for h in habitaciones])
@@ -321,6 +1304,7 @@ def eliminar_habitacion(habitacion_id):
     if habitacion:
         db.session.delete(habitacion)
         db.session.commit()
+        jerarquia_modificada(topologia=True)
         return jsonify({"message": "Habitación eliminada correctamente"}), 200
     return jsonify({"error": "Habitación no encontrada"}), 404
 
@@ -344,6 +1328,7 @@ def crear_habitacion():
     nueva_habitacion = Habitaciones(nombre=nombre, tablero_id=tablero_id)
     db.session.add(nueva_habitacion)
     db.session.commit()
+    jerarquia_modificada()
 
     return jsonify({
         "id": nueva_habitacion.id,
@@ -354,6 +1339,7 @@ def crear_habitacion():
 # API: Obtener lista de tableros
 @app.route('/api/tableros', methods=['GET'])
 @require_jwt
+@presupuesto_sql(1)
 def get_tableros():
     tableros = Tableros.query.all()
     return jsonify([{ "id": t.id, "nombre": t.nombre } for t in tableros])
@@ -374,6 +1360,7 @@ def crear_tablero():
     nuevo_tablero = Tableros(nombre=nombre)
     db.session.add(nuevo_tablero)
     db.session.commit()
+    jerarquia_modificada()
     
     return jsonify({"id": nuevo_tablero.id, "nombre": nuevo_tablero.nombre}), 201
 
@@ -395,19 +1382,31 @@ def eliminar_tablero(tablero_id):
 
     db.session.delete(tablero)
     db.session.commit()
+    jerarquia_modificada()
     return jsonify({"message": "Tablero eliminado correctamente"}), 200
 
+# Reordenamientos en una sola sentencia, sin importar cuántos elementos se mueven
+def actualizar_orden(tabla, data):
+    """
+    Args:
+        tabla: 'tableros', 'habitaciones' o 'dispositivos'
+        data: [{"id", "orden"}, ...]; los IDs que no existen se ignoran
+    """
+    db.session.execute(db.text(
+        f"UPDATE {tabla} t SET orden = n.orden "
+        "FROM unnest(CAST(:ids AS integer[]), CAST(:ordenes AS integer[])) AS n(id, orden) "
+        "WHERE t.id = n.id AND t.orden IS DISTINCT FROM n.orden"
+    ), {"ids": [int(item['id']) for item in data], "ordenes": [int(item['orden']) for item in data]})
+    db.session.commit()
+
 # API: Actualizar orden de tableros
 @app.route('/api/tableros/orden', methods=['PUT'])
 @require_jwt
+@presupuesto_sql(1)
 def actualizar_orden_tableros():
     try:
-        data = request.get_json()
-        for item in data:
-            tablero = Tableros.query.get(item['id'])
-            if tablero:
-                tablero.orden = item['orden']
-        db.session.commit()
+        actualizar_orden('tableros', request.get_json())
+        jerarquia_modificada()
         return jsonify({"message": "Orden actualizado"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -415,14 +1414,11 @@ def actualizar_orden_tableros():
 # API: Actualizar orden de habitaciones dentro de un tablero
 @app.route('/api/habitaciones/orden', methods=['PUT'])
 @require_jwt
+@presupuesto_sql(1)
 def actualizar_orden_habitaciones():
     try:
-        data = request.get_json()
-        for item in data:
-            habitacion = Habitaciones.query.get(item['id'])
-            if habitacion:
-                habitacion.orden = item['orden']
-        db.session.commit()
+        actualizar_orden('habitaciones', request.get_json())
+        jerarquia_modificada()
         return jsonify({"message": "Orden actualizado"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -431,14 +1427,11 @@ def actualizar_orden_habitaciones():
 @app.route('/api/dispositivos/orden', methods=['PUT'])
 @require_jwt
 @require_permission('update_device_order')
+@presupuesto_sql(2)
 def actualizar_orden_dispositivos():
     try:
-        data = request.get_json()
-        for item in data:
-            dispositivo = Dispositivos.query.get(item['id'])
-            if dispositivo:
-                dispositivo.orden = item['orden']
-        db.session.commit()
+        actualizar_orden('dispositivos', request.get_json())
+        jerarquia_modificada()
         return jsonify({"message": "Orden de dispositivos actualizado"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -465,6 +1458,7 @@ def renombrar_tablero(tablero_id):
         
     tablero.nombre = nuevo_nombre
     db.session.commit()
+    jerarquia_modificada()
     
     return jsonify({"message": "Tablero renombrado correctamente", "id": tablero.id, "nombre": tablero.nombre}), 200
 
@@ -490,6 +1484,7 @@ def renombrar_habitacion(habitacion_id):
         
     habitacion.nombre = nuevo_nombre
     db.session.commit()
+    jerarquia_modificada()
     
     return jsonify({"message": "Habitación renombrada correctamente", "id": habitacion.id, "nombre": habitacion.nombre}), 200
 
@@ -523,6 +1518,7 @@ def cambiar_tablero_habitacion(habitacion_id):
     habitacion.orden = max_orden + 1
     
     db.session.commit()
+    jerarquia_modificada(topologia=True)
     
     return jsonify({
         "message": "Habitación movida correctamente", 
@@ -548,15 +1544,17 @@ def start_discovery():
         subredes = [subred.strip() for subred in subredes]
         subredes_str = ",".join(subredes)
 
-        with open("/var/log/shelly_discovery.log", "a") as log_file:
+        with open(LOG_DESCUBRIMIENTO_PATH, "a") as log_file:
             log_file.write(f"\n📢 Descubrimiento iniciado en subredes: {subredes_str}\n")
 
         command = ["/usr/bin/python3", "/opt/shelly_monitoring/descubrir_shelly.py"] + subredes
+        if data.get("incremental"):
+            command.append("--incremental")
         process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
 
         stdout, stderr = process.communicate()
         
-        with open("/var/log/shelly_discovery.log", "a") as log_file:
+        with open(LOG_DESCUBRIMIENTO_PATH, "a") as log_file:
             if stdout:
                 log_file.write(stdout)
             if stderr:
@@ -565,30 +1563,317 @@ def start_discovery():
         return jsonify({"message": "Descubrimiento ejecutado."}), 200
 
     except Exception as e:
-        with open("/var/log/shelly_discovery.log", "a") as log_file:
+        with open(LOG_DESCUBRIMIENTO_PATH, "a") as log_file:
             log_file.write(f"\n❌ Error en descubrimiento: {str(e)}\n")
         return jsonify({"error": f"Error al ejecutar el descubrimiento: {str(e)}"}), 500
 
+# Descubrimiento distribuido: agentes de escaneo en cada segmento de red
+coordinador_agentes = CoordinadorAgentes(conectar=get_db_connection)
+coordinador_agentes.add_event_listener('progreso', lambda trabajo: socketio.emit('discovery_job', trabajo))
+
+def registrar_tarea_agente(tarea):
+    # El resumen queda en el mismo log que siguen los visores del descubrimiento
+    with open(LOG_DESCUBRIMIENTO_PATH, "a") as log_file:
+        log_file.write(f"\n🛰️ Agente {tarea['agente']} terminó {', '.join(tarea['subredes'])}: "
+                       f"{tarea['encontrados']} detectados, {tarea['agregados']} nuevos, "
+                       f"{tarea['actualizados']} actualizados\n")
+
+coordinador_agentes.add_event_listener('tareaFinalizada', registrar_tarea_agente)
+
+# API: Crear un trabajo de descubrimiento repartido entre los agentes
+@app.route('/api/descubrimiento/trabajos', methods=['POST'])
+@require_jwt
+@require_permission('discover_devices')
+def crear_trabajo_descubrimiento():
+    data = request.get_json() or {}
+    try:
+        trabajo = coordinador_agentes.crear_trabajo(data.get("subredes") or [], bool(data.get("incremental")),
+                                                    usuario_id=request.user_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(trabajo), 202
+
+@app.route('/api/descubrimiento/trabajos', methods=['GET'])
+@require_jwt
+@require_permission('discover_devices')
+def listar_trabajos_descubrimiento():
+    return jsonify(coordinador_agentes.listar_trabajos())
+
+# API: Progreso agregado de un trabajo de descubrimiento
+@app.route('/api/descubrimiento/trabajos/<trabajo_id>', methods=['GET'])
+@require_jwt
+@require_permission('discover_devices')
+def get_trabajo_descubrimiento(trabajo_id):
+    trabajo = coordinador_agentes.trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo)
+
+@app.route('/api/descubrimiento/trabajos/<trabajo_id>', methods=['DELETE'])
+@require_jwt
+@require_permission('discover_devices')
+def cancelar_trabajo_descubrimiento(trabajo_id):
+    trabajo = coordinador_agentes.cancelar_trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo)
+
+@app.route('/api/agentes', methods=['GET'])
+@require_jwt
+@require_permission('discover_devices')
+def listar_agentes():
+    return jsonify(coordinador_agentes.listar_agentes())
+
+# API de los agentes de escaneo
+@app.route('/api/agentes/registro', methods=['POST'])
+@require_agente
+def registrar_agente():
+    data = request.get_json() or {}
+    try:
+        agente = coordinador_agentes.registrar_agente(data.get("nombre"), data.get("segmentos") or [],
+                                                      data.get("version", 1))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(agente)
+
+@app.route('/api/agentes/tarea', methods=['GET'])
+@require_agente
+def siguiente_tarea_agente():
+    try:
+        return jsonify({"tarea": coordinador_agentes.siguiente_tarea(request.args.get('nombre'))})
+    except KeyError:
+        return jsonify({"error": "Agente no registrado"}), 404
+
+@app.route('/api/agentes/tareas/<tarea_id>', methods=['POST'])
+@require_agente
+def reportar_tarea_agente(tarea_id):
+    data = request.get_json() or {}
+    try:
+        return jsonify(coordinador_agentes.reportar(tarea_id, data.get("nombre"), data))
+    except KeyError:
+        return jsonify({"error": "Tarea no encontrada"}), 404
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 409
+
+# API: Estado del descubrimiento pasivo
+@app.route('/api/descubrimiento_pasivo', methods=['GET'])
+@require_jwt
+@require_permission('discover_devices')
+def get_descubrimiento_pasivo():
+    return jsonify(descubrimiento_pasivo.get_estado())
+
+def instante_parametro(nombre):
+    """
+    Lee un instante de la petición como epoch en segundos o fecha ISO 8601 (None si no viene)
+
+    Raises:
+        ValueError: si el valor no es válido
+    """
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(valor).timestamp()
+    except ValueError:
+        raise ValueError(f"{nombre} debe ser un epoch o una fecha ISO 8601")
+
+# API: Historial de eventos por dispositivo y rango de tiempo
+@app.route('/api/eventos', methods=['GET'])
+@require_jwt
+@require_permission('view_logs')
+def get_eventos():
+    try:
+        _, limite, cursor = parametros_lista()
+        desde, hasta = instante_parametro('desde'), instante_parametro('hasta')
+        tipos = [t.strip() for t in request.args.get('tipo', '').split(',') if t.strip()] or None
+        if cursor is not None and len(cursor) != 2:
+            raise ValueError("Cursor inválido")
+        eventos, siguiente = diario_eventos.consultar(
+            desde=desde, hasta=hasta, dispositivo=request.args.get('dispositivo') or None, tipos=tipos,
+            limite=limite or PAGINA_DEFECTO, cursor=cursor, descendente=request.args.get('orden', 'desc') != 'asc')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "items": eventos,
+        "next_cursor": json_rapido.codificar_cursor(siguiente) if siguiente else None
+    })
+
+def ids_parametro(nombre):
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        return [int(v) for v in valor.split(',') if v.strip()]
+    except ValueError:
+        raise ValueError(f"{nombre} debe ser una lista de IDs separados por coma")
+
+def habitaciones_permitidas():
+    """
+    Habitaciones visibles para el usuario de la petición (None si es admin)
+    """
+    user = User.query.get(request.user_id)
+    if user is None or user.role == 'admin':
+        return None
+    return {p.room_id for p in UserRoomPermission.query.filter_by(user_id=user.id).all()}
+
+def parametros_exportacion():
+    """
+    Formato, compresión y dispositivos seleccionados (?dispositivos, ?habitaciones, ?tableros)
+
+    Raises:
+        ValueError: si algún parámetro no es válido
+    """
+    formato = request.args.get('formato', 'csv')
+    comprimir = request.args.get('gzip', '').lower() in ('1', 'true')
+    exportacion.validar_formato(formato, comprimir)
+    seleccion = {c: ids_parametro(c) for c in ('dispositivos', 'habitaciones', 'tableros')}
+    permitidas = habitaciones_permitidas()
+    conn = get_db_connection()
+    try:
+        ids = exportacion.resolver_dispositivos(conn, permitidas=permitidas, **seleccion)
+        ips = None
+        if any(seleccion.values()) or permitidas is not None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ip FROM dispositivos WHERE id = ANY(%s)", (ids,))
+            ips = {fila[0] for fila in cursor.fetchall() if fila[0]}
+            cursor.close()
+    finally:
+        conn.close()
+    return formato, comprimir, ids, ips
+
+def respuesta_exportacion(prefijo, columnas, filas, formato, comprimir):
+    # El cuerpo es un generador: se codifica y envía por chunks, sin armar el archivo en memoria
+    mimetype = 'application/gzip' if comprimir else exportacion.TIPOS_CONTENIDO[formato]
+    respuesta = Response(exportacion.exportar(columnas, filas, formato, comprimir), mimetype=mimetype)
+    respuesta.headers['Content-Disposition'] = \
+        f'attachment; filename="{exportacion.nombre_archivo(prefijo, formato, comprimir)}"'
+    return respuesta
+
+# API: Exportar el historial de consumo por minuto (CSV o Parquet, en streaming)
+@app.route('/api/exportar/consumos', methods=['GET'])
+@require_jwt
+@require_permission('view_consumption')
+def exportar_consumos():
+    try:
+        desde, hasta = instante_parametro('desde'), instante_parametro('hasta') or time.time()
+        if desde is None:
+            raise ValueError("desde es obligatorio")
+        formato, comprimir, ids, _ = parametros_exportacion()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    filas = exportacion.filas_consumos(get_db_connection, ids, datetime.fromtimestamp(desde, timezone.utc),
+                                       datetime.fromtimestamp(hasta, timezone.utc))
+    return respuesta_exportacion('consumos', exportacion.COLUMNAS_CONSUMO, filas, formato, comprimir)
+
+# API: Exportar el diario de eventos de los dispositivos (CSV o Parquet, en streaming)
+@app.route('/api/exportar/eventos', methods=['GET'])
+@require_jwt
+@require_permission('view_logs')
+def exportar_eventos():
+    try:
+        desde, hasta = instante_parametro('desde'), instante_parametro('hasta')
+        tipos = [t.strip() for t in request.args.get('tipo', '').split(',') if t.strip()] or None
+        desconocidos = [t for t in tipos or [] if t not in TIPOS_EVENTO]
+        if desconocidos:
+            raise ValueError(f"Tipo de evento desconocido: {desconocidos[0]}")
+        formato, comprimir, _, ips = parametros_exportacion()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    filas = exportacion.filas_eventos(diario_eventos, desde, hasta, dispositivos=ips, tipos=tipos)
+    return respuesta_exportacion('eventos', exportacion.COLUMNAS_EVENTO, filas, formato, comprimir)
+
+# API: Solicitar un reporte mensual de facturación (se calcula en segundo plano)
+@app.route('/api/facturacion/reportes', methods=['POST'])
+@require_jwt
+@require_permission('view_consumption')
+def solicitar_reporte_facturacion():
+    data = request.get_json() or {}
+    if not data.get('mes'):
+        return jsonify({"error": "mes es obligatorio (AAAA-MM)"}), 400
+    try:
+        trabajo = motor_facturacion.solicitar(data['mes'], data.get('agrupar', 'habitacion'),
+                                              tarifa=data.get('tarifa') or tarifa_configurada(),
+                                              permitidas=habitaciones_permitidas(), usuario_id=request.user_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(trabajo), 200 if trabajo['estado'] == 'completado' else 202
+
+# API: Estado y resultado de un reporte de facturación
+@app.route('/api/facturacion/reportes/<trabajo_id>', methods=['GET'])
+@require_jwt
+@require_permission('view_consumption')
+def get_reporte_facturacion(trabajo_id):
+    trabajo = motor_facturacion.trabajo(trabajo_id)
+    if trabajo is None:
+        return jsonify({"error": "Reporte no encontrado"}), 404
+    return jsonify(trabajo)
+
 # API: Transmitir logs en vivo
 @app.route('/api/logs')
 @require_jwt
 def stream_logs():
     def generate():
-        with open("/var/log/shelly_discovery.log", "r") as log_file:
-            log_file.seek(0, 2)
+        cola = seguidor_log_descubrimiento.suscribir()
+        try:
             while True:
-                line = log_file.readline()
-                if line:
-                    clean_line = line[line.find("]") + 2:] if "]" in line else line
-                    yield f"data: {clean_line}\n\n"
-                else:
-                    time.sleep(1)
+                try:
+                    line = cola.get(timeout=15)
+                except queue.Empty:
+                    # Comentario SSE: mantiene viva la conexión y detecta clientes desconectados
+                    yield ": keepalive\n\n"
+                    continue
+                clean_line = line[line.find("]") + 2:] if "]" in line else line
+                yield f"data: {clean_line}\n\n"
+        finally:
+            seguidor_log_descubrimiento.desuscribir(cola)
     return Response(stream_with_context(generate()), content_type='text/event-stream')
 
 
+# API: Buscar en el historial de un log (archivo activo y segmentos rotados)
+@app.route('/api/logs/buscar', methods=['GET'])
+@require_jwt
+@require_permission('view_logs')
+def buscar_logs():
+    """
+    ?log=descubrimiento|backend, ?desde/?hasta (epoch o ISO 8601), ?q (texto o, con ?regex=1,
+    expresión regular), ?limit y ?cursor. Las líneas vuelven en orden cronológico.
+    """
+    almacen = almacenes_logs.get(request.args.get('log', 'descubrimiento'))
+    if almacen is None:
+        return jsonify({"error": f"log debe ser uno de: {', '.join(almacenes_logs)}"}), 400
+    try:
+        _, limite, cursor = parametros_lista()
+        if cursor is not None and len(cursor) != 2:
+            raise ValueError("Cursor inválido")
+        lineas, siguiente = almacen.buscar(
+            desde=instante_parametro('desde'), hasta=instante_parametro('hasta'),
+            patron=request.args.get('q') or None, regex=request.args.get('regex') == '1',
+            limite=limite or PAGINA_DEFECTO, cursor=cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "items": lineas,
+        "next_cursor": json_rapido.codificar_cursor(siguiente) if siguiente else None
+    })
+
+# API: Segmentos rotados de un log con su rango de tiempo
+@app.route('/api/logs/segmentos', methods=['GET'])
+@require_jwt
+@require_permission('view_logs')
+def get_segmentos_logs():
+    almacen = almacenes_logs.get(request.args.get('log', 'descubrimiento'))
+    if almacen is None:
+        return jsonify({"error": f"log debe ser uno de: {', '.join(almacenes_logs)}"}), 400
+    return jsonify(almacen.listar_segmentos())
+
 # API: Crear un nuevo usuario
 @app.route('/api/usuarios', methods=['POST'])
 @require_jwt
+@presupuesto_sql(3)
 def crear_usuario():
     data = request.get_json()
     logging.debug(f"Datos recibidos para crear usuario: {data}")
@@ -601,7 +1886,7 @@ def crear_usuario():
         logging.debug("Faltan campos obligatorios")
         return jsonify({"error": "Todos los campos son obligatorios"}), 400
 
-    if User.query.filter_by(email=email).first() or User.query.filter_by(username=username).first():
+    if User.query.filter(or_(User.email == email, User.username == username)).first():
         logging.debug("El nombre de usuario o el correo electrónico ya están en uso")
         return jsonify({"error": "El nombre de usuario o el correo electrónico ya están en uso"}), 400
 
@@ -609,34 +1894,37 @@ def crear_usuario():
         new_user = User(username=username, email=email, role=role, nombre=username)
         new_user.set_password(password)
         db.session.add(new_user)
-        db.session.commit()
-        logging.debug(f"Usuario creado: {new_user}")
+        db.session.flush()  # Asigna el id sin cerrar la transacción
+        creado = {"id": new_user.id, "username": new_user.username, "email": new_user.email, "role": new_user.role}
 
         # Si el usuario es admin, establecer todas las habitaciones permitidas por defecto
         if role == 'admin':
-            habitaciones = Habitaciones.query.all()
-            for habitacion in habitaciones:
-                permission = UserRoomPermission(user_id=new_user.id, room_id=habitacion.id)
-                db.session.add(permission)
-            db.session.commit()
+            db.session.execute(
+                db.text("INSERT INTO user_room_permissions (user_id, room_id) SELECT :user_id, id FROM habitaciones"),
+                {"user_id": new_user.id}
+            )
+        # Un solo commit: tras él no hace falta volver a leer el usuario
+        db.session.commit()
+        logging.debug(f"Usuario creado: {creado}")
 
-        return jsonify({"message": "Usuario creado correctamente", "user": {"id": new_user.id, "username": new_user.username, "email": new_user.email, "role": new_user.role}}), 201
+        return jsonify({"message": "Usuario creado correctamente", "user": creado}), 201
     except Exception as e:
         logging.error(f"Error al crear el usuario: {str(e)}")
         return jsonify({"error": f"Error al crear el usuario: {str(e)}"}), 500
 
 # API: Obtener todos los usuarios
+CAMPOS_USUARIO = ("id", "username", "email", "role", "nombre")
+
 @app.route('/api/usuarios', methods=['GET'])
 @require_jwt
 def get_users():
-    users = User.query.all()
-    return jsonify([{
-        "id": user.id,
-        "username": user.username,
-        "email": user.email,
-        "role": user.role,
-        "nombre": user.nombre
-    } for user in users])
+    try:
+        campos, limite, cursor = parametros_lista(CAMPOS_USUARIO)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    campos = campos or CAMPOS_USUARIO
+    consulta = db.session.query(*[getattr(User, c) for c in CAMPOS_USUARIO if c in campos or c == 'id']).order_by(User.id)
+    return respuesta_lista(consulta, [User.id], lambda u: (u.id,), lambda u: {c: getattr(u, c) for c in campos}, limite, cursor)
 
 # API: Eliminar un usuario
 @app.route('/api/usuarios/<int:user_id>', methods=['DELETE'])
@@ -683,9 +1971,59 @@ def actualizar_rol_usuario(user_id):
         return jsonify({"error": f"Error al actualizar el rol del usuario: {str(e)}"}), 500
 
 
+# Permisos de habitaciones como operaciones de conjuntos: una sentencia borra lo que sobra y otra
+# inserta lo que falta, para cualquier cantidad de usuarios (sin tocar las filas que no cambian)
+def guardar_permisos(asignaciones):
+    """
+    Args:
+        asignaciones: {user_id: [room_id, ...]} con el conjunto completo de habitaciones de cada usuario
+
+    Returns:
+        (permisos eliminados, permisos agregados)
+    """
+    usuarios = list(asignaciones)
+    pares = [(user_id, room_id) for user_id, room_ids in asignaciones.items() for room_id in set(room_ids)]
+    parametros = {
+        "usuarios": usuarios,
+        "pares_usuarios": [user_id for user_id, _ in pares],
+        "pares_habitaciones": [room_id for _, room_id in pares],
+    }
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM user_room_permissions p
+            WHERE p.user_id = ANY(%(usuarios)s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM unnest(%(pares_usuarios)s::int[], %(pares_habitaciones)s::int[]) AS n(user_id, room_id)
+                  WHERE n.user_id = p.user_id AND n.room_id = p.room_id
+              )
+        """, parametros)
+        eliminados = cursor.rowcount
+        cursor.execute("""
+            INSERT INTO user_room_permissions (user_id, room_id)
+            SELECT n.user_id, n.room_id
+            FROM unnest(%(pares_usuarios)s::int[], %(pares_habitaciones)s::int[]) AS n(user_id, room_id)
+            JOIN usuarios u ON u.id = n.user_id
+            JOIN habitaciones h ON h.id = n.room_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_room_permissions p WHERE p.user_id = n.user_id AND p.room_id = n.room_id
+            )
+        """, parametros)
+        agregados = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return eliminados, agregados
+
 # API: Guardar permisos de habitaciones
 @app.route('/api/save_user_permissions', methods=['POST'])
 @require_jwt
+@presupuesto_sql(3)
 def save_user_permissions():
     data = request.json
     user_id = data.get('user_id')
@@ -697,21 +2035,66 @@ def save_user_permissions():
     user = User.query.get(user_id)
     
     if user:
-        # Eliminar todos los permisos existentes para el usuario
-        UserRoomPermission.query.filter_by(user_id=user_id).delete()
-
-        if room_ids:
-            # Agregar los permisos específicos para las habitaciones proporcionadas
-            for room_id in room_ids:
-                permission = UserRoomPermission(user_id=user_id, room_id=room_id)
-                db.session.add(permission)
-                
-        db.session.commit()
+        guardar_permisos({user.id: room_ids})
         return jsonify({'success': True, 'message': 'Permissions saved successfully'}), 200
 
     return jsonify({'success': False, 'message': 'User not found'}), 404
 
 
+# API: Obtener todos los usuarios con sus habitaciones permitidas en una sola consulta
+@app.route('/api/usuarios/permisos', methods=['GET'])
+@require_jwt
+@presupuesto_sql(1)
+def get_users_with_permissions():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.id, u.username, u.email, u.role, u.nombre,
+                   COALESCE(array_agg(DISTINCT p.room_id) FILTER (WHERE p.room_id IS NOT NULL), '{}')
+            FROM usuarios u
+            LEFT JOIN user_room_permissions p ON p.user_id = u.id
+            GROUP BY u.id
+            ORDER BY u.id
+        """)
+        filas = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return jsonify([{
+        "id": id_usuario,
+        "username": username,
+        "email": email,
+        "role": role,
+        "nombre": nombre,
+        "room_ids": room_ids
+    } for id_usuario, username, email, role, nombre, room_ids in filas])
+
+
+# API: Guardar los permisos de varios usuarios a la vez
+@app.route('/api/usuarios/permisos', methods=['PUT'])
+@require_jwt
+@require_permission('manage_users')
+def save_users_permissions():
+    data = request.get_json()
+    if not isinstance(data, list):
+        return jsonify({'success': False, 'message': 'Se espera una lista de {user_id, room_ids}'}), 400
+
+    asignaciones = {}
+    for item in data:
+        if not isinstance(item, dict) or not item.get('user_id') or not isinstance(item.get('room_ids'), list):
+            return jsonify({'success': False, 'message': 'Missing fields'}), 400
+        asignaciones[item['user_id']] = item['room_ids']
+
+    try:
+        eliminados, agregados = guardar_permisos(asignaciones)
+    except Exception as e:
+        logging.error(f"Error al guardar permisos: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+    return jsonify({'success': True, 'usuarios': len(asignaciones), 'eliminados': eliminados, 'agregados': agregados}), 200
+
+
 # API: Obtener los permisos de habitaciones
 @app.route('/api/get_user_permissions/<int:user_id>', methods=['GET'])
 @require_jwt
@@ -737,6 +2120,7 @@ def asignar_habitacion():
         for dispositivo in dispositivos:
             dispositivo.habitacion_id = habitacion_id
         db.session.commit()
+        jerarquia_modificada(topologia=True)
         return jsonify({'success': True, 'message': 'Devices assigned successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -747,17 +2131,16 @@ def asignar_habitacion():
 @app.route('/api/habitaciones/<int:habitacion_id>/dispositivos', methods=['GET'])
 @require_jwt
 def get_dispositivos_by_habitacion(habitacion_id):
-    dispositivos = Dispositivos.query.filter_by(habitacion_id=habitacion_id).order_by(Dispositivos.orden).all()
-    return jsonify([{ 
-        "id": d.id, 
-        "nombre": d.nombre, 
-        "ip": d.ip, 
-        "tipo": d.tipo, 
-        "habitacion_id": d.habitacion_id, 
-        "ultimo_consumo": d.ultimo_consumo, 
-        "estado": d.estado,
-        "orden": d.orden
-    } for d in dispositivos])
+    try:
+        campos, limite, cursor = parametros_lista(CAMPOS_DISPOSITIVO)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    campos = campos or CAMPOS_DISPOSITIVO
+    orden = [db.func.coalesce(Dispositivos.orden, 0), Dispositivos.id]
+    consulta = db.session.query(*[getattr(Dispositivos, c) for c in CAMPOS_DISPOSITIVO if c in campos or c in ('id', 'orden')]) \
+        .filter(Dispositivos.habitacion_id == habitacion_id).order_by(*orden)
+    return respuesta_lista(consulta, orden, lambda d: (d.orden or 0, d.id),
+                           lambda d: {c: getattr(d, c) for c in campos}, limite, cursor)
 
 
 # API: Endpoint de prueba de conexión
@@ -772,8 +2155,18 @@ def test_connection():
 @require_jwt
 def get_shelly_devices():
     """Obtiene todos los dispositivos Shelly descubiertos por el adaptador"""
+    try:
+        campos, limite, cursor = parametros_lista()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     devices = shelly_interface.get_devices()
-    return jsonify(devices)
+    return respuesta_lista_memoria(devices, lambda d: (str(d.get('id')),), campos, limite, cursor)
+
+@app.route('/api/shelly/adapters', methods=['GET'])
+@require_jwt
+def get_shelly_adapters():
+    """Estado de cada adaptador (shard) y cuántos dispositivos reporta"""
+    return jsonify(shelly_interface.get_adapters())
 
 @app.route('/api/shelly/discover', methods=['POST'])
 @require_jwt
@@ -818,11 +2211,8 @@ def control_shelly_device(device_id):
     channel = int(data['channel'])
     state = bool(data['state'])
     
-    success = shelly_interface.control_device(device_id, channel, state)
-    if success:
-        return jsonify({"status": "ok", "message": "Dispositivo controlado correctamente"})
-    else:
-        return jsonify({"status": "error", "message": "Error al controlar el dispositivo"}), 500
+    comando = cola_comandos.encolar(device_id, channel, state, origen='usuario', usuario_id=request.user_id)
+    return jsonify({"status": "ok", "message": "Comando encolado", "comando": comando}), 202
 
 @app.route('/api/shelly/devices/<device_id>/firmware', methods=['GET'])
 @require_jwt
@@ -846,6 +2236,81 @@ def update_shelly_firmware(device_id):
     else:
         return jsonify({"status": "error", "message": "Error al iniciar la actualización"}), 500
 
+# === Espejo local de firmware ===
+
+@app.route('/firmware/<modelo>/<version>.zip', methods=['GET'])
+def servir_firmware(modelo, version):
+    """Entrega una imagen del espejo a un dispositivo (sin JWT: los Shelly no pueden enviarlo)"""
+    imagen = espejo.imagenes.get((modelo, version))
+    if imagen is None:
+        return jsonify({"error": "Imagen no encontrada"}), 404
+
+    if espejo_firmware.ACCEL_REDIRECT:
+        # nginx sirve el archivo (sendfile, Range y su propio límite de conexiones)
+        respuesta = Response(mimetype='application/zip')
+        respuesta.headers['X-Accel-Redirect'] = f"{espejo_firmware.ACCEL_REDIRECT.rstrip('/')}/{modelo}/{version}.zip"
+        return respuesta
+
+    archivo = espejo.abrir(modelo, version)
+    if archivo is None:
+        respuesta = jsonify({"error": "Demasiadas descargas simultáneas"})
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = str(espejo_firmware.REINTENTAR_EN)
+        return respuesta
+    try:
+        # Con un archivo abierto send_file no conoce el tamaño: Range y ETag se resuelven aquí
+        respuesta = send_file(archivo, mimetype='application/zip', conditional=False)
+        respuesta.content_length = imagen['tamano']
+        respuesta.set_etag(imagen['sha256'])
+        respuesta.cache_control.max_age = 86400
+        respuesta.make_conditional(request, accept_ranges=True, complete_length=imagen['tamano'])
+    except Exception:
+        archivo.close()
+        raise
+    if respuesta.status_code in (304, 412):
+        archivo.close()
+    return respuesta
+
+@app.route('/api/shelly/firmware_mirror', methods=['GET'])
+@require_jwt
+@require_permission('manage_devices')
+def get_firmware_mirror():
+    """Imágenes disponibles en el espejo local y descargas en curso"""
+    return jsonify({"estado": espejo.estado(), "imagenes": espejo.listar()})
+
+@app.route('/api/shelly/firmware_mirror', methods=['POST'])
+@require_jwt
+@require_permission('manage_devices')
+def add_firmware_mirror():
+    """
+    Agrega una imagen al espejo: JSON {model, version?, url?, sha256?} para descargarla
+    (sin versión, la última publicada) o multipart con 'file', 'model' y 'version' para importarla
+    """
+    try:
+        if 'file' in request.files:
+            if not request.form.get('model') or not request.form.get('version'):
+                return jsonify({"error": "model y version son obligatorios"}), 400
+            imagen = espejo.importar(request.form['model'], request.form['version'], request.files['file'].stream,
+                                     request.form.get('sha256'))
+        else:
+            data = request.get_json() or {}
+            if not data.get('model'):
+                return jsonify({"error": "model es obligatorio"}), 400
+            imagen = espejo.asegurar(data['model'], data.get('version'), data.get('url'), data.get('sha256'))
+    except FirmwareInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    except requests.RequestException as e:
+        return jsonify({"error": f"Error descargando la imagen: {e}"}), 502
+    return jsonify(imagen), 201
+
+@app.route('/api/shelly/firmware_mirror/<modelo>/<version>', methods=['DELETE'])
+@require_jwt
+@require_permission('manage_devices')
+def delete_firmware_mirror(modelo, version):
+    if not espejo.eliminar(modelo, version):
+        return jsonify({"error": "Imagen no encontrada"}), 404
+    return jsonify({"message": "Imagen eliminada"}), 200
+
 @app.route('/api/shelly/devices/<device_id>/energy', methods=['GET'])
 @require_jwt
 def get_shelly_energy_data(device_id):
@@ -912,6 +2377,7 @@ def sync_shelly_devices():
         
         # Guardar cambios en la base de datos
         db.session.commit()
+        jerarquia_modificada(topologia=True)
         
         return jsonify({
             "status": "ok",
@@ -960,20 +2426,12 @@ def control_device(ip):
     try:
         data = request.json
         on = data.get('on')
-        brightness = data.get('brightness')
-        
-        # Actualizamos la base de datos con el nuevo estado booleano
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE dispositivos SET estado = %s WHERE ip = %s",
-            (bool(on), ip)  # Usar un booleano en lugar de JSON
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
         
-        return jsonify({"success": True})
+        # El estado en la base se actualiza cuando el dispositivo confirma el cambio
+        dispositivo = Dispositivos.query.filter_by(ip=ip).first()
+        comando = cola_comandos.encolar(ip, 0, bool(on), dispositivo_id=dispositivo.id if dispositivo else None,
+                                        origen='usuario', usuario_id=request.user_id)
+        return jsonify({"success": True, "comando": comando}), 202
     except Exception as e:
         return jsonify({"success": False, "message": f"Error al controlar dispositivo: {str(e)}"}), 500
 
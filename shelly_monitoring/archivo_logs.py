@@ -0,0 +1,480 @@
+"""
+Rotación, compresión e índice de los logs de texto.
+
+Los logs (backend.log y el del descubrimiento) se siguen escribiendo en modo
+append sobre el archivo activo. Cuando éste supera TAMANO_SEGMENTO o tiene más
+de ROTACION_HORAS, se renombra y se comprime como un segmento
+<ruta>.<número>.gz. Los escritores detectan el cambio de inodo y vuelven a
+abrir la ruta original (WatchedFileHandler, DualLogger, SeguidorLog).
+
+Un segmento es una secuencia de miembros gzip independientes de unos
+TAMANO_BLOQUE bytes sin comprimir, así que `zcat` lo lee como un gzip normal.
+Su índice (<segmento>.idx, JSON) guarda por bloque el instante inicial, el
+final y el offset comprimido. Una búsqueda descarta los segmentos fuera del
+rango, salta directo al primer bloque que puede contener el inicio y
+descomprime en streaming desde ahí hasta pasar el final. El archivo activo no
+tiene índice: se busca su inicio con búsqueda binaria sobre los instantes.
+
+Las líneas sin marca de tiempo (trazas, salida sin formato) heredan la de la
+línea anterior. La retención borra los segmentos más viejos por antigüedad y
+por espacio total, para que el disco ocupado quede acotado.
+"""
+
+import bisect
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import time
+import zlib
+from threading import Lock, Thread
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de los logs
+TAMANO_SEGMENTO = 16 * 1024 * 1024     # Bytes del archivo activo que disparan la rotación
+ROTACION_HORAS = 24                    # Antigüedad máxima del archivo activo (si tiene contenido)
+TAMANO_BLOQUE = 256 * 1024             # Bytes sin comprimir por miembro gzip (granularidad del índice)
+MAX_TOTAL = 512 * 1024 * 1024          # Bytes comprimidos por log antes de borrar los segmentos más viejos
+RETENCION_DIAS = 90
+ESPERA_ESCRITORES = 2.0                # Segundos entre renombrar y comprimir, para las escrituras en vuelo
+INTERVALO = 30                         # Segundos entre revisiones del archivo activo
+LECTURA = 64 * 1024                    # Bytes leídos por vez al descomprimir
+LIMITE = 1000
+
+# "2025-03-04 10:15:00,123 - INFO - ..." (logging) o "[2025-03-04 10:15:00] ..." (DualLogger)
+_MARCA = re.compile(rb"\[?(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})")
+
+
+class _Reloj:
+    """
+    Instante (epoch) de la marca de hora local de una línea, con caché del último segundo visto
+    """
+    __slots__ = ("clave", "valor")
+
+    def __init__(self):
+        self.clave = None
+        self.valor = None
+
+    def instante(self, linea: bytes) -> Optional[float]:
+        coincidencia = _MARCA.match(linea)
+        if coincidencia is None:
+            return None
+        clave = coincidencia.groups()
+        if clave != self.clave:
+            self.clave = clave
+            self.valor = time.mktime(tuple(int(parte) for parte in clave) + (0, 0, -1))
+        return self.valor
+
+
+class _Segmento:
+    __slots__ = ("numero", "ruta", "inicio", "fin", "lineas", "tamano", "bloques", "fines")
+
+    def __init__(self, numero: int, ruta: str, indice: Dict[str, Any]):
+        self.numero = numero
+        self.ruta = ruta
+        self.inicio = indice["inicio"]
+        self.fin = indice["fin"]
+        self.lineas = indice["lineas"]
+        self.tamano = indice["tamano"]
+        self.bloques: List[Tuple[float, float, int]] = [tuple(b) for b in indice["bloques"]]
+        # Máximo acumulado de los finales: tolera líneas levemente desordenadas entre escritores
+        self.fines: List[float] = []
+        maximo = -math.inf
+        for _, fin, _ in self.bloques:
+            maximo = max(maximo, fin)
+            self.fines.append(maximo)
+
+    def resumen(self) -> Dict[str, Any]:
+        return {"numero": self.numero, "inicio": self.inicio, "fin": self.fin, "lineas": self.lineas,
+                "bytes": self.tamano, "comprimido": os.path.getsize(self.ruta) if os.path.exists(self.ruta) else 0}
+
+
+def _descomprimir(archivo) -> Iterator[bytes]:
+    """
+    Contenido de una secuencia de miembros gzip leída desde la posición actual del archivo
+    """
+    descompresor = zlib.decompressobj(31)
+    while True:
+        datos = archivo.read(LECTURA)
+        if not datos:
+            return
+        while datos:
+            salida = descompresor.decompress(datos)
+            if salida:
+                yield salida
+            if descompresor.eof:
+                datos = descompresor.unused_data
+                descompresor = zlib.decompressobj(31)
+            else:
+                datos = b""
+
+
+def _lineas(trozos: Iterable[bytes]) -> Iterator[bytes]:
+    resto = b""
+    for trozo in trozos:
+        partes = (resto + trozo).split(b"\n")
+        resto = partes.pop()
+        yield from partes
+    if resto:
+        yield resto
+
+
+def comprimir(origen: str, destino: str, anterior: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Comprime un archivo de log como segmento en bloques y escribe su índice
+
+    Args:
+        origen: Archivo de texto ya retirado por la rotación
+        destino: Ruta del segmento .gz; el índice queda en destino + '.idx'
+        anterior: Instante de la última línea del segmento previo (para las primeras líneas sin marca)
+
+    Returns:
+        El índice escrito
+    """
+    reloj = _Reloj()
+    actual = anterior
+    bloques: List[List[Any]] = []
+    lineas = tamano = 0
+    temporal = destino + ".tmp"
+
+    with open(origen, "rb") as entrada, open(temporal, "wb") as salida:
+        pendiente: List[bytes] = []
+        largo = 0
+        bloque_inicio = actual
+        bloque_fin = None
+
+        def cerrar_bloque():
+            inicio = bloque_inicio if bloque_inicio is not None else bloque_fin
+            bloques.append([inicio, bloque_fin if bloque_fin is not None else inicio, salida.tell()])
+            salida.write(gzip.compress(b"".join(pendiente), compresslevel=6, mtime=0))
+
+        for linea in entrada:
+            instante = reloj.instante(linea)
+            if instante is not None:
+                actual = instante
+                if bloque_inicio is None:
+                    bloque_inicio = instante
+                bloque_fin = instante if bloque_fin is None else max(bloque_fin, instante)
+            pendiente.append(linea)
+            largo += len(linea)
+            lineas += 1
+            if largo >= TAMANO_BLOQUE:
+                cerrar_bloque()
+                tamano += largo
+                pendiente, largo = [], 0
+                bloque_inicio, bloque_fin = actual, None
+        if pendiente:
+            cerrar_bloque()
+            tamano += largo
+
+    # Bloques sin ninguna marca antes de la primera línea fechada del archivo
+    respaldo = next((b[0] for b in bloques if b[0] is not None), None)
+    if respaldo is None:
+        respaldo = os.path.getmtime(origen)
+    for bloque in bloques:
+        if bloque[0] is None:
+            bloque[0] = bloque[1] = respaldo
+    indice = {
+        "inicio": bloques[0][0] if bloques else respaldo,
+        "fin": max((b[1] for b in bloques), default=respaldo),
+        "lineas": lineas,
+        "tamano": tamano,
+        "bloques": bloques,
+    }
+    with open(destino + ".idx.tmp", "w") as archivo:
+        json.dump(indice, archivo)
+    os.replace(destino + ".idx.tmp", destino + ".idx")
+    os.replace(temporal, destino)
+    return indice
+
+
+class AlmacenLogs:
+    """
+    Archivo activo más segmentos comprimidos e indexados de un log de texto
+    """
+    def __init__(self, ruta: str, tamano_segmento: int = TAMANO_SEGMENTO, rotacion_horas: float = ROTACION_HORAS,
+                 max_total: int = MAX_TOTAL, retencion_dias: float = RETENCION_DIAS):
+        """
+        Args:
+            ruta: Archivo activo del log (los segmentos quedan junto a él)
+            tamano_segmento: Bytes del archivo activo que disparan la rotación
+            rotacion_horas: Antigüedad máxima del archivo activo
+            max_total: Bytes comprimidos de segmentos a conservar
+            retencion_dias: Días de segmentos a conservar
+        """
+        self.ruta = ruta
+        self.tamano_segmento = tamano_segmento
+        self.rotacion_horas = rotacion_horas
+        self.max_total = max_total
+        self.retencion_dias = retencion_dias
+        self.segmentos: List[_Segmento] = []
+        self.pendientes: List[Tuple[int, str]] = []
+        self._abierto = time.time()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+        self._patron = re.compile(re.escape(os.path.basename(ruta)) + r"\.(\d{6})\.(gz|pendiente)$")
+
+    def _ruta_segmento(self, numero: int) -> str:
+        return f"{self.ruta}.{numero:06d}.gz"
+
+    def cargar(self):
+        """
+        Lee los índices de los segmentos existentes y comprime los que quedaron pendientes tras una caída
+        """
+        directorio = os.path.dirname(self.ruta) or "."
+        encontrados = []
+        for nombre in os.listdir(directorio) if os.path.isdir(directorio) else []:
+            coincidencia = self._patron.match(nombre)
+            if coincidencia:
+                encontrados.append((int(coincidencia.group(1)), coincidencia.group(2), os.path.join(directorio, nombre)))
+
+        segmentos, pendientes = [], []
+        for numero, tipo, ruta in sorted(encontrados):
+            if tipo == "pendiente":
+                pendientes.append((numero, ruta))
+                continue
+            try:
+                with open(ruta + ".idx") as archivo:
+                    segmentos.append(_Segmento(numero, ruta, json.load(archivo)))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Segmento de log sin índice válido, se omite: {ruta} ({e})")
+        with self._lock:
+            self.segmentos = segmentos
+            self.pendientes = pendientes
+        for numero, ruta in pendientes:
+            self._comprimir_pendiente(numero, ruta)
+        try:
+            self._abierto = os.path.getctime(self.ruta)
+        except OSError:
+            self._abierto = time.time()
+
+    # ===========================
+    # Rotación y retención
+    # ===========================
+    def debe_rotar(self) -> bool:
+        try:
+            tamano = os.path.getsize(self.ruta)
+        except OSError:
+            return False
+        return tamano >= self.tamano_segmento or (tamano > 0 and time.time() - self._abierto >= self.rotacion_horas * 3600)
+
+    def rotar(self) -> Optional[Dict[str, Any]]:
+        """
+        Retira el archivo activo, lo comprime como segmento y aplica la retención
+
+        Returns:
+            Resumen del segmento creado, o None si el archivo activo estaba vacío
+        """
+        with self._lock:
+            if not os.path.exists(self.ruta) or os.path.getsize(self.ruta) == 0:
+                return None
+            numeros = [s.numero for s in self.segmentos] + [n for n, _ in self.pendientes]
+            numero = max(numeros, default=0) + 1
+            pendiente = f"{self.ruta}.{numero:06d}.pendiente"
+            os.rename(self.ruta, pendiente)
+            # El archivo nuevo se crea enseguida para que los lectores no lo encuentren ausente
+            open(self.ruta, "a").close()
+            shutil.copymode(pendiente, self.ruta)
+            self.pendientes.append((numero, pendiente))
+            self._abierto = time.time()
+
+        # Los escritores con el archivo abierto pueden terminar una línea en el renombrado
+        time.sleep(ESPERA_ESCRITORES)
+        segmento = self._comprimir_pendiente(numero, pendiente)
+        self.aplicar_retencion()
+        return segmento.resumen() if segmento else None
+
+    def _comprimir_pendiente(self, numero: int, pendiente: str) -> Optional[_Segmento]:
+        with self._lock:
+            anterior = self.segmentos[-1].fin if self.segmentos else None
+        ruta = self._ruta_segmento(numero)
+        try:
+            segmento = _Segmento(numero, ruta, comprimir(pendiente, ruta, anterior))
+        except OSError as e:
+            logger.error(f"Error comprimiendo {pendiente}: {e}")
+            return None
+        with self._lock:
+            self.segmentos.append(segmento)
+            self.segmentos.sort(key=lambda s: s.numero)
+            self.pendientes = [(n, r) for n, r in self.pendientes if n != numero]
+        os.remove(pendiente)
+        logger.info(f"Log rotado: {ruta} ({segmento.lineas} líneas, {segmento.tamano} bytes sin comprimir)")
+        return segmento
+
+    def aplicar_retencion(self):
+        """
+        Borra los segmentos más viejos que la retención o que exceden el espacio total
+        """
+        limite = time.time() - self.retencion_dias * 86400
+        with self._lock:
+            tamanos = {s.numero: os.path.getsize(s.ruta) if os.path.exists(s.ruta) else 0 for s in self.segmentos}
+            total = sum(tamanos.values())
+            borrar = []
+            for segmento in self.segmentos:
+                if segmento.fin >= limite and total <= self.max_total:
+                    break
+                borrar.append(segmento)
+                total -= tamanos[segmento.numero]
+            self.segmentos = self.segmentos[len(borrar):]
+        for segmento in borrar:
+            for ruta in (segmento.ruta, segmento.ruta + ".idx"):
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+        if borrar:
+            logger.info(f"Retención de {self.ruta}: {len(borrar)} segmento(s) borrado(s)")
+
+    def iniciar(self):
+        """
+        Carga los segmentos y lanza el thread que rota el archivo activo
+        """
+        def bucle():
+            while True:
+                try:
+                    if self.debe_rotar():
+                        self.rotar()
+                except Exception as e:
+                    logger.error(f"Error rotando {self.ruta}: {e}")
+                time.sleep(INTERVALO)
+
+        if self._thread is None:
+            self.cargar()
+            self.aplicar_retencion()
+            self._thread = Thread(target=bucle, daemon=True)
+            self._thread.start()
+
+    # ===========================
+    # Búsqueda
+    # ===========================
+    def listar_segmentos(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            segmentos = list(self.segmentos)
+        return [segmento.resumen() for segmento in segmentos]
+
+    def _leer_segmento(self, segmento: _Segmento, desde: float, hasta: float) -> Iterator[Tuple[float, bytes]]:
+        i = bisect.bisect_left(segmento.fines, desde)
+        if i >= len(segmento.bloques):
+            return
+        actual = segmento.bloques[i][0]
+        reloj = _Reloj()
+        with open(segmento.ruta, "rb") as archivo:
+            archivo.seek(segmento.bloques[i][2])
+            for linea in _lineas(_descomprimir(archivo)):
+                instante = reloj.instante(linea)
+                if instante is not None:
+                    actual = instante
+                if actual > hasta:
+                    return
+                if actual >= desde:
+                    yield actual, linea
+
+    def _leer_texto(self, ruta: str, desde: float, hasta: float) -> Iterator[Tuple[float, bytes]]:
+        with open(ruta, "rb") as archivo:
+            tamano = os.fstat(archivo.fileno()).st_size
+            offset = self._offset_texto(archivo, tamano, desde) if desde > -math.inf else 0
+            archivo.seek(offset)
+            if offset:
+                archivo.readline()  # La búsqueda binaria cae en medio de una línea
+            reloj = _Reloj()
+            actual = None
+            while archivo.tell() < tamano:
+                linea = archivo.readline().rstrip(b"\n")
+                instante = reloj.instante(linea)
+                if instante is not None:
+                    actual = instante
+                if actual is None:
+                    # Antes de la primera marca sólo se sabe que es anterior al resto del archivo
+                    if desde > -math.inf:
+                        continue
+                    actual = -math.inf
+                if actual > hasta:
+                    return
+                if actual >= desde:
+                    yield actual, linea
+
+    @staticmethod
+    def _offset_texto(archivo, tamano: int, desde: float) -> int:
+        """
+        Offset de un archivo de texto anterior a las líneas con instante >= desde (búsqueda binaria)
+        """
+        reloj = _Reloj()
+        bajo, alto = 0, tamano
+        while alto - bajo > TAMANO_BLOQUE:
+            medio = (bajo + alto) // 2
+            archivo.seek(medio)
+            archivo.readline()
+            instante = None
+            while instante is None and archivo.tell() < min(alto, medio + TAMANO_BLOQUE):
+                instante = reloj.instante(archivo.readline())
+            if instante is None or instante >= desde:
+                alto = medio
+            else:
+                bajo = medio
+        return bajo
+
+    def buscar(self, desde: Optional[float] = None, hasta: Optional[float] = None, patron: Optional[str] = None,
+               regex: bool = False, limite: int = LIMITE,
+               cursor: Optional[Tuple[float, int]] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, int]]]:
+        """
+        Líneas de un rango de tiempo en orden cronológico, opcionalmente filtradas por texto
+
+        Args:
+            desde: Instante inicial (epoch, inclusive)
+            hasta: Instante final (epoch, inclusive)
+            patron: Texto a buscar (sin distinguir mayúsculas) o expresión regular si regex
+            regex: Interpreta el patrón como expresión regular
+            limite: Líneas por página
+            cursor: (instante, líneas ya devueltas con ese instante) de la página anterior
+
+        Returns:
+            (líneas, cursor de la página siguiente o None)
+
+        Raises:
+            ValueError: si la expresión regular no es válida
+        """
+        desde = -math.inf if desde is None else desde
+        hasta = math.inf if hasta is None else hasta
+        saltear = 0
+        if cursor is not None:
+            desde, saltear = max(desde, cursor[0]), cursor[1]
+        filtro = None
+        if patron:
+            try:
+                filtro = re.compile(patron.encode("utf-8") if regex else re.escape(patron.encode("utf-8")), re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Expresión regular inválida: {e}")
+
+        with self._lock:
+            # Foto de las fuentes en orden: segmentos, archivos en compresión y el activo
+            candidatos = [s for s in self.segmentos if s.inicio <= hasta and s.fin >= desde]
+            pendientes = [ruta for _, ruta in self.pendientes]
+        fuentes = [lambda s=s: self._leer_segmento(s, desde, hasta) for s in candidatos]
+        fuentes += [lambda r=r: self._leer_texto(r, desde, hasta) for r in pendientes + [self.ruta]]
+
+        lineas: List[Dict[str, Any]] = []
+        # Instante de la última línea entregada y cuántas (contando páginas anteriores) lo comparten
+        ultimo, repetidas = desde, 0
+        for fuente in fuentes:
+            try:
+                for instante, linea in fuente():
+                    if filtro is not None and not filtro.search(linea):
+                        continue
+                    if instante == desde and saltear:
+                        saltear -= 1
+                        repetidas += 1
+                        continue
+                    if len(lineas) == limite:
+                        # Hay al menos una más: la página siguiente retoma en esta posición
+                        return lineas, (ultimo, repetidas)
+                    repetidas = repetidas + 1 if instante == ultimo else 1
+                    ultimo = instante
+                    lineas.append({"instante": instante, "linea": linea.decode("utf-8", "replace")})
+            except FileNotFoundError:
+                continue  # Borrado por retención o rotado durante la búsqueda
+        return lineas, None
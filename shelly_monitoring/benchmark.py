@@ -0,0 +1,555 @@
+"""
+Benchmarks del backend (no forman parte del servicio).
+
+    # Lanza un servidor Socket.IO de prueba en el modo indicado y conecta N clientes
+    python benchmark.py websocket --modo eventlet --clientes 5000 --activos 500 --duracion 30
+
+    # Contra un backend ya desplegado (la memoria sólo se mide si se indica su PID)
+    python benchmark.py websocket --destino 127.0.0.1:5000 --pid 1234 --clientes 5000
+
+    # Serialización de listas grandes: jsonify clásico vs. proveedor rápido vs. streaming
+    python benchmark.py json --dispositivos 50000
+
+    # Actualizaciones en vivo: eventos JSON 'device_update' vs. tramas binarias de deltas
+    python benchmark.py delta --dispositivos 5000 --frecuencia 2000 --duracion 60
+
+    # Sentencias SQL por endpoint contra su presupuesto (el backend corre con SHELLY_PERFIL_SQL=1 o estricto)
+    python benchmark.py consultas --destino 127.0.0.1:5000 --email admin@ejemplo.com --password secreto
+
+Los clientes usan un cliente WebSocket/Engine.IO mínimo sobre green threads, de
+modo que un solo proceso puede abrir miles de conexiones. Los clientes inactivos
+sólo responden los pings; los activos además envían un evento por segundo y
+miden el eco. Todos miden la latencia de los 'device_update' difundidos.
+"""
+
+import argparse
+import base64
+import json
+import os
+import resource
+import socket
+import statistics
+import tracemalloc
+import struct
+import subprocess
+import sys
+import time
+
+import modo_asincrono
+
+RUTA_SOCKETIO = "/socket.io/?EIO=4&transport=websocket"
+
+
+# ===========================
+# Utilidades
+# ===========================
+def rss_kb(pid: int) -> int:
+    """
+    Memoria residente de un proceso en KB (Linux)
+    """
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            if linea.startswith("VmRSS:"):
+                return int(linea.split()[1])
+    return 0
+
+
+def subir_limite_archivos():
+    blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if blando < duro:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    return duro
+
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def esperar_puerto(host: str, puerto: int, timeout: float = 15.0) -> bool:
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            socket.create_connection((host, puerto), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+# ===========================
+# Cliente WebSocket mínimo (RFC 6455) para Engine.IO v4
+# ===========================
+class ClienteWS:
+    def __init__(self, host: str, puerto: int, ruta: str = RUTA_SOCKETIO):
+        self.sock = socket.create_connection((host, puerto), timeout=30)
+        self.sock.settimeout(None)
+        clave = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            f"GET {ruta} HTTP/1.1\r\nHost: {host}:{puerto}\r\nUpgrade: websocket\r\n"
+            f"Connection: Upgrade\r\nSec-WebSocket-Key: {clave}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        self.lector = self.sock.makefile("rb")
+        estado = self.lector.readline()
+        if b" 101 " not in estado:
+            raise ConnectionError(f"Handshake rechazado: {estado!r}")
+        while self.lector.readline() not in (b"\r\n", b""):
+            pass
+
+    def enviar(self, texto: str, opcode: int = 1):
+        datos = texto.encode()
+        mascara = os.urandom(4)
+        n = len(datos)
+        if n < 126:
+            cabecera = struct.pack("!BB", 0x80 | opcode, 0x80 | n)
+        elif n < 65536:
+            cabecera = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, n)
+        else:
+            cabecera = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, n)
+        enmascarado = bytes(b ^ mascara[i % 4] for i, b in enumerate(datos))
+        self.sock.sendall(cabecera + mascara + enmascarado)
+
+    def recibir(self):
+        """
+        Devuelve (opcode, payload) del próximo frame de datos; responde los ping de WebSocket
+        """
+        while True:
+            cabecera = self.lector.read(2)
+            if len(cabecera) < 2:
+                raise ConnectionError("Conexión cerrada")
+            opcode = cabecera[0] & 0x0F
+            n = cabecera[1] & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", self.lector.read(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", self.lector.read(8))[0]
+            payload = self.lector.read(n)
+            if opcode == 0x9:
+                self.enviar(payload.decode("latin-1"), opcode=0xA)
+                continue
+            if opcode == 0x8:
+                raise ConnectionError("Cierre recibido")
+            return opcode, payload
+
+    def cerrar(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+# ===========================
+# Benchmark de WebSocket
+# ===========================
+def servidor_websocket(args):
+    """
+    Servidor Socket.IO de prueba con la misma configuración que app.py
+    """
+    modo_asincrono.preparar(args.modo)
+    from flask import Flask
+    from flask_socketio import SocketIO, emit
+
+    subir_limite_archivos()
+    app = Flask(__name__)
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=args.modo)
+
+    @socketio.on("eco")
+    def eco(datos):
+        emit("eco", datos)
+
+    def difundir():
+        i = 0
+        while True:
+            socketio.sleep(1 / args.frecuencia)
+            socketio.emit("device_update", {"id": i % 100, "state": bool(i % 2), "power": 12.5,
+                                            "online": True, "t": time.time()})
+            i += 1
+
+    socketio.start_background_task(difundir)
+    socketio.run(app, host=args.host, port=args.puerto, log_output=False, **modo_asincrono.opciones_servidor(args.modo))
+
+
+class Estadisticas:
+    def __init__(self):
+        self.conectados = 0
+        self.fallidos = 0
+        self.mensajes = 0
+        self.latencias_difusion = []
+        self.latencias_eco = []
+
+
+def cliente_socketio(host, puerto, activo, estado, stats, clientes):
+    import eventlet
+    try:
+        ws = ClienteWS(host, puerto)
+        clientes.append(ws)
+        opcode, abierto = ws.recibir()          # "0{sid, pingInterval, ...}"
+        ws.enviar("40")
+        opcode, conectado = ws.recibir()        # "40{sid}"
+        if not conectado.startswith(b"40"):
+            raise ConnectionError(f"Conexión al namespace rechazada: {conectado!r}")
+    except Exception:
+        stats.fallidos += 1
+        return
+    stats.conectados += 1
+
+    if activo:
+        def emisor():
+            while estado["corriendo"]:
+                eventlet.sleep(1.0)
+                try:
+                    ws.enviar("42" + json.dumps(["eco", {"t": time.time()}]))
+                except OSError:
+                    return
+        eventlet.spawn(emisor)
+
+    while estado["corriendo"]:
+        try:
+            _, payload = ws.recibir()
+        except Exception:
+            return
+        if payload == b"2":
+            ws.enviar("3")
+            continue
+        if payload.startswith(b"42") and estado["midiendo"]:
+            evento, datos = json.loads(payload[2:])
+            stats.mensajes += 1
+            latencia = (time.time() - datos["t"]) * 1000
+            (stats.latencias_eco if evento == "eco" else stats.latencias_difusion).append(latencia)
+
+
+def benchmark_websocket(args):
+    import eventlet
+    eventlet.monkey_patch()
+    limite = subir_limite_archivos()
+    if limite < args.clientes * 2 + 100 and not args.destino:
+        print(f"⚠️ Límite de archivos abiertos ({limite}) bajo para {args.clientes} clientes y el servidor en la misma máquina")
+
+    servidor = None
+    if args.destino:
+        host, _, puerto = args.destino.partition(":")
+        puerto = int(puerto or 5000)
+        pid = args.pid
+    else:
+        host, puerto = "127.0.0.1", args.puerto
+        servidor = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "servidor-websocket",
+            "--modo", args.modo, "--puerto", str(puerto), "--frecuencia", str(args.frecuencia),
+        ])
+        pid = servidor.pid
+
+    try:
+        if not esperar_puerto(host, puerto):
+            print("❌ El servidor no respondió")
+            return
+        time.sleep(1.0)
+        rss_base = rss_kb(pid) if pid else None
+
+        stats = Estadisticas()
+        estado = {"corriendo": True, "midiendo": False}
+        clientes = []
+        pool = eventlet.GreenPool(args.clientes + 10)
+        print(f"🔌 Conectando {args.clientes} clientes ({args.activos} activos) a {host}:{puerto}...")
+        inicio = time.time()
+        for i in range(args.clientes):
+            pool.spawn_n(cliente_socketio, host, puerto, i < args.activos, estado, stats, clientes)
+            if (i + 1) % args.ritmo == 0:
+                eventlet.sleep(1.0)
+        while stats.conectados + stats.fallidos < args.clientes and time.time() - inicio < 120:
+            eventlet.sleep(0.2)
+        tiempo_conexion = time.time() - inicio
+        eventlet.sleep(2.0)
+        rss_conectados = rss_kb(pid) if pid else None
+
+        estado["midiendo"] = True
+        eventlet.sleep(args.duracion)
+        estado["midiendo"] = False
+        rss_final = rss_kb(pid) if pid else None
+        estado["corriendo"] = False
+        for ws in clientes:
+            ws.cerrar()
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+
+    print("\n🔎 **Resumen del benchmark WebSocket:**")
+    print(f"📌 Modo: {args.modo if servidor else 'externo'}")
+    print(f"🔌 Conectados: {stats.conectados}/{args.clientes} (fallidos: {stats.fallidos}) en {tiempo_conexion:.1f} s")
+    print(f"📨 Mensajes recibidos en {args.duracion} s: {stats.mensajes} ({stats.mensajes / args.duracion:.0f}/s)")
+    for nombre, latencias in (("difusión", stats.latencias_difusion), ("eco", stats.latencias_eco)):
+        if latencias:
+            print(f"⏱️ Latencia {nombre}: p50 {percentil(latencias, 50):.1f} ms, "
+                  f"p99 {percentil(latencias, 99):.1f} ms, media {statistics.mean(latencias):.1f} ms")
+    if rss_base is not None:
+        por_conexion = (rss_conectados - rss_base) / max(stats.conectados, 1)
+        print(f"💾 RSS servidor: base {rss_base / 1024:.1f} MB, conectados {rss_conectados / 1024:.1f} MB, "
+              f"final {rss_final / 1024:.1f} MB")
+        print(f"💾 Memoria por conexión: {por_conexion:.1f} KB "
+              f"(crecimiento durante la medición: {(rss_final - rss_conectados) / 1024:.1f} MB)")
+
+
+# ===========================
+# Benchmark de serialización JSON
+# ===========================
+def filas_dispositivos(n: int):
+    """
+    Filas como las que devuelve la consulta de /api/dispositivos
+    """
+    for i in range(1, n + 1):
+        yield (i, f"Shelly {i}", f"10.{i // 65536}.{i // 256 % 256}.{i % 256}", "SHPLG-S",
+               i // 20 or None, round(i * 0.37 % 2500, 2), bool(i % 2), i % 20)
+
+
+def medir(funcion, repeticiones: int):
+    """
+    Ejecuta la función y devuelve (mejor tiempo en s, pico de memoria en KB, bytes producidos)
+
+    El tiempo se mide sin tracemalloc, que ralentiza mucho las asignaciones.
+    """
+    duraciones = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        producido = funcion()
+        duraciones.append(time.perf_counter() - inicio)
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(duraciones), pico / 1024, producido
+
+
+def benchmark_json(args):
+    import json_rapido
+    from flask.json.provider import DefaultJSONProvider
+
+    campos = ("id", "nombre", "ip", "tipo", "habitacion_id", "ultimo_consumo", "estado", "orden")
+    seleccion = args.campos.split(",")
+    indices = [campos.index(c) for c in seleccion]
+
+    def clasico():
+        # Lo que hacía jsonify: lista completa de dicts y json de la librería estándar con sort_keys
+        lista = [dict(zip(campos, fila)) for fila in filas_dispositivos(args.dispositivos)]
+        return len(json.dumps(lista, default=DefaultJSONProvider.default, sort_keys=True))
+
+    def proveedor():
+        lista = [dict(zip(campos, fila)) for fila in filas_dispositivos(args.dispositivos)]
+        return len(json_rapido.codificar(lista))
+
+    def streaming():
+        total = 0
+        for chunk in json_rapido.iterar_lista(filas_dispositivos(args.dispositivos), lambda f: dict(zip(campos, f))):
+            total += len(chunk)
+        return total
+
+    def streaming_campos():
+        total = 0
+        for chunk in json_rapido.iterar_lista(filas_dispositivos(args.dispositivos),
+                                              lambda f: {campos[i]: f[i] for i in indices}):
+            total += len(chunk)
+        return total
+
+    motor = "orjson" if json_rapido.orjson is not None else "json (orjson no instalado)"
+    print(f"🧪 Serializando {args.dispositivos} dispositivos (motor rápido: {motor})")
+    print(f"{'Variante':<44}{'Tiempo':>12}{'Pico memoria':>16}{'Bytes':>14}")
+    for nombre, funcion in (("jsonify clásico", clasico), ("proveedor rápido", proveedor),
+                            ("streaming", streaming), (f"streaming ?fields={args.campos}", streaming_campos)):
+        duracion, pico, producido = medir(funcion, args.repeticiones)
+        print(f"{nombre:<44}{duracion * 1000:>9.1f} ms{pico / 1024:>13.1f} MB{producido:>14}")
+
+
+# ===========================
+# Benchmark del protocolo de deltas
+# ===========================
+def simular_actualizaciones(n: int, cantidad: int, semilla: int = 1):
+    """
+    Flujo de actualizaciones parecido al real: sobre todo variaciones de potencia,
+    algunos encendidos/apagados y pocas caídas
+    """
+    import random
+    azar = random.Random(semilla)
+    ids = [f"shellyplug-s-{i:06X}" for i in range(n)]
+    estados = [[azar.random() < 0.5, True, round(azar.uniform(0, 2000), 1)] for _ in range(n)]
+    iniciales = [(ids[i], *estados[i]) for i in range(n)]
+    actualizaciones = []
+    for _ in range(cantidad):
+        i = azar.randrange(n)
+        estado = estados[i]
+        sorteo = azar.random()
+        if sorteo < 0.02:
+            estado[1] = not estado[1]
+        elif sorteo < 0.10:
+            estado[0] = not estado[0]
+            estado[2] = round(azar.uniform(5, 2000), 1) if estado[0] else 0.0
+        elif estado[0]:
+            estado[2] = round(max(0.0, estado[2] * azar.uniform(0.95, 1.05)), 1)
+        actualizaciones.append((ids[i], *estado))
+    return iniciales, actualizaciones
+
+
+def benchmark_delta(args):
+    import protocolo_delta
+    from protocolo_delta import CodificadorDelta, DecodificadorDelta
+
+    cantidad = int(args.frecuencia * args.duracion)
+    iniciales, actualizaciones = simular_actualizaciones(args.dispositivos, cantidad)
+    # Sobrecarga de Socket.IO por mensaje: paquete de texto del evento (o cabecera del binario) y trama WebSocket
+    sobrecarga_binaria = len('451-["device_delta",{"_placeholder":true,"num":0}]') + 4 + 4
+
+    # JSON: un evento por actualización, como emite hoy handle_device_update
+    inicio = time.perf_counter()
+    bytes_json = 0
+    for device_id, encendido, online, potencia in actualizaciones:
+        paquete = "42" + json.dumps(["device_update", {"id": device_id, "state": encendido, "power": potencia,
+                                                       "online": online}], separators=(",", ":"))
+        bytes_json += len(paquete.encode("utf-8")) + 4
+    costo_json = (time.perf_counter() - inicio) / max(cantidad, 1)
+
+    # Deltas: se coalescen por ventana de INTERVALO_TRAMA y se difunden keyframes periódicos
+    codificador = CodificadorDelta()
+    decodificador = DecodificadorDelta()
+    for device_id, encendido, online, potencia in iniciales:
+        codificador.registrar(device_id, encendido, online, potencia)
+    codificador.trama()
+    # Como un cliente real, el decodificador arranca con el keyframe de la suscripción
+    keyframe = codificador.keyframe()
+    decodificador.aplicar(keyframe)
+    keyframe_inicial = len(keyframe)
+
+    por_trama = max(1, int(args.frecuencia * protocolo_delta.INTERVALO_TRAMA))
+    tramas_por_keyframe = int(protocolo_delta.INTERVALO_KEYFRAME / protocolo_delta.INTERVALO_TRAMA)
+    bytes_delta = mensajes_delta = 0
+    duracion_codificacion = 0.0
+    for numero, desde in enumerate(range(0, cantidad, por_trama), start=1):
+        inicio = time.perf_counter()
+        for device_id, encendido, online, potencia in actualizaciones[desde:desde + por_trama]:
+            codificador.registrar(device_id, encendido, online, potencia)
+        trama = codificador.trama()
+        keyframe = codificador.keyframe() if numero % tramas_por_keyframe == 0 else None
+        duracion_codificacion += time.perf_counter() - inicio
+        for enviada in (trama, keyframe):
+            if enviada is not None:
+                if not decodificador.aplicar(enviada):
+                    raise RuntimeError("Trama fuera de secuencia")
+                bytes_delta += len(enviada) + sobrecarga_binaria
+                mensajes_delta += 1
+    costo_delta = duracion_codificacion / max(cantidad, 1)
+
+    esperado = {device_id: {"state": e, "online": o, "power": p}
+                for device_id, e, o, p in iniciales + actualizaciones}
+    if decodificador.estado != esperado:
+        raise RuntimeError("El estado decodificado no coincide con el difundido")
+
+    print(f"🧪 {args.dispositivos} dispositivos, {args.frecuencia:.0f} actualizaciones/s durante {args.duracion:.0f} s "
+          f"(tramas cada {protocolo_delta.INTERVALO_TRAMA * 1000:.0f} ms, keyframe cada "
+          f"{protocolo_delta.INTERVALO_KEYFRAME} s)")
+    print(f"{'Protocolo':<22}{'Bytes/s por cliente':>22}{'Mensajes/s':>14}{'Codificación':>20}")
+    for nombre, total, mensajes, costo in (("JSON device_update", bytes_json, cantidad, costo_json),
+                                           ("deltas binarios", bytes_delta, mensajes_delta, costo_delta)):
+        print(f"{nombre:<22}{total / args.duracion:>22,.0f}{mensajes / args.duracion:>14.1f}"
+              f"{costo * 1e6:>14.2f} µs/act")
+    print(f"📉 Reducción de tráfico: {bytes_json / max(bytes_delta, 1):.1f}x; "
+          f"keyframe completo: {keyframe_inicial / 1024:.1f} KB; estado decodificado verificado")
+
+
+# ===========================
+# Sentencias SQL por endpoint
+# ===========================
+# Sin /api/dispositivos: sin ?limit responde en streaming y sus sentencias corren después de la medición
+ENDPOINTS_CONSULTAS = ("/api/dashboard", "/api/tableros", "/api/habitaciones", "/api/usuarios/permisos")
+
+
+def benchmark_consultas(args):
+    import urllib.request
+    import urllib.error
+
+    base = f"http://{args.destino}"
+    pedido = urllib.request.Request(f"{base}/api/login", method="POST",
+                                    data=json.dumps({"email": args.email, "password": args.password}).encode(),
+                                    headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(pedido, timeout=10) as respuesta:
+        token = json.load(respuesta)["token"]
+
+    excedidos = 0
+    print(f"{'Endpoint':<28}{'Estado':>8}{'Consultas':>11}{'Presupuesto':>13}{'Repetidas':>11}{'SQL ms':>9}")
+    for ruta in args.endpoints.split(","):
+        pedido = urllib.request.Request(f"{base}{ruta}", headers={"Authorization": f"Bearer {token}"})
+        try:
+            respuesta = urllib.request.urlopen(pedido, timeout=30)
+        except urllib.error.HTTPError as e:
+            respuesta = e
+        with respuesta:
+            respuesta.read()
+            encabezados = respuesta.headers
+            estado = respuesta.getcode()
+        consultas = encabezados.get("X-SQL-Consultas")
+        if consultas is None:
+            print(f"{ruta:<28}{estado:>8}   sin medición (¿SHELLY_PERFIL_SQL=0?)")
+            continue
+        presupuesto = encabezados.get("X-SQL-Presupuesto", "-")
+        duracion = next((parte.split("=", 1)[1] for parte in encabezados.get("Server-Timing", "").split(";")
+                         if parte.startswith("dur=")), "-")
+        excedido = estado >= 500 or (presupuesto != "-" and int(consultas) > int(presupuesto))
+        excedidos += excedido
+        print(f"{ruta:<28}{estado:>8}{consultas:>11}{presupuesto:>13}{encabezados.get('X-SQL-Repetidas', '0'):>11}"
+              f"{duracion:>9}{'  ❌' if excedido else ''}")
+
+    if excedidos:
+        print(f"❌ {excedidos} endpoint(s) exceden su presupuesto de consultas")
+        sys.exit(1)
+    print("✅ Todos los endpoints dentro de su presupuesto")
+
+
+# ===========================
+# Línea de comandos
+# ===========================
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Benchmarks del backend de Shelly Monitoring")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    ws = sub.add_parser("websocket", help="Clientes Socket.IO concurrentes inactivos y activos")
+    ws.add_argument("--modo", choices=modo_asincrono.MODOS, default="eventlet")
+    ws.add_argument("--clientes", type=int, default=5000)
+    ws.add_argument("--activos", type=int, default=500, help="Clientes que además envían un evento por segundo")
+    ws.add_argument("--duracion", type=float, default=30.0, help="Segundos de medición con todos conectados")
+    ws.add_argument("--frecuencia", type=float, default=1.0, help="Difusiones 'device_update' por segundo")
+    ws.add_argument("--ritmo", type=int, default=500, help="Conexiones nuevas por segundo")
+    ws.add_argument("--puerto", type=int, default=5055)
+    ws.add_argument("--destino", help="host:puerto de un backend ya desplegado")
+    ws.add_argument("--pid", type=int, help="PID del backend externo para medir su memoria")
+    ws.set_defaults(funcion=benchmark_websocket)
+
+    js = sub.add_parser("json", help="Tiempo y pico de memoria al serializar listas grandes")
+    js.add_argument("--dispositivos", type=int, default=50000)
+    js.add_argument("--campos", default="id,estado,ultimo_consumo", help="Selección para la variante con ?fields=")
+    js.add_argument("--repeticiones", type=int, default=3)
+    js.set_defaults(funcion=benchmark_json)
+
+    dl = sub.add_parser("delta", help="Bytes/s por cliente y costo de codificación: JSON vs. deltas binarios")
+    dl.add_argument("--dispositivos", type=int, default=5000)
+    dl.add_argument("--frecuencia", type=float, default=2000.0, help="Actualizaciones por segundo en toda la flota")
+    dl.add_argument("--duracion", type=float, default=60.0, help="Segundos simulados")
+    dl.set_defaults(funcion=benchmark_delta)
+
+    cs = sub.add_parser("consultas", help="Sentencias SQL por endpoint contra su presupuesto declarado")
+    cs.add_argument("--destino", default="127.0.0.1:5000", help="host:puerto del backend")
+    cs.add_argument("--email", required=True)
+    cs.add_argument("--password", required=True)
+    cs.add_argument("--endpoints", default=",".join(ENDPOINTS_CONSULTAS), help="Rutas GET separadas por coma")
+    cs.set_defaults(funcion=benchmark_consultas)
+
+    servidor = sub.add_parser("servidor-websocket", help=argparse.SUPPRESS)
+    servidor.add_argument("--modo", choices=modo_asincrono.MODOS, default="eventlet")
+    servidor.add_argument("--host", default="127.0.0.1")
+    servidor.add_argument("--puerto", type=int, default=5055)
+    servidor.add_argument("--frecuencia", type=float, default=1.0)
+    servidor.set_defaults(funcion=servidor_websocket)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    argumentos = parsear_argumentos()
+    argumentos.funcion(argumentos)
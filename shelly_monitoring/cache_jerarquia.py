@@ -0,0 +1,85 @@
+"""
+Caché de la jerarquía tablero → habitación → dispositivo.
+
+La estructura del dashboard sólo cambia cuando se crea, renombra, reordena,
+mueve o asigna algo, así que cada una de esas operaciones incrementa una
+versión global. Las respuestas ya codificadas se guardan por (versión,
+conjunto de permisos): mientras la versión no cambie, una carga del dashboard
+no reconstruye ni recodifica el árbol, y el ETag (hash del cuerpo) permite
+responder 304.
+"""
+
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de la caché
+MAX_ENTRADAS = 256              # Conjuntos de permisos distintos que se conservan
+
+
+class CacheJerarquia:
+    """
+    Respuestas codificadas por conjunto de permisos, invalidadas por versión global
+    """
+    def __init__(self, max_entradas: int = MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self.version = 0
+        self._entradas: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = Lock()
+
+    def invalidar(self):
+        """
+        Incrementa la versión de la jerarquía y descarta todas las respuestas guardadas
+        """
+        with self._lock:
+            self.version += 1
+            self._entradas.clear()
+
+    def exportar_estado(self) -> Dict[str, int]:
+        return {"version": self.version}
+
+    def restaurar_estado(self, estado: Dict[str, int]):
+        """
+        Retoma la versión anterior al reinicio: si la jerarquía no cambió, el cuerpo reconstruido
+        es idéntico y los ETag que tienen los clientes siguen siendo válidos
+        """
+        with self._lock:
+            if estado.get("version", 0) > self.version:
+                self.version = estado["version"]
+                self._entradas.clear()
+
+    def obtener(self, clave: Hashable, construir: Callable[[], Any]) -> Tuple[str, bytes]:
+        """
+        Devuelve (etag, cuerpo JSON) para un conjunto de permisos, construyéndolo si hace falta
+
+        Args:
+            clave: Identifica el conjunto de permisos ("admin" o frozenset de habitaciones)
+            construir: Función que arma la jerarquía (serializable a JSON)
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                return entrada
+            version = self.version
+
+        # La construcción va fuera del lock para no bloquear a otros conjuntos de permisos
+        cuerpo = _codificar(dict(version=version, tableros=construir()))
+        entrada = (hashlib.blake2b(cuerpo, digest_size=16).hexdigest(), cuerpo)
+
+        with self._lock:
+            # Si la jerarquía cambió mientras se construía, la respuesta se entrega pero no se guarda
+            if version == self.version:
+                self._entradas[clave] = entrada
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+        return entrada
+
+
+def _codificar(datos: Any) -> bytes:
+    return json.dumps(datos, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,132 @@
+"""
+Caché de las consultas que el backend reenvía a los adaptadores y dispositivos.
+
+Cada clave (tipo de consulta y dispositivo) tiene una sola petición en vuelo:
+las requests que llegan mientras tanto esperan ese resultado en lugar de
+repetir la llamada (singleflight). El resultado queda fresco durante `ttl`
+segundos; después, y hasta `ttl + obsoleto`, se sigue entregando al instante
+mientras un thread lo renueva en segundo plano (stale-while-revalidate). Así
+un dispositivo no recibe más de una consulta de cada tipo por intervalo, sin
+importar cuántos usuarios lo estén mirando.
+
+Los resultados vacíos (None: el adaptador no respondió) se recuerdan hasta
+TTL_VACIO segundos, para no reintentar en ráfaga contra un dispositivo caído;
+si todavía hay un valor previo dentro de la ventana de obsoleto, se sigue
+entregando ése. Las excepciones del cargador llegan a todos los que esperaban
+y no se guardan.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de la caché
+MAX_ENTRADAS = 10000            # Claves guardadas antes de descartar las más viejas
+TTL_VACIO = 5.0                 # Segundos máximos que se recuerda una consulta sin respuesta
+
+
+class _Entrada:
+    __slots__ = ("valor", "instante", "reintento")
+
+    def __init__(self, valor: Any, instante: float, reintento: float):
+        self.valor = valor
+        self.instante = instante
+        self.reintento = reintento      # Antes de este instante no se lanza otra renovación
+
+
+class _Vuelo:
+    __slots__ = ("evento", "valor", "error", "descartar")
+
+    def __init__(self):
+        self.evento = Event()
+        self.valor = None
+        self.error: Optional[BaseException] = None
+        self.descartar = False
+
+
+class CachePasarela:
+    """
+    Resultados recientes por clave con una sola carga en vuelo por clave
+    """
+    def __init__(self, max_entradas: int = MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[Hashable, _Entrada]" = OrderedDict()
+        self._vuelos: Dict[Hashable, _Vuelo] = {}
+        self._lock = Lock()
+
+    def obtener(self, clave: Hashable, cargar: Callable[[], Any], ttl: float, obsoleto: float = 0.0) -> Any:
+        """
+        Devuelve el resultado de `cargar` para la clave, compartido y reutilizado
+
+        Args:
+            clave: Identifica la consulta (p. ej. ('estado', device_id))
+            cargar: Hace la consulta real; devuelve None si no hubo respuesta
+            ttl: Segundos durante los que el resultado se considera fresco
+            obsoleto: Segundos adicionales en que se entrega mientras se renueva en segundo plano
+
+        Raises:
+            La excepción de `cargar`, si la carga compartida falló
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            fresca = ttl if entrada is None or entrada.valor is not None else min(ttl, TTL_VACIO)
+            if entrada is not None and ahora - entrada.instante < fresca:
+                return entrada.valor
+            vuelo = self._vuelos.get(clave)
+            if entrada is not None and entrada.valor is not None and ahora - entrada.instante < ttl + obsoleto:
+                if vuelo is None and ahora >= entrada.reintento:
+                    vuelo = self._vuelos[clave] = _Vuelo()
+                    Thread(target=self._cargar, args=(clave, cargar, ttl, obsoleto, vuelo), daemon=True).start()
+                return entrada.valor
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+
+        if lider:
+            self._cargar(clave, cargar, ttl, obsoleto, vuelo)
+        else:
+            vuelo.evento.wait()
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.valor
+
+    def _cargar(self, clave: Hashable, cargar: Callable[[], Any], ttl: float, obsoleto: float, vuelo: _Vuelo):
+        try:
+            vuelo.valor = cargar()
+        except Exception as e:
+            vuelo.error = e
+            logger.debug(f"Error cargando {clave}: {e}")
+        ahora = time.monotonic()
+        with self._lock:
+            if self._vuelos.get(clave) is vuelo:
+                del self._vuelos[clave]
+            previa = self._entradas.get(clave)
+            vigente = previa is not None and previa.valor is not None and ahora - previa.instante < ttl + obsoleto
+            if vuelo.descartar:
+                pass
+            elif vuelo.error is not None or (vuelo.valor is None and vigente):
+                # Falló la renovación: se sigue entregando el valor previo sin reintentar hasta el próximo intervalo
+                if previa is not None:
+                    previa.reintento = ahora + ttl
+            else:
+                self._entradas[clave] = _Entrada(vuelo.valor, ahora, ahora + ttl)
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+        vuelo.evento.set()
+
+    def invalidar(self, *claves: Hashable):
+        """
+        Descarta las claves (p. ej. tras un comando); una carga en vuelo ya no guardará su resultado
+        """
+        with self._lock:
+            for clave in claves:
+                self._entradas.pop(clave, None)
+                vuelo = self._vuelos.pop(clave, None)
+                if vuelo is not None:
+                    vuelo.descartar = True
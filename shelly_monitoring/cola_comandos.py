@@ -0,0 +1,410 @@
+"""
+Cola persistente de comandos para los dispositivos (outbox).
+
+Cada orden se guarda en la tabla `comandos` con una sola sentencia y se responde
+enseguida; el envío al adaptador es asíncrono. En memoria sólo vive el último
+estado deseado por dispositivo y canal: una orden nueva reemplaza a la que
+estaba pendiente, así que varios toggles seguidos terminan en una única llamada
+al adaptador. Un único thread atiende un heap de próximos intentos y reparte los
+envíos en un pool acotado, sin dos envíos simultáneos al mismo dispositivo.
+
+Si el adaptador o el dispositivo no responden se reintenta con backoff
+exponencial, y una orden sólo se da por cumplida cuando el estado que reporta el
+dispositivo coincide con el pedido. Al arrancar se retoman de la tabla las
+órdenes que quedaron a medias.
+
+Estados: pendiente -> enviado -> confirmado, o bien reemplazado / fallido.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de la cola
+MAX_WORKERS = 8
+MAX_INTENTOS = 8                # Envíos antes de dar la orden por fallida
+BACKOFF_INICIAL = 1.0           # Segundos antes del primer reintento
+BACKOFF_MAXIMO = 60.0
+TIEMPO_CONFIRMACION = 10.0      # Segundos que se espera al estado reportado tras un envío aceptado
+EXPIRACION_MINUTOS = 30         # Al arrancar, las órdenes más viejas no se reanudan
+
+ACTIVOS = ("pendiente", "enviado")
+
+
+def estados_reportados(dispositivo: Dict[str, Any]) -> Dict[int, bool]:
+    """
+    Estado de cada canal según una actualización del adaptador o del sondeo directo
+    """
+    estados = {}
+    for clave in ("relays", "lights"):
+        for canal, salida in enumerate(dispositivo.get(clave) or []):
+            if isinstance(salida, dict) and "ison" in salida:
+                estados[canal] = bool(salida["ison"])
+    if "state" in dispositivo:
+        estados[0] = bool(dispositivo["state"])
+    return estados
+
+
+class _Comando:
+    __slots__ = ("id", "clave", "canal", "estado", "dispositivo_id", "origen", "usuario_id",
+                 "status", "intentos", "ultimo_error", "creado", "version")
+
+    def __init__(self, id: int, clave: str, canal: int, estado: bool, dispositivo_id: Optional[int],
+                 origen: Optional[str], usuario_id: Optional[int], creado, intentos: int = 0):
+        self.id = id
+        self.clave = clave
+        self.canal = canal
+        self.estado = estado
+        self.dispositivo_id = dispositivo_id
+        self.origen = origen
+        self.usuario_id = usuario_id
+        self.status = "pendiente"
+        self.intentos = intentos
+        self.ultimo_error = None
+        self.creado = creado
+        self.version = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "dispositivo": self.clave,
+            "canal": self.canal,
+            "estado": self.estado,
+            "dispositivo_id": self.dispositivo_id,
+            "origen": self.origen,
+            "usuario_id": self.usuario_id,
+            "status": self.status,
+            "intentos": self.intentos,
+            "ultimo_error": self.ultimo_error,
+            "creado": self.creado.isoformat() if self.creado else None,
+        }
+
+
+class ColaComandos:
+    """
+    Outbox en Postgres con una cola en memoria por dispositivo y canal
+    """
+    def __init__(self, conectar: Callable[[], Any],
+                 enviar: Callable[[str, int, bool], bool],
+                 leer_estado: Callable[[str, int], Optional[bool]],
+                 max_workers: int = MAX_WORKERS):
+        """
+        Args:
+            conectar: Devuelve una conexión psycopg2
+            enviar: Aplica un estado en un dispositivo (IP o ID del adaptador) y canal; True si se aceptó
+            leer_estado: Último estado reportado de un dispositivo y canal (None si no se conoce)
+            max_workers: Envíos en curso a la vez
+        """
+        self.conectar = conectar
+        self.enviar = enviar
+        self.leer_estado = leer_estado
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.comandos: Dict[Tuple[str, int], _Comando] = {}
+        self.event_listeners = []
+        self._heap = []
+        self._secuencia = itertools.count()
+        self._en_vuelo = set()
+        self._diferidas: Dict[Tuple[str, int], tuple] = {}   # Entradas vencidas durante un envío en curso
+        self._condicion = Condition()
+
+    def add_event_listener(self, event_type: str, callback):
+        """
+        Agrega un listener para eventos de la cola ('comandoActualizado')
+
+        Args:
+            event_type: Tipo de evento a escuchar
+            callback: Función a llamar cuando ocurra el evento
+        """
+        self.event_listeners.append((event_type, callback))
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for listener_type, callback in self.event_listeners:
+            if listener_type == event_type:
+                try:
+                    callback(data)
+                except Exception as e:
+                    logger.error(f"Error en event listener: {e}")
+
+    # ===========================
+    # Persistencia
+    # ===========================
+    def _ejecutar_sql(self, sentencia: str, parametros: tuple = (), devolver: bool = False):
+        conn = self.conectar()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sentencia, parametros)
+            filas = cursor.fetchall() if devolver else None
+            conn.commit()
+            cursor.close()
+            return filas
+        finally:
+            conn.close()
+
+    def _persistir(self, comando: _Comando):
+        # Una orden ya reemplazada en la tabla no vuelve a un estado activo
+        try:
+            self._ejecutar_sql(
+                "UPDATE comandos SET status = %s, intentos = %s, ultimo_error = %s, actualizado = now() "
+                "WHERE id = %s AND status IN ('pendiente', 'enviado')",
+                (comando.status, comando.intentos, comando.ultimo_error, comando.id))
+        except Exception as e:
+            logger.error(f"Error guardando el comando {comando.id}: {e}")
+        self._notify_listeners("comandoActualizado", comando.to_dict())
+
+    def iniciar(self):
+        """
+        Retoma las órdenes activas de la tabla y lanza el thread de despacho
+        """
+        filas = self._ejecutar_sql(
+            "WITH expirados AS ("
+            "    UPDATE comandos SET status = 'fallido', ultimo_error = 'Expirado', actualizado = now() "
+            "    WHERE status IN ('pendiente', 'enviado') AND creado < now() - %s * interval '1 minute'"
+            ") "
+            "SELECT id, clave, canal, estado, dispositivo_id, origen, usuario_id, intentos, creado FROM comandos "
+            "WHERE status IN ('pendiente', 'enviado') AND creado >= now() - %s * interval '1 minute' ORDER BY id",
+            (EXPIRACION_MINUTOS, EXPIRACION_MINUTOS), devolver=True)
+        reemplazados = []
+        with self._condicion:
+            for id_comando, clave, canal, estado, dispositivo_id, origen, usuario_id, intentos, creado in filas:
+                anterior = self.comandos.get((clave, canal))
+                if anterior is not None:
+                    reemplazados.append(anterior.id)
+                self.comandos[(clave, canal)] = _Comando(id_comando, clave, canal, estado, dispositivo_id,
+                                                         origen, usuario_id, creado, intentos)
+            for comando in self.comandos.values():
+                self._programar(comando, 0)
+        if reemplazados:
+            self._ejecutar_sql("UPDATE comandos SET status = 'reemplazado', actualizado = now() WHERE id = ANY(%s)",
+                               (reemplazados,))
+        thread = Thread(target=self._bucle, daemon=True)
+        thread.start()
+        logger.info(f"Cola de comandos iniciada con {len(self.comandos)} órdenes pendientes")
+
+    # ===========================
+    # API
+    # ===========================
+    def encolar(self, clave: str, canal: int, estado: bool, dispositivo_id: Optional[int] = None,
+                origen: Optional[str] = None, usuario_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Registra el estado deseado de un dispositivo y devuelve la orden creada
+
+        Args:
+            clave: IP del dispositivo o ID del adaptador
+            canal: Relé o salida
+            estado: True para encender
+            dispositivo_id: ID en la tabla dispositivos, si se conoce
+            origen: Qué dio la orden (usuario, programacion, regla...)
+            usuario_id: Usuario que dio la orden, si la dio un usuario
+        """
+        return self.encolar_varios([(clave, dispositivo_id)], canal, estado, origen, usuario_id)[0]
+
+    def encolar_varios(self, objetivos: List[Tuple[str, Optional[int]]], canal: int, estado: bool,
+                       origen: Optional[str] = None, usuario_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Igual que encolar() para varios dispositivos, con una única sentencia SQL
+
+        Args:
+            objetivos: Pares (clave, dispositivo_id)
+        """
+        objetivos = list({clave: dispositivo_id for clave, dispositivo_id in objetivos if clave}.items())
+        if not objetivos:
+            return []
+        # Las órdenes activas del mismo dispositivo y canal quedan reemplazadas en la misma transacción
+        filas = self._ejecutar_sql(
+            "WITH nuevos AS ("
+            "    SELECT * FROM unnest(%s::text[], %s::int[]) AS n(clave, dispositivo_id)"
+            "), reemplazados AS ("
+            "    UPDATE comandos c SET status = 'reemplazado', actualizado = now() FROM nuevos n "
+            "    WHERE c.clave = n.clave AND c.canal = %s AND c.status IN ('pendiente', 'enviado')"
+            ") "
+            "INSERT INTO comandos (clave, canal, estado, dispositivo_id, origen, usuario_id, status, intentos, creado, actualizado) "
+            "SELECT clave, %s, %s, dispositivo_id, %s, %s, 'pendiente', 0, now(), now() FROM nuevos "
+            "RETURNING id, clave, dispositivo_id, creado",
+            ([c for c, _ in objetivos], [d for _, d in objetivos], canal, canal, estado, origen, usuario_id), devolver=True)
+
+        creados, reemplazados = [], []
+        with self._condicion:
+            for id_comando, clave, dispositivo_id, creado in filas:
+                comando = _Comando(id_comando, clave, canal, estado, dispositivo_id, origen, usuario_id, creado)
+                anterior = self.comandos.get((clave, canal))
+                if anterior is not None:
+                    anterior.status = "reemplazado"
+                    comando.version = anterior.version + 1
+                    reemplazados.append(anterior.to_dict())
+                self.comandos[(clave, canal)] = comando
+                # Si hay un envío en curso, la orden nueva sale cuando termine
+                if (clave, canal) not in self._en_vuelo:
+                    self._programar(comando, 0)
+                creados.append(comando.to_dict())
+            self._condicion.notify()
+
+        for evento in reemplazados + creados:
+            self._notify_listeners("comandoActualizado", evento)
+        return creados
+
+    def estado_deseado(self, clave: str, canal: int = 0) -> Optional[bool]:
+        """
+        Estado de la orden activa de un dispositivo y canal (None si no hay)
+        """
+        comando = self.comandos.get((clave, canal))
+        return comando.estado if comando is not None else None
+
+    def activos(self) -> List[Dict[str, Any]]:
+        """
+        Órdenes todavía no confirmadas ni descartadas
+        """
+        with self._condicion:
+            return [comando.to_dict() for comando in self.comandos.values()]
+
+    def obtener(self, comando_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Estado de una orden, activa o histórica
+        """
+        filas = self._ejecutar_sql(
+            "SELECT id, clave, canal, estado, dispositivo_id, origen, usuario_id, status, intentos, ultimo_error, creado, actualizado "
+            "FROM comandos WHERE id = %s", (comando_id,), devolver=True)
+        if not filas:
+            return None
+        (id_comando, clave, canal, estado, dispositivo_id, origen, usuario_id, status, intentos, ultimo_error,
+         creado, actualizado) = filas[0]
+        return {
+            "id": id_comando,
+            "dispositivo": clave,
+            "canal": canal,
+            "estado": estado,
+            "dispositivo_id": dispositivo_id,
+            "origen": origen,
+            "usuario_id": usuario_id,
+            "status": status,
+            "intentos": intentos,
+            "ultimo_error": ultimo_error,
+            "creado": creado.isoformat() if creado else None,
+            "actualizado": actualizado.isoformat() if actualizado else None,
+        }
+
+    def confirmar(self, dispositivo: Dict[str, Any]):
+        """
+        Confirma las órdenes que coinciden con el estado reportado por un dispositivo
+        """
+        if not self.comandos:
+            return
+        confirmados = []
+        with self._condicion:
+            for clave in {dispositivo.get("ip"), dispositivo.get("id")} - {None}:
+                for canal, estado in estados_reportados(dispositivo).items():
+                    comando = self.comandos.get((str(clave), canal))
+                    if comando is not None and comando.estado == estado:
+                        self._finalizar(comando, "confirmado")
+                        confirmados.append(comando)
+        for comando in confirmados:
+            self._persistir(comando)
+
+    # ===========================
+    # Despacho
+    # ===========================
+    def _programar(self, comando: _Comando, espera: float):
+        heapq.heappush(self._heap, (time.monotonic() + espera, next(self._secuencia),
+                                    (comando.clave, comando.canal), comando.version))
+
+    def _vigente(self, entrada) -> bool:
+        comando = self.comandos.get(entrada[2])
+        return comando is not None and comando.version == entrada[3]
+
+    def _finalizar(self, comando: _Comando, status: str):
+        comando.status = status
+        if self.comandos.get((comando.clave, comando.canal)) is comando:
+            del self.comandos[(comando.clave, comando.canal)]
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while True:
+                    # Borrado perezoso de órdenes reemplazadas o terminadas; las que vencen con un envío
+                    # en curso (reintento o espera de confirmación) se retoman cuando ese envío termina
+                    while self._heap and (not self._vigente(self._heap[0]) or (
+                            self._heap[0][2] in self._en_vuelo and self._heap[0][0] <= time.monotonic())):
+                        entrada = heapq.heappop(self._heap)
+                        if self._vigente(entrada):
+                            self._diferidas[entrada[2]] = entrada
+                    espera = self._heap[0][0] - time.monotonic() if self._heap else None
+                    if espera is not None and espera <= 0:
+                        break
+                    self._condicion.wait(espera)
+                _, _, clave, _ = heapq.heappop(self._heap)
+                comando = self.comandos[clave]
+                self._en_vuelo.add(clave)
+            self.pool.submit(self._procesar, comando)
+
+    def _procesar(self, comando: _Comando):
+        try:
+            self._intentar(comando)
+        except Exception as e:
+            logger.error(f"Error procesando el comando {comando.id}: {e}")
+        finally:
+            with self._condicion:
+                clave = (comando.clave, comando.canal)
+                self._en_vuelo.discard(clave)
+                siguiente = self.comandos.get(clave)
+                diferida = self._diferidas.pop(clave, None)
+                # Una orden que llegó durante el envío sale ahora
+                if siguiente is not None and siguiente is not comando:
+                    self._programar(siguiente, 0)
+                elif diferida is not None and self._vigente(diferida):
+                    heapq.heappush(self._heap, diferida)
+                self._condicion.notify()
+
+    def _intentar(self, comando: _Comando):
+        if comando.status not in ACTIVOS:
+            return
+        if comando.status == "enviado":
+            # Venció la espera de confirmación: puede que el estado no cambiara y no haya llegado evento
+            if self.leer_estado(comando.clave, comando.canal) == comando.estado:
+                self._cerrar(comando, "confirmado")
+                return
+            error = "El dispositivo no reportó el estado pedido"
+        else:
+            try:
+                aceptado = self.enviar(comando.clave, comando.canal, comando.estado)
+                error = None if aceptado else "El adaptador no aceptó el comando"
+            except Exception as e:
+                aceptado, error = False, str(e)
+            comando.intentos += 1
+            if aceptado:
+                if self.leer_estado(comando.clave, comando.canal) == comando.estado:
+                    self._cerrar(comando, "confirmado")
+                    return
+                with self._condicion:
+                    if comando.status != "pendiente":
+                        return
+                    comando.status = "enviado"
+                    comando.ultimo_error = None
+                    self._programar(comando, TIEMPO_CONFIRMACION)
+                self._persistir(comando)
+                return
+
+        with self._condicion:
+            if comando.status not in ACTIVOS:
+                return
+            comando.ultimo_error = error
+            if comando.intentos >= MAX_INTENTOS:
+                self._finalizar(comando, "fallido")
+                logger.warning(f"Comando {comando.id} para {comando.clave} fallido: {error}")
+            else:
+                comando.status = "pendiente"
+                espera = min(BACKOFF_MAXIMO, BACKOFF_INICIAL * 2 ** (comando.intentos - 1))
+                self._programar(comando, espera * random.uniform(0.8, 1.2))
+        self._persistir(comando)
+
+    def _cerrar(self, comando: _Comando, status: str):
+        with self._condicion:
+            if comando.status not in ACTIVOS:
+                return
+            self._finalizar(comando, status)
+        self._persistir(comando)
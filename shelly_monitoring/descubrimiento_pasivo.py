@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+"""
+Descubrimiento pasivo de dispositivos Shelly.
+
+Escucha los anuncios que los propios dispositivos envían a la red en lugar de
+sondear cada dirección de una subred:
+
+- Gen1: multicast CoIoT (CoAP) en 224.0.1.187:5683
+- Gen2: anuncios mDNS del servicio _shelly._tcp en 224.0.0.251:5353
+
+Por cada anuncio se extrae modelo, id e IP, se inserta/actualiza la tabla
+`dispositivos` y se detectan cambios de IP (movimientos por DHCP). El escaneo
+activo de descubrir_shelly.py queda sólo para completar huecos.
+
+Uso:
+    python3 descubrimiento_pasivo.py escuchar
+    python3 descubrimiento_pasivo.py capturar <archivo.jsonl>
+    python3 descubrimiento_pasivo.py reproducir <archivo.jsonl> [--enviar HOST] [--sin-db]
+"""
+
+import json
+import logging
+import select
+import socket
+import struct
+import sys
+import time
+from threading import Thread, Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de red
+COIOT_GRUPO = "224.0.1.187"
+COIOT_PUERTO = 5683
+MDNS_GRUPO = "224.0.0.251"
+MDNS_PUERTO = 5353
+MDNS_SERVICIO = "_shelly._tcp.local"
+
+# Opción CoAP propietaria de Shelly con "<modelo>#<id>#<version>"
+COIOT_OPCION_DEVID = 3332
+
+# Tipos de registro DNS que interesan
+DNS_A = 1
+DNS_PTR = 12
+DNS_TXT = 16
+DNS_SRV = 33
+
+# 📌 Configuración de la base de datos (igual que descubrir_shelly.py)
+DB_NAME = "shelly_db"
+DB_USER = "shelly_user"
+DB_PASSWORD = "shelly_pass"
+DB_HOST = "localhost"
+
+# Tipos CoIoT de Gen1 -> tipo usado en `dispositivos` (mismo formato que extraer_modelo)
+MODELOS_COIOT = {
+    "SHSW-1": "1",
+    "SHSW-PM": "1PM",
+    "SHSW-L": "1L",
+    "SHSW-21": "SWITCH",
+    "SHSW-25": "SWITCH25",
+    "SHPLG-1": "PLUG",
+    "SHPLG-S": "PLUG",
+    "SHPLG-U1": "PLUGUS",
+    "SHDM-1": "DIMMER",
+    "SHDM-2": "DIMMER2",
+    "SHEM": "EM",
+    "SHEM-3": "EM3",
+    "SHRGBW2": "RGBW2",
+    "SHBLB-1": "BULB",
+    "SHIX3-1": "IX3",
+    "SHUNI-1": "UNI",
+    "SHHT-1": "HT",
+}
+
+
+def extraer_modelo(texto):
+    """Extrae el nombre del modelo del ID o hostname con formato 'shelly<modelo>-<mac>'"""
+    if texto and "-" in texto:
+        return texto.split("-")[0].lower().replace("shelly", "").upper()
+    return None
+
+
+def extraer_id(texto):
+    """Extrae el identificador (MAC) del ID o hostname con formato 'shelly<modelo>-<mac>'"""
+    if texto and "-" in texto:
+        return texto.rsplit("-", 1)[1].lower()
+    return None
+
+
+# ===========================
+# Decodificación de CoIoT
+# ===========================
+def parsear_coiot(datos: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Decodifica un anuncio CoIoT de Gen1
+
+    Args:
+        datos: Contenido del datagrama UDP
+
+    Returns:
+        Diccionario con shelly_id, tipo, modelo y gen, o None si no es un anuncio Shelly
+    """
+    if len(datos) < 4 or (datos[0] >> 6) != 1:
+        return None
+
+    tkl = datos[0] & 0x0F
+    pos = 4 + tkl
+    numero_opcion = 0
+
+    while pos < len(datos):
+        byte = datos[pos]
+        if byte == 0xFF:
+            break
+        pos += 1
+        delta, longitud = byte >> 4, byte & 0x0F
+
+        # Deltas y longitudes extendidas (RFC 7252, sección 3.1)
+        if delta == 13:
+            delta = datos[pos] + 13
+            pos += 1
+        elif delta == 14:
+            delta = struct.unpack(">H", datos[pos:pos + 2])[0] + 269
+            pos += 2
+        if longitud == 13:
+            longitud = datos[pos] + 13
+            pos += 1
+        elif longitud == 14:
+            longitud = struct.unpack(">H", datos[pos:pos + 2])[0] + 269
+            pos += 2
+
+        numero_opcion += delta
+        valor = datos[pos:pos + longitud]
+        pos += longitud
+
+        if numero_opcion == COIOT_OPCION_DEVID:
+            partes = valor.decode("utf-8", errors="replace").split("#")
+            if len(partes) < 2 or not partes[1]:
+                return None
+            modelo = partes[0]
+            return {
+                "shelly_id": partes[1].lower(),
+                "modelo": modelo,
+                "tipo": MODELOS_COIOT.get(modelo, modelo),
+                "gen": 1,
+            }
+    return None
+
+
+# ===========================
+# Decodificación de mDNS
+# ===========================
+def _leer_nombre(datos: bytes, pos: int) -> Tuple[str, int]:
+    """Lee un nombre DNS (con compresión) y devuelve (nombre, posición siguiente)"""
+    etiquetas = []
+    siguiente = None
+    saltos = 0
+    while True:
+        longitud = datos[pos]
+        if longitud == 0:
+            pos += 1
+            break
+        if longitud & 0xC0 == 0xC0:
+            if siguiente is None:
+                siguiente = pos + 2
+            pos = ((longitud & 0x3F) << 8) | datos[pos + 1]
+            saltos += 1
+            if saltos > 32:
+                raise ValueError("Bucle de compresión en nombre DNS")
+            continue
+        pos += 1
+        etiquetas.append(datos[pos:pos + longitud].decode("utf-8", errors="replace"))
+        pos += longitud
+    return ".".join(etiquetas), (siguiente if siguiente is not None else pos)
+
+
+def parsear_mdns(datos: bytes) -> List[Dict[str, Any]]:
+    """
+    Decodifica un paquete mDNS y extrae los anuncios _shelly._tcp de Gen2
+
+    Args:
+        datos: Contenido del datagrama UDP
+
+    Returns:
+        Lista de anuncios con shelly_id, tipo, nombre, ip y gen
+    """
+    try:
+        _, flags, qd, an, ns, ar = struct.unpack(">HHHHHH", datos[:12])
+    except struct.error:
+        return []
+    if not flags & 0x8000:
+        return []  # Sólo respuestas/anuncios
+
+    pos = 12
+    for _ in range(qd):
+        _, pos = _leer_nombre(datos, pos)
+        pos += 4
+
+    instancias = set()
+    srv = {}
+    txt = {}
+    direcciones = {}
+
+    for _ in range(an + ns + ar):
+        nombre, pos = _leer_nombre(datos, pos)
+        tipo, _, _, longitud = struct.unpack(">HHIH", datos[pos:pos + 10])
+        pos += 10
+        rdata_inicio = pos
+        pos += longitud
+
+        if tipo == DNS_PTR and nombre.lower() == MDNS_SERVICIO:
+            instancia, _ = _leer_nombre(datos, rdata_inicio)
+            instancias.add(instancia)
+        elif tipo == DNS_SRV:
+            destino, _ = _leer_nombre(datos, rdata_inicio + 6)
+            srv[nombre] = destino
+        elif tipo == DNS_TXT:
+            valores = {}
+            i = rdata_inicio
+            while i < pos:
+                n = datos[i]
+                entrada = datos[i + 1:i + 1 + n].decode("utf-8", errors="replace")
+                clave, _, valor = entrada.partition("=")
+                valores[clave] = valor
+                i += 1 + n
+            txt[nombre] = valores
+        elif tipo == DNS_A and longitud == 4:
+            direcciones[nombre.lower()] = socket.inet_ntoa(datos[rdata_inicio:pos])
+
+    # Un anuncio puede traer sólo SRV/TXT sin PTR
+    instancias.update(n for n in srv if n.lower().endswith("." + MDNS_SERVICIO))
+
+    anuncios = []
+    for instancia in instancias:
+        host = srv.get(instancia)
+        ip = direcciones.get(host.lower()) if host else None
+        etiqueta = instancia.split(".")[0]
+        shelly_id = extraer_id(etiqueta)
+        if not ip or not shelly_id:
+            continue
+        valores = txt.get(instancia, {})
+        anuncios.append({
+            "shelly_id": shelly_id,
+            "tipo": extraer_modelo(etiqueta) or valores.get("app", "").upper(),
+            "nombre": etiqueta,
+            "ip": ip,
+            "gen": int(valores.get("gen", 2) or 2),
+        })
+    return anuncios
+
+
+def construir_consulta_mdns() -> bytes:
+    """Construye una consulta PTR para _shelly._tcp.local"""
+    cabecera = struct.pack(">HHHHHH", 0, 0, 1, 0, 0, 0)
+    nombre = b"".join(bytes([len(p)]) + p.encode() for p in MDNS_SERVICIO.split(".")) + b"\x00"
+    return cabecera + nombre + struct.pack(">HH", DNS_PTR, 1)
+
+
+# ===========================
+# Persistencia
+# ===========================
+def conectar_db():
+    import psycopg2
+    return psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST)
+
+
+def guardar_anuncio(conn, anuncio: Dict[str, Any]) -> Optional[str]:
+    """
+    Inserta o actualiza un dispositivo a partir de un anuncio
+
+    Args:
+        conn: Conexión psycopg2
+        anuncio: Anuncio con shelly_id, ip y tipo
+
+    Returns:
+        "agregado", "movido", "adoptado", "actualizado", "conflicto" si la IP nueva
+        pertenece a otro dispositivo (no se guarda nada), o None si no hubo cambios
+    """
+    shelly_id, ip, tipo = anuncio["shelly_id"], anuncio["ip"], anuncio.get("tipo") or ""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, ip, tipo FROM dispositivos WHERE shelly_id = %s", (shelly_id,))
+        por_id = cur.fetchone()
+        cur.execute("SELECT id, shelly_id, habitacion_id FROM dispositivos WHERE ip = %s", (ip,))
+        por_ip = cur.fetchone()
+
+        resultado = None
+        if por_id:
+            id_dispositivo, ip_actual, tipo_actual = por_id
+            if ip_actual != ip:
+                if por_ip:
+                    # La IP nueva está ocupada por otra fila: sólo se libera si es un
+                    # registro del escaneo activo sin identificar ni asignar a habitación
+                    if por_ip[1] is None and por_ip[2] is None:
+                        cur.execute("DELETE FROM dispositivos WHERE id = %s", (por_ip[0],))
+                    else:
+                        logger.warning(f"Conflicto de IP para {shelly_id}: {ip} ya pertenece al dispositivo {por_ip[0]}")
+                        conn.rollback()
+                        return "conflicto"
+                cur.execute("UPDATE dispositivos SET ip = %s WHERE id = %s", (ip, id_dispositivo))
+                resultado = "movido"
+            if tipo and tipo_actual != tipo:
+                cur.execute("UPDATE dispositivos SET tipo = %s WHERE id = %s", (tipo, id_dispositivo))
+                resultado = resultado or "actualizado"
+        elif por_ip:
+            # Dispositivo ya conocido por el escaneo activo: asociarle su identificador
+            cur.execute("UPDATE dispositivos SET shelly_id = %s WHERE id = %s", (shelly_id, por_ip[0]))
+            resultado = "adoptado"
+        else:
+            nombre = anuncio.get("nombre") or "SIN_NOMBRE"
+            cur.execute(
+                "INSERT INTO dispositivos (nombre, ip, tipo, shelly_id) VALUES (%s, %s, %s, %s)",
+                (nombre, ip, tipo, shelly_id)
+            )
+            resultado = "agregado"
+
+        conn.commit()
+        return resultado
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# ===========================
+# Servicio de escucha
+# ===========================
+class DescubrimientoPasivo:
+    """
+    Servicio que escucha anuncios CoIoT y mDNS y mantiene `dispositivos` al día
+    """
+    def __init__(self, conectar: Optional[Callable] = conectar_db, interfaz: str = "0.0.0.0",
+                 coiot_puerto: int = COIOT_PUERTO, mdns_puerto: int = MDNS_PUERTO):
+        """
+        Inicializa el servicio
+
+        Args:
+            conectar: Función que devuelve una conexión psycopg2 (None para no persistir)
+            interfaz: Dirección local donde unirse a los grupos multicast
+            coiot_puerto: Puerto UDP de CoIoT
+            mdns_puerto: Puerto UDP de mDNS
+        """
+        self.conectar = conectar
+        self.interfaz = interfaz
+        self.coiot_puerto = coiot_puerto
+        self.mdns_puerto = mdns_puerto
+        self.vistos = {}  # shelly_id -> {"ip", "tipo", "gen", "ultimo_anuncio"}
+        self.contadores = {"paquetes": 0, "anuncios": 0, "agregados": 0, "movidos": 0, "adoptados": 0, "conflictos": 0, "errores": 0}
+        self.event_listeners = []
+        self._conn = None
+        self._lock = Lock()
+        self._sockets = {}
+
+    def add_event_listener(self, event_type: str, callback):
+        """
+        Agrega un listener para eventos del servicio ('anuncio', 'dispositivoNuevo', 'cambioIp')
+
+        Args:
+            event_type: Tipo de evento a escuchar
+            callback: Función a llamar cuando ocurra el evento
+        """
+        self.event_listeners.append((event_type, callback))
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for listener_type, callback in self.event_listeners:
+            if listener_type == event_type:
+                try:
+                    callback(data)
+                except Exception as e:
+                    logger.error(f"Error en event listener: {e}")
+
+    def _abrir_socket(self, grupo: str, puerto: int) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            # El adaptador Node también escucha CoIoT en el mismo puerto
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", puerto))
+        membresia = struct.pack("4s4s", socket.inet_aton(grupo), socket.inet_aton(self.interfaz))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membresia)
+        return sock
+
+    def iniciar(self, consultar_mdns: bool = True):
+        """
+        Abre los sockets multicast y lanza el thread de escucha
+
+        Args:
+            consultar_mdns: Envía una única consulta mDNS al arrancar para que los
+                            dispositivos Gen2 se anuncien sin esperar a su próximo anuncio
+        """
+        for protocolo, grupo, puerto in (("coiot", COIOT_GRUPO, self.coiot_puerto),
+                                         ("mdns", MDNS_GRUPO, self.mdns_puerto)):
+            try:
+                self._sockets[protocolo] = self._abrir_socket(grupo, puerto)
+            except OSError as e:
+                logger.error(f"No se pudo escuchar {protocolo} en el puerto {puerto}: {e}")
+
+        if not self._sockets:
+            return False
+
+        if consultar_mdns and "mdns" in self._sockets:
+            try:
+                self._sockets["mdns"].sendto(construir_consulta_mdns(), (MDNS_GRUPO, self.mdns_puerto))
+            except OSError as e:
+                logger.warning(f"No se pudo enviar la consulta mDNS: {e}")
+
+        thread = Thread(target=self._escuchar, daemon=True)
+        thread.start()
+        logger.info(f"Descubrimiento pasivo escuchando: {', '.join(self._sockets)}")
+        return True
+
+    def _escuchar(self):
+        protocolos = {sock: protocolo for protocolo, sock in self._sockets.items()}
+        while True:
+            listos, _, _ = select.select(list(protocolos), [], [], 5)
+            for sock in listos:
+                try:
+                    datos, (ip, _) = sock.recvfrom(9000)
+                    self.procesar_paquete(protocolos[sock], datos, ip)
+                except Exception as e:
+                    self.contadores["errores"] += 1
+                    logger.error(f"Error procesando anuncio: {e}")
+
+    def procesar_paquete(self, protocolo: str, datos: bytes, ip_origen: str) -> List[Dict[str, Any]]:
+        """
+        Procesa un datagrama recibido (o reproducido desde una captura)
+
+        Args:
+            protocolo: "coiot" o "mdns"
+            datos: Contenido del datagrama
+            ip_origen: IP de origen del datagrama
+
+        Returns:
+            Lista de anuncios extraídos
+        """
+        self.contadores["paquetes"] += 1
+        if protocolo == "coiot":
+            anuncio = parsear_coiot(datos)
+            anuncios = []
+            if anuncio:
+                anuncio["ip"] = ip_origen
+                anuncios.append(anuncio)
+        else:
+            anuncios = parsear_mdns(datos)
+
+        for anuncio in anuncios:
+            self.registrar(anuncio)
+        return anuncios
+
+    def registrar(self, anuncio: Dict[str, Any]):
+        """
+        Registra un anuncio; sólo toca la base de datos si el dispositivo es nuevo o cambió
+
+        Args:
+            anuncio: Anuncio con shelly_id, ip, tipo y gen
+        """
+        ahora = time.time()
+        self.contadores["anuncios"] += 1
+        shelly_id = anuncio["shelly_id"]
+
+        with self._lock:
+            anterior = self.vistos.get(shelly_id)
+            cambio = anterior is None or anterior["ip"] != anuncio["ip"] or anterior["tipo"] != anuncio.get("tipo")
+            self.vistos[shelly_id] = {
+                "ip": anuncio["ip"],
+                "tipo": anuncio.get("tipo"),
+                "gen": anuncio.get("gen"),
+                "ultimo_anuncio": ahora,
+            }
+
+            resultado = None
+            if cambio and self.conectar:
+                try:
+                    if self._conn is None or self._conn.closed:
+                        self._conn = self.conectar()
+                    resultado = guardar_anuncio(self._conn, anuncio)
+                    if resultado == "conflicto":
+                        # El cambio no llegó a la base: se vuelve a lo anterior para reintentar con el próximo anuncio
+                        if anterior is None:
+                            self.vistos.pop(shelly_id, None)
+                        else:
+                            self.vistos[shelly_id] = anterior
+                except Exception as e:
+                    self.contadores["errores"] += 1
+                    logger.error(f"Error guardando anuncio de {shelly_id}: {e}")
+                    # Se olvida para reintentar con el próximo anuncio
+                    self.vistos.pop(shelly_id, None)
+                    self._conn = None
+
+        self._notify_listeners("anuncio", anuncio)
+        if resultado == "agregado":
+            self.contadores["agregados"] += 1
+            logger.info(f"Nuevo Shelly anunciado: {shelly_id} ({anuncio.get('tipo')}) en {anuncio['ip']}")
+            self._notify_listeners("dispositivoNuevo", anuncio)
+        elif resultado == "adoptado":
+            self.contadores["adoptados"] += 1
+        elif resultado == "conflicto":
+            self.contadores["conflictos"] += 1
+        elif resultado == "movido":
+            self.contadores["movidos"] += 1
+            logger.info(f"Shelly {shelly_id} cambió de IP: {anterior['ip'] if anterior else '?'} -> {anuncio['ip']}")
+            self._notify_listeners("cambioIp", dict(anuncio, ip_anterior=anterior["ip"] if anterior else None))
+
+    def get_estado(self) -> Dict[str, Any]:
+        """
+        Devuelve los contadores y los dispositivos vistos por anuncios
+        """
+        with self._lock:
+            vistos = [dict(v, shelly_id=k) for k, v in self.vistos.items()]
+        return {"escuchando": list(self._sockets), "contadores": dict(self.contadores), "dispositivos": vistos}
+
+
+# ===========================
+# Captura y reproducción
+# ===========================
+def capturar(ruta: str):
+    """Guarda los datagramas recibidos en un archivo JSON Lines para reproducirlos después"""
+    servicio = DescubrimientoPasivo(conectar=None)
+    with open(ruta, "a") as archivo:
+        def guardar(protocolo, datos, ip):
+            archivo.write(json.dumps({"protocolo": protocolo, "ip": ip, "datos": datos.hex(), "ts": time.time()}) + "\n")
+            archivo.flush()
+            return DescubrimientoPasivo.procesar_paquete(servicio, protocolo, datos, ip)
+
+        servicio.procesar_paquete = guardar
+        servicio.iniciar()
+        print(f"📡 Capturando anuncios en {ruta} (Ctrl+C para terminar)")
+        while True:
+            time.sleep(1)
+
+
+def reproducir(ruta: str, enviar: Optional[str] = None, persistir: bool = True):
+    """
+    Reproduce una captura
+
+    Args:
+        ruta: Archivo JSON Lines generado por `capturar`
+        enviar: Si se indica, reenvía los datagramas por UDP a ese host (prueba de sockets);
+                si no, los procesa en este mismo proceso conservando la IP original
+        persistir: Guarda los anuncios en la base de datos al procesar localmente
+    """
+    servicio = DescubrimientoPasivo(conectar=conectar_db if persistir else None)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if enviar else None
+
+    with open(ruta) as archivo:
+        for linea in archivo:
+            if not linea.strip():
+                continue
+            registro = json.loads(linea)
+            datos = bytes.fromhex(registro["datos"])
+            if sock:
+                puerto = COIOT_PUERTO if registro["protocolo"] == "coiot" else MDNS_PUERTO
+                sock.sendto(datos, (enviar, puerto))
+            else:
+                for anuncio in servicio.procesar_paquete(registro["protocolo"], datos, registro["ip"]):
+                    print(f"✅ {anuncio['shelly_id']:<14} {anuncio.get('tipo') or '?':<10} {anuncio['ip']}")
+
+    if not sock:
+        print(f"\n🔎 Resumen: {json.dumps(servicio.contadores)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    argumentos = sys.argv[1:]
+    if not argumentos or argumentos[0] == "escuchar":
+        DescubrimientoPasivo().iniciar()
+        while True:
+            time.sleep(1)
+    elif argumentos[0] == "capturar" and len(argumentos) > 1:
+        capturar(argumentos[1])
+    elif argumentos[0] == "reproducir" and len(argumentos) > 1:
+        destino = argumentos[argumentos.index("--enviar") + 1] if "--enviar" in argumentos else None
+        reproducir(argumentos[1], enviar=destino, persistir="--sin-db" not in argumentos)
+    else:
+        print(__doc__)
+        sys.exit(1)
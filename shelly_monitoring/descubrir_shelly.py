@@ -7,6 +7,7 @@ import ipaddress
 import requests
 import json
 import time
+import threading
 from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 
@@ -16,18 +17,25 @@ VENV_DIR = "/opt/shelly_monitoring/venv"
 VENV_PYTHON = os.path.join(VENV_DIR, "bin", "python3")
 VENV_PIP = os.path.join(VENV_DIR, "bin", "pip")
 
-# 📌 Verificar si estamos dentro del entorno virtual
-if sys.prefix != VENV_DIR:
-    print("🔄 Reiniciando el script dentro del entorno virtual...")
-    os.execv(VENV_PYTHON, [VENV_PYTHON] + sys.argv)
-
-# 📌 Instalar dependencias si no existen
+# 📌 psycopg2 sólo hace falta en el servidor central (los agentes no usan la DB)
 try:
     import psycopg2
 except ImportError:
-    print("📦 psycopg2 no encontrado. Instalando en el entorno virtual...")
-    subprocess.run([VENV_PIP, "install", "psycopg2-binary"], check=True)
-    import psycopg2  # Volver a importar después de la instalación
+    psycopg2 = None
+
+def asegurar_entorno():
+    """Reinicia el script dentro del entorno virtual e instala psycopg2 si falta"""
+    global psycopg2
+    # 📌 Verificar si estamos dentro del entorno virtual
+    if sys.prefix != VENV_DIR:
+        print("🔄 Reiniciando el script dentro del entorno virtual...")
+        os.execv(VENV_PYTHON, [VENV_PYTHON] + sys.argv)
+
+    # 📌 Instalar dependencias si no existen
+    if psycopg2 is None:
+        print("📦 psycopg2 no encontrado. Instalando en el entorno virtual...")
+        subprocess.run([VENV_PIP, "install", "psycopg2-binary"], check=True)
+        import psycopg2  # Volver a importar después de la instalación
 
 # 📌 Configuración de la base de datos
 DB_NAME = "shelly_db"
@@ -39,14 +47,67 @@ DB_HOST = "localhost"
 ENDPOINTS = ["/rpc/Shelly.GetDeviceInfo", "/settings"]
 TIMEOUT = 4
 TIMEOUT_EXTRA = 6
+TIMEOUT_CONFIRMACION = 2
 REINTENTOS = 2
 MAX_WORKERS = 75
 MAX_WORKERS_REINTENTO = 50
 
+# 🗂️ Configuración del modo incremental
+CACHE_PATH = os.environ.get("SHELLY_CACHE_DESCUBRIMIENTO", "/opt/shelly_monitoring/cache_descubrimiento.json")
+CACHE_FALLOS_K = 3                        # Escaneos seguidos sin respuesta para omitir una IP
+CACHE_TTL = 7 * 24 * 3600                 # Tiempo que una IP queda omitida tras el último fallo
+CACHE_BARRIDO_COMPLETO = 7 * 24 * 3600    # Cada cuánto se barre completa una subred ya conocida
+
+# 🚦 Límite global de sondeos (peticiones HTTP y pings por segundo; 0 = sin límite)
+class SondeoDetenido(Exception):
+    pass
+
+class LimitadorTasa:
+    """Token bucket compartido por todos los threads de sondeo"""
+    def __init__(self, tasa=0):
+        self.tasa = tasa
+        self.disponibles = 0.0
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+        self.detenido = threading.Event()
+
+    def configurar(self, tasa):
+        with self.lock:
+            self.tasa = tasa
+
+    def detener(self):
+        """Hace fallar los sondeos siguientes (cancela el escaneo en curso)"""
+        self.detenido.set()
+
+    def reanudar(self):
+        self.detenido.clear()
+
+    def esperar(self):
+        while True:
+            if self.detenido.is_set():
+                raise SondeoDetenido()
+            with self.lock:
+                if self.tasa <= 0:
+                    return
+                ahora = time.monotonic()
+                # Ráfaga máxima de un segundo de sondeos
+                self.disponibles = min(self.tasa, self.disponibles + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.disponibles >= 1:
+                    self.disponibles -= 1
+                    return
+                espera = (1 - self.disponibles) / self.tasa
+            time.sleep(espera)
+
+limitador = LimitadorTasa(float(os.environ.get("SHELLY_TASA_SONDEOS", "0")))
+
 # 📌 Datos de reintentos
 ips_para_reintento = []
 ips_exitosas_en_reintento = []
 
+# 📌 Estadísticas del modo incremental
+estadisticas_cache = Counter()
+
 # ✅ 1️⃣ Conectar a la base de datos
 def conectar_db():
     try:
@@ -71,6 +132,7 @@ def extraer_modelo(texto):
 def hacer_peticion(url, timeout=TIMEOUT, reintentos=REINTENTOS):
     """Realiza una petición GET con reintentos"""
     for intento in range(reintentos):
+        limitador.esperar()
         try:
             respuesta = requests.get(url, timeout=timeout)
             if respuesta.status_code == 200:
@@ -102,12 +164,20 @@ def obtener_info_desde_settings(ip, timeout=TIMEOUT):
 def hacer_ping(ip):
     """Hace ping a la IP y devuelve True si responde"""
     print(f"📡 Haciendo ping a {ip}...")
+    limitador.esperar()
     try:
         resultado = subprocess.run(["ping", "-c", "1", "-W", "1", ip], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         return resultado.returncode == 0
     except Exception:
         return False
 
+def confirmar_shelly(ip, timeout=TIMEOUT_CONFIRMACION):
+    """Confirma rápidamente que sigue habiendo un Shelly en la IP usando /shelly (Gen1 y Gen2)"""
+    datos = hacer_peticion(f"http://{ip}/shelly", timeout=timeout, reintentos=1)
+    if datos and ("mac" in datos or "type" in datos or "gen" in datos):
+        return ip, datos
+    return ip, None
+
 def identificar_shelly(ip, timeout=TIMEOUT):
     """Intenta identificar un dispositivo Shelly en la IP dada"""
     modelo, nombre = obtener_info_desde_rpc(ip, timeout)
@@ -119,16 +189,71 @@ def identificar_shelly(ip, timeout=TIMEOUT):
     return ip, modelo, nombre
 
 # ✅ 3️⃣ Escanear la red
-def escanear_red(subred):
-    """Escanea una subred para identificar dispositivos Shelly"""
+def escanear_red(subred, incremental=False, cache=None, conocidos=None, progreso=None):
+    """Escanea una subred para identificar dispositivos Shelly
+
+    En modo incremental confirma primero las IPs ya registradas en la DB con /shelly
+    y omite las IPs sin respuesta en los últimos CACHE_FALLOS_K escaneos, salvo que
+    la subred sea nueva o toque barrerla completa.
+
+    progreso(ip, modelo, nombre) se llama por cada IP sondeada (modelo None si no hay un Shelly).
+    """
     print(f"🔍 Escaneando la red: {subred}")
     dispositivos_shelly = {}
     ip_sin_respuesta = []
     ips_analizadas_con_ping = []  # Nueva lista para contar todas las IPs a las que se les hizo ping
+    ips_reintento_subred = []
+
+    subred = subred.strip()  # 🔥 Asegura que no haya espacios en blanco
+    red = ipaddress.IPv4Network(subred, strict=False)
+    ips = [str(ip) for ip in red]
+    ahora = time.time()
+    cache = cache if cache is not None else {"ips": {}, "subredes": {}}
+    conocidos = conocidos or {}
+
+    if incremental:
+        barrido_completo = ahora - cache["subredes"].get(str(red), 0) > CACHE_BARRIDO_COMPLETO
+
+        # 1. Confirmar los dispositivos ya conocidos con una sola petición rápida
+        ips_conocidas = [ip for ip in ips if ip in conocidos]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            confirmaciones = list(executor.map(confirmar_shelly, ips_conocidas))
+
+        for ip, datos in confirmaciones:
+            modelo, nombre, shelly_id = conocidos[ip]
+            mac = (datos or {}).get("mac", "").lower()
+            if datos and (not shelly_id or not mac or mac.endswith(shelly_id)):
+                dispositivos_shelly[ip] = (modelo, nombre)
+                estadisticas_cache["conocidas_confirmadas"] += 1
+        estadisticas_cache["conocidas"] += len(ips_conocidas)
+
+        # 2. Descartar las IPs que la caché negativa marca como vacías
+        pendientes = []
+        for ip in ips:
+            if ip in dispositivos_shelly:
+                continue
+            entrada = cache["ips"].get(ip)
+            if (not barrido_completo and ip not in conocidos and entrada
+                    and entrada["fallos"] >= CACHE_FALLOS_K and ahora - entrada["ultimo"] < CACHE_TTL):
+                estadisticas_cache["omitidas"] += 1
+                continue
+            pendientes.append(ip)
+        estadisticas_cache["desconocidas"] += len(ips) - len(ips_conocidas)
+        estadisticas_cache["subredes_completas" if barrido_completo else "subredes_incrementales"] += 1
+        print(f"🗂️ {len(dispositivos_shelly)}/{len(ips_conocidas)} conocidos confirmados, "
+              f"{len(pendientes)} IPs a sondear ({'barrido completo' if barrido_completo else 'incremental'})")
+    else:
+        barrido_completo = True
+        pendientes = ips
+
+    def identificar(ip):
+        resultado = identificar_shelly(ip)
+        if progreso:
+            progreso(*resultado)
+        return resultado
 
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        subred = subred.strip()  # 🔥 Asegura que no haya espacios en blanco
-        resultados = list(executor.map(identificar_shelly, [str(ip) for ip in ipaddress.IPv4Network(subred, strict=False)]))
+        resultados = list(executor.map(identificar, pendientes))
 
     for ip, modelo, nombre in resultados:
         if modelo:
@@ -144,11 +269,12 @@ def escanear_red(subred):
         ips_analizadas_con_ping.append(ip)  # Guardar todas las IPs a las que se les hizo ping
         if resultados_ping[i]:  # Si responde al ping
             print(f"🔄 IP {ip} responde al ping, reintentando confirmar si es un Shelly con timeout extendido...")
-            ips_para_reintento.append(ip)
+            ips_reintento_subred.append(ip)
+    ips_para_reintento.extend(ips_reintento_subred)
 
-    if ips_para_reintento:
+    if ips_reintento_subred:
         with ThreadPoolExecutor(max_workers=MAX_WORKERS_REINTENTO) as executor:
-            resultados_extra = list(executor.map(lambda ip: identificar_shelly(ip, TIMEOUT_EXTRA), ips_para_reintento))
+            resultados_extra = list(executor.map(lambda ip: identificar_shelly(ip, TIMEOUT_EXTRA), ips_reintento_subred))
 
         for ip, modelo, nombre in resultados_extra:
             if modelo:
@@ -156,8 +282,54 @@ def escanear_red(subred):
                 ips_exitosas_en_reintento.append(ip)
                 print(f"✅ (Reintento) Shelly detectado en {ip:<15} ({modelo:<8}) - Nombre: {nombre}")
 
+    # 🗂️ Actualizar la caché negativa con las IPs sondeadas
+    for ip in pendientes:
+        if ip in dispositivos_shelly:
+            cache["ips"].pop(ip, None)
+        else:
+            entrada = cache["ips"].setdefault(ip, {"fallos": 0, "ultimo": 0})
+            entrada["fallos"] += 1
+            entrada["ultimo"] = ahora
+    if barrido_completo:
+        cache["subredes"][str(red)] = ahora
+
     return dispositivos_shelly, ips_analizadas_con_ping  # Retornar también la lista de IPs analizadas con ping
 
+# 🗂️ Caché de descubrimiento
+def cargar_cache():
+    """Carga la caché negativa persistida; si no existe o está corrupta empieza vacía"""
+    try:
+        with open(CACHE_PATH) as archivo:
+            cache = json.load(archivo)
+        cache.setdefault("ips", {})
+        cache.setdefault("subredes", {})
+        return cache
+    except (OSError, ValueError):
+        return {"ips": {}, "subredes": {}}
+
+def guardar_cache(cache):
+    """Guarda la caché de forma atómica"""
+    temporal = f"{CACHE_PATH}.tmp"
+    try:
+        with open(temporal, "w") as archivo:
+            json.dump(cache, archivo)
+        os.replace(temporal, CACHE_PATH)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar la caché de descubrimiento: {e}")
+
+def cargar_conocidos():
+    """Devuelve {ip: (tipo, nombre, shelly_id)} de los dispositivos ya registrados"""
+    conn = conectar_db()
+    cur = conn.cursor()
+    cur.execute("SELECT ip, tipo, nombre, shelly_id FROM dispositivos")
+    conocidos = {ip: (tipo, nombre, shelly_id) for ip, tipo, nombre, shelly_id in cur.fetchall()}
+    cur.close()
+    conn.close()
+    return conocidos
+
+def porcentaje(parte, total):
+    return f"{(100 * parte / total):.1f}%" if total else "-"
+
 # ✅ 4️⃣ Guardar en la base de datos y generar resumen
 def guardar_en_db(dispositivos):
     conn = conectar_db()
@@ -204,6 +376,15 @@ def generar_resumen(dispositivos_totales, ips_analizadas_total):
     print(f"🔄 **IPs que se reintentaron tras responder al ping:** {len(ips_para_reintento)}")
     print(f"✅ **Dispositivos detectados en reintento:** {len(ips_exitosas_en_reintento)}")
 
+    if estadisticas_cache:
+        print("\n🗂️ **Modo incremental:**")
+        print(f"   - Conocidos confirmados con /shelly: {estadisticas_cache['conocidas_confirmadas']}/{estadisticas_cache['conocidas']} "
+              f"({porcentaje(estadisticas_cache['conocidas_confirmadas'], estadisticas_cache['conocidas'])})")
+        print(f"   - IPs omitidas por caché negativa: {estadisticas_cache['omitidas']}/{estadisticas_cache['desconocidas']} "
+              f"({porcentaje(estadisticas_cache['omitidas'], estadisticas_cache['desconocidas'])})")
+        print(f"   - Subredes barridas completas: {estadisticas_cache['subredes_completas']}, "
+              f"incrementales: {estadisticas_cache['subredes_incrementales']}")
+
     print(f"\n✅ **Dispositivos ya existentes en la DB:** {existentes}")
     print(f"🆕 **Dispositivos nuevos agregados a la DB:** {agregados}")
     print(f"🔄 **Dispositivos actualizados:** {actualizados}")
@@ -213,32 +394,197 @@ def generar_resumen(dispositivos_totales, ips_analizadas_total):
 
 
 # ✅ 6️⃣ Ejecutar todo
-def main():
-    if len(sys.argv) > 1:
-        # Si se ejecuta con argumentos, usarlos como las subredes a escanear
-        subredes = [subred.strip() for subred in sys.argv[1:] if subred.strip()]
-    else:
-        # Si no se pasa argumento, pedir al usuario
-        subredes = [subred.strip() for subred in input("Ingrese las subredes a escanear (ejemplo: 192.168.1.0/24, 10.1.100.0/24): ").split(",") if subred.strip()]
-
-    subredes = [subred.strip() for subred in subredes]
-
+def parsear_argumentos(argumentos):
+    """Separa las opciones (--incremental) de las subredes a escanear"""
+    incremental = "--incremental" in argumentos
+    subredes = [subred.strip() for subred in argumentos if subred.strip() and not subred.startswith("--")]
+    return subredes, incremental
+
+def escanear_subredes(subredes, incremental=False):
+    """Escanea todas las subredes y persiste la caché de descubrimiento"""
     dispositivos_totales = {}
     ips_analizadas_total = []  # Nueva lista para almacenar las IPs analizadas con ping en todas las subredes
+    cache = cargar_cache()
+    conocidos = cargar_conocidos() if incremental else {}
 
     for subred in subredes:
-        dispositivos, ips_analizadas = escanear_red(subred)  # Capturar ambos valores
+        dispositivos, ips_analizadas = escanear_red(subred, incremental, cache, conocidos)  # Capturar ambos valores
         dispositivos_totales.update(dispositivos)
         ips_analizadas_total.extend(ips_analizadas)  # Agregar todas las IPs analizadas con ping
 
+    guardar_cache(cache)
+    return dispositivos_totales, ips_analizadas_total
+
+def main():
+    if len(sys.argv) > 1:
+        # Si se ejecuta con argumentos, usarlos como las subredes a escanear
+        subredes, incremental = parsear_argumentos(sys.argv[1:])
+    else:
+        # Si no se pasa argumento, pedir al usuario
+        subredes, incremental = parsear_argumentos(input("Ingrese las subredes a escanear (ejemplo: 192.168.1.0/24, 10.1.100.0/24): ").split(","))
+
+    dispositivos_totales, ips_analizadas_total = escanear_subredes(subredes, incremental)
     generar_resumen(dispositivos_totales, ips_analizadas_total)  # Pasar las IPs analizadas a generar_resumen()
 
+# ✅ 7️⃣ Modo agente: escanea los segmentos locales por encargo del backend central
+AGENTE_INTERVALO = 5             # Segundos entre consultas de tareas cuando no hay trabajo
+AGENTE_ENVIO = 2                 # Segundos máximos entre envíos de resultados
+AGENTE_SUBREDES_PARALELAS = 4    # Subredes escaneadas a la vez dentro de una tarea
+
+class TareaCancelada(Exception):
+    pass
+
+class Agente:
+    """Recibe tareas de escaneo del backend, las ejecuta localmente y envía los resultados por lotes
+
+    Protocolo (JSON, autenticado con el token de agentes del backend):
+        POST /api/agentes/registro   {nombre, segmentos, version}
+        GET  /api/agentes/tarea      ?nombre=  -> {tarea: {id, subredes, incremental, conocidos, tasa} | null}
+        POST /api/agentes/tareas/ID  {nombre, hechas, total, dispositivos: [[ip, modelo, nombre], ...], fin}
+                                     -> {tasa, cancelada}
+    """
+    def __init__(self, backend, nombre, segmentos, token, verificar_tls=True):
+        self.backend = backend.rstrip("/")
+        self.nombre = nombre
+        self.segmentos = segmentos
+        self.sesion = requests.Session()
+        self.sesion.headers["Authorization"] = f"Bearer {token}"
+        self.sesion.verify = verificar_tls
+
+    def _api(self, metodo, ruta, **kwargs):
+        respuesta = self.sesion.request(metodo, f"{self.backend}{ruta}", timeout=30, **kwargs)
+        if respuesta.status_code == 409:
+            raise TareaCancelada(respuesta.json().get("error"))
+        respuesta.raise_for_status()
+        return respuesta.json()
+
+    def registrar(self):
+        self._api("POST", "/api/agentes/registro", json={"nombre": self.nombre, "segmentos": self.segmentos, "version": 1})
+        print(f"🛰️ Agente {self.nombre} registrado en {self.backend} (segmentos: {', '.join(self.segmentos)})")
+
+    def ejecutar_tarea(self, tarea):
+        """Escanea las subredes de la tarea en paralelo, enviando los resultados a medida que aparecen"""
+        print(f"\n=== Tarea {tarea['id']}: {', '.join(tarea['subredes'])} ===\n")
+        estadisticas_cache.clear()
+        ips_para_reintento.clear()
+        ips_exitosas_en_reintento.clear()
+        limitador.configurar(tarea.get("tasa") or 0)
+        lock = threading.Lock()
+        estado = {"hechas": 0, "dispositivos": [], "enviados": set()}
+        total = sum(ipaddress.IPv4Network(subred.strip(), strict=False).num_addresses for subred in tarea["subredes"])
+        terminado = threading.Event()
+
+        def al_sondear(ip, modelo, nombre):
+            with lock:
+                estado["hechas"] += 1
+                if modelo and ip not in estado["enviados"]:
+                    estado["enviados"].add(ip)
+                    estado["dispositivos"].append([ip, modelo, nombre])
+
+        def enviar(fin=False, extra=None):
+            with lock:
+                lote, estado["dispositivos"] = estado["dispositivos"], []
+                cuerpo = {"nombre": self.nombre, "hechas": total if fin else estado["hechas"], "total": total,
+                          "dispositivos": lote, "fin": fin}
+            if extra:
+                cuerpo.update(extra)
+            respuesta = self._api("POST", f"/api/agentes/tareas/{tarea['id']}", json=cuerpo)
+            limitador.configurar(respuesta.get("tasa") or 0)
+            return respuesta
+
+        def reportar():
+            while not terminado.wait(AGENTE_ENVIO):
+                try:
+                    if enviar().get("cancelada"):
+                        limitador.detener()
+                except TareaCancelada:
+                    limitador.detener()
+                except requests.RequestException as e:
+                    print(f"⚠️ No se pudo enviar el progreso: {e}")
+
+        cache = cargar_cache()
+        conocidos = {ip: tuple(datos) for ip, datos in (tarea.get("conocidos") or {}).items()}
+        reportero = threading.Thread(target=reportar, daemon=True)
+        reportero.start()
+        try:
+            with ThreadPoolExecutor(max_workers=AGENTE_SUBREDES_PARALELAS) as executor:
+                resultados = list(executor.map(
+                    lambda subred: escanear_red(subred, tarea.get("incremental", False), cache, conocidos, al_sondear),
+                    tarea["subredes"]))
+        except SondeoDetenido:
+            raise TareaCancelada("cancelada durante el escaneo")
+        finally:
+            terminado.set()
+            reportero.join()
+            limitador.reanudar()
+            limitador.configurar(0)
+        guardar_cache(cache)
+
+        # Conocidos confirmados y detectados en el reintento no pasan por al_sondear
+        with lock:
+            for dispositivos, _ in resultados:
+                for ip, (modelo, nombre) in dispositivos.items():
+                    if ip not in estado["enviados"]:
+                        estado["enviados"].add(ip)
+                        estado["dispositivos"].append([ip, modelo, nombre])
+        enviar(fin=True, extra={"estadisticas": dict(estadisticas_cache)})
+        print(f"✅ Tarea {tarea['id']} terminada: {len(estado['enviados'])} dispositivos")
+
+    def bucle(self):
+        registrado = False
+        while True:
+            try:
+                if not registrado:
+                    self.registrar()
+                    registrado = True
+                tarea = self._api("GET", "/api/agentes/tarea", params={"nombre": self.nombre}).get("tarea")
+                if tarea:
+                    try:
+                        self.ejecutar_tarea(tarea)
+                    except TareaCancelada as e:
+                        print(f"⚠️ Tarea {tarea['id']} cancelada por el backend: {e}")
+                    continue
+            except requests.HTTPError as e:
+                print(f"⚠️ El backend rechazó la petición: {e}")
+                registrado = False
+            except requests.RequestException as e:
+                print(f"⚠️ Backend no disponible: {e}")
+                registrado = False
+            time.sleep(AGENTE_INTERVALO)
+
+def main_agente(argumentos):
+    import argparse
+    parser = argparse.ArgumentParser(description="Agente de escaneo de Shelly para un segmento de red")
+    parser.add_argument("--agente", required=True, help="URL del backend central (https://servidor:8000)")
+    parser.add_argument("--nombre", required=True, help="Nombre único del agente")
+    parser.add_argument("--segmentos", required=True, help="Subredes alcanzables desde este host, separadas por coma")
+    parser.add_argument("--token", default=os.environ.get("SHELLY_AGENTES_TOKEN"), help="Token de agentes del backend")
+    parser.add_argument("--sin-verificar-tls", action="store_true", help="Acepta el certificado autofirmado del backend")
+    opciones = parser.parse_args(argumentos)
+    if not opciones.token:
+        parser.error("Falta el token de agentes (--token o SHELLY_AGENTES_TOKEN)")
+    segmentos = [str(ipaddress.IPv4Network(s.strip(), strict=False)) for s in opciones.segmentos.split(",") if s.strip()]
+    Agente(opciones.agente, opciones.nombre, segmentos, opciones.token,
+           verificar_tls=not opciones.sin_verificar_tls).bucle()
+
 class DualLogger:
     """Clase que permite escribir simultáneamente en la terminal y en el log con timestamp."""
     def __init__(self, log_file_path):
+        self.log_file_path = log_file_path
         self.log_file = open(log_file_path, "a")
+
+    def _reabrir_si_rotado(self):
+        # El backend rota el log renombrándolo: se vuelve a abrir la ruta original
+        try:
+            rotado = os.stat(self.log_file_path).st_ino != os.fstat(self.log_file.fileno()).st_ino
+        except FileNotFoundError:
+            rotado = True
+        if rotado:
+            self.log_file.close()
+            self.log_file = open(self.log_file_path, "a")
     
     def write(self, message):
+        self._reabrir_si_rotado()
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')  # Formato de fecha y hora
         if message.strip():  # Evita escribir líneas vacías con timestamp
             log_message = f"[{timestamp}] {message}"  # Guarda con timestamp en el log
@@ -255,11 +601,17 @@ class DualLogger:
         self.log_file.flush()
 
 if __name__ == "__main__":
+    if "--agente" in sys.argv:
+        main_agente(sys.argv[1:])
+        sys.exit(0)
+
+    asegurar_entorno()
+
     # 📌 Pedimos la entrada del usuario ANTES de redirigir stdout y stderr
     if len(sys.argv) > 1:
-        subredes = sys.argv[1:]
+        subredes, incremental = parsear_argumentos(sys.argv[1:])
     else:
-        subredes = input("Ingrese las subredes a escanear (ejemplo: 192.168.1.0/24, 10.1.100.0/24): ").split(",")
+        subredes, incremental = parsear_argumentos(input("Ingrese las subredes a escanear (ejemplo: 192.168.1.0/24, 10.1.100.0/24): ").split(","))
 
     # 📌 Ahora redirigimos stdout y stderr
     log_file_path = "/var/log/shelly_discovery.log"
@@ -267,15 +619,9 @@ if __name__ == "__main__":
     sys.stdout = dual_logger  # Redirige stdout a la terminal y al log
     sys.stderr = dual_logger  # Redirige stderr a la terminal y al log
 
-    print("\n=== Inicio del descubrimiento ===\n")
-
-    dispositivos_totales = {}
-    ips_analizadas_total = []
+    print(f"\n=== Inicio del descubrimiento{' incremental' if incremental else ''} ===\n")
 
-    for subred in subredes:
-        dispositivos, ips_analizadas = escanear_red(subred)
-        dispositivos_totales.update(dispositivos)
-        ips_analizadas_total.extend(ips_analizadas)
+    dispositivos_totales, ips_analizadas_total = escanear_subredes(subredes, incremental)
 
     generar_resumen(dispositivos_totales, ips_analizadas_total)
 
@@ -0,0 +1,404 @@
+"""
+Diario de eventos de los dispositivos (append-only).
+
+Cambios de estado, comandos, transiciones online/offline y descubrimientos se
+escriben como registros binarios compactos en archivos de segmento que rotan
+por tamaño. Escribir cuesta empaquetar el registro en un buffer en memoria; un
+thread lo vuelca al archivo cada medio segundo.
+
+Cada segmento guarda un índice (.idx) con su rango de tiempo, los dispositivos
+que aparecen y una marca (instante, offset) cada cierto número de registros.
+Una consulta descarta los segmentos que no se solapan con el rango pedido o no
+contienen el dispositivo, y dentro de cada uno empieza a leer (con mmap) desde
+la marca adecuada, así que no recorre todo el historial.
+
+Formato de un registro (little endian):
+    crc32 (I) | instante (d) | tipo (B) | largo clave (B) | largo datos (H) | clave | datos (JSON)
+"""
+
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import json_rapido
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del diario
+TAMANO_SEGMENTO = 64 * 1024 * 1024     # Bytes por segmento antes de rotar
+REGISTROS_POR_MARCA = 256              # Granularidad del índice de tiempo dentro de un segmento
+INTERVALO_VACIADO = 0.5                # Segundos entre volcados del buffer al disco
+MAX_BUFFER = 1024 * 1024               # Bytes en memoria que fuerzan un volcado inmediato
+RETENCION_DIAS = 400                   # Los segmentos más viejos se borran al rotar
+LIMITE = 100
+
+TIPOS = {
+    "estado": 1,
+    "online": 2,
+    "offline": 3,
+    "comando": 4,
+    "descubierto": 5,
+    "cambio_ip": 6,
+}
+NOMBRES_TIPO = {codigo: nombre for nombre, codigo in TIPOS.items()}
+
+_CABECERA = struct.Struct("<IdBBH")
+
+
+class _Segmento:
+    __slots__ = ("numero", "ruta", "inicio", "fin", "registros", "tamano", "dispositivos", "marcas")
+
+    def __init__(self, numero: int, ruta: str):
+        self.numero = numero
+        self.ruta = ruta
+        self.inicio = None
+        self.fin = None
+        self.registros = 0
+        self.tamano = 0
+        self.dispositivos = set()
+        self.marcas: List[Tuple[float, int]] = []
+
+    def agregar(self, instante: float, clave: str, offset: int, largo: int):
+        if self.registros % REGISTROS_POR_MARCA == 0:
+            self.marcas.append((instante, offset))
+        if self.inicio is None:
+            self.inicio = instante
+        self.fin = instante
+        self.registros += 1
+        self.tamano = offset + largo
+        self.dispositivos.add(clave)
+
+    def bloques(self, desde: float, hasta: float, tamano: int) -> List[Tuple[int, int]]:
+        """
+        Rangos de bytes [inicio, fin) cuyas marcas se solapan con [desde, hasta]
+        """
+        bloques = []
+        # La primera marca posterior a `desde` cierra el primer bloque que interesa
+        primero = max(0, bisect.bisect_left(self.marcas, (desde, -1)) - 1)
+        for i in range(primero, len(self.marcas)):
+            instante, offset = self.marcas[i]
+            if offset >= tamano:
+                break
+            siguiente = self.marcas[i + 1] if i + 1 < len(self.marcas) else (self.fin, tamano)
+            if instante > hasta:
+                break
+            if siguiente[0] >= desde:
+                bloques.append((offset, min(siguiente[1], tamano)))
+        return bloques
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "inicio": self.inicio,
+            "fin": self.fin,
+            "registros": self.registros,
+            "tamano": self.tamano,
+            "dispositivos": sorted(self.dispositivos),
+            "marcas": self.marcas,
+        }
+
+
+def _leer(datos, inicio: int, fin: int) -> Iterator[Tuple[int, float, int, str, bytes, int]]:
+    """
+    Recorre los registros válidos entre dos offsets: (offset, instante, tipo, clave, datos, siguiente)
+    """
+    offset = inicio
+    while offset + _CABECERA.size <= fin:
+        crc, instante, tipo, largo_clave, largo_datos = _CABECERA.unpack_from(datos, offset)
+        cuerpo = offset + _CABECERA.size
+        siguiente = cuerpo + largo_clave + largo_datos
+        if siguiente > fin or zlib.crc32(datos[offset + 4:siguiente]) != crc:
+            return
+        clave = bytes(datos[cuerpo:cuerpo + largo_clave]).decode("utf-8")
+        yield offset, instante, tipo, clave, datos[cuerpo + largo_clave:siguiente], siguiente
+        offset = siguiente
+
+
+class DiarioEventos:
+    """
+    Historial de eventos en segmentos binarios con índice por tiempo y dispositivo
+    """
+    def __init__(self, directorio: str, tamano_segmento: int = TAMANO_SEGMENTO,
+                 retencion_dias: float = RETENCION_DIAS):
+        self.directorio = directorio
+        self.tamano_segmento = tamano_segmento
+        self.retencion_dias = retencion_dias
+        self.segmentos: List[_Segmento] = []
+        self._activo: Optional[_Segmento] = None
+        self._archivo = None
+        self._buffer = bytearray()
+        self._escrito = 0
+        self._ultimo_instante = 0.0
+        self._ultimos_estados: Dict[str, bool] = {}
+        self._lock = Lock()
+
+    # ===========================
+    # Arranque y recuperación
+    # ===========================
+    def iniciar(self):
+        """
+        Carga los índices de los segmentos existentes, repara el último y lanza el thread de volcado
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        numeros = sorted(int(nombre[:-4]) for nombre in os.listdir(self.directorio)
+                         if nombre.endswith(".seg") and nombre[:-4].isdigit())
+        for i, numero in enumerate(numeros):
+            segmento = self._cargar_indice(numero)
+            # El último segmento (o uno sin índice tras una caída) se reconstruye leyéndolo
+            if segmento is None or i == len(numeros) - 1:
+                segmento = self._reconstruir(numero)
+            self.segmentos.append(segmento)
+
+        if self.segmentos:
+            self._activo = self.segmentos[-1]
+            self._ultimo_instante = self._activo.fin or 0.0
+            self._archivo = open(self._activo.ruta, "ab")
+            self._escrito = self._activo.tamano
+        else:
+            self._abrir_segmento(0)
+
+        thread = Thread(target=self._bucle_vaciado, daemon=True)
+        thread.start()
+        logger.info(f"Diario de eventos iniciado en {self.directorio} ({len(self.segmentos)} segmentos)")
+
+    def _ruta(self, numero: int, extension: str) -> str:
+        return os.path.join(self.directorio, f"{numero:08d}.{extension}")
+
+    def _cargar_indice(self, numero: int) -> Optional[_Segmento]:
+        try:
+            with open(self._ruta(numero, "idx"), "rb") as archivo:
+                indice = json_rapido.decodificar(archivo.read())
+        except (OSError, ValueError):
+            return None
+        segmento = _Segmento(numero, self._ruta(numero, "seg"))
+        segmento.inicio = indice["inicio"]
+        segmento.fin = indice["fin"]
+        segmento.registros = indice["registros"]
+        segmento.tamano = indice["tamano"]
+        segmento.dispositivos = set(indice["dispositivos"])
+        segmento.marcas = [tuple(marca) for marca in indice["marcas"]]
+        return segmento
+
+    def _reconstruir(self, numero: int) -> _Segmento:
+        segmento = _Segmento(numero, self._ruta(numero, "seg"))
+        tamano = os.path.getsize(segmento.ruta)
+        if tamano:
+            with open(segmento.ruta, "rb") as archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+                for offset, instante, _, clave, _, siguiente in _leer(datos, 0, tamano):
+                    segmento.agregar(instante, clave, offset, siguiente - offset)
+        if segmento.tamano < tamano:
+            # Registro incompleto al final (el proceso murió a mitad de un volcado)
+            logger.warning(f"Diario: truncando {segmento.ruta} de {tamano} a {segmento.tamano} bytes")
+            os.truncate(segmento.ruta, segmento.tamano)
+        return segmento
+
+    def _abrir_segmento(self, numero: int):
+        self._activo = _Segmento(numero, self._ruta(numero, "seg"))
+        self.segmentos.append(self._activo)
+        self._archivo = open(self._activo.ruta, "ab")
+        self._escrito = 0
+
+    # ===========================
+    # Escritura
+    # ===========================
+    def registrar(self, tipo: str, clave: Optional[str], datos: Optional[Dict[str, Any]] = None):
+        """
+        Agrega un evento al diario
+
+        Args:
+            tipo: Uno de TIPOS
+            clave: IP del dispositivo (o su ID si no tiene IP)
+            datos: Detalle del evento (se guarda como JSON)
+        """
+        if self._archivo is None or not clave:
+            return
+        clave_bytes = str(clave).encode("utf-8")[:255]
+        cuerpo = json_rapido.codificar(datos) if datos else b""
+        if len(cuerpo) > 0xFFFF:
+            logger.warning(f"Diario: evento {tipo} de {clave} demasiado grande, se descarta")
+            return
+        with self._lock:
+            # Los registros quedan ordenados por instante aunque el reloj retroceda
+            instante = max(time.time(), self._ultimo_instante)
+            self._ultimo_instante = instante
+            resto = struct.pack("<dBBH", instante, TIPOS[tipo], len(clave_bytes), len(cuerpo)) + clave_bytes + cuerpo
+            registro = struct.pack("<I", zlib.crc32(resto)) + resto
+            self._activo.agregar(instante, clave_bytes.decode("utf-8", "ignore"), self._escrito + len(self._buffer),
+                                 len(registro))
+            self._buffer += registro
+            if len(self._buffer) >= MAX_BUFFER or self._activo.tamano >= self.tamano_segmento:
+                self._vaciar()
+
+    def registrar_estado(self, dispositivo: Dict[str, Any]):
+        """
+        Registra un evento 'estado' cuando cambia el estado reportado de un dispositivo
+        """
+        clave = dispositivo.get("ip") or dispositivo.get("id")
+        if not clave or "state" not in dispositivo:
+            return
+        estado = bool(dispositivo["state"])
+        anterior = self._ultimos_estados.get(clave)
+        self._ultimos_estados[clave] = estado
+        # El primer reporte tras arrancar no es un cambio
+        if anterior is not None and anterior != estado:
+            potencia = (dispositivo.get("meters") or [{}])[0].get("power")
+            self.registrar("estado", clave, {"estado": estado, "potencia": potencia})
+
+    def vaciar(self):
+        """
+        Escribe en disco los eventos pendientes
+        """
+        with self._lock:
+            self._vaciar()
+
+    def _vaciar(self):
+        if self._buffer:
+            self._archivo.write(self._buffer)
+            self._archivo.flush()
+            self._escrito += len(self._buffer)
+            self._buffer = bytearray()
+        if self._escrito >= self.tamano_segmento:
+            self._rotar()
+
+    def _rotar(self):
+        os.fsync(self._archivo.fileno())
+        self._archivo.close()
+        cerrado = self._activo
+        temporal = self._ruta(cerrado.numero, "idx.tmp")
+        with open(temporal, "wb") as archivo:
+            archivo.write(json_rapido.codificar(cerrado.to_dict()))
+        os.replace(temporal, self._ruta(cerrado.numero, "idx"))
+        self._abrir_segmento(cerrado.numero + 1)
+        self._aplicar_retencion()
+
+    def _aplicar_retencion(self):
+        limite = time.time() - self.retencion_dias * 86400
+        while len(self.segmentos) > 1 and self.segmentos[0].fin is not None and self.segmentos[0].fin < limite:
+            viejo = self.segmentos.pop(0)
+            for extension in ("seg", "idx"):
+                try:
+                    os.remove(self._ruta(viejo.numero, extension))
+                except OSError:
+                    pass
+            logger.info(f"Diario: segmento {viejo.numero} eliminado por retención")
+
+    def _bucle_vaciado(self):
+        while True:
+            time.sleep(INTERVALO_VACIADO)
+            try:
+                self.vaciar()
+            except Exception as e:
+                logger.error(f"Error volcando el diario de eventos: {e}")
+
+    # ===========================
+    # Consultas
+    # ===========================
+    def consultar(self, desde: Optional[float] = None, hasta: Optional[float] = None,
+                  dispositivo: Optional[str] = None, tipos: Optional[List[str]] = None,
+                  limite: int = LIMITE, cursor: Optional[Tuple[int, int]] = None,
+                  descendente: bool = True) -> Tuple[List[Dict[str, Any]], Optional[Tuple[int, int]]]:
+        """
+        Eventos en un rango de tiempo, opcionalmente de un dispositivo y de ciertos tipos
+
+        Args:
+            desde: Instante inicial (epoch, inclusive)
+            hasta: Instante final (epoch, inclusive)
+            dispositivo: IP (o ID) del dispositivo
+            tipos: Nombres de TIPOS a incluir
+            limite: Eventos por página
+            cursor: Posición (segmento, offset) devuelta por la página anterior
+            descendente: Los más recientes primero
+
+        Returns:
+            (eventos, cursor de la página siguiente o None)
+
+        Raises:
+            ValueError: si algún tipo no existe
+        """
+        desde = -math.inf if desde is None else desde
+        hasta = math.inf if hasta is None else hasta
+        try:
+            codigos = {TIPOS[tipo] for tipo in tipos} if tipos else None
+        except KeyError as e:
+            raise ValueError(f"Tipo de evento desconocido: {e.args[0]}")
+
+        self.vaciar()
+        with self._lock:
+            # Foto de los segmentos y de cuánto hay escrito en cada uno
+            candidatos = [
+                (segmento, segmento.tamano) for segmento in self.segmentos
+                if segmento.registros and segmento.inicio <= hasta and segmento.fin >= desde
+                and (dispositivo is None or dispositivo in segmento.dispositivos)
+            ]
+        if descendente:
+            candidatos.reverse()
+
+        eventos = []
+        for segmento, tamano in candidatos:
+            if cursor is not None and (segmento.numero > cursor[0] if descendente else segmento.numero < cursor[0]):
+                continue
+            try:
+                self._leer_segmento(segmento, tamano, desde, hasta, dispositivo, codigos, cursor,
+                                    descendente, eventos, limite + 1)
+            except FileNotFoundError:
+                continue  # Eliminado por retención durante la consulta
+            if len(eventos) > limite:
+                break
+
+        siguiente = None
+        if len(eventos) > limite:
+            eventos = eventos[:limite]
+            siguiente = eventos[-1].pop("_posicion")
+        for evento in eventos:
+            evento.pop("_posicion", None)
+        return eventos, siguiente
+
+    def _leer_segmento(self, segmento: _Segmento, tamano: int, desde: float, hasta: float,
+                       dispositivo: Optional[str], codigos: Optional[set], cursor: Optional[Tuple[int, int]],
+                       descendente: bool, eventos: List[Dict[str, Any]], maximo: int):
+        bloques = segmento.bloques(desde, hasta, tamano)
+        if descendente:
+            bloques.reverse()
+        with open(segmento.ruta, "rb") as archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            for inicio, fin in bloques:
+                encontrados = []
+                for offset, instante, tipo, clave, cuerpo, _ in _leer(datos, inicio, fin):
+                    if instante < desde or instante > hasta:
+                        continue
+                    if (dispositivo is not None and clave != dispositivo) or (codigos and tipo not in codigos):
+                        continue
+                    posicion = (segmento.numero, offset)
+                    if cursor is not None and (posicion >= tuple(cursor) if descendente else posicion <= tuple(cursor)):
+                        continue
+                    encontrados.append({
+                        "instante": instante,
+                        "tipo": NOMBRES_TIPO.get(tipo, str(tipo)),
+                        "dispositivo": clave,
+                        "datos": json_rapido.decodificar(cuerpo) if cuerpo else {},
+                        "_posicion": posicion,
+                    })
+                if descendente:
+                    encontrados.reverse()
+                eventos.extend(encontrados[:maximo - len(eventos)])
+                if len(eventos) >= maximo:
+                    return
+
+    def resumen(self) -> Dict[str, Any]:
+        """
+        Tamaño y rango de tiempo del diario
+        """
+        with self._lock:
+            segmentos = list(self.segmentos)
+        return {
+            "segmentos": len(segmentos),
+            "registros": sum(s.registros for s in segmentos),
+            "bytes": sum(s.tamano for s in segmentos),
+            "desde": next((s.inicio for s in segmentos if s.inicio is not None), None),
+            "hasta": next((s.fin for s in reversed(segmentos) if s.fin is not None), None),
+        }
@@ -0,0 +1,333 @@
+"""
+Espejo local de imágenes de firmware para las actualizaciones OTA.
+
+Cada imagen (modelo, versión) se descarga una sola vez desde la nube de Shelly
+—o se importa desde un archivo— y se verifica (ZIP íntegro, tamaño y SHA-256
+si se conoce) antes de publicarla con un rename atómico. Los dispositivos la
+bajan desde este servidor en lugar de hacerlo cada uno por la WAN.
+
+Las imágenes se sirven con send_file (Range, ETag y wsgi.file_wrapper, que en
+gunicorn usa sendfile) o, detrás de nginx, con X-Accel-Redirect. Un semáforo
+limita las descargas simultáneas: el exceso recibe 503 con Retry-After y el
+dispositivo reintenta.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+from threading import BoundedSemaphore, Event, Lock
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import requests
+
+import json_rapido
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del espejo
+DIRECTORIO = os.environ.get("SHELLY_FIRMWARE_DIR", "/opt/shelly_monitoring/firmware")
+URL_BASE = os.environ.get("SHELLY_FIRMWARE_URL_BASE", "")     # URL con la que los dispositivos llegan a este servidor
+ACCEL_REDIRECT = os.environ.get("SHELLY_FIRMWARE_ACCEL", "")  # Location interna de nginx que apunta a DIRECTORIO
+MAX_DESCARGAS = int(os.environ.get("SHELLY_FIRMWARE_MAX_DESCARGAS", "20"))
+CATALOGO_URL = "https://api.shelly.cloud/files/firmware"
+CATALOGO_TTL = 3600             # Segundos que se reutiliza el catálogo de la nube
+MAX_TAMANO = 32 * 1024 * 1024   # Bytes máximos de una imagen
+TIMEOUT = 30
+REINTENTAR_EN = 30              # Segundos sugeridos a un dispositivo cuando se alcanza el límite
+
+_NOMBRE_VALIDO = re.compile(r"^[A-Za-z0-9._+-]{1,64}$")
+
+
+class FirmwareInvalido(ValueError):
+    pass
+
+
+def version_semantica(version: str) -> str:
+    """
+    Extrae la versión de cadenas como '20201124-091508/v1.9.4@57ac4ad8'
+    """
+    return version.split("/v")[1].split("@")[0] if "/v" in version else version
+
+
+class EspejoFirmware:
+    """
+    Caché en disco de imágenes de firmware por modelo y versión
+    """
+    def __init__(self, directorio: str = DIRECTORIO, max_descargas: int = MAX_DESCARGAS):
+        """
+        Args:
+            directorio: Carpeta donde se guardan las imágenes ({modelo}/{version}.zip y su .json)
+            max_descargas: Dispositivos descargando a la vez
+        """
+        self.directorio = directorio
+        self.limite = BoundedSemaphore(max_descargas)
+        self.max_descargas = max_descargas
+        self.imagenes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.servidas = 0
+        self.rechazadas = 0
+        self._catalogo: Optional[Dict[str, Any]] = None
+        self._catalogo_instante = 0.0
+        self._en_curso: Dict[Tuple[str, str], Event] = {}
+        self._lock = Lock()
+        self._cargar()
+
+    def _cargar(self):
+        if not os.path.isdir(self.directorio):
+            return
+        for modelo in os.listdir(self.directorio):
+            carpeta = os.path.join(self.directorio, modelo)
+            if not os.path.isdir(carpeta):
+                continue
+            for nombre in os.listdir(carpeta):
+                if not nombre.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(carpeta, nombre), "rb") as archivo:
+                        meta = json_rapido.decodificar(archivo.read())
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Espejo de firmware: metadatos ilegibles {nombre}: {e}")
+                    continue
+                if os.path.exists(self.ruta(meta["modelo"], meta["version"])):
+                    self.imagenes[(meta["modelo"], meta["version"])] = meta
+
+    def ruta(self, modelo: str, version: str) -> str:
+        return os.path.join(self.directorio, modelo, f"{version}.zip")
+
+    def listar(self) -> List[Dict[str, Any]]:
+        return sorted(self.imagenes.values(), key=lambda m: (m["modelo"], m["version"]))
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "imagenes": len(self.imagenes),
+            "bytes": sum(m["tamano"] for m in self.imagenes.values()),
+            "max_descargas": self.max_descargas,
+            "servidas": self.servidas,
+            "rechazadas": self.rechazadas,
+        }
+
+    # ===========================
+    # Catálogo de la nube
+    # ===========================
+    def catalogo(self) -> Dict[str, Any]:
+        """
+        Catálogo {modelo: {version, url, ...}} de la nube de Shelly, cacheado CATALOGO_TTL segundos
+        """
+        with self._lock:
+            if self._catalogo is not None and time.time() - self._catalogo_instante < CATALOGO_TTL:
+                return self._catalogo
+        respuesta = requests.get(CATALOGO_URL, timeout=TIMEOUT)
+        respuesta.raise_for_status()
+        catalogo = respuesta.json().get("data", {})
+        with self._lock:
+            self._catalogo = catalogo
+            self._catalogo_instante = time.time()
+        return catalogo
+
+    def buscar_modelo(self, modelo: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Busca un modelo en el catálogo (acepta 'SHSW-1' o 'shsw-1' y el prefijo 'shelly')
+        """
+        modelo = modelo.lower()
+        for clave, datos in self.catalogo().items():
+            if clave.lower() in (modelo, "shelly" + modelo):
+                return clave, datos
+        return None
+
+    # ===========================
+    # Alta de imágenes
+    # ===========================
+    def asegurar(self, modelo: str, version: Optional[str] = None, url: Optional[str] = None,
+                 sha256: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Devuelve la imagen del espejo, descargándola si todavía no está
+
+        Sin versión ni URL se usa la última versión publicada para el modelo. Si varias
+        peticiones piden la misma imagen a la vez sólo una la descarga.
+
+        Raises:
+            FirmwareInvalido: si el modelo no existe o la imagen no pasa la verificación
+            requests.RequestException: si falla la descarga
+        """
+        if version and (modelo, version) in self.imagenes:
+            return self.imagenes[(modelo, version)]
+        if not url:
+            encontrado = self.buscar_modelo(modelo)
+            if encontrado is None:
+                raise FirmwareInvalido(f"No se encontró firmware para el modelo {modelo}")
+            modelo, datos = encontrado
+            ultima = version_semantica(datos.get("version", ""))
+            # La nube sólo publica la última versión; otras hay que darlas con su URL o importarlas
+            if version and version != ultima:
+                raise FirmwareInvalido(f"La versión {version} de {modelo} no está publicada (última: {ultima})")
+            version, url = ultima, datos.get("url")
+        if not version:
+            raise FirmwareInvalido("Falta la versión de la imagen")
+        self._validar_nombres(modelo, version)
+        clave = (modelo, version)
+
+        while True:
+            with self._lock:
+                if clave in self.imagenes:
+                    return self.imagenes[clave]
+                evento = self._en_curso.get(clave)
+                if evento is None:
+                    evento = self._en_curso[clave] = Event()
+                    break
+            # Otra petición ya la está descargando: se espera y se vuelve a mirar
+            evento.wait(TIMEOUT * 4)
+
+        try:
+            logger.info(f"Espejo de firmware: descargando {modelo} {version} desde {url}")
+            with requests.get(url, stream=True, timeout=TIMEOUT) as respuesta:
+                respuesta.raise_for_status()
+                esperado = respuesta.headers.get("Content-Length")
+                return self._guardar(modelo, version, respuesta.iter_content(64 * 1024), url, sha256,
+                                     int(esperado) if esperado and esperado.isdigit() else None)
+        finally:
+            with self._lock:
+                self._en_curso.pop(clave, None)
+            evento.set()
+
+    def importar(self, modelo: str, version: str, archivo: BinaryIO, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Agrega una imagen desde un archivo (p. ej. un upload) en lugar de descargarla
+
+        Raises:
+            FirmwareInvalido: si la imagen no pasa la verificación
+        """
+        self._validar_nombres(modelo, version)
+        return self._guardar(modelo, version, iter(lambda: archivo.read(64 * 1024), b""), "importado", sha256)
+
+    def eliminar(self, modelo: str, version: str) -> bool:
+        with self._lock:
+            meta = self.imagenes.pop((modelo, version), None)
+        if meta is None:
+            return False
+        for ruta in (self.ruta(modelo, version), self.ruta(modelo, version)[:-4] + ".json"):
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        return True
+
+    def _validar_nombres(self, modelo: str, version: str):
+        # Los nombres terminan en rutas del disco: nada de separadores ni '..'
+        for valor in (modelo, version):
+            if not valor or not _NOMBRE_VALIDO.match(valor) or valor.startswith("."):
+                raise FirmwareInvalido(f"Nombre de modelo o versión inválido: {valor!r}")
+
+    def _guardar(self, modelo: str, version: str, bloques, origen: str, sha256: Optional[str],
+                 tamano_esperado: Optional[int] = None) -> Dict[str, Any]:
+        carpeta = os.path.join(self.directorio, modelo)
+        os.makedirs(carpeta, exist_ok=True)
+        resumen = hashlib.sha256()
+        tamano = 0
+        descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix=".parcial")
+        try:
+            with os.fdopen(descriptor, "wb") as destino:
+                for bloque in bloques:
+                    tamano += len(bloque)
+                    if tamano > MAX_TAMANO:
+                        raise FirmwareInvalido(f"La imagen supera {MAX_TAMANO} bytes")
+                    resumen.update(bloque)
+                    destino.write(bloque)
+                destino.flush()
+                os.fsync(destino.fileno())
+
+            if tamano_esperado is not None and tamano != tamano_esperado:
+                raise FirmwareInvalido(f"Descarga incompleta: {tamano} de {tamano_esperado} bytes")
+            if sha256 and resumen.hexdigest() != sha256.lower():
+                raise FirmwareInvalido("El SHA-256 de la imagen no coincide")
+            try:
+                with zipfile.ZipFile(temporal) as imagen:
+                    corrupto = imagen.testzip()
+            except zipfile.BadZipFile:
+                raise FirmwareInvalido("La imagen no es un ZIP válido")
+            if corrupto is not None:
+                raise FirmwareInvalido(f"La imagen está dañada ({corrupto})")
+
+            meta = {
+                "modelo": modelo,
+                "version": version,
+                "sha256": resumen.hexdigest(),
+                "tamano": tamano,
+                "origen": origen,
+                "agregado": time.time(),
+            }
+            ruta = self.ruta(modelo, version)
+            os.replace(temporal, ruta)
+            with open(ruta[:-4] + ".json", "wb") as archivo:
+                archivo.write(json_rapido.codificar(meta))
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+
+        with self._lock:
+            self.imagenes[(modelo, version)] = meta
+        logger.info(f"Espejo de firmware: {modelo} {version} disponible ({tamano} bytes)")
+        return meta
+
+    # ===========================
+    # Servicio a los dispositivos
+    # ===========================
+    def url_publica(self, modelo: str, version: str, base: str) -> str:
+        """
+        URL desde la que un dispositivo descarga la imagen
+
+        Args:
+            base: URL de este servidor vista desde los dispositivos (URL_BASE tiene prioridad)
+        """
+        return f"{(URL_BASE or base).rstrip('/')}/firmware/{modelo}/{version}.zip"
+
+    def abrir(self, modelo: str, version: str) -> Optional[BinaryIO]:
+        """
+        Abre una imagen para enviarla, ocupando una de las descargas simultáneas
+
+        El turno se libera al cerrar el archivo, que es lo que hace el servidor WSGI
+        cuando termina de enviar el cuerpo (el wrapper de sendfile no cierra la Response).
+
+        Returns:
+            El archivo, o None si ya hay MAX_DESCARGAS en curso
+        """
+        if not self.limite.acquire(blocking=False):
+            self.rechazadas += 1
+            return None
+        try:
+            archivo = _ArchivoConTurno(self.ruta(modelo, version), self.limite)
+        except OSError:
+            self.limite.release()
+            raise
+        self.servidas += 1
+        return archivo
+
+
+class _ArchivoConTurno(io.FileIO):
+    def __init__(self, ruta: str, limite: BoundedSemaphore):
+        super().__init__(ruta, "rb")
+        self._limite = limite
+
+    def close(self):
+        if not self.closed:
+            self._limite.release()
+        super().close()
+
+
+_espejo = None
+_espejo_lock = Lock()
+
+
+def espejo_compartido() -> EspejoFirmware:
+    """
+    Instancia única para todo el proceso (app y blueprint de firmware)
+    """
+    global _espejo
+    with _espejo_lock:
+        if _espejo is None:
+            _espejo = EspejoFirmware()
+        return _espejo
@@ -0,0 +1,265 @@
+"""
+Estadísticas de la flota mantenidas de forma incremental.
+
+Cada actualización de un dispositivo resta su aporte anterior y suma el nuevo:
+contadores globales, totales e histograma de potencia por tipo, carga por
+habitación y por tablero, y rankings de mayores consumidores. Así leer el
+resumen no recorre la flota: se devuelve una instantánea ya armada que sólo se
+rehace (en O(tipos + k)) cuando algo cambió.
+
+Los rankings son listas ordenadas con bisect: ubicar el elemento es O(log n) y
+el desplazamiento es un memmove, y a diferencia de un heap acotado a k siguen
+siendo exactos cuando un consumidor del top baja su potencia.
+
+Se alimenta de los eventos del índice de dispositivos ('cargado', 'actualizado',
+'eliminado'), que ya integra los NOTIFY de la tabla y los eventos en vivo.
+"""
+
+import bisect
+import logging
+import time
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de las estadísticas
+TOP_K = 10                          # Elementos de cada ranking en el resumen
+TOP_K_MAXIMO = 100
+INTERVALO_EMISION = 2.0             # Segundos mínimos entre emisiones por Socket.IO
+LIMITES_POTENCIA = (10, 100, 500, 1000, 2000)   # W; además del tramo de 0 W
+TRAMOS = ["0", "<10", "10-100", "100-500", "500-1000", "1000-2000", ">=2000"]
+
+
+def _tramo(potencia: float) -> int:
+    if potencia <= 0:
+        return 0
+    return bisect.bisect_right(LIMITES_POTENCIA, potencia) + 1
+
+
+class _Ranking:
+    """
+    Valores por clave en una lista ordenada (valor, clave)
+    """
+    def __init__(self):
+        self.valores: Dict[Hashable, float] = {}
+        self._orden: List[Tuple[float, Hashable]] = []
+
+    def fijar(self, clave: Hashable, valor: float):
+        anterior = self.valores.get(clave)
+        if anterior == valor:
+            return
+        if anterior is not None:
+            self._sacar(anterior, clave)
+        self.valores[clave] = valor
+        bisect.insort(self._orden, (valor, clave))
+
+    def sumar(self, clave: Hashable, delta: float):
+        if delta:
+            # Redondeo para que sumas y restas sucesivas no dejen residuos de coma flotante
+            self.fijar(clave, round(self.valores.get(clave, 0) + delta, 3))
+
+    def quitar(self, clave: Hashable):
+        anterior = self.valores.pop(clave, None)
+        if anterior is not None:
+            self._sacar(anterior, clave)
+
+    def _sacar(self, valor: float, clave: Hashable):
+        i = bisect.bisect_left(self._orden, (valor, clave))
+        if i < len(self._orden) and self._orden[i] == (valor, clave):
+            del self._orden[i]
+
+    def mayores(self, k: int) -> List[Tuple[Hashable, float]]:
+        return [(clave, valor) for valor, clave in reversed(self._orden[-k:]) if valor > 0]
+
+
+class EstadisticasFlota:
+    """
+    Contadores, histogramas y rankings de consumo de toda la flota
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._tableros: Dict[int, Optional[int]] = {}       # habitacion_id -> tablero_id
+        self._vaciar()
+        self._emitir_thread: Optional[Thread] = None
+
+    def _vaciar(self):
+        self._aportes: Dict[int, Tuple] = {}                # id -> aporte vigente
+        self._info: Dict[int, Dict[str, Any]] = {}          # id -> nombre, ip, tipo, habitacion_id
+        self.total = 0
+        self.online = 0
+        self.encendidos = 0
+        self.potencia_total = 0.0
+        self._por_tipo: Dict[str, Dict[str, Any]] = {}
+        self._dispositivos = _Ranking()
+        self._habitaciones = _Ranking()
+        self._tablero_potencia = _Ranking()
+        self.version = 0
+        self._instantanea: Optional[Dict[str, Any]] = None
+        self._version_instantanea = -1
+
+    # ===========================
+    # Mantenimiento
+    # ===========================
+    def cargar(self, dispositivos: Iterable[Dict[str, Any]]):
+        """
+        Recalcula todo a partir de la lista completa de dispositivos
+        """
+        with self._lock:
+            self._vaciar()
+            for dispositivo in dispositivos:
+                self._aplicar(dispositivo)
+
+    def actualizar(self, dispositivo: Dict[str, Any]):
+        """
+        Aplica el estado actual de un dispositivo (fila de la tabla más online)
+        """
+        with self._lock:
+            self._aplicar(dispositivo)
+
+    def eliminar(self, dispositivo_id: int):
+        with self._lock:
+            aporte = self._aportes.pop(dispositivo_id, None)
+            if aporte is not None:
+                self._restar(dispositivo_id, aporte)
+                self._info.pop(dispositivo_id, None)
+                self.version += 1
+
+    def fijar_tableros(self, habitaciones: Iterable[Tuple[int, Optional[int]]]):
+        """
+        Actualiza la pertenencia de habitaciones a tableros y rehace la carga por tablero
+        """
+        with self._lock:
+            self._tableros = dict(habitaciones)
+            self._tablero_potencia = _Ranking()
+            for habitacion_id, potencia in self._habitaciones.valores.items():
+                tablero_id = self._tableros.get(habitacion_id)
+                if tablero_id is not None:
+                    self._tablero_potencia.sumar(tablero_id, potencia)
+            self.version += 1
+
+    def _aplicar(self, dispositivo: Dict[str, Any]):
+        dispositivo_id = dispositivo["id"]
+        online = dispositivo.get("online")
+        encendido = bool(dispositivo.get("estado"))
+        potencia = float(dispositivo.get("ultimo_consumo") or 0) if online is not False else 0.0
+        aporte = (dispositivo.get("tipo") or "desconocido", dispositivo.get("habitacion_id"),
+                  online is True, encendido, potencia)
+        anterior = self._aportes.get(dispositivo_id)
+        info = {c: dispositivo.get(c) for c in ("nombre", "ip", "tipo", "habitacion_id")}
+        if anterior == aporte:
+            if self._info.get(dispositivo_id) != info:
+                self._info[dispositivo_id] = info
+                self.version += 1
+            return
+        self._info[dispositivo_id] = info
+        if anterior is not None:
+            self._restar(dispositivo_id, anterior)
+        self._sumar(dispositivo_id, aporte)
+        self._aportes[dispositivo_id] = aporte
+        self.version += 1
+
+    def _sumar(self, dispositivo_id: int, aporte: Tuple, signo: int = 1):
+        tipo, habitacion_id, online, encendido, potencia = aporte
+        self.total += signo
+        self.online += signo * online
+        self.encendidos += signo * encendido
+        self.potencia_total += signo * potencia
+
+        por_tipo = self._por_tipo.get(tipo)
+        if por_tipo is None:
+            por_tipo = self._por_tipo[tipo] = {
+                "total": 0, "online": 0, "encendidos": 0, "potencia": 0.0, "histograma": [0] * len(TRAMOS),
+            }
+        por_tipo["total"] += signo
+        por_tipo["online"] += signo * online
+        por_tipo["encendidos"] += signo * encendido
+        por_tipo["potencia"] += signo * potencia
+        por_tipo["histograma"][_tramo(potencia)] += signo
+        if not por_tipo["total"]:
+            del self._por_tipo[tipo]
+
+        if signo > 0:
+            self._dispositivos.fijar(dispositivo_id, potencia)
+        else:
+            self._dispositivos.quitar(dispositivo_id)
+        if habitacion_id is not None and potencia:
+            self._habitaciones.sumar(habitacion_id, signo * potencia)
+            tablero_id = self._tableros.get(habitacion_id)
+            if tablero_id is not None:
+                self._tablero_potencia.sumar(tablero_id, signo * potencia)
+
+    def _restar(self, dispositivo_id: int, aporte: Tuple):
+        self._sumar(dispositivo_id, aporte, signo=-1)
+
+    # ===========================
+    # Lectura
+    # ===========================
+    def resumen(self, k: int = TOP_K) -> Dict[str, Any]:
+        """
+        Devuelve el resumen de la flota; si no hubo cambios es la misma instantánea ya armada
+        """
+        with self._lock:
+            if k == TOP_K and self._version_instantanea == self.version:
+                return self._instantanea
+            instantanea = self._armar(k)
+            if k == TOP_K:
+                self._instantanea = instantanea
+                self._version_instantanea = self.version
+            return instantanea
+
+    def _armar(self, k: int) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "online": self.online,
+            "offline": self.total - self.online,
+            "encendidos": self.encendidos,
+            "potencia_total": round(self.potencia_total, 2),
+            "por_tipo": {
+                tipo: {
+                    "total": datos["total"],
+                    "online": datos["online"],
+                    "encendidos": datos["encendidos"],
+                    "potencia": round(datos["potencia"], 2),
+                    "histograma": dict(zip(TRAMOS, datos["histograma"])),
+                }
+                for tipo, datos in self._por_tipo.items()
+            },
+            "top_dispositivos": [
+                dict(self._info[dispositivo_id], id=dispositivo_id, potencia=potencia)
+                for dispositivo_id, potencia in self._dispositivos.mayores(k)
+            ],
+            "top_habitaciones": [
+                {"habitacion_id": habitacion_id, "potencia": round(potencia, 2)}
+                for habitacion_id, potencia in self._habitaciones.mayores(k)
+            ],
+            "top_tableros": [
+                {"tablero_id": tablero_id, "potencia": round(potencia, 2)}
+                for tablero_id, potencia in self._tablero_potencia.mayores(k)
+            ],
+            "version": self.version,
+            "timestamp": time.time(),
+        }
+
+    # ===========================
+    # Emisión periódica
+    # ===========================
+    def iniciar(self, emitir: Callable[[Dict[str, Any]], None], intervalo: float = INTERVALO_EMISION):
+        """
+        Emite el resumen cada `intervalo` segundos, sólo si cambió desde la última emisión
+        """
+        def bucle():
+            emitida = -1
+            while True:
+                time.sleep(intervalo)
+                try:
+                    if self.version != emitida:
+                        resumen = self.resumen()
+                        emitida = resumen["version"]
+                        emitir(resumen)
+                except Exception as e:
+                    logger.error(f"Error emitiendo estadísticas de la flota: {e}")
+
+        if self._emitir_thread is None:
+            self._emitir_thread = Thread(target=bucle, daemon=True)
+            self._emitir_thread.start()
@@ -0,0 +1,334 @@
+"""
+Exportación en streaming del historial de consumo y de eventos.
+
+Las filas se leen con un cursor del lado del servidor (named cursor de
+psycopg2, ITERSIZE filas por viaje) y se codifican por bloques: CSV (opcionalmente
+con gzip) o Parquet (columnar, comprimido con zstd, un row group por bloque).
+La memoria usada depende del tamaño del bloque y no del rango exportado.
+
+Parquet requiere pyarrow (dependencia opcional).
+
+Uso desde la línea de comandos (escribe en un archivo o en stdout):
+    python exportacion.py consumos --desde 2025-01-01 --hasta 2026-01-01 --tableros 1 --formato parquet --salida consumo.parquet
+    python exportacion.py consumos --desde 2025-06-01 --dispositivos 10,11 --gzip --salida - > consumo.csv.gz
+"""
+
+import argparse
+import csv
+import io
+import logging
+import sys
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence
+
+import json_rapido
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de la exportación
+ITERSIZE = 10000                # Filas por viaje del cursor del servidor
+FILAS_BLOQUE = 65536            # Filas por row group de Parquet
+BYTES_CHUNK = 256 * 1024        # Tamaño aproximado de cada chunk CSV
+FORMATOS = ("csv", "parquet")
+TIPOS_CONTENIDO = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+COLUMNAS_CONSUMO = ("dispositivo_id", "dispositivo", "instante", "potencia", "estado", "energia")
+COLUMNAS_EVENTO = ("instante", "tipo", "dispositivo", "datos")
+
+# 📌 Configuración de la base de datos (uso desde la línea de comandos)
+DB_NAME = "shelly_db"
+DB_USER = "shelly_user"
+DB_PASSWORD = "shelly_pass"
+DB_HOST = "localhost"
+
+SQL_CONSUMOS = (
+    "SELECT c.dispositivo_id, d.nombre, c.instante, c.potencia, c.estado, c.energia "
+    "FROM consumos c JOIN dispositivos d ON d.id = c.dispositivo_id "
+    "WHERE c.dispositivo_id = ANY(%s) AND c.instante >= %s AND c.instante < %s "
+    # Mismo orden que la clave primaria: se recorre el índice sin ordenar en memoria
+    "ORDER BY c.dispositivo_id, c.instante"
+)
+
+
+def conectar_db():
+    import psycopg2
+    return psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST)
+
+
+def validar_formato(formato: str, comprimir: bool = False):
+    """
+    Raises:
+        ValueError: si el formato no existe o no está disponible
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"formato debe ser uno de: {', '.join(FORMATOS)}")
+    if formato == "parquet" and pyarrow is None:
+        raise ValueError("La exportación Parquet requiere pyarrow")
+    if formato == "parquet" and comprimir:
+        raise ValueError("Parquet ya se comprime por columna; gzip sólo aplica a CSV")
+
+
+def nombre_archivo(prefijo: str, formato: str, comprimir: bool) -> str:
+    marca = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    return f"{prefijo}_{marca}.{formato}" + (".gz" if comprimir else "")
+
+
+# ===========================
+# Lectura
+# ===========================
+def resolver_dispositivos(conn, dispositivos: Optional[Sequence[int]] = None,
+                          habitaciones: Optional[Sequence[int]] = None,
+                          tableros: Optional[Sequence[int]] = None,
+                          permitidas: Optional[Iterable[int]] = None) -> List[int]:
+    """
+    IDs de los dispositivos seleccionados (unión de los criterios; sin criterios, todos)
+
+    Args:
+        permitidas: Si se indica, restringe a dispositivos de estas habitaciones (permisos del usuario)
+    """
+    condiciones, parametros = [], []
+    if dispositivos:
+        condiciones.append("d.id = ANY(%s)")
+        parametros.append(list(dispositivos))
+    if habitaciones:
+        condiciones.append("d.habitacion_id = ANY(%s)")
+        parametros.append(list(habitaciones))
+    if tableros:
+        condiciones.append("h.tablero_id = ANY(%s)")
+        parametros.append(list(tableros))
+    sql = "SELECT d.id FROM dispositivos d LEFT JOIN habitaciones h ON h.id = d.habitacion_id"
+    filtros = []
+    if condiciones:
+        filtros.append("(" + " OR ".join(condiciones) + ")")
+    if permitidas is not None:
+        filtros.append("d.habitacion_id = ANY(%s)")
+        parametros.append(list(permitidas))
+    if filtros:
+        sql += " WHERE " + " AND ".join(filtros)
+    cursor = conn.cursor()
+    cursor.execute(sql + " ORDER BY d.id", parametros)
+    ids = [fila[0] for fila in cursor.fetchall()]
+    cursor.close()
+    return ids
+
+
+def filas_consumos(conectar: Callable[[], Any], dispositivos: List[int],
+                   desde: datetime, hasta: datetime) -> Iterator[tuple]:
+    """
+    Muestras de consumo en [desde, hasta) leídas con un cursor del lado del servidor
+    """
+    conn = conectar()
+    try:
+        # El cursor con nombre vive en el servidor: sólo viajan ITERSIZE filas por vez
+        cursor = conn.cursor(name="exportar_consumos")
+        cursor.itersize = ITERSIZE
+        cursor.execute(SQL_CONSUMOS, (dispositivos, desde, hasta))
+        yield from cursor
+        cursor.close()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def filas_eventos(diario, desde: Optional[float], hasta: Optional[float],
+                  dispositivos: Optional[set] = None, tipos: Optional[List[str]] = None,
+                  pagina: int = 1000) -> Iterator[tuple]:
+    """
+    Eventos del diario en orden cronológico, recorridos por páginas
+
+    Args:
+        dispositivos: IPs (o IDs) a incluir; None para todos
+    """
+    unico = next(iter(dispositivos)) if dispositivos and len(dispositivos) == 1 else None
+    cursor = None
+    while True:
+        eventos, cursor = diario.consultar(desde=desde, hasta=hasta, dispositivo=unico, tipos=tipos,
+                                           limite=pagina, cursor=cursor, descendente=False)
+        for evento in eventos:
+            if dispositivos is None or evento["dispositivo"] in dispositivos:
+                yield (datetime.fromtimestamp(evento["instante"], timezone.utc), evento["tipo"],
+                       evento["dispositivo"], evento["datos"])
+        if cursor is None:
+            return
+
+
+# ===========================
+# Codificación
+# ===========================
+def _valor_csv(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if isinstance(valor, dict):
+        return json_rapido.codificar(valor).decode("utf-8")
+    return valor
+
+
+def chunks_csv(columnas: Sequence[str], filas: Iterable[tuple], comprimir: bool = False) -> Iterator[bytes]:
+    """
+    CSV con cabecera en chunks de ~BYTES_CHUNK, opcionalmente comprimido con gzip en streaming
+    """
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+    escritor.writerow(columnas)
+
+    def vaciar() -> bytes:
+        datos = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compresor.compress(datos) if compresor else datos
+
+    convertir = None
+    for fila in filas:
+        if convertir is None:
+            # Las columnas que necesitan conversión se detectan una vez, con la primera fila
+            convertir = [i for i, valor in enumerate(fila) if isinstance(valor, (datetime, dict))]
+        if convertir:
+            fila = list(fila)
+            for i in convertir:
+                if fila[i] is not None:
+                    fila[i] = _valor_csv(fila[i])
+        escritor.writerow(fila)
+        if buffer.tell() >= BYTES_CHUNK:
+            chunk = vaciar()
+            if chunk:
+                yield chunk
+    chunk = vaciar()
+    if compresor:
+        chunk += compresor.flush()
+    if chunk:
+        yield chunk
+
+
+class _SalidaEnMemoria(io.RawIOBase):
+    """
+    Destino de escritura de Parquet: acumula lo escrito hasta que el generador lo entrega
+    """
+    def __init__(self):
+        super().__init__()
+        self.pendiente = bytearray()
+        self.posicion = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self.pendiente += datos
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self.posicion
+
+    def retirar(self) -> bytes:
+        datos = bytes(self.pendiente)
+        self.pendiente.clear()
+        return datos
+
+
+def _esquema(columnas: Sequence[str]):
+    tipos = {
+        "dispositivo_id": pyarrow.int32(),
+        "dispositivo": pyarrow.string(),
+        "instante": pyarrow.timestamp("us", tz="UTC"),
+        "potencia": pyarrow.float32(),
+        "estado": pyarrow.bool_(),
+        "energia": pyarrow.float64(),
+        "tipo": pyarrow.string(),
+        "datos": pyarrow.string(),
+    }
+    return pyarrow.schema([(columna, tipos[columna]) for columna in columnas])
+
+
+def chunks_parquet(columnas: Sequence[str], filas: Iterable[tuple]) -> Iterator[bytes]:
+    """
+    Parquet escrito por row groups de FILAS_BLOQUE filas; cada row group se entrega apenas se escribe
+    """
+    esquema = _esquema(columnas)
+    salida = _SalidaEnMemoria()
+    escritor = pyarrow.parquet.ParquetWriter(salida, esquema, compression="zstd")
+    bloque: List[List[Any]] = [[] for _ in columnas]
+
+    def escribir():
+        escritor.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(valores, type=campo.type) for valores, campo in zip(bloque, esquema)], schema=esquema))
+        for valores in bloque:
+            valores.clear()
+
+    for fila in filas:
+        for valores, valor in zip(bloque, fila):
+            valores.append(_valor_csv(valor) if isinstance(valor, dict) else valor)
+        if len(bloque[0]) >= FILAS_BLOQUE:
+            escribir()
+            yield salida.retirar()
+    if bloque[0]:
+        escribir()
+    escritor.close()
+    yield salida.retirar()
+
+
+def exportar(columnas: Sequence[str], filas: Iterable[tuple], formato: str, comprimir: bool = False) -> Iterator[bytes]:
+    if formato == "parquet":
+        return chunks_parquet(columnas, filas)
+    return chunks_csv(columnas, filas, comprimir)
+
+
+# ===========================
+# Línea de comandos
+# ===========================
+def _fecha(texto: str) -> datetime:
+    fecha = datetime.fromisoformat(texto)
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+
+def _ids(texto: Optional[str]) -> Optional[List[int]]:
+    return [int(v) for v in texto.split(",") if v.strip()] if texto else None
+
+
+def main(argumentos: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Exporta el historial de consumo")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    consumos = sub.add_parser("consumos", help="Muestras por minuto de potencia y estado")
+    consumos.add_argument("--desde", type=_fecha, required=True, help="Fecha ISO (UTC si no tiene zona)")
+    consumos.add_argument("--hasta", type=_fecha, default=datetime.now(timezone.utc))
+    consumos.add_argument("--dispositivos", type=_ids)
+    consumos.add_argument("--habitaciones", type=_ids)
+    consumos.add_argument("--tableros", type=_ids)
+    consumos.add_argument("--formato", choices=FORMATOS, default="csv")
+    consumos.add_argument("--gzip", action="store_true", help="Comprime el CSV")
+    consumos.add_argument("--salida", default="-", help="Archivo destino o - para stdout")
+    args = parser.parse_args(argumentos)
+
+    try:
+        validar_formato(args.formato, args.gzip)
+    except ValueError as e:
+        parser.error(str(e))
+    conn = conectar_db()
+    try:
+        ids = resolver_dispositivos(conn, args.dispositivos, args.habitaciones, args.tableros)
+    finally:
+        conn.close()
+
+    destino = sys.stdout.buffer if args.salida == "-" else open(args.salida, "wb")
+    total = 0
+    try:
+        for chunk in exportar(COLUMNAS_CONSUMO, filas_consumos(conectar_db, ids, args.desde, args.hasta),
+                              args.formato, args.gzip):
+            destino.write(chunk)
+            total += len(chunk)
+    finally:
+        if destino is not sys.stdout.buffer:
+            destino.close()
+    print(f"✅ {len(ids)} dispositivos exportados ({total / 1024 / 1024:.1f} MB)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
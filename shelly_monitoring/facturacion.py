@@ -0,0 +1,537 @@
+"""
+Reportes mensuales de facturación de energía por habitación o tablero.
+
+La energía se calcula a partir del historial por minuto (tabla consumos):
+
+- Entre dos muestras consecutivas de un dispositivo se usa la diferencia del
+  contador de energía cuando ambas lo tienen. Si el contador bajó (reinicio del
+  dispositivo) se toma el valor posterior, que es lo acumulado desde el reinicio.
+- Sin contador se integra la potencia por trapecios, sólo si el intervalo no
+  supera MAX_HUECO; los intervalos más largos se informan como huecos (la
+  energía que cubre el contador en un hueco se suma a la franja de su inicio y
+  no cuenta para la demanda).
+
+Cada intervalo se asigna a una franja horaria de la tarifa (tabla por minuto
+de la semana, en la zona horaria de la tarifa) y a una ventana de demanda. Todo
+se calcula con NumPy sobre bloques de DISPOSITIVOS_POR_TAREA dispositivos, que
+se reparten en un pool de procesos; las muestras se leen con COPY binario y se
+interpretan sin pasar por objetos de Python. En modo eventlet no se hace fork
+(ver modo_asincrono): cada bloque se lee en una green thread y se calcula en
+los threads nativos de eventlet.
+
+Formato de la tarifa (JSON):
+    {
+        "nombre": "T2 comercial", "moneda": "ARS", "zona": "America/Argentina/Buenos_Aires",
+        "precio_kwh": 120.0,
+        "franjas": [
+            {"nombre": "punta", "precio_kwh": 180.0, "dias": [0, 1, 2, 3, 4], "desde": "18:00", "hasta": "23:00"},
+            {"nombre": "valle", "precio_kwh": 80.0, "desde": "23:00", "hasta": "05:00"}
+        ],
+        "cargo_demanda_kw": 950.0, "ventana_demanda_min": 15, "cargo_fijo": 5000.0
+    }
+
+Los días van de 0 (lunes) a 6; si una franja se superpone con otra, prevalece
+la que figura después. Los cargos de demanda y fijo se aplican por grupo: la
+demanda es el máximo de la potencia media del grupo en una ventana.
+"""
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+
+import exportacion
+import json_rapido
+import modo_asincrono
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de la facturación
+MAX_HUECO = 5 * 60              # Segundos máximos entre muestras para integrar la potencia
+DISPOSITIVOS_POR_TAREA = 50     # Dispositivos por tarea del pool (~100 MB de muestras por mes)
+PROCESOS = int(os.environ.get("SHELLY_FACTURACION_PROCESOS", "0")) or os.cpu_count() or 2
+TTL_MES_EN_CURSO = 300          # Segundos que vale un reporte que incluye el mes en curso
+MAX_REPORTES = 64               # Reportes guardados en la caché
+MAX_TRABAJOS = 200              # Trabajos terminados que se conservan
+AGRUPACIONES = ("habitacion", "tablero")
+MINUTOS_SEMANA = 7 * 1440
+
+TARIFA_DEFECTO = {
+    "nombre": "Tarifa única",
+    "moneda": "ARS",
+    "zona": "UTC",
+    "precio_kwh": 0.0,
+    "franjas": [],
+    "cargo_demanda_kw": 0.0,
+    "ventana_demanda_min": 15,
+    "cargo_fijo": 0.0,
+}
+
+SQL_GRUPOS = {
+    "habitacion": "SELECT d.id, h.id, h.nombre FROM dispositivos d JOIN habitaciones h ON h.id = d.habitacion_id",
+    "tablero": (
+        "SELECT d.id, t.id, t.nombre FROM dispositivos d JOIN habitaciones h ON h.id = d.habitacion_id "
+        "JOIN tableros t ON t.id = h.tablero_id"
+    ),
+}
+
+# Filas de COPY ... (FORMAT binary): cantidad de campos y, por campo, largo y valor (big endian)
+SQL_MUESTRAS = (
+    "COPY (SELECT dispositivo_id, EXTRACT(EPOCH FROM instante)::float8, potencia, COALESCE(energia, 'NaN') "
+    "FROM consumos WHERE dispositivo_id = ANY(%s) AND instante >= to_timestamp(%s) AND instante < to_timestamp(%s) "
+    "ORDER BY dispositivo_id, instante) TO STDOUT (FORMAT binary)"
+)
+FILA_COPY = np.dtype([
+    ("campos", ">i2"), ("l_id", ">i4"), ("id", ">i4"), ("l_t", ">i4"), ("t", ">f8"),
+    ("l_p", ">i4"), ("p", ">f4"), ("l_e", ">i4"), ("e", ">f8"),
+])
+FIRMA_COPY = b"PGCOPY\n\xff\r\n\x00"
+
+
+# ===========================
+# Tarifas
+# ===========================
+def _minutos(texto: str) -> int:
+    horas, minutos = texto.split(":")
+    valor = int(horas) * 60 + int(minutos)
+    if not 0 <= valor <= 1440:
+        raise ValueError(f"Hora inválida: {texto}")
+    return valor
+
+
+def validar_tarifa(tarifa: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Completa la tarifa con los valores por defecto y la valida
+
+    Raises:
+        ValueError: si algún campo no es válido
+    """
+    resultado = dict(TARIFA_DEFECTO, **(tarifa or {}))
+    try:
+        ZoneInfo(resultado["zona"])
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Zona horaria desconocida: {resultado['zona']}")
+    for campo in ("precio_kwh", "cargo_demanda_kw", "cargo_fijo"):
+        if not isinstance(resultado[campo], (int, float)) or resultado[campo] < 0:
+            raise ValueError(f"{campo} debe ser un número no negativo")
+    if resultado["ventana_demanda_min"] not in (1, 5, 10, 15, 30, 60):
+        raise ValueError("ventana_demanda_min debe ser 1, 5, 10, 15, 30 o 60")
+    nombres = {"base"}
+    for franja in resultado["franjas"]:
+        if not franja.get("nombre") or franja["nombre"] in nombres:
+            raise ValueError("Cada franja necesita un nombre único (distinto de 'base')")
+        nombres.add(franja["nombre"])
+        if not isinstance(franja.get("precio_kwh"), (int, float)) or franja["precio_kwh"] < 0:
+            raise ValueError(f"precio_kwh inválido en la franja {franja['nombre']}")
+        if any(d not in range(7) for d in franja.get("dias", range(7))):
+            raise ValueError(f"dias inválidos en la franja {franja['nombre']} (0 = lunes ... 6)")
+        _minutos(franja.get("desde", "00:00"))
+        _minutos(franja.get("hasta", "24:00"))
+    return resultado
+
+
+def tabla_franjas(tarifa: Dict[str, Any]) -> np.ndarray:
+    """
+    Franja (0 = base, i = franjas[i - 1]) de cada minuto de la semana, empezando el lunes a las 00:00
+    """
+    tabla = np.zeros(MINUTOS_SEMANA, dtype=np.int8)
+    minutos = np.arange(1440)
+    for numero, franja in enumerate(tarifa["franjas"], start=1):
+        desde, hasta = _minutos(franja.get("desde", "00:00")), _minutos(franja.get("hasta", "24:00"))
+        # desde > hasta: la franja cruza la medianoche (23:00 a 05:00)
+        del_dia = (minutos >= desde) & (minutos < hasta) if desde <= hasta else (minutos >= desde) | (minutos < hasta)
+        for dia in franja.get("dias", range(7)):
+            tabla[dia * 1440:(dia + 1) * 1440][del_dia] = numero
+    return tabla
+
+
+def rango_mes(mes: str, zona: str) -> Tuple[float, float]:
+    """
+    Inicio y fin (epoch) del mes 'AAAA-MM' en la zona horaria indicada
+
+    Raises:
+        ValueError: si el mes no tiene el formato AAAA-MM
+    """
+    try:
+        anio, numero = (int(v) for v in mes.split("-"))
+        inicio = datetime(anio, numero, 1, tzinfo=ZoneInfo(zona))
+    except (TypeError, ValueError):
+        raise ValueError("mes debe tener el formato AAAA-MM")
+    fin = datetime(anio + numero // 12, numero % 12 + 1, 1, tzinfo=ZoneInfo(zona))
+    return inicio.timestamp(), fin.timestamp()
+
+
+def desplazamientos(inicio: float, fin: float, zona: str) -> np.ndarray:
+    """
+    Desplazamiento UTC (s) de la zona en cada hora del rango; los cambios de horario caen en horas enteras
+    """
+    zona_info = ZoneInfo(zona)
+    horas = np.arange(inicio, fin + 3600, 3600)
+    return np.array([datetime.fromtimestamp(h, zona_info).utcoffset().total_seconds() for h in horas])
+
+
+# ===========================
+# Cálculo (se ejecuta en los procesos del pool)
+# ===========================
+def leer_muestras(conn, dispositivos: Sequence[int], inicio: float, fin: float) -> np.ndarray:
+    """
+    Muestras (id, t, p, e) ordenadas por dispositivo e instante, leídas con COPY binario
+    """
+    buffer = io.BytesIO()
+    cursor = conn.cursor()
+    cursor.copy_expert(cursor.mogrify(SQL_MUESTRAS, (list(dispositivos), inicio, fin)).decode("utf-8"), buffer)
+    cursor.close()
+    datos = buffer.getbuffer()
+    if bytes(datos[:len(FIRMA_COPY)]) != FIRMA_COPY:
+        raise ValueError("Respuesta de COPY binario inesperada")
+    cabecera = len(FIRMA_COPY) + 8 + int.from_bytes(datos[len(FIRMA_COPY) + 4:len(FIRMA_COPY) + 8], "big")
+    return np.frombuffer(datos[cabecera:len(datos) - 2], dtype=FILA_COPY)
+
+
+def integrar(ids: np.ndarray, t: np.ndarray, p: np.ndarray, e: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Energía de cada intervalo entre muestras consecutivas de un mismo dispositivo
+
+    Returns:
+        (índice de la muestra inicial, Wh, duración en s, si el intervalo es un hueco)
+    """
+    mismo = ids[1:] == ids[:-1]
+    dt = np.diff(t)
+    con_contador = mismo & ~np.isnan(e[:-1]) & ~np.isnan(e[1:])
+    delta = np.diff(e)
+    por_contador = np.where(delta >= 0, delta, e[1:])
+    corto = mismo & (dt <= MAX_HUECO)
+    por_potencia = (p[:-1].astype(np.float64) + p[1:]) * dt / 7200
+    wh = np.where(con_contador, por_contador, np.where(corto, por_potencia, 0.0))
+    seleccion = np.flatnonzero(mismo)
+    return seleccion, wh[seleccion], dt[seleccion], ~corto[seleccion]
+
+
+def calcular_bloque(dispositivos: Sequence[int], grupos: Sequence[int], inicio: float, fin: float,
+                    offsets: np.ndarray, tabla: np.ndarray, ventana: int,
+                    conectar: Callable[[], Any] = exportacion.conectar_db) -> Dict[str, Any]:
+    """
+    Energía por franja, energía por ventana de demanda y huecos de un bloque de dispositivos
+
+    Args:
+        dispositivos: IDs del bloque
+        grupos: Índice de grupo de cada dispositivo
+        ventana: Segundos de la ventana de demanda
+
+    Returns:
+        Arrays por grupo local; 'grupos' indica a qué grupo global corresponde cada fila
+    """
+    conn = conectar()
+    try:
+        muestras = leer_muestras(conn, dispositivos, inicio, fin)
+    finally:
+        conn.close()
+    return procesar_bloque(muestras, dispositivos, grupos, inicio, fin, offsets, tabla, ventana)
+
+
+def calcular_bloque_cooperativo(dispositivos: Sequence[int], grupos: Sequence[int], inicio: float, fin: float,
+                                offsets: np.ndarray, tabla: np.ndarray, ventana: int,
+                                conectar: Callable[[], Any] = exportacion.conectar_db) -> Dict[str, Any]:
+    """
+    Como calcular_bloque, para el modo eventlet: la lectura cede el hub y el cálculo va a un thread nativo
+    """
+    conn = conectar()
+    try:
+        muestras = leer_muestras(conn, dispositivos, inicio, fin)
+    finally:
+        conn.close()
+    return modo_asincrono.en_hilo_nativo(procesar_bloque, muestras, dispositivos, grupos, inicio, fin,
+                                         offsets, tabla, ventana)
+
+
+def procesar_bloque(muestras: np.ndarray, dispositivos: Sequence[int], grupos: Sequence[int], inicio: float,
+                    fin: float, offsets: np.ndarray, tabla: np.ndarray, ventana: int) -> Dict[str, Any]:
+    locales, inverso = np.unique(np.asarray(grupos), return_inverse=True)
+    franjas = int(tabla.max()) + 1 if len(tabla) else 1
+    ventanas = int(np.ceil((fin - inicio) / ventana))
+    resultado = {
+        "grupos": locales,
+        "franjas": np.zeros((len(locales), franjas)),
+        "ventanas": np.zeros((len(locales), ventanas)),
+        "huecos_s": np.zeros(len(locales)),
+        "wh_huecos": np.zeros(len(locales)),
+        "muestras": np.zeros(len(locales), dtype=np.int64),
+    }
+    if len(muestras) == 0:
+        return resultado
+
+    orden_ids = np.asarray(dispositivos)
+    orden = np.argsort(orden_ids)
+    grupo_muestra = inverso[orden][np.searchsorted(orden_ids[orden], muestras["id"])]
+    np.add.at(resultado["muestras"], grupo_muestra, 1)
+
+    t = muestras["t"].astype(np.float64)
+    indices, wh, dt, hueco = integrar(muestras["id"], t, muestras["p"], muestras["e"])
+    grupo = grupo_muestra[indices]
+    t0 = t[indices]
+
+    # Franja de cada intervalo según la hora local de su inicio
+    local = t0 + offsets[((t0 - inicio) // 3600).astype(np.int64)]
+    dias = local // 86400
+    minuto = (((dias + 3) % 7) * 1440 + (local - dias * 86400) // 60).astype(np.int64)  # 1970-01-01 fue jueves
+    franja = tabla[minuto].astype(np.int64)
+    resultado["franjas"] = np.bincount(grupo * franjas + franja, weights=wh,
+                                       minlength=len(locales) * franjas).reshape(len(locales), franjas)
+
+    # La energía de un hueco no se puede ubicar en el tiempo: no cuenta para la demanda
+    continuo = ~hueco
+    ventana_indice = ((t0[continuo] - inicio) // ventana).astype(np.int64)
+    resultado["ventanas"] = np.bincount(grupo[continuo] * ventanas + ventana_indice, weights=wh[continuo],
+                                        minlength=len(locales) * ventanas).reshape(len(locales), ventanas)
+    resultado["huecos_s"] = np.bincount(grupo[hueco], weights=dt[hueco], minlength=len(locales))
+    resultado["wh_huecos"] = np.bincount(grupo[hueco], weights=wh[hueco], minlength=len(locales))
+    return resultado
+
+
+# ===========================
+# Reportes
+# ===========================
+def armar_reporte(tarifa: Dict[str, Any], mes: str, agrupar: str, inicio: float, fin: float,
+                  nombres: List[Tuple[int, str]], dispositivos_por_grupo: np.ndarray,
+                  franjas: np.ndarray, ventanas: np.ndarray, huecos_s: np.ndarray,
+                  wh_huecos: np.ndarray, muestras: np.ndarray) -> Dict[str, Any]:
+    """
+    Aplica la tarifa a los acumulados por grupo
+    """
+    precios = np.array([tarifa["precio_kwh"]] + [f["precio_kwh"] for f in tarifa["franjas"]])
+    nombres_franja = ["base"] + [f["nombre"] for f in tarifa["franjas"]]
+    ventana = tarifa["ventana_demanda_min"] * 60
+    kwh = franjas / 1000
+    costo_energia = kwh @ precios[:kwh.shape[1]]
+    demanda_kw = ventanas.max(axis=1, initial=0) / (ventana / 3600) / 1000 if ventanas.size else np.zeros(len(nombres))
+    pico = ventanas.argmax(axis=1) if ventanas.size else np.zeros(len(nombres), dtype=np.int64)
+    costo_demanda = demanda_kw * tarifa["cargo_demanda_kw"]
+    fijo = np.where(dispositivos_por_grupo > 0, tarifa["cargo_fijo"], 0.0)
+    costo_total = costo_energia + costo_demanda + fijo
+
+    grupos = []
+    for i, (grupo_id, nombre) in enumerate(nombres):
+        grupos.append({
+            "id": grupo_id,
+            "nombre": nombre,
+            "dispositivos": int(dispositivos_por_grupo[i]),
+            "kwh": round(float(kwh[i].sum()), 3),
+            "kwh_por_franja": {nombres_franja[j]: round(float(kwh[i, j]), 3) for j in range(kwh.shape[1])},
+            "demanda_kw": round(float(demanda_kw[i]), 3),
+            "demanda_instante": (datetime.fromtimestamp(inicio + int(pico[i]) * ventana, timezone.utc).isoformat()
+                                 if demanda_kw[i] > 0 else None),
+            "costo_energia": round(float(costo_energia[i]), 2),
+            "costo_demanda": round(float(costo_demanda[i]), 2),
+            "cargo_fijo": round(float(fijo[i]), 2),
+            "costo_total": round(float(costo_total[i]), 2),
+            "huecos_horas": round(float(huecos_s[i]) / 3600, 2),
+            "kwh_en_huecos": round(float(wh_huecos[i]) / 1000, 3),
+            "muestras": int(muestras[i]),
+        })
+    grupos.sort(key=lambda g: g["costo_total"], reverse=True)
+    return {
+        "mes": mes,
+        "agrupar": agrupar,
+        "tarifa": tarifa["nombre"],
+        "moneda": tarifa["moneda"],
+        "desde": datetime.fromtimestamp(inicio, timezone.utc).isoformat(),
+        "hasta": datetime.fromtimestamp(fin, timezone.utc).isoformat(),
+        "grupos": grupos,
+        "total": {
+            "kwh": round(float(kwh.sum()), 3),
+            "costo_total": round(float(costo_total.sum()), 2),
+        },
+    }
+
+
+class MotorFacturacion:
+    """
+    Trabajos de facturación en segundo plano, con un pool de procesos compartido y caché de resultados
+    """
+    def __init__(self, conectar: Callable[[], Any], procesos: int = PROCESOS):
+        """
+        Args:
+            conectar: Devuelve una conexión psycopg2 (para resolver los grupos)
+            procesos: Procesos del pool de cálculo
+        """
+        self.conectar = conectar
+        self.procesos = procesos
+        self.trabajos: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.cache: "OrderedDict[str, Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+        self.event_listeners: Dict[str, List[Callable]] = {'finalizado': []}
+        self._en_curso: Dict[str, str] = {}             # clave -> id del trabajo que la calcula
+        self._pool: Optional[Executor] = None
+        self._lock = Lock()
+
+    def add_event_listener(self, event_type: str, callback):
+        if event_type in self.event_listeners:
+            self.event_listeners[event_type].append(callback)
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for callback in self.event_listeners.get(event_type, []):
+            try:
+                callback(data)
+            except Exception as e:
+                logger.error(f"Error en listener {event_type}: {e}")
+
+    def _obtener_pool(self) -> Executor:
+        with self._lock:
+            if self._pool is None:
+                if modo_asincrono.hub_cooperativo():
+                    # Con eventlet no se hace fork: el hijo heredaría el hub y las green threads del padre
+                    self._pool = ThreadPoolExecutor(max_workers=self.procesos)
+                else:
+                    # fork: los procesos no vuelven a importar el módulo principal (app.py) al arrancar
+                    self._pool = ProcessPoolExecutor(max_workers=self.procesos,
+                                                     mp_context=multiprocessing.get_context("fork"))
+            return self._pool
+
+    # ===========================
+    # Trabajos
+    # ===========================
+    def solicitar(self, mes: str, agrupar: str, tarifa: Optional[Dict[str, Any]] = None,
+                  permitidas: Optional[Sequence[int]] = None, usuario_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Encola un reporte; si ya está en la caché o calculándose se reutiliza
+
+        Args:
+            permitidas: Si se indica, sólo se incluyen dispositivos de estas habitaciones
+
+        Raises:
+            ValueError: si la agrupación, el mes o la tarifa no son válidos
+        """
+        if agrupar not in AGRUPACIONES:
+            raise ValueError(f"agrupar debe ser uno de: {', '.join(AGRUPACIONES)}")
+        tarifa = validar_tarifa(tarifa)
+        inicio, fin = rango_mes(mes, tarifa["zona"])
+        if inicio > time.time():
+            raise ValueError("El mes todavía no empezó")
+        clave = hashlib.sha256(json_rapido.codificar({
+            "mes": mes, "agrupar": agrupar, "tarifa": tarifa,
+            "permitidas": sorted(permitidas) if permitidas is not None else None,
+        })).hexdigest()
+
+        with self._lock:
+            guardado = self.cache.get(clave)
+            if guardado is not None and (guardado[0] is None or guardado[0] > time.time()):
+                self.cache.move_to_end(clave)
+                return self._registrar(clave, usuario_id, estado="completado", resultado=guardado[1], cache=True)
+            if clave in self._en_curso:
+                return self._publico(self.trabajos[self._en_curso[clave]])
+            trabajo = self._registrar(clave, usuario_id, estado="pendiente")
+            self._en_curso[clave] = trabajo["id"]
+
+        Thread(target=self._ejecutar, args=(trabajo["id"], clave, mes, agrupar, tarifa, inicio, fin, permitidas),
+               daemon=True).start()
+        return self._publico(trabajo)
+
+    def _registrar(self, clave: str, usuario_id: Optional[int], **campos) -> Dict[str, Any]:
+        trabajo = dict({"id": uuid.uuid4().hex, "clave": clave, "usuario_id": usuario_id,
+                        "creado": time.time(), "terminado": None, "progreso": 0.0,
+                        "resultado": None, "error": None, "cache": False}, **campos)
+        self.trabajos[trabajo["id"]] = trabajo
+        while len(self.trabajos) > MAX_TRABAJOS:
+            self.trabajos.popitem(last=False)
+        return trabajo
+
+    @staticmethod
+    def _publico(trabajo: Dict[str, Any], resultado: bool = False) -> Dict[str, Any]:
+        datos = {c: v for c, v in trabajo.items() if c not in ("clave", "resultado")}
+        if resultado:
+            datos["resultado"] = trabajo["resultado"]
+        return datos
+
+    def trabajo(self, trabajo_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Estado del trabajo, con el reporte si terminó
+        """
+        trabajo = self.trabajos.get(trabajo_id)
+        return self._publico(trabajo, resultado=True) if trabajo else None
+
+    def _ejecutar(self, trabajo_id: str, clave: str, mes: str, agrupar: str, tarifa: Dict[str, Any],
+                  inicio: float, fin: float, permitidas: Optional[Sequence[int]]):
+        trabajo = self.trabajos[trabajo_id]
+        trabajo["estado"] = "ejecutando"
+        try:
+            reporte = self._calcular(trabajo, mes, agrupar, tarifa, inicio, fin, permitidas)
+            # Un mes cerrado no cambia; el mes en curso se recalcula pasado el TTL
+            expira = None if fin <= time.time() else time.time() + TTL_MES_EN_CURSO
+            with self._lock:
+                self.cache[clave] = (expira, reporte)
+                while len(self.cache) > MAX_REPORTES:
+                    self.cache.popitem(last=False)
+            trabajo.update(estado="completado", resultado=reporte, progreso=1.0)
+        except Exception as e:
+            logger.error(f"Error calculando el reporte de facturación {mes}/{agrupar}: {e}")
+            trabajo.update(estado="error", error=str(e))
+        finally:
+            trabajo["terminado"] = time.time()
+            with self._lock:
+                self._en_curso.pop(clave, None)
+        self._notify_listeners('finalizado', self._publico(trabajo))
+
+    def _calcular(self, trabajo: Dict[str, Any], mes: str, agrupar: str, tarifa: Dict[str, Any],
+                  inicio: float, fin: float, permitidas: Optional[Sequence[int]]) -> Dict[str, Any]:
+        conn = self.conectar()
+        try:
+            cursor = conn.cursor()
+            if permitidas is None:
+                cursor.execute(SQL_GRUPOS[agrupar] + " ORDER BY 2, 1")
+            else:
+                cursor.execute(SQL_GRUPOS[agrupar] + " WHERE h.id = ANY(%s) ORDER BY 2, 1", (list(permitidas),))
+            filas = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+
+        nombres: List[Tuple[int, str]] = []
+        indice_grupo: Dict[int, int] = {}
+        dispositivos, grupos = [], []
+        for dispositivo_id, grupo_id, nombre in filas:
+            if grupo_id not in indice_grupo:
+                indice_grupo[grupo_id] = len(nombres)
+                nombres.append((grupo_id, nombre))
+            dispositivos.append(dispositivo_id)
+            grupos.append(indice_grupo[grupo_id])
+
+        tabla = tabla_franjas(tarifa)
+        offsets = desplazamientos(inicio, fin, tarifa["zona"])
+        ventana = tarifa["ventana_demanda_min"] * 60
+        cantidad_franjas = len(tarifa["franjas"]) + 1
+        cantidad_ventanas = int(np.ceil((fin - inicio) / ventana))
+        franjas = np.zeros((len(nombres), cantidad_franjas))
+        ventanas = np.zeros((len(nombres), cantidad_ventanas))
+        huecos_s, wh_huecos = np.zeros(len(nombres)), np.zeros(len(nombres))
+        muestras = np.zeros(len(nombres), dtype=np.int64)
+
+        # Los dispositivos vienen ordenados por grupo: cada bloque toca pocos grupos
+        bloques = [(dispositivos[i:i + DISPOSITIVOS_POR_TAREA], grupos[i:i + DISPOSITIVOS_POR_TAREA])
+                   for i in range(0, len(dispositivos), DISPOSITIVOS_POR_TAREA)]
+        pool = self._obtener_pool()
+        calcular = calcular_bloque_cooperativo if isinstance(pool, ThreadPoolExecutor) else calcular_bloque
+        futuros = [pool.submit(calcular, ids, indices, inicio, fin, offsets, tabla, ventana)
+                   for ids, indices in bloques]
+        for terminados, futuro in enumerate(as_completed(futuros), start=1):
+            parcial = futuro.result()
+            filas_grupo = parcial["grupos"]
+            franjas[filas_grupo, :parcial["franjas"].shape[1]] += parcial["franjas"]
+            ventanas[filas_grupo] += parcial["ventanas"]
+            huecos_s[filas_grupo] += parcial["huecos_s"]
+            wh_huecos[filas_grupo] += parcial["wh_huecos"]
+            muestras[filas_grupo] += parcial["muestras"]
+            trabajo["progreso"] = round(terminados / len(futuros), 3)
+
+        dispositivos_por_grupo = np.bincount(np.asarray(grupos, dtype=np.int64), minlength=len(nombres))
+        return armar_reporte(tarifa, mes, agrupar, inicio, fin, nombres, dispositivos_por_grupo,
+                             franjas, ventanas, huecos_s, wh_huecos, muestras)
@@ -6,6 +6,7 @@ import BoltIcon from '@mui/icons-material/Bolt';
 import EditIcon from '@mui/icons-material/Edit';
 import DeleteIcon from '@mui/icons-material/Delete';
 import { formatearConsumo, getColorForConsumo, HabitacionConConsumo } from '../services/consumptionService';
+import { DispositivoDashboard } from './RoomDeviceMatrix';
 
 // Interfaz para Tablero
 export interface Tablero {
@@ -19,6 +20,7 @@ export interface Habitacion {
   nombre: string;
   tablero_id: number;
   orden?: number;
+  dispositivos?: DispositivoDashboard[];   // Los del árbol de /api/dashboard, se conservan al reordenar
 }
 
 interface DraggableRoomGridProps {
@@ -80,7 +82,8 @@ const DraggableRoomGrid: React.FC<DraggableRoomGridProps> = ({
       id: item.id,
       nombre: item.nombre,
       tablero_id: item.tablero_id,
-      orden: item.orden
+      orden: item.orden,
+      dispositivos: item.dispositivos
     }));
     
     onReorder(habitacionesActualizadas);
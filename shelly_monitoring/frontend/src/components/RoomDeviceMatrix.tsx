@@ -42,9 +42,54 @@ const modeloPrioridad: {[key: string]: number} = {
   'PROEM50': 8
 };
 
+// Dispositivo tal como llega en el árbol de /api/dashboard
+export interface DispositivoDashboard {
+  id: number;
+  nombre: string;
+  ip: string;
+  tipo: string;
+  habitacion_id: number;
+  ultimo_consumo?: number | null;
+  estado?: boolean | null;
+  orden?: number;
+}
+
+// Ordenar modelos según el orden personalizado
+const ordenarModelos = (dispositivos: Dispositivo[]): string[] => {
+  const tiposSet = new Set<string>();
+  dispositivos.forEach((d: Dispositivo) => {
+    if (d.tipo) tiposSet.add(d.tipo);
+  });
+  const modelos: string[] = Array.from(tiposSet);
+  modelos.sort((a, b) => {
+    const prioridadA = modeloPrioridad[a] || 999;
+    const prioridadB = modeloPrioridad[b] || 999;
+    return prioridadA - prioridadB;
+  });
+  return modelos;
+};
+
+// Convierte los dispositivos del dashboard y los registra en DeviceStateService;
+// lo que el servicio ya recibió en vivo tiene prioridad sobre la instantánea del árbol
+const desdeDashboard = (dispositivos: DispositivoDashboard[]): Dispositivo[] => {
+  const nuevos = dispositivos.filter(d => !DeviceStateService.getDeviceById(d.id));
+  if (nuevos.length > 0) {
+    DeviceStateService.updateDevicesCache(nuevos.map(({ ultimo_consumo, estado, ...d }) => ({
+      ...d,
+      estado: estado ? 1 : 0,
+      consumo: ultimo_consumo || 0,
+    })));
+  }
+  return dispositivos
+    .map(d => DeviceStateService.getDeviceById(d.id))
+    .filter((d): d is Dispositivo => d !== null);
+};
+
 interface RoomDeviceMatrixProps {
   habitacionId: number;
   editMode: boolean;
+  // Dispositivos de la habitación ya incluidos en /api/dashboard: evitan la consulta inicial
+  dispositivosIniciales?: DispositivoDashboard[];
   // Propiedades para renombrar y eliminar dispositivos
   onRenameDispositivo?: (id: number, newName: string) => Promise<void>;
   onDeleteDispositivo?: (id: number, type: string) => void;
@@ -53,6 +98,7 @@ interface RoomDeviceMatrixProps {
 const RoomDeviceMatrix: React.FC<RoomDeviceMatrixProps> = ({ 
   habitacionId, 
   editMode,
+  dispositivosIniciales,
   onRenameDispositivo,
   onDeleteDispositivo
 }) => {
@@ -79,6 +125,19 @@ const RoomDeviceMatrix: React.FC<RoomDeviceMatrixProps> = ({
   // Lista de modelos para filtrar
   const [todosModelos, setTodosModelos] = useState<string[]>([]);
   
+  // Muestra los dispositivos recibidos y actualiza la lista de modelos para los filtros
+  const mostrarDispositivos = useCallback((devices: Dispositivo[]) => {
+    setTodosModelos(ordenarModelos(devices));
+    
+    // Actualizar estado directamente
+    if (isMounted.current) {
+      console.log(`[${instanceId}] Recibidos ${devices.length} dispositivos`);
+      setDispositivos(devices);
+      setDispositivosFiltrados(devices); // Inicialmente sin filtros
+      setLoading(false);
+    }
+  }, [instanceId]);
+
   // Función para cargar dispositivos a través del DeviceStateService y consumptionService
   const cargarDispositivos = useCallback(async () => {
     if (!isMounted.current) return;
@@ -100,36 +159,14 @@ const RoomDeviceMatrix: React.FC<RoomDeviceMatrixProps> = ({
         };
       });
       
-      // Extraer modelos para filtros
-      const tiposSet = new Set<string>();
-      mergedDevices.forEach((d: Dispositivo) => {
-        if (d.tipo) tiposSet.add(d.tipo);
-      });
-      
-      // Ordenar modelos según el orden personalizado
-      const modelos: string[] = Array.from(tiposSet);
-      modelos.sort((a, b) => {
-        const prioridadA = modeloPrioridad[a] || 999;
-        const prioridadB = modeloPrioridad[b] || 999;
-        return prioridadA - prioridadB;
-      });
-      
-      setTodosModelos(modelos);
-      
-      // Actualizar estado directamente
-      if (isMounted.current) {
-        console.log(`[${instanceId}] Recibidos ${mergedDevices.length} dispositivos`);
-        setDispositivos(mergedDevices);
-        setDispositivosFiltrados(mergedDevices); // Inicialmente sin filtros
-        setLoading(false);
-      }
+      mostrarDispositivos(mergedDevices);
     } catch (error) {
       console.error(`[${instanceId}] Error al obtener dispositivos:`, error);
       if (isMounted.current) {
         setLoading(false);
       }
     }
-  }, [habitacionId, instanceId]);
+  }, [habitacionId, instanceId, mostrarDispositivos]);
 
   // Función para ordenar dispositivos - MODIFICADA para usar prioridad personalizada de modelos
   const ordenarDispositivos = useCallback((dispositivos: Dispositivo[], criterio: SortCriterion) => {
@@ -240,23 +277,7 @@ const RoomDeviceMatrix: React.FC<RoomDeviceMatrixProps> = ({
       if (roomDevices.length > 0) {
         console.log(`[${instanceId}] Actualizando desde evento devices:loaded: ${roomDevices.length} dispositivos`);
         setDispositivos(roomDevices);
-        
-        // Extraer modelos para filtros
-        const tiposSet = new Set<string>();
-        roomDevices.forEach((d: Dispositivo) => {
-          if (d.tipo) tiposSet.add(d.tipo);
-        });
-        
-        // Ordenar modelos según el orden personalizado
-        const modelos: string[] = Array.from(tiposSet);
-        modelos.sort((a, b) => {
-          const prioridadA = modeloPrioridad[a] || 999;
-          const prioridadB = modeloPrioridad[b] || 999;
-          return prioridadA - prioridadB;
-        });
-        
-        setTodosModelos(modelos);
-        
+        setTodosModelos(ordenarModelos(roomDevices));
         setLoading(false);
       }
     });
@@ -364,8 +385,12 @@ const RoomDeviceMatrix: React.FC<RoomDeviceMatrixProps> = ({
       });
     });
     
-    // Cargar datos iniciales
-    cargarDispositivos();
+    // Cargar datos iniciales: si vinieron en /api/dashboard no hace falta consultar la habitación
+    if (dispositivosIniciales) {
+      mostrarDispositivos(desdeDashboard(dispositivosIniciales));
+    } else {
+      cargarDispositivos();
+    }
 
     // Limpiar al desmontar
     return () => {
@@ -380,7 +405,7 @@ const RoomDeviceMatrix: React.FC<RoomDeviceMatrixProps> = ({
       unsubConsumptionUpdates(); // Dar de baja la suscripción a datos de consumo
       setLoadingDevices({});
     };
-  }, [habitacionId, editMode, cargarDispositivos, instanceId]);
+  }, [habitacionId, editMode, cargarDispositivos, mostrarDispositivos, dispositivosIniciales, instanceId]);
 
   // Aplicar filtros cuando cambien los criterios o los dispositivos
   useEffect(() => {
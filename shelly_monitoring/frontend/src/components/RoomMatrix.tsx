@@ -12,6 +12,7 @@ import {
 } from '../services/consumptionService';
 
 interface RoomMatrixProps {
+  // Habitaciones del tablero con sus `dispositivos` tal como llegan en /api/dashboard
   habitaciones: any[];
   editMode: boolean;
   roomMatrixView: boolean;
@@ -146,6 +147,7 @@ const RoomMatrix: React.FC<RoomMatrixProps> = ({
           <RoomDeviceMatrix 
             habitacionId={selectedHabitacion} 
             editMode={editMode}
+            dispositivosIniciales={habitaciones.find(h => h.id === selectedHabitacion)?.dispositivos}
             onRenameDispositivo={onRenameDispositivo}
             onDeleteDispositivo={onDeleteDispositivo}
           />
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { AppBar, IconButton, Box, Menu, MenuItem, CircularProgress, Typography, Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField } from '@mui/material';
 import EditIcon from '@mui/icons-material/Edit';
@@ -13,7 +13,8 @@ import TabManager from '../components/TabManager';
 import DeviceList from '../components/DeviceList';
 import DraggableTabManager from '../components/DraggableTabManager';
 import DraggableRoomGrid from '../components/DraggableRoomGrid';
-import { getHabitacionesByTablero, deleteTablero, deleteHabitacion, getTableros, getHabitaciones, updateTableroName, updateOrdenTableros, updateOrdenHabitaciones, renameHabitacion, cambiarTableroHabitacion, createTablero, createHabitacion, renameDispositivo, deleteDispositivo } from '../services/api';
+import { DispositivoDashboard } from '../components/RoomDeviceMatrix';
+import { deleteTablero, deleteHabitacion, getDashboard, updateTableroName, updateOrdenTableros, updateOrdenHabitaciones, renameHabitacion, cambiarTableroHabitacion, createTablero, createHabitacion, renameDispositivo, deleteDispositivo } from '../services/api';
 import { checkPermission, setAuthToken } from '../services/auth';
 
 // Estilos de barra de desplazamiento consistentes para toda la aplicación
@@ -39,6 +40,7 @@ interface Habitacion {
   tablero_id: number;
   orden?: number;
   consumo?: number;
+  dispositivos?: DispositivoDashboard[];
 }
 
 interface Tablero {
@@ -47,6 +49,13 @@ interface Tablero {
   orden?: number;
 }
 
+interface TableroDashboard extends Tablero {
+  habitaciones: Habitacion[];
+}
+
+const idsHabitaciones = (tablerosDashboard: TableroDashboard[]): number[] =>
+  tablerosDashboard.flatMap(tablero => tablero.habitaciones.map(hab => hab.id));
+
 interface DashboardProps {
   user: {
     permissions: string[];
@@ -59,6 +68,7 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
   const [selectedTab, setSelectedTab] = useState<number>(0);
   const [habitaciones, setHabitaciones] = useState<Habitacion[]>([]);
   const [tableros, setTableros] = useState<Tablero[]>([]);
+  const [tablerosDashboard, setTablerosDashboard] = useState<TableroDashboard[]>([]);
   const [editMode, setEditMode] = useState<boolean>(false);
   const [anchorEl, setAnchorEl] = useState<null | HTMLElement>(null);
   const [editMenuAnchorEl, setEditMenuAnchorEl] = useState<null | HTMLElement>(null);
@@ -107,140 +117,47 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
     }
   };
 
+  // Una sola petición trae tableros, habitaciones y dispositivos ya filtrados por permisos
+  // (para usuarios no-admin sólo vienen los tableros con alguna habitación permitida).
+  // Tras un cambio en la jerarquía se vuelve a pedir: se revalida por ETag y, si no cambió, el servidor responde 304
+  const cargarDashboard = useCallback(async (): Promise<TableroDashboard[]> => {
+    const arbol: TableroDashboard[] = (await getDashboard()).tableros;
+    setTablerosDashboard(arbol);
+    setTableros(arbol.map(({ habitaciones, ...tablero }) => tablero));
+    setTodasHabitacionesPermitidasIds(idsHabitaciones(arbol));
+    return arbol;
+  }, []);
+
   useEffect(() => {
     const token = localStorage.getItem('token');
     setAuthToken(token);
 
-    const fetchTableros = async () => {
+    const fetchDashboard = async () => {
       try {
-        // Primero cargamos todos los tableros
-        const allTableros = await getTableros();
-        
-        // Para administradores, mostrar todos los tableros sin filtrar
-        if (isAdmin) {
-          setTableros(allTableros);
-          setLoading(false);
-          return;
-        }
-        
-        // Para usuarios no-admin, filtramos los tableros basados en permisos
-        // 1. Obtener todas las habitaciones a las que el usuario tiene permiso
-        const habitacionesPermitidas = await getHabitaciones();
-        
-        // Si no hay habitaciones permitidas, no mostrar ningún tablero
-        if (!habitacionesPermitidas || habitacionesPermitidas.length === 0) {
-          console.log("Usuario sin habitaciones permitidas");
-          setTableros([]);
-          setLoading(false);
-          return;
-        }
-        
-        // 2. Crear un mapa de habitaciones permitidas por ID para búsqueda rápida
-        const habitacionesPermitidasMap = new Map();
-        habitacionesPermitidas.forEach((hab: Habitacion) => {
-          habitacionesPermitidasMap.set(hab.id, hab);
-        });
-        
-        // 3. Comprobar tablero por tablero cuáles tienen habitaciones permitidas
-        const tablerosConPermiso = [];
-        
-        for (const tablero of allTableros) {
-          const habitacionesTablero = await getHabitacionesByTablero(tablero.id);
-          
-          // Verificar si alguna habitación del tablero está en las permitidas
-          const tienePermiso = habitacionesTablero.some((hab: any) => 
-            habitacionesPermitidasMap.has(hab.id)
-          );
-          
-          if (tienePermiso) {
-            tablerosConPermiso.push(tablero);
-          }
-        }
-        
-        console.log("Tableros con permiso:", tablerosConPermiso.length);
-        console.log("Habitaciones permitidas:", habitacionesPermitidas.length);
-        
-        // 4. Actualizar estado con los tableros filtrados
-        setTableros(tablerosConPermiso);
-        
+        const arbol = await cargarDashboard();
+        console.log("Tableros con permiso:", arbol.length);
       } catch (error) {
-        console.error("Error fetching tableros:", error);
+        console.error("Error fetching dashboard:", error);
       } finally {
         setLoading(false);
       }
     };
 
-    fetchTableros();
-    
-    // Cargar todas las habitaciones permitidas al iniciar
-    const fetchTodasHabitacionesPermitidas = async () => {
-      try {
-        if (isAdmin) {
-          // Para administradores, obtener todas las habitaciones de todos los tableros
-          const allTableros = await getTableros();
-          let allHabitaciones: Habitacion[] = [];
-          
-          // Recopilamos todas las habitaciones de todos los tableros
-          for (const tablero of allTableros) {
-            const habitacionesTablero = await getHabitacionesByTablero(tablero.id);
-            allHabitaciones = [...allHabitaciones, ...habitacionesTablero];
-          }
-          
-          // Eliminar duplicados y obtener solo los IDs
-          const habitacionesIds = Array.from(new Set(allHabitaciones.map(hab => hab.id)));
-          console.log("Admin: Cargadas todas las habitaciones:", habitacionesIds.length);
-          setTodasHabitacionesPermitidasIds(habitacionesIds);
-        } else {
-          // Para usuarios normales, solo las habitaciones permitidas
-          const habitacionesPermitidas = await getHabitaciones();
-          const habitacionesIds = habitacionesPermitidas.map((hab: Habitacion) => hab.id);
-          console.log("Usuario: Cargadas habitaciones permitidas:", habitacionesIds.length);
-          setTodasHabitacionesPermitidasIds(habitacionesIds);
-        }
-      } catch (error) {
-        console.error("Error fetching todas las habitaciones permitidas:", error);
-      }
-    };
-
-    fetchTodasHabitacionesPermitidas();
-  }, [isAdmin]);
+    fetchDashboard();
+  }, [isAdmin, cargarDashboard]);
 
-  // Efecto para cargar habitaciones cuando cambia el tablero seleccionado
-  // Este efecto se ejecuta DESPUÉS de que se cambia el tablero seleccionado
+  // Efecto para mostrar las habitaciones cuando cambia el tablero seleccionado
+  // Salen del árbol ya cargado: cambiar de tablero no hace ninguna petición
   useEffect(() => {
     // Evitar ejecución inicial o cuando no hay tableros
     if (!tableros || tableros.length === 0 || selectedTab >= tableros.length) {
       return;
     }
     
-    const fetchHabitacionesPermitidas = async () => {
-      try {
-        // Obtener el ID del tablero seleccionado
-        const tableroId = tableros[selectedTab].id;
-        
-        // Cargar habitaciones del nuevo tablero
-        const habitacionesTablero = await getHabitacionesByTablero(tableroId);
-        
-        // Para administradores, mostrar todas las habitaciones del tablero
-        if (isAdmin) {
-          setHabitaciones(habitacionesTablero);
-        } else {
-          // Para usuarios normales, filtrar por permisos
-          const habitacionesPermitidas = await getHabitaciones();
-          const habitacionesFiltradas = habitacionesTablero.filter((hab: Habitacion) => 
-            habitacionesPermitidas.some((perm: Habitacion) => perm.id === hab.id)
-          );
-          
-          setHabitaciones(habitacionesFiltradas);
-        }
-      } catch (error) {
-        console.error("Error fetching habitaciones:", error);
-        setHabitaciones([]);
-      }
-    };
-
-    fetchHabitacionesPermitidas();
-  }, [selectedTab, tableros, isAdmin]);
+    const tableroId = tableros[selectedTab].id;
+    const tablero = tablerosDashboard.find(t => t.id === tableroId);
+    setHabitaciones(tablero ? tablero.habitaciones : []);
+  }, [selectedTab, tableros, tablerosDashboard]);
 
 
   const handleMenuClick = (event: React.MouseEvent<HTMLButtonElement>) => {
@@ -279,9 +196,9 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
         // Actualizar habitaciones localmente
         setHabitaciones(prevHabitaciones => prevHabitaciones.filter(hab => hab.id !== id));
       } else if (type === 'Tablero') {
-        // Verificar si el tablero tiene habitaciones
-        const habitacionesAsignadas = await getHabitacionesByTablero(id);
-        if (habitacionesAsignadas.length > 0) {
+        // Verificar si el tablero tiene habitaciones (con el árbol revalidado, no el de la carga inicial)
+        const tableroABorrar = (await cargarDashboard()).find(t => t.id === id);
+        if (tableroABorrar && tableroABorrar.habitaciones.length > 0) {
           setErrorMessage('Este tablero tiene habitaciones asignadas y no se puede borrar.');
           setErrorDialogOpen(true);
           setDeleteDialogOpen(false);
@@ -303,27 +220,8 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
       
       setDeleteDialogOpen(false);
       
-      // Actualizar la lista de habitaciones permitidas después de borrar
-      const fetchActualizarHabitaciones = async () => {
-        if (isAdmin) {
-          const allTableros = await getTableros();
-          let allHabitaciones: Habitacion[] = [];
-          
-          for (const tablero of allTableros) {
-            const habitacionesTablero = await getHabitacionesByTablero(tablero.id);
-            allHabitaciones = [...allHabitaciones, ...habitacionesTablero];
-          }
-          
-          const habitacionesIds = Array.from(new Set(allHabitaciones.map(hab => hab.id)));
-          setTodasHabitacionesPermitidasIds(habitacionesIds);
-        } else {
-          const habitacionesPermitidas = await getHabitaciones();
-          const habitacionesIds = habitacionesPermitidas.map((hab: Habitacion) => hab.id);
-          setTodasHabitacionesPermitidasIds(habitacionesIds);
-        }
-      };
-      
-      fetchActualizarHabitaciones();
+      // Actualizar el árbol y la lista de habitaciones permitidas después de borrar
+      await cargarDashboard();
       
     } catch (error: any) {
       console.error("Error deleting item:", error);
@@ -405,8 +303,7 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
       setErrorMessage('Error al reordenar los tableros. Por favor, inténtelo de nuevo.');
       setErrorDialogOpen(true);
       // Recargar tableros en caso de error
-      const data = await getTableros();
-      setTableros(data);
+      await cargarDashboard();
     }
   };
 
@@ -422,10 +319,11 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
       const response = await renameHabitacion(id, newName);
       console.log('Respuesta de API al renombrar habitación:', response);
       
-      // Actualizar localmente
+      // Actualizar localmente y luego el árbol, para que el cambio siga al volver a este tablero
       setHabitaciones(prev => prev.map(hab => 
         hab.id === id ? { ...hab, nombre: newName } : hab
       ));
+      await cargarDashboard();
     } catch (error: any) {
       console.error('Error renaming habitacion:', error);
       // Mostrar más detalles del error para diagnóstico
@@ -446,18 +344,15 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
       // Llamar a API para actualizar el orden
       await updateOrdenHabitaciones(ordenData);
       
-      // Actualizar el estado local
+      // Actualizar el estado local y luego el árbol
       setHabitaciones(newOrder);
+      await cargarDashboard();
     } catch (error) {
       console.error('Error reordering habitaciones:', error);
       setErrorMessage('Error al reordenar las habitaciones. Por favor, inténtelo de nuevo.');
       setErrorDialogOpen(true);
       // Recargar habitaciones en caso de error
-      if (tableros.length > 0 && selectedTab < tableros.length) {
-        const tableroId = tableros[selectedTab].id;
-        const habitacionesActualizadas = await getHabitacionesByTablero(tableroId);
-        setHabitaciones(habitacionesActualizadas);
-      }
+      await cargarDashboard();
     }
   };
 
@@ -466,12 +361,8 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
       console.log(`Intentando mover habitación ${habitacionId} al tablero ${tableroId}`);
       await cambiarTableroHabitacion(habitacionId, tableroId);
       
-      // Recargar habitaciones del tablero actual
-      if (tableros.length > 0 && selectedTab < tableros.length) {
-        const currentTableroId = tableros[selectedTab].id;
-        const habitacionesActualizadas = await getHabitacionesByTablero(currentTableroId);
-        setHabitaciones(habitacionesActualizadas);
-      }
+      // Recargar el árbol: la habitación sale del tablero actual y entra en el otro
+      await cargarDashboard();
     } catch (error: any) {
       console.error('Error changing tablero:', error);
       const errorDetails = error?.response?.data?.error || 'Error al mover la habitación a otro tablero. Por favor, inténtelo de nuevo.';
@@ -505,8 +396,8 @@ const Dashboard: React.FC<DashboardProps> = ({ user }) => {
         setTableros((prev) => [...prev, newTablero]);
       } else {
         const tableroId = tableros[selectedTab].id;
-        const newHabitacion = await createHabitacion(newItemName, tableroId);
-        setHabitaciones((prev) => [...prev, newHabitacion]);
+        await createHabitacion(newItemName, tableroId);
+        await cargarDashboard();
       }
       setAddDialogOpen(false);
     } catch (error) {
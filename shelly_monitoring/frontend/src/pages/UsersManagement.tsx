@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { createUser, getUsers, deleteUser, updateUserRole, getRooms, getUserPermissions, saveUserPermissions } from '../services/api';
+import { createUser, getUsers, deleteUser, updateUserRole, getRooms, saveUserPermissions, getUsersWithPermissions, saveUsersPermissions } from '../services/api';
 import { checkPermission } from '../services/auth';
 import { Box, TextField, Button, MenuItem, Typography, IconButton, Dialog, DialogTitle, DialogContent, DialogActions, FormControlLabel, Checkbox } from '@mui/material';
 import EditIcon from '@mui/icons-material/Edit';
@@ -60,33 +60,29 @@ const UsersManagement: React.FC<UsersManagementProps> = ({ user }) => {
   // Función para cargar usuarios con permisos actualizados
   const fetchUsers = async () => {
     try {
-      const fetchedUsers = await getUsers();
+      // Usuarios y habitaciones permitidas llegan juntos desde una única consulta agregada
+      const fetchedUsers = await getUsersWithPermissions();
       console.log('Fetched users:', fetchedUsers);
       
       // Obtener la lista actualizada de habitaciones para asegurar que tengamos todas
       const currentRooms = await fetchRooms();
       const roomIds = currentRooms.map(room => room.id);
+      const allRoomIds = new Set<number>(roomIds);
       
-      const usersWithPermissions = await Promise.all(
-        fetchedUsers.map(async (user: User) => {
-          const userPermissions = await getUserPermissions(user.id);
-          
-          // Si el usuario es admin, asegurarse que tenga acceso a todas las habitaciones
-          let permissions = userPermissions.room_ids;
-          if (user.role === 'admin') {
-            // Para administradores, asignar automáticamente todas las habitaciones
-            permissions = roomIds;
-            
-            // Actualizar los permisos en el backend si es necesario
-            if (JSON.stringify(userPermissions.room_ids.sort()) !== JSON.stringify(roomIds.sort())) {
-              console.log('Updating admin permissions to include all rooms');
-              await saveUserPermissions(user.id, roomIds);
-            }
-          }
-          
-          return { ...user, permissions };
-        })
+      // Los administradores deben tener acceso a todas las habitaciones
+      const adminsDesactualizados = fetchedUsers.filter((user: any) =>
+        user.role === 'admin' &&
+        (user.room_ids.length !== allRoomIds.size || user.room_ids.some((id: number) => !allRoomIds.has(id)))
       );
+      if (adminsDesactualizados.length > 0) {
+        console.log('Updating admin permissions to include all rooms');
+        await saveUsersPermissions(adminsDesactualizados.map((user: any) => ({ user_id: user.id, room_ids: roomIds })));
+      }
+      
+      const usersWithPermissions: User[] = fetchedUsers.map(({ room_ids, ...user }: any) => ({
+        ...user,
+        permissions: user.role === 'admin' ? roomIds : room_ids
+      }));
       
       // Ordenar los usuarios: admin primero y luego user, ambos alfabéticamente
       usersWithPermissions.sort((a, b) => {
@@ -232,12 +228,12 @@ const UsersManagement: React.FC<UsersManagementProps> = ({ user }) => {
       // Refrescar la lista de habitaciones antes de abrir el diálogo
       const currentRooms = await fetchRooms();
       
-      // Obtener permisos actuales del usuario
-      const userPermissions = await getUserPermissions(id);
-      console.log('User permissions:', userPermissions);
+      // Los permisos actuales ya vienen con la lista de usuarios
+      const roomIds = users.find(u => u.id === id)?.permissions ?? [];
+      console.log('User permissions:', roomIds);
       
-      setSelectedRooms(userPermissions.room_ids);
-      setSelectAll(userPermissions.room_ids.length === currentRooms.length);
+      setSelectedRooms(roomIds);
+      setSelectAll(roomIds.length === currentRooms.length);
       setDialogOpen(true);
     } catch (error) {
       console.error('Error fetching user permissions:', error);
@@ -93,6 +93,33 @@ export const renameDispositivo = async (id: number, nombre: string): Promise<any
   }
 };
 
+/**
+ * Solicita un reporte mensual de facturación; se calcula en segundo plano
+ * @param mes Mes en formato AAAA-MM
+ * @param agrupar 'habitacion' o 'tablero'
+ * @param tarifa Tarifa a aplicar (por defecto la configurada en el servidor)
+ */
+export const solicitarReporteFacturacion = async (mes: string, agrupar: 'habitacion' | 'tablero' = 'habitacion',
+                                                  tarifa?: Record<string, any>): Promise<any> => {
+  try {
+    const response = await api.post('/facturacion/reportes', { mes, agrupar, tarifa });
+    return response.data;
+  } catch (error) {
+    console.error('solicitarReporteFacturacion error:', error);
+    throw error;
+  }
+};
+
+export const getReporteFacturacion = async (trabajoId: string): Promise<any> => {
+  try {
+    const response = await api.get(`/facturacion/reportes/${trabajoId}`);
+    return response.data;
+  } catch (error) {
+    console.error('getReporteFacturacion error:', error);
+    throw error;
+  }
+};
+
 // Habitaciones
 export const getHabitaciones = async (): Promise<any> => {
   try {
@@ -178,6 +205,19 @@ export const updateOrdenDispositivos = async (dispositivos: { id: number; orden:
   }
 };
 
+// Dashboard: tableros → habitaciones → dispositivos filtrados por permisos en una sola petición.
+// El servidor responde con ETag, así que el navegador revalida con If-None-Match y reutiliza su copia (304).
+export const getDashboard = async (): Promise<any> => {
+  try {
+    const response = await api.get('/dashboard');
+    console.log('getDashboard response:', response);
+    return response.data;
+  } catch (error) {
+    console.error('getDashboard error:', error);
+    throw error;
+  }
+};
+
 // Tableros
 export const getTableros = async (): Promise<any> => {
   try {
@@ -294,6 +334,30 @@ export const startDiscovery = async (subredes: string[]): Promise<any> => {
   }
 };
 
+/**
+ * Crea un trabajo de descubrimiento repartido entre los agentes de escaneo de cada segmento
+ * El progreso llega también por Socket.IO en 'discovery_job'
+ */
+export const crearTrabajoDescubrimiento = async (subredes: string[], incremental = false): Promise<any> => {
+  try {
+    const response = await api.post('/descubrimiento/trabajos', { subredes, incremental });
+    return response.data;
+  } catch (error) {
+    console.error('crearTrabajoDescubrimiento error:', error);
+    throw error;
+  }
+};
+
+export const getTrabajoDescubrimiento = async (trabajoId: string): Promise<any> => {
+  try {
+    const response = await api.get(`/descubrimiento/trabajos/${trabajoId}`);
+    return response.data;
+  } catch (error) {
+    console.error('getTrabajoDescubrimiento error:', error);
+    throw error;
+  }
+};
+
 // Logs
 export const getLogs = async (): Promise<any> => {
   try {
@@ -390,6 +454,30 @@ export const saveUserPermissions = async (userId: number, roomIds: number[]): Pr
   }
 };
 
+// Obtener todos los usuarios con sus habitaciones permitidas (una sola petición)
+export const getUsersWithPermissions = async (): Promise<any> => {
+  try {
+    const response = await api.get('/usuarios/permisos');
+    console.log('getUsersWithPermissions response:', response);
+    return response.data;
+  } catch (error) {
+    console.error('getUsersWithPermissions error:', error);
+    throw error;
+  }
+};
+
+// Guardar los permisos de varios usuarios a la vez
+export const saveUsersPermissions = async (permisos: { user_id: number; room_ids: number[] }[]): Promise<any> => {
+  try {
+    const response = await api.put('/usuarios/permisos', permisos);
+    console.log('saveUsersPermissions response:', response);
+    return response.data;
+  } catch (error) {
+    console.error('saveUsersPermissions error:', error);
+    throw error;
+  }
+};
+
 // Agregar función de login
 export const loginUser = async (email: string, password: string): Promise<any> => {
   try {
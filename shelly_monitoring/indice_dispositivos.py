@@ -0,0 +1,468 @@
+"""
+Índice en memoria para buscar dispositivos sin recorrer la tabla.
+
+- Nombre: prefijos de 1 y 2 letras de cada palabra para el typeahead y
+  trigramas para subcadenas de 3 o más caracteres. Varias palabras se
+  intersectan como conjuntos y sólo se verifica el nombre de los candidatos
+  que hacen falta para llenar la página.
+- tipo, habitacion_id, online y estado: índices hash {valor: ids}.
+- IP: lista ordenada de IPs como enteros para filtrar por rango o CIDR.
+
+Los filtros se resuelven intersectando los conjuntos de candidatos, empezando
+por el más chico. Con muchos candidatos, el orden por `orden`, `nombre` o `id`
+recorre una lista ya ordenada (que sólo se rehace al agregar, quitar o renombrar
+dispositivos) hasta completar la página, en lugar de ordenarlos todos.
+
+El índice se mantiene al día con NOTIFY desde un trigger de Postgres (cualquier
+INSERT/UPDATE/DELETE en dispositivos, venga del ORM, de psycopg2 o de otro
+proceso) y con los eventos de los dispositivos (online/offline, estado, consumo).
+Cada cambio se publica a los listeners ('cargado', 'actualizado', 'eliminado')
+para que otras vistas en memoria (estadísticas) no necesiten su propio LISTEN.
+"""
+
+import bisect
+import heapq
+import ipaddress
+import logging
+import select
+import time
+import unicodedata
+from threading import RLock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import json_rapido
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del índice
+CANAL = "dispositivos"              # Canal de LISTEN/NOTIFY del trigger
+REINTENTO = 5.0                     # Segundos antes de reconectar el listener
+LIMITE = 50
+ORDENES = ("orden", "ultimo_consumo", "nombre", "id")
+ORDENES_FIJOS = ("orden", "nombre", "id")   # No cambian con los eventos: admiten lista preordenada
+UMBRAL_ORDEN_DIRECTO = 2000         # Con menos candidatos se ordenan directamente
+
+# Sentencias para MIGRACIONES: notifican cada cambio de la tabla con la fila completa
+TRIGGER_SQL = [
+    "CREATE OR REPLACE FUNCTION notificar_dispositivo() RETURNS trigger AS $$ "
+    "BEGIN "
+    "  IF TG_OP = 'DELETE' THEN "
+    "    PERFORM pg_notify('" + CANAL + "', CAST(json_build_object('op', TG_OP, 'fila', row_to_json(OLD)) AS text)); "
+    "    RETURN OLD; "
+    "  END IF; "
+    "  PERFORM pg_notify('" + CANAL + "', CAST(json_build_object('op', TG_OP, 'fila', row_to_json(NEW)) AS text)); "
+    "  RETURN NEW; "
+    "END; $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS dispositivos_notificar ON dispositivos",
+    "CREATE TRIGGER dispositivos_notificar AFTER INSERT OR UPDATE OR DELETE ON dispositivos "
+    "FOR EACH ROW EXECUTE FUNCTION notificar_dispositivo()",
+]
+
+
+def normalizar(texto: str) -> str:
+    """
+    Minúsculas y sin acentos, para que 'Salón' coincida con 'salon'
+    """
+    descompuesto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+
+def _trigramas(texto: str) -> Set[str]:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _prefijos(texto: str) -> Set[str]:
+    return {palabra[:n] for palabra in texto.split() for n in (1, 2)}
+
+
+def _ip_entero(ip: Optional[str]) -> Optional[int]:
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except (ipaddress.AddressValueError, ValueError, TypeError):
+        return None
+
+
+def rango_ip(filtro: str) -> Tuple[int, int]:
+    """
+    Convierte '10.0.1.0/24', '10.0.1.10-10.0.1.50' o una IP en un rango [desde, hasta] de enteros
+
+    Raises:
+        ValueError: si el filtro no es válido
+    """
+    try:
+        if "/" in filtro:
+            red = ipaddress.IPv4Network(filtro, strict=False)
+            return int(red.network_address), int(red.broadcast_address)
+        if "-" in filtro:
+            desde, hasta = (int(ipaddress.IPv4Address(p.strip())) for p in filtro.split("-", 1))
+            return min(desde, hasta), max(desde, hasta)
+        ip = int(ipaddress.IPv4Address(filtro.strip()))
+        return ip, ip
+    except ValueError:
+        raise ValueError(f"Rango de IP inválido: {filtro}")
+
+
+class IndiceDispositivos:
+    """
+    Índices de búsqueda sobre la tabla dispositivos
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self.event_listeners = []
+        self._online_pendiente: Dict[str, bool] = {}              # ip -> online visto antes de cargar la fila
+        self._vaciar()
+
+    def _vaciar(self):
+        self.dispositivos: Dict[int, Dict[str, Any]] = {}
+        self._prefijos: Dict[str, Set[int]] = {}                  # prefijo de 1-2 letras -> ids
+        self._trigramas: Dict[str, Set[int]] = {}
+        self._hash: Dict[str, Dict[Any, Set[int]]] = {"tipo": {}, "habitacion_id": {}, "online": {}, "estado": {}}
+        self._ips: List[Tuple[int, int]] = []                      # (ip, id) ordenado
+        self._por_ip: Dict[str, int] = {}
+        self._ordenados: Dict[str, List[int]] = {}                 # orden fijo -> ids ordenados
+
+    def add_event_listener(self, event_type: str, callback):
+        """
+        Agrega un listener para cambios del índice ('cargado', 'actualizado', 'eliminado')
+
+        Los callbacks se llaman con el lock tomado: deben ser rápidos y no consultar el índice.
+        """
+        self.event_listeners.append((event_type, callback))
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for listener_type, callback in self.event_listeners:
+            if listener_type == event_type:
+                try:
+                    callback(data)
+                except Exception as e:
+                    logger.error(f"Error en event listener: {e}")
+
+    # ===========================
+    # Mantenimiento
+    # ===========================
+    def cargar(self, filas: Iterable[Dict[str, Any]]):
+        """
+        Reconstruye el índice completo a partir de las filas de la tabla
+        """
+        with self._lock:
+            online = {i: d.get("online") for i, d in self.dispositivos.items()}
+            self._vaciar()
+            for fila in filas:
+                self._insertar(dict(fila, online=online.get(fila["id"], self._online_pendiente.get(fila.get("ip")))),
+                               ordenado=False)
+            # En la carga completa se ordena una vez en lugar de insertar ordenado fila por fila
+            self._ips.sort()
+            self._notify_listeners('cargado', list(self.dispositivos.values()))
+
+    def actualizar(self, fila: Dict[str, Any]):
+        """
+        Inserta o reemplaza un dispositivo (fila de la tabla)
+        """
+        with self._lock:
+            anterior = self.dispositivos.get(fila["id"])
+            if anterior is not None and all(anterior.get(c) == fila.get(c) for c in ("nombre", "ip", "orden")):
+                # Lo habitual (estado, consumo): basta con los índices hash
+                self._cambiar(anterior, {c: v for c, v in fila.items() if c != "online"})
+            else:
+                if anterior is not None:
+                    self._quitar(anterior)
+                self._insertar(dict(fila, online=anterior.get("online") if anterior else None))
+            self._notify_listeners('actualizado', self.dispositivos[fila["id"]])
+
+    def eliminar(self, dispositivo_id: int):
+        with self._lock:
+            anterior = self.dispositivos.get(dispositivo_id)
+            if anterior is not None:
+                self._quitar(anterior)
+                self._notify_listeners('eliminado', dispositivo_id)
+
+    def actualizar_vivo(self, ip: Optional[str], **valores):
+        """
+        Actualiza online, estado o ultimo_consumo a partir de eventos, sin pasar por la base
+        """
+        with self._lock:
+            dispositivo_id = self._por_ip.get(ip)
+            if dispositivo_id is None:
+                # Eventos previos a la carga (p. ej. al restaurar una instantánea): se aplican al cargar la fila
+                if ip and valores.get("online") is not None:
+                    self._online_pendiente[ip] = valores["online"]
+                return
+            dispositivo = self.dispositivos[dispositivo_id]
+            if self._cambiar(dispositivo, {c: v for c, v in valores.items() if v is not None}):
+                self._notify_listeners('actualizado', dispositivo)
+
+    def _cambiar(self, dispositivo: Dict[str, Any], valores: Dict[str, Any]) -> bool:
+        cambio = False
+        for campo, valor in valores.items():
+            if dispositivo.get(campo) == valor:
+                continue
+            if campo in self._hash:
+                self._hash_quitar(campo, dispositivo.get(campo), dispositivo["id"])
+                self._hash[campo].setdefault(valor, set()).add(dispositivo["id"])
+            dispositivo[campo] = valor
+            cambio = True
+        return cambio
+
+    def _insertar(self, dispositivo: Dict[str, Any], ordenado: bool = True):
+        dispositivo_id = dispositivo["id"]
+        agregar = bisect.insort if ordenado else list.append
+        pendiente = self._online_pendiente.pop(dispositivo.get("ip"), None)
+        if dispositivo.get("online") is None and pendiente is not None:
+            dispositivo["online"] = pendiente
+        dispositivo["_nombre"] = normalizar(dispositivo.get("nombre"))
+        dispositivo["_ip"] = _ip_entero(dispositivo.get("ip"))
+        self.dispositivos[dispositivo_id] = dispositivo
+        for prefijo in _prefijos(dispositivo["_nombre"]):
+            self._prefijos.setdefault(prefijo, set()).add(dispositivo_id)
+        for trigrama in _trigramas(dispositivo["_nombre"]):
+            self._trigramas.setdefault(trigrama, set()).add(dispositivo_id)
+        for campo, indice in self._hash.items():
+            indice.setdefault(dispositivo.get(campo), set()).add(dispositivo_id)
+        if dispositivo["_ip"] is not None:
+            agregar(self._ips, (dispositivo["_ip"], dispositivo_id))
+        if dispositivo.get("ip"):
+            self._por_ip[dispositivo["ip"]] = dispositivo_id
+        self._ordenados.clear()
+
+    def _quitar(self, dispositivo: Dict[str, Any]):
+        dispositivo_id = dispositivo["id"]
+        del self.dispositivos[dispositivo_id]
+        for prefijo in _prefijos(dispositivo["_nombre"]):
+            ids = self._prefijos.get(prefijo)
+            if ids is not None:
+                ids.discard(dispositivo_id)
+                if not ids:
+                    del self._prefijos[prefijo]
+        for trigrama in _trigramas(dispositivo["_nombre"]):
+            ids = self._trigramas.get(trigrama)
+            if ids is not None:
+                ids.discard(dispositivo_id)
+                if not ids:
+                    del self._trigramas[trigrama]
+        for campo in self._hash:
+            self._hash_quitar(campo, dispositivo.get(campo), dispositivo_id)
+        if dispositivo["_ip"] is not None:
+            i = bisect.bisect_left(self._ips, (dispositivo["_ip"], dispositivo_id))
+            if i < len(self._ips) and self._ips[i] == (dispositivo["_ip"], dispositivo_id):
+                del self._ips[i]
+        if self._por_ip.get(dispositivo.get("ip")) == dispositivo_id:
+            del self._por_ip[dispositivo["ip"]]
+        self._ordenados.clear()
+
+    def _hash_quitar(self, campo: str, valor: Any, dispositivo_id: int):
+        ids = self._hash[campo].get(valor)
+        if ids is not None:
+            ids.discard(dispositivo_id)
+            if not ids:
+                del self._hash[campo][valor]
+
+    # ===========================
+    # Búsqueda
+    # ===========================
+    def _por_texto(self, texto: str) -> Tuple[Set[int], List[str]]:
+        """
+        Candidatos por nombre y subcadenas que todavía hay que verificar sobre el nombre
+
+        Los conjuntos se intersectan sin recorrer nombres; la verificación de las
+        subcadenas de más de 3 letras (los trigramas pueden aparecer separados) se
+        deja para cuando se arma la página, así no se paga por candidatos que no se muestran.
+        """
+        conjuntos = []
+        verificar = []
+        for termino in normalizar(texto).split():
+            if len(termino) >= 3:
+                conjuntos.extend(self._trigramas.get(t, set()) for t in _trigramas(termino))
+                if len(termino) > 3:
+                    verificar.append(termino)
+            else:
+                # Términos cortos: prefijo de alguna palabra del nombre
+                conjuntos.append(self._prefijos.get(termino, set()))
+        if not conjuntos:
+            return set(self.dispositivos), []
+        conjuntos.sort(key=len)
+        ids = conjuntos[0].intersection(*conjuntos[1:]) if len(conjuntos) > 1 else conjuntos[0]
+        return ids, verificar
+
+    def _por_ip_rango(self, desde: int, hasta: int) -> Set[int]:
+        inicio = bisect.bisect_left(self._ips, (desde, -1))
+        fin = bisect.bisect_right(self._ips, (hasta, float("inf")))
+        return {dispositivo_id for _, dispositivo_id in self._ips[inicio:fin]}
+
+    def _ordenado(self, orden: str, clave: Callable[[int], Tuple]) -> List[int]:
+        ids = self._ordenados.get(orden)
+        if ids is None:
+            ids = self._ordenados[orden] = sorted(self.dispositivos, key=clave)
+        return ids
+
+    def _clave_orden(self, orden: str) -> Callable[[int], Tuple]:
+        dispositivos = self.dispositivos
+        if orden == "nombre":
+            return lambda i: (dispositivos[i]["_nombre"], i)
+        if orden == "id":
+            return lambda i: (i,)
+        return lambda i: (dispositivos[i].get(orden) or 0, i)
+
+    def buscar(self, texto: Optional[str] = None, tipo: Optional[str] = None,
+               habitacion_id: Optional[int] = None, online: Optional[bool] = None,
+               estado: Optional[bool] = None, ip: Optional[str] = None,
+               habitaciones: Optional[Set[int]] = None, orden: str = "orden", descendente: bool = False,
+               limite: int = LIMITE, cursor: Optional[Tuple] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple]]:
+        """
+        Busca dispositivos combinando filtros
+
+        Args:
+            texto: Palabras del nombre (prefijo si tienen menos de 3 letras, subcadena si no)
+            tipo, habitacion_id, online, estado: Valores exactos
+            ip: IP, rango 'a-b' o CIDR
+            habitaciones: Restringe a estas habitaciones (permisos del usuario)
+            orden: Uno de ORDENES
+            descendente: Orden inverso
+            limite: Resultados por página
+            cursor: Clave de orden del último resultado de la página anterior
+
+        Returns:
+            (dispositivos, cursor de la página siguiente o None)
+
+        Raises:
+            ValueError: si el orden o el rango de IP no son válidos
+        """
+        if orden not in ORDENES:
+            raise ValueError(f"orden debe ser uno de: {', '.join(ORDENES)}")
+        rango = rango_ip(ip) if ip else None
+
+        with self._lock:
+            conjuntos = []
+            for campo, valor in (("tipo", tipo), ("habitacion_id", habitacion_id), ("online", online), ("estado", estado)):
+                if valor is not None:
+                    conjuntos.append(self._hash[campo].get(valor, set()))
+            if habitaciones is not None:
+                conjuntos.append(set().union(*(self._hash["habitacion_id"].get(h, set()) for h in habitaciones)))
+            if rango is not None:
+                conjuntos.append(self._por_ip_rango(*rango))
+            coincide = None
+            if texto and texto.strip():
+                ids, verificar = self._por_texto(texto)
+                conjuntos.append(ids)
+                if verificar:
+                    dispositivos = self.dispositivos
+
+                    def coincide(i: int) -> bool:
+                        nombre = dispositivos[i]["_nombre"]
+                        for termino in verificar:
+                            if termino not in nombre:
+                                return False
+                        return True
+
+            # Se parte del conjunto más chico; sin filtros, todos
+            conjuntos.sort(key=len)
+            if conjuntos:
+                candidatos = conjuntos[0]
+                for otro in conjuntos[1:]:
+                    candidatos = candidatos & otro
+                    if not candidatos:
+                        break
+                filtrado = True
+            else:
+                candidatos = self.dispositivos.keys()
+                filtrado = False
+
+            clave = self._clave_orden(orden)
+            if cursor is not None:
+                cursor = tuple(cursor)
+                despues = (lambda i: clave(i) < cursor) if descendente else (lambda i: clave(i) > cursor)
+            else:
+                despues = None
+
+            if orden in ORDENES_FIJOS and len(candidatos) > UMBRAL_ORDEN_DIRECTO:
+                # Muchos candidatos: se recorre la lista ya ordenada hasta completar la página
+                ordenados = self._ordenado(orden, clave)
+                if descendente:
+                    fin = bisect.bisect_left(ordenados, cursor, key=clave) if cursor is not None else len(ordenados)
+                    recorrido = (ordenados[j] for j in range(fin - 1, -1, -1))
+                else:
+                    inicio = bisect.bisect_right(ordenados, cursor, key=clave) if cursor is not None else 0
+                    recorrido = (ordenados[j] for j in range(inicio, len(ordenados)))
+                pagina = []
+                for i in recorrido:
+                    if (not filtrado or i in candidatos) and (coincide is None or coincide(i)):
+                        pagina.append(i)
+                        if len(pagina) > limite:
+                            break
+            else:
+                seleccion = candidatos if coincide is None else [i for i in candidatos if coincide(i)]
+                seleccion = [i for i in seleccion if despues(i)] if despues is not None else list(seleccion)
+                if len(seleccion) <= UMBRAL_ORDEN_DIRECTO:
+                    pagina = sorted(seleccion, key=clave, reverse=descendente)[:limite + 1]
+                elif descendente:
+                    pagina = heapq.nlargest(limite + 1, seleccion, key=clave)
+                else:
+                    pagina = heapq.nsmallest(limite + 1, seleccion, key=clave)
+
+            siguiente = clave(pagina[limite - 1]) if len(pagina) > limite else None
+            resultados = [
+                {c: v for c, v in self.dispositivos[i].items() if not c.startswith("_")}
+                for i in pagina[:limite]
+            ]
+        return resultados, siguiente
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "dispositivos": len(self.dispositivos),
+                "prefijos": len(self._prefijos),
+                "trigramas": len(self._trigramas),
+                "tipos": len(self._hash["tipo"]),
+            }
+
+    # ===========================
+    # Sincronización con Postgres
+    # ===========================
+    def iniciar(self, conectar: Callable[[], Any], cargar: Callable[[], List[Dict[str, Any]]]):
+        """
+        Carga el índice y escucha los NOTIFY del trigger de la tabla dispositivos
+
+        Args:
+            conectar: Devuelve una conexión psycopg2 (se usa en autocommit para LISTEN)
+            cargar: Devuelve todas las filas de la tabla
+        """
+        def escuchar():
+            while True:
+                conn = None
+                try:
+                    conn = conectar()
+                    conn.autocommit = True
+                    cursor = conn.cursor()
+                    cursor.execute(f"LISTEN {CANAL}")
+                    # Se recarga después de LISTEN para no perder cambios entre la carga y la escucha
+                    inicio = time.perf_counter()
+                    self.cargar(cargar())
+                    logger.info(f"Índice de dispositivos cargado: {len(self.dispositivos)} dispositivos "
+                                f"en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+                    while True:
+                        if select.select([conn], [], [], 60) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self._aplicar(conn.notifies.pop(0).payload)
+                except Exception as e:
+                    logger.error(f"Error en la sincronización del índice de dispositivos: {e}")
+                finally:
+                    if conn is not None:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                time.sleep(REINTENTO)
+
+        thread = Thread(target=escuchar, daemon=True)
+        thread.start()
+
+    def _aplicar(self, payload: str):
+        try:
+            cambio = json_rapido.decodificar(payload)
+            if cambio["op"] == "DELETE":
+                self.eliminar(cambio["fila"]["id"])
+            else:
+                self.actualizar(cambio["fila"])
+        except Exception as e:
+            logger.error(f"NOTIFY de dispositivos inválido: {e}")
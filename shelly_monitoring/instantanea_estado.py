@@ -0,0 +1,205 @@
+"""
+Instantáneas del estado en memoria para arrancar en caliente.
+
+Cada componente registra cómo exportar e importar su estado (último estado de
+cada dispositivo, salud, historial de potencia, versión de la caché de la
+jerarquía). Periódicamente y al salir se escribe todo en un único archivo local:
+se escribe a un temporal, fsync y os.replace, así que un corte nunca deja una
+instantánea a medias.
+
+Formato (little endian):
+    cabecera  4s magia | H formato | H secciones | I crc32 | d guardado | Q largo del directorio
+    directorio JSON {nombre: [desplazamiento, largo, "json" | "bin"]}
+    secciones alineadas a 8 bytes (el crc32 cubre directorio y secciones)
+
+Las secciones binarias (matrices float32) quedan alineadas para leerse
+directamente del archivo mapeado en memoria.
+"""
+
+import atexit
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import json_rapido
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración de las instantáneas
+INTERVALO_GUARDADO = 60         # Segundos entre instantáneas
+MAX_EDAD = 6 * 3600             # Instantáneas más viejas se descartan al arrancar
+MAGIA = b"SHIE"
+FORMATO = 1
+CABECERA = struct.Struct("<4sHHIdQ")
+ALINEACION = 8
+
+
+def _alinear(n: int) -> int:
+    return (n + ALINEACION - 1) // ALINEACION * ALINEACION
+
+
+class InstantaneaEstado:
+    """
+    Guarda y restaura el estado de los componentes registrados
+    """
+    def __init__(self, ruta: str, intervalo: float = INTERVALO_GUARDADO, max_edad: float = MAX_EDAD):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.max_edad = max_edad
+        self.componentes: Dict[str, Tuple[Callable[[], Any], Callable[[Any], Any]]] = {}
+        self.ultimo_guardado: Optional[float] = None
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def registrar(self, nombre: str, exportar: Callable[[], Any], importar: Callable[[Any], Any]):
+        """
+        Registra un componente
+
+        Args:
+            nombre: Nombre de la sección
+            exportar: Devuelve el estado (serializable a JSON, o bytes para una sección binaria)
+            importar: Recibe lo que devolvió exportar en la ejecución anterior
+        """
+        self.componentes[nombre] = (exportar, importar)
+
+    # ===========================
+    # Escritura
+    # ===========================
+    def guardar(self) -> Optional[int]:
+        """
+        Escribe la instantánea de forma atómica
+
+        Returns:
+            Tamaño en bytes o None si no se pudo escribir
+        """
+        with self._lock:
+            secciones = []
+            for nombre, (exportar, _) in self.componentes.items():
+                try:
+                    datos = exportar()
+                except Exception as e:
+                    logger.error(f"Error exportando '{nombre}' para la instantánea: {e}")
+                    continue
+                if isinstance(datos, (bytes, bytearray, memoryview)):
+                    secciones.append((nombre, "bin", bytes(datos)))
+                else:
+                    secciones.append((nombre, "json", json_rapido.codificar(datos)))
+
+            directorio, desplazamiento = {}, 0
+            for nombre, tipo, cuerpo in secciones:
+                directorio[nombre] = [desplazamiento, len(cuerpo), tipo]
+                desplazamiento = _alinear(desplazamiento + len(cuerpo))
+            indice = json_rapido.codificar(directorio)
+            indice += b" " * (_alinear(CABECERA.size + len(indice)) - CABECERA.size - len(indice))
+
+            contenido = bytearray(indice)
+            for nombre, _, cuerpo in secciones:
+                contenido += cuerpo
+                contenido += b"\0" * (_alinear(CABECERA.size + len(contenido)) - CABECERA.size - len(contenido))
+            guardado = time.time()
+            cabecera = CABECERA.pack(MAGIA, FORMATO, len(secciones), zlib.crc32(contenido), guardado, len(indice))
+
+            temporal = f"{self.ruta}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+                with open(temporal, "wb") as f:
+                    f.write(cabecera)
+                    f.write(contenido)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporal, self.ruta)
+                directorio_fd = os.open(os.path.dirname(self.ruta) or ".", os.O_RDONLY)
+                try:
+                    os.fsync(directorio_fd)
+                finally:
+                    os.close(directorio_fd)
+            except OSError as e:
+                logger.error(f"No se pudo guardar la instantánea {self.ruta}: {e}")
+                try:
+                    os.unlink(temporal)
+                except OSError:
+                    pass
+                return None
+            self.ultimo_guardado = guardado
+            return CABECERA.size + len(contenido)
+
+    # ===========================
+    # Lectura
+    # ===========================
+    def leer(self) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """
+        Lee la instantánea del disco
+
+        Returns:
+            (instante de guardado, {sección: datos}) o None si no hay una válida y reciente
+        """
+        try:
+            with open(self.ruta, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if len(mm) < CABECERA.size:
+                    raise ValueError("archivo truncado")
+                magia, formato, _, crc, guardado, largo_indice = CABECERA.unpack_from(mm)
+                if magia != MAGIA or formato != FORMATO:
+                    raise ValueError("formato desconocido")
+                vista = memoryview(mm)
+                try:
+                    if zlib.crc32(vista[CABECERA.size:]) != crc:
+                        raise ValueError("crc inválido")
+                finally:
+                    vista.release()
+                if time.time() - guardado > self.max_edad:
+                    logger.info(f"Instantánea {self.ruta} descartada por antigua")
+                    return None
+                inicio = CABECERA.size + largo_indice
+                secciones = {}
+                for nombre, (desplazamiento, largo, tipo) in json_rapido.decodificar(
+                        mm[CABECERA.size:inicio]).items():
+                    cuerpo = mm[inicio + desplazamiento:inicio + desplazamiento + largo]
+                    secciones[nombre] = cuerpo if tipo == "bin" else json_rapido.decodificar(cuerpo)
+                return guardado, secciones
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Instantánea {self.ruta} inválida, se arranca en frío: {e}")
+            return None
+
+    def restaurar(self) -> List[str]:
+        """
+        Entrega a cada componente registrado su sección de la última instantánea
+
+        Returns:
+            Nombres de las secciones restauradas
+        """
+        leida = self.leer()
+        if leida is None:
+            return []
+        guardado, secciones = leida
+        restauradas = []
+        for nombre, (_, importar) in self.componentes.items():
+            if nombre not in secciones:
+                continue
+            try:
+                importar(secciones[nombre])
+                restauradas.append(nombre)
+            except Exception as e:
+                logger.error(f"Error restaurando '{nombre}' de la instantánea: {e}")
+        logger.info(f"Instantánea de hace {time.time() - guardado:.0f} s restaurada: {', '.join(restauradas)}")
+        return restauradas
+
+    def iniciar(self):
+        """
+        Lanza el guardado periódico y guarda una última vez al salir
+        """
+        def bucle():
+            while True:
+                time.sleep(self.intervalo)
+                self.guardar()
+
+        if self._thread is None:
+            self._thread = Thread(target=bucle, daemon=True)
+            self._thread.start()
+            atexit.register(self.guardar)
@@ -0,0 +1,109 @@
+"""
+Serialización JSON rápida y respuestas de listas en streaming.
+
+- ProveedorJSON reemplaza el proveedor JSON de Flask: usa orjson si está
+  instalado (dependencia opcional) y si no la librería estándar con separadores
+  compactos. Los tipos que Flask sabe serializar (fechas, Decimal, UUID...) se
+  codifican igual que con el proveedor por defecto.
+- iterar_lista() codifica una colección por lotes y la entrega en chunks, sin
+  armar la lista completa de diccionarios ni el cuerpo entero en memoria.
+- codificar_cursor()/decodificar_cursor() implementan cursores opacos para la
+  paginación por clave (keyset) de los endpoints de listas.
+"""
+
+import base64
+import json
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 📌 Configuración
+LOTE = 500                      # Elementos codificados por chunk en las respuestas en streaming
+
+
+def _por_defecto(obj: Any) -> Any:
+    return DefaultJSONProvider.default(obj)
+
+
+if orjson is not None:
+    _OPCIONES = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def codificar(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_por_defecto, option=_OPCIONES)
+else:
+    def codificar(obj: Any) -> bytes:
+        return json.dumps(obj, default=_por_defecto, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def decodificar(datos) -> Any:
+    if orjson is not None:
+        return orjson.loads(datos)
+    return json.loads(datos)
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    """
+    Proveedor JSON de Flask respaldado por orjson (o json compacto si no está disponible)
+    """
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return codificar(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return decodificar(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        # Se escriben directamente los bytes codificados, sin pasar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(codificar(obj) + b"\n", mimetype=self.mimetype)
+
+
+def iterar_lista(elementos: Iterable[Any], serializar: Optional[Callable[[Any], Any]] = None,
+                 lote: int = LOTE) -> Iterator[bytes]:
+    """
+    Genera un array JSON en chunks a partir de un iterable
+
+    Args:
+        elementos: Filas o diccionarios (p. ej. una consulta con yield_per)
+        serializar: Convierte cada elemento en un objeto serializable
+        lote: Elementos por chunk
+    """
+    yield b"["
+    primero = True
+    pendientes = []
+    for elemento in elementos:
+        pendientes.append(serializar(elemento) if serializar else elemento)
+        if len(pendientes) >= lote:
+            # Un lote se codifica en una sola llamada y se le quitan los corchetes
+            yield (b"" if primero else b",") + codificar(pendientes)[1:-1]
+            primero = False
+            pendientes = []
+    if pendientes:
+        yield (b"" if primero else b",") + codificar(pendientes)[1:-1]
+    yield b"]\n"
+
+
+def codificar_cursor(clave: Tuple[Any, ...]) -> str:
+    """
+    Cursor opaco a partir de la clave de orden del último elemento devuelto
+    """
+    return base64.urlsafe_b64encode(codificar(list(clave))).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[Any, ...]:
+    """
+    Raises:
+        ValueError: si el cursor no es válido
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        clave = decodificar(base64.urlsafe_b64decode(cursor + relleno))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(clave, list) or not clave:
+        raise ValueError("Cursor inválido")
+    return tuple(clave)
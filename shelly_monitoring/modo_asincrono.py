@@ -0,0 +1,114 @@
+"""
+Modo de despliegue del backend: threads del sistema o green threads (eventlet).
+
+Con SHELLY_ASYNC_MODE=eventlet todo el proceso coopera sobre un único hub:
+la librería estándar se parchea (sockets, threads, time, subprocess) antes de
+importar Flask, y psycopg2 —que es una extensión en C— recibe un callback de
+espera para que las consultas cedan el control en vez de bloquear el hub. Así
+cada conexión Socket.IO/SSE cuesta una green thread y no un thread del sistema.
+
+Uso:
+    SHELLY_ASYNC_MODE=eventlet gunicorn -k eventlet -w 1 --worker-connections 10000 wsgi:app
+    SHELLY_ASYNC_MODE=eventlet python wsgi.py
+
+El límite de conexiones simultáneas por worker (1000 en gunicorn, 1024 en
+eventlet.wsgi) hay que subirlo explícitamente, igual que `ulimit -n`.
+
+Con varios workers hace falta un message queue para Socket.IO y sticky sessions
+en el proxy; un worker eventlet ya sostiene miles de clientes (ver benchmark.py).
+
+Con eventlet no se usan pools de procesos con fork: eventlet no reinicia el hub
+en el hijo, que hereda las green threads del padre (scheduler, cola de comandos,
+sondeos) y el callback de psycopg2, y la primera espera verde puede ejecutarlas
+dentro del worker o bloquearse. La facturación (facturacion.py) lee entonces las
+muestras en green threads y hace el cálculo con NumPy en los threads nativos de
+eventlet (tpool, tamaño en EVENTLET_THREADPOOL_SIZE, 20 por defecto).
+"""
+
+import logging
+import os
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+MODOS = ("threading", "eventlet")
+MAX_CONEXIONES = int(os.environ.get("SHELLY_MAX_CONEXIONES", "10000"))
+
+
+def modo_configurado() -> str:
+    """
+    Devuelve el modo pedido en SHELLY_ASYNC_MODE ('threading' por defecto)
+    """
+    modo = os.environ.get("SHELLY_ASYNC_MODE", "threading").strip().lower()
+    if modo not in MODOS:
+        raise ValueError(f"SHELLY_ASYNC_MODE inválido: {modo} (opciones: {', '.join(MODOS)})")
+    return modo
+
+
+def preparar(modo: str):
+    """
+    Prepara el proceso para el modo indicado; debe llamarse antes de importar Flask
+
+    Args:
+        modo: 'threading' o 'eventlet'
+    """
+    if modo != "eventlet":
+        return
+    import eventlet
+    # Con gunicorn -k eventlet el worker ya parcheó; repetirlo no tiene efecto
+    eventlet.monkey_patch()
+
+    import psycopg2.extensions
+    psycopg2.extensions.set_wait_callback(esperar_psycopg2)
+
+
+def opciones_servidor(modo: str) -> dict:
+    """
+    Argumentos extra para socketio.run() según el modo
+    """
+    if modo == "eventlet":
+        # eventlet.wsgi atiende por defecto como mucho 1024 conexiones a la vez
+        return {"max_size": MAX_CONEXIONES}
+    return {"allow_unsafe_werkzeug": True}
+
+
+def esperar_psycopg2(conn, timeout=None):
+    """
+    Callback de espera de psycopg2 para eventlet: cede el hub mientras el socket no esté listo
+    """
+    import psycopg2.extensions
+    from eventlet.hubs import trampoline
+
+    while True:
+        estado = conn.poll()
+        if estado == psycopg2.extensions.POLL_OK:
+            break
+        elif estado == psycopg2.extensions.POLL_READ:
+            trampoline(conn.fileno(), read=True)
+        elif estado == psycopg2.extensions.POLL_WRITE:
+            trampoline(conn.fileno(), write=True)
+        else:
+            raise psycopg2.OperationalError(f"Estado de poll inesperado: {estado}")
+
+
+def hub_cooperativo() -> bool:
+    """
+    True si el proceso corre sobre el hub de eventlet (threads parcheados)
+    """
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched("thread")
+
+
+def en_hilo_nativo(funcion: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta trabajo de CPU (p. ej. bcrypt) fuera del hub para no frenar al resto de conexiones
+
+    En modo threading simplemente llama a la función.
+    """
+    if hub_cooperativo():
+        from eventlet import tpool
+        return tpool.execute(funcion, *args, **kwargs)
+    return funcion(*args, **kwargs)
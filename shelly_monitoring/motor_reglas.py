@@ -0,0 +1,306 @@
+"""
+Motor de reglas evaluado sobre cada actualización de dispositivo.
+
+Cada regla compara una métrica de un ámbito (dispositivo, habitación o
+tablero) contra un valor, opcionalmente durante un tiempo mínimo, y al
+cumplirse controla un objetivo. Las reglas se indexan por el ámbito que
+referencian, y las sumas de potencia y la cantidad de dispositivos encendidos
+por habitación y tablero se mantienen por diferencias. Así cada evento sólo
+reevalúa las reglas de su dispositivo, su habitación y su tablero.
+"""
+
+import heapq
+import logging
+import operator
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del motor
+MAX_WORKERS = 4
+RECARGA_TOPOLOGIA = 300          # Segundos entre recargas de la jerarquía desde la DB
+
+OPERADORES = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+METRICAS = ("potencia", "estado", "encendidos")
+AMBITOS = ("dispositivo", "habitacion", "tablero")
+
+
+class ReglaInvalida(ValueError):
+    pass
+
+
+class _Regla:
+    __slots__ = ("id", "nombre", "ambito", "ambito_id", "metrica", "comparar", "valor", "durante",
+                 "accion", "enfriamiento", "cumplida", "desde", "ultimo_disparo")
+
+    def __init__(self, regla: Dict[str, Any]):
+        self.id = regla["id"]
+        self.nombre = regla.get("nombre")
+        self.ambito = regla["ambito"]
+        self.ambito_id = regla["ambito_id"]
+        self.metrica = regla["metrica"]
+        self.comparar = OPERADORES[regla["operador"]]
+        self.valor = float(regla["valor"])
+        self.durante = regla.get("durante") or 0
+        self.accion = (regla["accion_objetivo_tipo"], regla["accion_objetivo_id"], bool(regla["accion_estado"]))
+        self.enfriamiento = regla.get("enfriamiento") or 0
+        self.cumplida = False
+        self.desde = None
+        self.ultimo_disparo = 0.0
+
+
+def validar_regla(regla: Dict[str, Any]):
+    """
+    Raises:
+        ReglaInvalida: si la definición no es válida
+    """
+    if regla.get("ambito") not in AMBITOS or regla.get("ambito_id") is None:
+        raise ReglaInvalida("ambito debe ser dispositivo, habitacion o tablero, con ambito_id")
+    if regla.get("metrica") not in METRICAS:
+        raise ReglaInvalida(f"metrica debe ser una de: {', '.join(METRICAS)}")
+    if regla.get("metrica") == "estado" and regla.get("ambito") != "dispositivo":
+        raise ReglaInvalida("La métrica estado sólo aplica a dispositivos")
+    if regla.get("operador") not in OPERADORES:
+        raise ReglaInvalida(f"operador debe ser uno de: {' '.join(OPERADORES)}")
+    try:
+        float(regla.get("valor"))
+    except (TypeError, ValueError):
+        raise ReglaInvalida("valor debe ser numérico")
+    if regla.get("accion_objetivo_tipo") not in AMBITOS or regla.get("accion_objetivo_id") is None:
+        raise ReglaInvalida("La acción requiere accion_objetivo_tipo y accion_objetivo_id")
+
+
+class MotorReglas:
+    """
+    Evaluación incremental de reglas sobre los eventos 'deviceUpdate'
+    """
+    def __init__(self, cargar_reglas: Callable[[], List[Dict[str, Any]]],
+                 cargar_topologia: Callable[[], Tuple[List[tuple], List[tuple]]],
+                 ejecutar: Callable[[str, int, bool], Any],
+                 max_workers: int = MAX_WORKERS):
+        """
+        Args:
+            cargar_reglas: Devuelve las reglas activas
+            cargar_topologia: Devuelve ([(id, ip, habitacion_id, estado, ultimo_consumo)], [(habitacion_id, tablero_id)])
+            ejecutar: Controla un objetivo (objetivo_tipo, objetivo_id, estado)
+            max_workers: Acciones ejecutándose a la vez
+        """
+        self.cargar_reglas = cargar_reglas
+        self.cargar_topologia = cargar_topologia
+        self.ejecutar = ejecutar
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.reglas: Dict[int, _Regla] = {}
+        self.indice: Dict[Tuple[str, int], List[_Regla]] = defaultdict(list)
+        # Estado por dispositivo: id -> [potencia, estado, habitacion_id]
+        self.dispositivos: Dict[int, list] = {}
+        self.id_por_ip: Dict[str, int] = {}
+        self.habitacion_tablero: Dict[int, int] = {}
+        self.potencia = defaultdict(float)     # (ambito, id) -> W
+        self.encendidos = defaultdict(int)     # (ambito, id) -> dispositivos encendidos
+        self._pendientes = []                  # (vence, regla_id, desde) de reglas con 'durante'
+        self._lock = Lock()
+
+    def iniciar(self):
+        """
+        Carga topología y reglas y lanza el thread de reglas temporizadas
+        """
+        self.recargar_topologia()
+        self.recargar_reglas()
+
+        def ticker():
+            proxima_recarga = time.monotonic() + RECARGA_TOPOLOGIA
+            while True:
+                time.sleep(1)
+                try:
+                    self._revisar_pendientes()
+                    if time.monotonic() >= proxima_recarga:
+                        self.recargar_topologia()
+                        proxima_recarga = time.monotonic() + RECARGA_TOPOLOGIA
+                except Exception as e:
+                    logger.error(f"Error en el ticker del motor de reglas: {e}")
+
+        thread = Thread(target=ticker, daemon=True)
+        thread.start()
+
+    # ===========================
+    # Reglas
+    # ===========================
+    def recargar_reglas(self):
+        reglas = self.cargar_reglas()
+        with self._lock:
+            self.reglas.clear()
+            self.indice.clear()
+            for regla in reglas:
+                self._agregar(regla)
+
+    def actualizar_regla(self, regla: Dict[str, Any]):
+        """
+        Agrega o reemplaza una regla
+        """
+        with self._lock:
+            self._quitar(regla["id"])
+            if regla.get("activa", True):
+                self._agregar(regla)
+
+    def eliminar_regla(self, regla_id: int):
+        with self._lock:
+            self._quitar(regla_id)
+
+    def _agregar(self, definicion: Dict[str, Any]):
+        regla = _Regla(definicion)
+        self.reglas[regla.id] = regla
+        self.indice[(regla.ambito, regla.ambito_id)].append(regla)
+        # Una regla nueva se evalúa con el estado actual, sin esperar al próximo evento
+        self._evaluar(regla, time.monotonic())
+
+    def _quitar(self, regla_id: int):
+        regla = self.reglas.pop(regla_id, None)
+        if regla:
+            self.indice[(regla.ambito, regla.ambito_id)].remove(regla)
+
+    # ===========================
+    # Topología y agregados
+    # ===========================
+    def recargar_topologia(self):
+        """
+        Recarga la jerarquía dispositivo -> habitación -> tablero y recalcula los agregados
+        """
+        dispositivos, habitaciones = self.cargar_topologia()
+        with self._lock:
+            self.habitacion_tablero = {habitacion_id: tablero_id for habitacion_id, tablero_id in habitaciones}
+            anteriores = self.dispositivos
+            self.dispositivos = {}
+            self.id_por_ip = {}
+            for id_dispositivo, ip, habitacion_id, estado, consumo in dispositivos:
+                # Se conserva el último valor en vivo si ya se conocía
+                potencia, encendido, _ = anteriores.get(id_dispositivo, (consumo or 0.0, bool(estado), None))
+                self.dispositivos[id_dispositivo] = [potencia, encendido, habitacion_id]
+                self.id_por_ip[ip] = id_dispositivo
+
+            self.potencia.clear()
+            self.encendidos.clear()
+            for id_dispositivo, (potencia, encendido, habitacion_id) in self.dispositivos.items():
+                for clave in self._ambitos(id_dispositivo, habitacion_id):
+                    self.potencia[clave] += potencia
+                    self.encendidos[clave] += int(encendido)
+
+    def _ambitos(self, id_dispositivo: int, habitacion_id: Optional[int]) -> List[Tuple[str, int]]:
+        claves = [("dispositivo", id_dispositivo)]
+        if habitacion_id is not None:
+            claves.append(("habitacion", habitacion_id))
+            tablero_id = self.habitacion_tablero.get(habitacion_id)
+            if tablero_id is not None:
+                claves.append(("tablero", tablero_id))
+        return claves
+
+    def valores_afectados(self, device: Dict[str, Any]) -> List[Tuple[Tuple[str, int], float]]:
+        """
+        Devuelve la potencia actual del dispositivo de una actualización y de su habitación y tablero
+
+        Returns:
+            Lista [((ambito, id), potencia)]; vacía si el dispositivo no está en la topología
+        """
+        id_dispositivo = self.id_por_ip.get(device.get("ip"), device.get("id"))
+        with self._lock:
+            actual = self.dispositivos.get(id_dispositivo)
+            if actual is None:
+                return []
+            return [(clave, self.potencia[clave]) for clave in self._ambitos(id_dispositivo, actual[2])]
+
+    def get_agregados(self) -> Dict[str, Any]:
+        """
+        Devuelve la potencia total y los encendidos por habitación y tablero
+        """
+        nombres = {"habitacion": "habitaciones", "tablero": "tableros"}
+        with self._lock:
+            resultado = {"habitaciones": {}, "tableros": {}}
+            for (ambito, ambito_id), potencia in self.potencia.items():
+                if ambito in nombres:
+                    resultado[nombres[ambito]][ambito_id] = {
+                        "potencia": potencia,
+                        "encendidos": self.encendidos[(ambito, ambito_id)],
+                    }
+            return resultado
+
+    # ===========================
+    # Eventos
+    # ===========================
+    def procesar_actualizacion(self, device: Dict[str, Any]):
+        """
+        Listener de 'deviceUpdate': actualiza agregados y reevalúa sólo las reglas afectadas
+        """
+        id_dispositivo = self.id_por_ip.get(device.get("ip"), device.get("id"))
+        ahora = time.monotonic()
+        with self._lock:
+            actual = self.dispositivos.get(id_dispositivo)
+            if actual is None:
+                return
+            potencia = float((device.get("meters") or [{}])[0].get("power", 0) or 0)
+            encendido = bool(device.get("state", False))
+            delta_potencia = potencia - actual[0]
+            delta_encendidos = int(encendido) - int(actual[1])
+            actual[0], actual[1] = potencia, encendido
+
+            for clave in self._ambitos(id_dispositivo, actual[2]):
+                self.potencia[clave] += delta_potencia
+                self.encendidos[clave] += delta_encendidos
+                for regla in self.indice.get(clave, ()):
+                    self._evaluar(regla, ahora)
+
+    def _valor(self, regla: _Regla) -> Optional[float]:
+        clave = (regla.ambito, regla.ambito_id)
+        if regla.metrica == "potencia":
+            return self.potencia.get(clave)
+        if regla.metrica == "encendidos":
+            return self.encendidos.get(clave)
+        dispositivo = self.dispositivos.get(regla.ambito_id)
+        return float(dispositivo[1]) if dispositivo else None
+
+    def _evaluar(self, regla: _Regla, ahora: float):
+        valor = self._valor(regla)
+        cumple = valor is not None and regla.comparar(valor, regla.valor)
+        if cumple and not regla.cumplida:
+            # Disparo por flanco: sólo al pasar de no cumplida a cumplida
+            regla.cumplida = True
+            regla.desde = ahora
+            if regla.durante > 0:
+                heapq.heappush(self._pendientes, (ahora + regla.durante, regla.id, ahora))
+            else:
+                self._disparar(regla, ahora)
+        elif not cumple and regla.cumplida:
+            regla.cumplida = False
+            regla.desde = None
+
+    def _revisar_pendientes(self):
+        ahora = time.monotonic()
+        with self._lock:
+            while self._pendientes and self._pendientes[0][0] <= ahora:
+                _, regla_id, desde = heapq.heappop(self._pendientes)
+                regla = self.reglas.get(regla_id)
+                # Sólo si la condición se mantuvo cumplida desde entonces
+                if regla and regla.cumplida and regla.desde == desde:
+                    self._disparar(regla, ahora)
+
+    def _disparar(self, regla: _Regla, ahora: float):
+        if ahora - regla.ultimo_disparo < regla.enfriamiento:
+            return
+        regla.ultimo_disparo = ahora
+        logger.info(f"Regla {regla.id} ({regla.nombre}) cumplida: {regla.metrica} {regla.valor}")
+        self.pool.submit(self._ejecutar, regla)
+
+    def _ejecutar(self, regla: _Regla):
+        try:
+            self.ejecutar(*regla.accion)
+        except Exception as e:
+            logger.error(f"Error ejecutando la acción de la regla {regla.id}: {e}")
@@ -0,0 +1,218 @@
+"""
+Conteo y tiempo de las sentencias SQL de cada request.
+
+Se miden las sentencias que pasan por SQLAlchemy (eventos del engine) y por las
+conexiones psycopg2 creadas con connection_factory=ConexionMedida (las de
+get_db_connection). Por request se acumulan la cantidad, el tiempo y la forma
+de cada sentencia (el SQL con los marcadores de parámetros, sin valores): una
+misma forma repetida UMBRAL_N1 veces o más es el patrón N+1 de un lookup dentro
+de un loop, y se registra como warning.
+
+Cada respuesta lleva:
+    X-SQL-Consultas: cantidad de sentencias
+    X-SQL-Presupuesto: máximo declarado para el endpoint (si lo tiene)
+    X-SQL-Repetidas: sentencias repetidas (N+1), si las hubo
+    Server-Timing: sql;dur=<ms>;desc="<n> consultas"
+
+Los endpoints declaran su presupuesto con @presupuesto_sql(n). Excederlo genera
+un warning; con SHELLY_PERFIL_SQL=estricto la request responde 500, para que
+los tests y `python benchmark.py consultas` fallen. Las sentencias que corren
+después de la respuesta (cuerpos en streaming) no se cuentan.
+"""
+
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+import psycopg2.extensions
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del perfil SQL
+MODO = os.environ.get("SHELLY_PERFIL_SQL", "1")    # 0 desactivado, 1 medir, estricto: fallar al exceder
+UMBRAL_N1 = 5                   # Repeticiones de una misma forma para marcarla como N+1
+LARGO_FORMA = 200               # Caracteres de la forma que se incluyen en logs y encabezados
+
+_medicion: contextvars.ContextVar[Optional["MedicionSQL"]] = contextvars.ContextVar("medicion_sql", default=None)
+_LISTA_PARAMETROS = re.compile(r"(%\(\w+\)s|%s|\?)(\s*,\s*(%\(\w+\)s|%s|\?))+")
+_ESPACIOS = re.compile(r"\s+")
+
+
+def forma(sentencia: Any) -> str:
+    """
+    SQL normalizado: espacios colapsados y listas de parámetros (IN expandidos) reducidas a uno
+    """
+    if isinstance(sentencia, bytes):
+        sentencia = sentencia.decode("utf-8", "replace")
+    elif not isinstance(sentencia, str):
+        sentencia = str(sentencia)
+    return _LISTA_PARAMETROS.sub(r"\1", _ESPACIOS.sub(" ", sentencia).strip())
+
+
+class MedicionSQL:
+    """
+    Sentencias ejecutadas durante una request
+    """
+    __slots__ = ("cantidad", "duracion", "formas")
+
+    def __init__(self):
+        self.cantidad = 0
+        self.duracion = 0.0
+        self.formas: Counter = Counter()
+
+    def registrar(self, sentencia: Any, duracion: float):
+        self.cantidad += 1
+        self.duracion += duracion
+        self.formas[forma(sentencia)] += 1
+
+    def repetidas(self, umbral: int = UMBRAL_N1) -> Dict[str, int]:
+        return {f: n for f, n in self.formas.items() if n >= umbral}
+
+
+def registrar(sentencia: Any, duracion: float):
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.registrar(sentencia, duracion)
+
+
+def iniciar_medicion() -> contextvars.Token:
+    return _medicion.set(MedicionSQL())
+
+
+def terminar_medicion(token: contextvars.Token) -> Optional[MedicionSQL]:
+    medicion = _medicion.get()
+    _medicion.reset(token)
+    return medicion
+
+
+# ===========================
+# psycopg2
+# ===========================
+class _CursorMedido:
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            registrar(query, time.perf_counter() - inicio)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            registrar(query, time.perf_counter() - inicio)
+
+    def copy_expert(self, sql, file, size=8192):
+        inicio = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            registrar(sql, time.perf_counter() - inicio)
+
+
+_clases_medidas: Dict[type, type] = {}
+
+
+def _clase_medida(clase: type) -> type:
+    medida = _clases_medidas.get(clase)
+    if medida is None:
+        medida = _clases_medidas[clase] = type(f"{clase.__name__}Medido", (_CursorMedido, clase), {})
+    return medida
+
+
+class ConexionMedida(psycopg2.extensions.connection):
+    """
+    Conexión psycopg2 cuyos cursores (de cualquier cursor_factory) registran cada sentencia
+    """
+    def cursor(self, *args, **kwargs):
+        clase = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _clase_medida(clase)
+        return super().cursor(*args, **kwargs)
+
+
+# ===========================
+# Flask y SQLAlchemy
+# ===========================
+def presupuesto_sql(maximo: int) -> Callable:
+    """
+    Declara la cantidad máxima de sentencias SQL de un endpoint
+    """
+    def decorator(f):
+        # functools.wraps de los decoradores externos copia el atributo a la vista registrada
+        f.presupuesto_sql = maximo
+        return f
+    return decorator
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("perfil_sql_inicio", []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    registrar(statement, time.perf_counter() - conn.info["perfil_sql_inicio"].pop())
+
+
+def _error_sql(contexto):
+    inicios = contexto.connection.info.get("perfil_sql_inicio") if contexto.connection is not None else None
+    if inicios:
+        inicios.pop()
+
+
+def instalar(app, modo: str = MODO):
+    """
+    Registra la medición en la app Flask y en todos los engines de SQLAlchemy
+    """
+    if modo == "0":
+        return
+    estricto = modo == "estricto"
+    event.listen(Engine, "before_cursor_execute", _antes_de_ejecutar)
+    event.listen(Engine, "after_cursor_execute", _despues_de_ejecutar)
+    event.listen(Engine, "handle_error", _error_sql)
+
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def medir_sql():
+        g.perfil_sql = iniciar_medicion()
+
+    @app.after_request
+    def informar_sql(respuesta):
+        token = g.pop("perfil_sql", None)
+        if token is None:
+            return respuesta
+        medicion = terminar_medicion(token)
+        vista = app.view_functions.get(request.endpoint)
+        maximo = getattr(vista, "presupuesto_sql", None)
+
+        repetidas = medicion.repetidas()
+        for sentencia, veces in repetidas.items():
+            logger.warning(f"N+1 en {request.method} {request.path}: {veces}x {sentencia[:LARGO_FORMA]}")
+        if maximo is not None and medicion.cantidad > maximo:
+            mensaje = (f"{request.method} {request.path} ejecutó {medicion.cantidad} sentencias SQL "
+                       f"(presupuesto {maximo})")
+            logger.warning(mensaje)
+            if estricto:
+                respuesta = jsonify({"error": mensaje, "sentencias": dict(medicion.formas)})
+                respuesta.status_code = 500
+
+        respuesta.headers["X-SQL-Consultas"] = str(medicion.cantidad)
+        if maximo is not None:
+            respuesta.headers["X-SQL-Presupuesto"] = str(maximo)
+        if repetidas:
+            respuesta.headers["X-SQL-Repetidas"] = str(sum(repetidas.values()))
+        respuesta.headers.add("Server-Timing", f'sql;dur={medicion.duracion * 1000:.1f};desc="{medicion.cantidad} consultas"')
+        return respuesta
+
+    @app.teardown_request
+    def limpiar_sql(_error=None):
+        # Si la request falló antes de after_request la medición se descarta
+        token = g.pop("perfil_sql", None)
+        if token is not None:
+            terminar_medicion(token)
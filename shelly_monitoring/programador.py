@@ -0,0 +1,320 @@
+"""
+Programador de acciones sobre dispositivos.
+
+Las programaciones (cron de 5 campos o relativas a la salida/puesta del sol) se
+guardan en Postgres y se cargan en un heap ordenado por próxima ejecución: un
+único thread duerme hasta la cabeza del heap y cada alta, cambio o disparo
+cuesta O(log n). Las acciones se ejecutan en un pool acotado y, al arrancar, se
+recupera el último disparo perdido de cada programación dentro de una ventana.
+"""
+
+import heapq
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del programador
+MAX_WORKERS = 8
+VENTANA_RECUPERACION = timedelta(hours=1)   # Disparos perdidos más antiguos se descartan
+LATITUD = float(os.environ.get('SHELLY_LATITUD', '-34.6037'))
+LONGITUD = float(os.environ.get('SHELLY_LONGITUD', '-58.3816'))
+
+RANGOS_CRON = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+class ExpresionInvalida(ValueError):
+    pass
+
+
+# ===========================
+# Expresiones cron
+# ===========================
+def _parsear_campo(campo: str, minimo: int, maximo: int) -> List[int]:
+    valores = set()
+    for parte in campo.split(","):
+        rango, _, paso = parte.partition("/")
+        paso = int(paso) if paso else 1
+        if rango == "*":
+            inicio, fin = minimo, maximo
+        elif "-" in rango:
+            inicio, fin = (int(x) for x in rango.split("-"))
+        else:
+            inicio = fin = int(rango)
+            if paso > 1:
+                fin = maximo
+        if inicio < minimo or fin > maximo or inicio > fin or paso < 1:
+            raise ExpresionInvalida(f"Campo fuera de rango: {parte}")
+        valores.update(range(inicio, fin + 1, paso))
+    return sorted(valores)
+
+
+class Cron:
+    """
+    Expresión cron de 5 campos: minuto hora día-del-mes mes día-de-la-semana (0 = domingo)
+    """
+    def __init__(self, expresion: str):
+        campos = expresion.split()
+        if len(campos) != 5:
+            raise ExpresionInvalida("Se esperan 5 campos: minuto hora día mes día_semana")
+        try:
+            self.minutos, self.horas, self.dias, self.meses, dias_semana = (
+                _parsear_campo(c, *r) for c, r in zip(campos, RANGOS_CRON)
+            )
+        except ValueError as e:
+            raise ExpresionInvalida(str(e))
+        # El 7 también significa domingo
+        self.dias_semana = sorted({d % 7 for d in dias_semana})
+        self.dia_restringido = campos[2] != "*"
+        self.semana_restringida = campos[4] != "*"
+
+    def _dia_valido(self, fecha: datetime) -> bool:
+        en_mes = fecha.day in self.dias
+        en_semana = (fecha.isoweekday() % 7) in self.dias_semana
+        # Semántica de cron: si ambos campos están restringidos basta con uno
+        if self.dia_restringido and self.semana_restringida:
+            return en_mes or en_semana
+        return en_mes and en_semana
+
+    def siguiente(self, desde: datetime) -> datetime:
+        """
+        Próximo instante estrictamente posterior a `desde` (hora local)
+        """
+        t = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = t + timedelta(days=366 * 5)
+        while t < limite:
+            if t.month not in self.meses:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._dia_valido(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            hora = next((h for h in self.horas if h >= t.hour), None)
+            if hora is None:
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if hora != t.hour:
+                t = t.replace(hour=hora, minute=0)
+            minuto = next((m for m in self.minutos if m >= t.minute), None)
+            if minuto is None:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            return t.replace(minute=minuto)
+        raise ExpresionInvalida("La expresión nunca se cumple")
+
+
+# ===========================
+# Expresiones solares
+# ===========================
+def hora_solar(fecha, salida: bool, latitud: float = LATITUD, longitud: float = LONGITUD) -> Optional[datetime]:
+    """
+    Calcula la salida o puesta del sol (algoritmo NOAA simplificado)
+
+    Returns:
+        Instante en hora local (naive), o None si ese día no sale/se pone el sol
+    """
+    dia = fecha.timetuple().tm_yday
+    gamma = 2 * math.pi / 365 * (dia - 1)
+    ecuacion = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                         - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    declinacion = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+                   - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+                   - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+    lat = math.radians(latitud)
+    coseno = (math.cos(math.radians(90.833)) / (math.cos(lat) * math.cos(declinacion))
+              - math.tan(lat) * math.tan(declinacion))
+    if abs(coseno) > 1:
+        return None
+    angulo = math.degrees(math.acos(coseno))
+    minutos_utc = 720 - 4 * (longitud + (angulo if salida else -angulo)) - ecuacion
+    medianoche_utc = datetime(fecha.year, fecha.month, fecha.day, tzinfo=timezone.utc)
+    return (medianoche_utc + timedelta(minutes=minutos_utc)).astimezone().replace(tzinfo=None)
+
+
+class Solar:
+    """
+    Expresión relativa al sol: "sunrise", "sunset", "sunrise+30", "sunset-15" (minutos)
+    """
+    def __init__(self, expresion: str):
+        base = expresion.strip().lower()
+        desfase = 0
+        for signo in ("+", "-"):
+            if signo in base:
+                base, _, minutos = base.partition(signo)
+                try:
+                    desfase = int(minutos) * (1 if signo == "+" else -1)
+                except ValueError:
+                    raise ExpresionInvalida(f"Desfase inválido: {minutos}")
+                break
+        if base not in ("sunrise", "sunset"):
+            raise ExpresionInvalida("Se espera sunrise o sunset")
+        self.salida = base == "sunrise"
+        self.desfase = timedelta(minutes=desfase)
+
+    def siguiente(self, desde: datetime) -> datetime:
+        for dias in range(0, 400):
+            fecha = (desde + timedelta(days=dias)).date()
+            instante = hora_solar(fecha, self.salida)
+            if instante is not None:
+                instante = (instante + self.desfase).replace(second=0, microsecond=0)
+                if instante > desde:
+                    return instante
+        raise ExpresionInvalida("El sol no sale/se pone en esta latitud")
+
+
+def compilar(tipo: str, expresion: str):
+    """
+    Valida y compila una expresión de programación
+
+    Raises:
+        ExpresionInvalida: si el tipo o la expresión no son válidos
+    """
+    if tipo == "cron":
+        return Cron(expresion)
+    if tipo == "solar":
+        return Solar(expresion)
+    raise ExpresionInvalida(f"Tipo de programación desconocido: {tipo}")
+
+
+def ultimo_disparo(regla, desde: datetime, hasta: datetime) -> Optional[datetime]:
+    """
+    Último instante de la regla en (desde, hasta], o None si no hay ninguno
+    """
+    ultimo = None
+    instante = regla.siguiente(desde)
+    while instante <= hasta:
+        ultimo = instante
+        instante = regla.siguiente(instante)
+    return ultimo
+
+
+# ===========================
+# Programador
+# ===========================
+class Programador:
+    """
+    Heap de próximas ejecuciones atendido por un único thread
+    """
+    def __init__(self, cargar: Callable[[], List[Dict[str, Any]]],
+                 ejecutar: Callable[[Dict[str, Any]], None],
+                 registrar_ejecucion: Callable[[int, datetime], None],
+                 max_workers: int = MAX_WORKERS):
+        """
+        Args:
+            cargar: Devuelve las programaciones activas (id, tipo, expresion, ultima_ejecucion, ...)
+            ejecutar: Aplica la acción de una programación
+            registrar_ejecucion: Persiste la hora del último disparo (para recuperar tras reinicios)
+            max_workers: Acciones ejecutándose a la vez
+        """
+        self.cargar = cargar
+        self.ejecutar = ejecutar
+        self.registrar_ejecucion = registrar_ejecucion
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.programaciones: Dict[int, Dict[str, Any]] = {}
+        self._heap = []
+        self._versiones: Dict[int, int] = {}
+        self._condicion = Condition()
+
+    def iniciar(self):
+        """
+        Carga las programaciones, recupera disparos perdidos y lanza el thread
+        """
+        ahora = datetime.now()
+        with self._condicion:
+            for programacion in self.cargar():
+                self._agregar(programacion, ahora, recuperar=True)
+        thread = Thread(target=self._bucle, daemon=True)
+        thread.start()
+        logger.info(f"Programador iniciado con {len(self.programaciones)} programaciones")
+
+    def actualizar(self, programacion: Dict[str, Any]):
+        """
+        Agrega o reemplaza una programación (O(log n))
+        """
+        with self._condicion:
+            self._quitar(programacion["id"])
+            if programacion.get("activa", True):
+                self._agregar(programacion, datetime.now())
+            self._condicion.notify()
+
+    def eliminar(self, programacion_id: int):
+        with self._condicion:
+            self._quitar(programacion_id)
+            self._condicion.notify()
+
+    def proximas(self, limite: int = 50) -> List[Dict[str, Any]]:
+        """
+        Devuelve las próximas ejecuciones pendientes
+        """
+        with self._condicion:
+            vigentes = [e for e in self._heap if self._versiones.get(e[1]) == e[2]]
+        return [
+            {"id": programacion_id, "proxima_ejecucion": instante.isoformat()}
+            for instante, programacion_id, _ in heapq.nsmallest(limite, vigentes)
+        ]
+
+    def _quitar(self, programacion_id: int):
+        # Borrado perezoso: las entradas viejas del heap se descartan por versión
+        self.programaciones.pop(programacion_id, None)
+        self._versiones[programacion_id] = self._versiones.get(programacion_id, 0) + 1
+
+    def _agregar(self, programacion: Dict[str, Any], ahora: datetime, recuperar: bool = False):
+        # Una expresión que compila pero nunca se cumple (p. ej. "0 0 30 2 *") desactiva sólo esa programación
+        try:
+            regla = compilar(programacion["tipo"], programacion["expresion"])
+            ultima = programacion.get("ultima_ejecucion")
+            # Sólo cuenta el último disparo perdido, y sólo si cae dentro de la ventana:
+            # se busca desde el inicio de la ventana aunque la última ejecución sea más vieja
+            desde = max(ultima, ahora - VENTANA_RECUPERACION - timedelta(microseconds=1)) if recuperar and ultima else None
+            perdida = ultimo_disparo(regla, desde, ahora) if desde is not None else None
+            siguiente = regla.siguiente(ahora)
+        except ExpresionInvalida as e:
+            logger.error(f"Programación {programacion['id']} inválida, queda desactivada: {e}")
+            return
+        programacion = dict(programacion, _regla=regla)
+        programacion_id = programacion["id"]
+        self.programaciones[programacion_id] = programacion
+        version = self._versiones.get(programacion_id, 0) + 1
+        self._versiones[programacion_id] = version
+
+        if perdida is not None:
+            logger.info(f"Recuperando disparo perdido de la programación {programacion_id} ({perdida})")
+            heapq.heappush(self._heap, (ahora, programacion_id, version))
+            return
+        heapq.heappush(self._heap, (siguiente, programacion_id, version))
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while True:
+                    while self._heap and self._versiones.get(self._heap[0][1]) != self._heap[0][2]:
+                        heapq.heappop(self._heap)
+                    espera = (self._heap[0][0] - datetime.now()).total_seconds() if self._heap else 60
+                    if espera <= 0:
+                        break
+                    # Se despierta al menos cada minuto por cambios de hora del sistema
+                    self._condicion.wait(min(espera, 60))
+
+                instante, programacion_id, version = heapq.heappop(self._heap)
+                programacion = self.programaciones[programacion_id]
+                try:
+                    siguiente = programacion["_regla"].siguiente(max(instante, datetime.now()))
+                    heapq.heappush(self._heap, (siguiente, programacion_id, version))
+                except ExpresionInvalida as e:
+                    # Se dispara esta vez y no se vuelve a programar
+                    logger.error(f"Programación {programacion_id} sin próxima ejecución, queda desactivada: {e}")
+                    self._quitar(programacion_id)
+
+            self.pool.submit(self._disparar, programacion, instante)
+
+    def _disparar(self, programacion: Dict[str, Any], instante: datetime):
+        try:
+            self.ejecutar(programacion)
+            self.registrar_ejecucion(programacion["id"], instante)
+        except Exception as e:
+            logger.error(f"Error ejecutando la programación {programacion['id']}: {e}")
@@ -0,0 +1,289 @@
+"""
+Protocolo binario de deltas para las actualizaciones de dispositivos.
+
+Alternativa opcional al evento JSON 'device_update' (que se sigue emitiendo
+para los clientes existentes). Un cliente se suscribe con 'delta_subscribe' y
+desde entonces recibe tramas binarias 'device_delta':
+
+- Los IDs de dispositivo se codifican con un diccionario: cada ID recibe un
+  índice entero la primera vez que aparece y viaja como texto una sola vez.
+- Las actualizaciones se acumulan durante INTERVALO_TRAMA y se coalescen: cada
+  registro lleva sólo los campos que cambiaron respecto de la trama anterior.
+- Cada trama tiene un número de secuencia y se aplica sobre la anterior. Los
+  clientes confirman la última secuencia aplicada ('delta_ack'); a quien se
+  atrasa más de MAX_RETRASO tramas (o pide 'delta_resync') se le envía un
+  keyframe con el diccionario y el estado completos. Además se difunde un
+  keyframe cada INTERVALO_KEYFRAME para corregir cualquier desvío.
+
+Las tramas se codifican una sola vez y se difunden a todos los suscriptos.
+
+Formato (little endian):
+    B tipo (1 keyframe, 2 delta) | I secuencia | d timestamp
+    varint entradas nuevas del diccionario, cada una: varint índice | varint largo | UTF-8
+    varint registros, cada uno: varint índice | B máscara | [varint zigzag potencia en décimas de W]
+
+Máscara: 0x01 estado presente, 0x02 online presente, 0x04 potencia presente,
+0x08 valor de estado, 0x10 valor de online.
+"""
+
+import logging
+import struct
+import time
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del protocolo
+VERSION = 1
+INTERVALO_TRAMA = 0.25          # Segundos durante los que se acumulan cambios
+INTERVALO_KEYFRAME = 120        # Segundos entre keyframes difundidos
+MAX_RETRASO = 40                # Tramas sin confirmar antes de reenviar un keyframe
+SALA = "delta"                  # Sala de Socket.IO de los suscriptos
+
+KEYFRAME = 1
+DELTA = 2
+CABECERA = struct.Struct("<BId")
+
+ESTADO_PRESENTE = 0x01
+ONLINE_PRESENTE = 0x02
+POTENCIA_PRESENTE = 0x04
+ESTADO_VALOR = 0x08
+ONLINE_VALOR = 0x10
+
+Estado = Tuple[bool, bool, int]   # (encendido, online, potencia en décimas de W)
+
+
+def _varint(valor: int, salida: bytearray):
+    while valor >= 0x80:
+        salida.append((valor & 0x7F) | 0x80)
+        valor >>= 7
+    salida.append(valor)
+
+
+def _leer_varint(datos: bytes, pos: int) -> Tuple[int, int]:
+    valor = desplazamiento = 0
+    while True:
+        byte = datos[pos]
+        pos += 1
+        valor |= (byte & 0x7F) << desplazamiento
+        if byte < 0x80:
+            return valor, pos
+        desplazamiento += 7
+
+
+def _zigzag(valor: int) -> int:
+    return valor * 2 if valor >= 0 else -valor * 2 - 1
+
+
+def _dezigzag(valor: int) -> int:
+    return valor >> 1 if not valor & 1 else -(valor >> 1) - 1
+
+
+def _registro(indice: int, estado: Estado, anterior: Optional[Estado], salida: bytearray):
+    encendido, online, potencia = estado
+    mascara = 0
+    if anterior is None or anterior[0] != encendido:
+        mascara |= ESTADO_PRESENTE | (ESTADO_VALOR if encendido else 0)
+    if anterior is None or anterior[1] != online:
+        mascara |= ONLINE_PRESENTE | (ONLINE_VALOR if online else 0)
+    if anterior is None or anterior[2] != potencia:
+        mascara |= POTENCIA_PRESENTE
+    _varint(indice, salida)
+    salida.append(mascara)
+    if mascara & POTENCIA_PRESENTE:
+        _varint(_zigzag(potencia), salida)
+
+
+class CodificadorDelta:
+    """
+    Estado difundido, diccionario de IDs y suscriptores del protocolo de deltas
+    """
+    def __init__(self, intervalo: float = INTERVALO_TRAMA, intervalo_keyframe: float = INTERVALO_KEYFRAME):
+        self.intervalo = intervalo
+        self.intervalo_keyframe = intervalo_keyframe
+        self.seq = 0
+        self._indices: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._nuevos: List[int] = []                    # Índices asignados desde la última trama
+        self._estado: Dict[int, Estado] = {}            # Último estado difundido
+        self._pendientes: Dict[int, Estado] = {}        # Estado más reciente aún no difundido
+        self.clientes: Dict[str, int] = {}              # sid -> última secuencia confirmada
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def registrar(self, device_id: Any, encendido: bool, online: bool, potencia: Optional[float]):
+        """
+        Registra el estado actual de un dispositivo; se difunde en la próxima trama
+        """
+        estado = (bool(encendido), bool(online), int(round((potencia or 0) * 10)))
+        clave = str(device_id)
+        with self._lock:
+            indice = self._indices.get(clave)
+            if indice is None:
+                indice = self._indices[clave] = len(self._ids)
+                self._ids.append(clave)
+                self._nuevos.append(indice)
+            self._pendientes[indice] = estado
+
+    # ===========================
+    # Tramas
+    # ===========================
+    def trama(self) -> Optional[bytes]:
+        """
+        Arma la trama delta con los cambios pendientes (None si no hay ninguno)
+        """
+        with self._lock:
+            if not self._pendientes and not self._nuevos:
+                return None
+            salida = bytearray(CABECERA.pack(DELTA, self.seq + 1, time.time()))
+            self._diccionario(self._nuevos, salida)
+            registros = bytearray()
+            cantidad = 0
+            for indice, estado in self._pendientes.items():
+                anterior = self._estado.get(indice)
+                if anterior == estado:
+                    continue
+                _registro(indice, estado, anterior, registros)
+                self._estado[indice] = estado
+                cantidad += 1
+            self._pendientes.clear()
+            self._nuevos = []
+            if cantidad == 0 and len(salida) == CABECERA.size + 1:
+                return None
+            _varint(cantidad, salida)
+            salida += registros
+            self.seq += 1
+            return bytes(salida)
+
+    def keyframe(self) -> bytes:
+        """
+        Trama con el diccionario y el estado completos en la secuencia actual
+        """
+        with self._lock:
+            salida = bytearray(CABECERA.pack(KEYFRAME, self.seq, time.time()))
+            self._diccionario([i for i in range(len(self._ids)) if i in self._estado], salida)
+            _varint(len(self._estado), salida)
+            for indice, estado in self._estado.items():
+                _registro(indice, estado, None, salida)
+            return bytes(salida)
+
+    def _diccionario(self, indices: List[int], salida: bytearray):
+        _varint(len(indices), salida)
+        for indice in indices:
+            nombre = self._ids[indice].encode("utf-8")
+            _varint(indice, salida)
+            _varint(len(nombre), salida)
+            salida += nombre
+
+    # ===========================
+    # Suscriptores
+    # ===========================
+    def suscribir(self, sid: str) -> bytes:
+        """
+        Da de alta un cliente y devuelve el keyframe con el que arranca
+        """
+        keyframe = self.keyframe()
+        with self._lock:
+            self.clientes[sid] = CABECERA.unpack_from(keyframe)[1]
+        return keyframe
+
+    def confirmar(self, sid: str, seq: int):
+        with self._lock:
+            if sid in self.clientes:
+                self.clientes[sid] = max(self.clientes[sid], int(seq))
+
+    def baja(self, sid: str):
+        with self._lock:
+            self.clientes.pop(sid, None)
+
+    def atrasados(self) -> List[str]:
+        """
+        Clientes cuya última confirmación quedó más de MAX_RETRASO tramas atrás
+        """
+        with self._lock:
+            return [sid for sid, seq in self.clientes.items() if self.seq - seq > MAX_RETRASO]
+
+    def iniciar(self, difundir: Callable[[bytes], None], enviar: Callable[[str, bytes], None]):
+        """
+        Lanza el thread que difunde las tramas, los keyframes periódicos y los de resincronización
+
+        Args:
+            difundir: Envía una trama a todos los suscriptos
+            enviar: Envía una trama a un solo cliente (sid, trama)
+        """
+        def bucle():
+            ultimo_keyframe = time.monotonic()
+            while True:
+                time.sleep(self.intervalo)
+                try:
+                    if not self.clientes:
+                        # Sin suscriptores se sigue coalesciendo para que el keyframe esté al día
+                        self.trama()
+                        continue
+                    trama = self.trama()
+                    if trama is not None:
+                        difundir(trama)
+                    if time.monotonic() - ultimo_keyframe >= self.intervalo_keyframe:
+                        ultimo_keyframe = time.monotonic()
+                        difundir(self.keyframe())
+                    atrasados = self.atrasados()
+                    if atrasados:
+                        keyframe = self.keyframe()
+                        seq = CABECERA.unpack_from(keyframe)[1]
+                        for sid in atrasados:
+                            self.confirmar(sid, seq)
+                            enviar(sid, keyframe)
+                except Exception as e:
+                    logger.error(f"Error difundiendo deltas: {e}")
+
+        if self._thread is None:
+            self._thread = Thread(target=bucle, daemon=True)
+            self._thread.start()
+
+
+class DecodificadorDelta:
+    """
+    Lado cliente del protocolo (lo usa el benchmark; el frontend tiene su equivalente)
+    """
+    def __init__(self):
+        self.seq: Optional[int] = None
+        self.ids: Dict[int, str] = {}
+        self.estado: Dict[str, Dict[str, Any]] = {}
+
+    def aplicar(self, trama: bytes) -> bool:
+        """
+        Aplica una trama; devuelve False si es un delta fuera de secuencia (hay que pedir resync)
+        """
+        tipo, seq, _ = CABECERA.unpack_from(trama)
+        if tipo == DELTA:
+            if self.seq is None or seq <= self.seq:
+                return True     # Anterior al keyframe inicial o ya aplicada: se ignora
+            if seq != self.seq + 1:
+                return False
+        elif self.seq is not None and seq < self.seq:
+            return True
+        else:
+            self.ids, self.estado = {}, {}
+        pos = CABECERA.size
+        nuevos, pos = _leer_varint(trama, pos)
+        for _ in range(nuevos):
+            indice, pos = _leer_varint(trama, pos)
+            largo, pos = _leer_varint(trama, pos)
+            self.ids[indice] = trama[pos:pos + largo].decode("utf-8")
+            pos += largo
+        cantidad, pos = _leer_varint(trama, pos)
+        for _ in range(cantidad):
+            indice, pos = _leer_varint(trama, pos)
+            mascara = trama[pos]
+            pos += 1
+            dispositivo = self.estado.setdefault(self.ids[indice], {})
+            if mascara & ESTADO_PRESENTE:
+                dispositivo["state"] = bool(mascara & ESTADO_VALOR)
+            if mascara & ONLINE_PRESENTE:
+                dispositivo["online"] = bool(mascara & ONLINE_VALOR)
+            if mascara & POTENCIA_PRESENTE:
+                valor, pos = _leer_varint(trama, pos)
+                dispositivo["power"] = _dezigzag(valor) / 10
+        self.seq = seq
+        return True
@@ -0,0 +1,105 @@
+"""
+Historial de consumo por minuto.
+
+Una vez por minuto (alineado al inicio del minuto) se toma la potencia y el
+estado en vivo de cada dispositivo online y se agregan a la tabla consumos con
+COPY, en una sola operación por muestreo. Los dispositivos offline no generan
+muestra: el hueco en la serie indica que no hubo datos.
+
+Junto con la potencia se guarda el contador de energía del dispositivo (Wh),
+cuando lo reporta: permite calcular la energía exacta aun a través de huecos.
+"""
+
+import io
+import logging
+import time
+from datetime import datetime, timezone
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del historial
+INTERVALO = 60                  # Segundos entre muestras
+
+Muestra = Tuple[int, float, Optional[bool], Optional[float]]   # (dispositivo_id, potencia, estado, energía Wh)
+
+
+def energia_contador(medidor: Dict[str, Any]) -> Optional[float]:
+    """
+    Contador de energía acumulada en Wh de un medidor ('meters' del adaptador)
+
+    Gen2 reporta aenergy.total en Wh; Gen1 reporta total en watt-minuto.
+    """
+    aenergy = medidor.get("aenergy")
+    if isinstance(aenergy, dict) and aenergy.get("total") is not None:
+        return float(aenergy["total"])
+    if medidor.get("total") is not None:
+        return float(medidor["total"]) / 60
+    return None
+
+
+class RegistroConsumos:
+    """
+    Muestreo periódico de la potencia de la flota hacia la tabla consumos
+    """
+    def __init__(self, conectar: Callable[[], Any], muestrear: Callable[[], Iterable[Muestra]],
+                 intervalo: int = INTERVALO):
+        """
+        Args:
+            conectar: Devuelve una conexión psycopg2
+            muestrear: Devuelve (dispositivo_id, potencia, estado, energía) de los dispositivos online
+            intervalo: Segundos entre muestras
+        """
+        self.conectar = conectar
+        self.muestrear = muestrear
+        self.intervalo = intervalo
+        self.ultimo: Optional[datetime] = None
+        self._thread: Optional[Thread] = None
+
+    def registrar(self, instante: datetime, muestras: Iterable[Muestra]) -> int:
+        """
+        Agrega las muestras de un instante
+
+        Returns:
+            Filas escritas
+        """
+        buffer = io.StringIO()
+        filas = 0
+        marca = instante.isoformat()
+        for dispositivo_id, potencia, estado, energia in muestras:
+            estado_texto = "\\N" if estado is None else ("t" if estado else "f")
+            energia_texto = "\\N" if energia is None else float(energia)
+            buffer.write(f"{dispositivo_id}\t{marca}\t{float(potencia or 0)}\t{estado_texto}\t{energia_texto}\n")
+            filas += 1
+        if not filas:
+            return 0
+        buffer.seek(0)
+        conn = self.conectar()
+        try:
+            cursor = conn.cursor()
+            cursor.copy_expert("COPY consumos (dispositivo_id, instante, potencia, estado, energia) FROM STDIN", buffer)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self.ultimo = instante
+        return filas
+
+    def iniciar(self):
+        """
+        Lanza el thread que muestrea al comienzo de cada intervalo
+        """
+        def bucle():
+            while True:
+                ahora = time.time()
+                time.sleep(self.intervalo - ahora % self.intervalo)
+                instante = datetime.fromtimestamp(time.time() // self.intervalo * self.intervalo, timezone.utc)
+                try:
+                    self.registrar(instante, self.muestrear())
+                except Exception as e:
+                    logger.error(f"Error registrando el historial de consumo: {e}")
+
+        if self._thread is None:
+            self._thread = Thread(target=bucle, daemon=True)
+            self._thread.start()
@@ -1,7 +1,8 @@
 import requests
 from flask import Blueprint, jsonify, request
 import logging
-from shelly_interface import ShellyInterface
+from shelly_interface import shared_interface
+from espejo_firmware import espejo_compartido, FirmwareInvalido
 
 # Inicializar blueprint para rutas de firmware
 firmware_bp = Blueprint('firmware', __name__, url_prefix='/api/shelly')
@@ -9,8 +10,14 @@ firmware_bp = Blueprint('firmware', __name__, url_prefix='/api/shelly')
 # Inicializar el logger
 logger = logging.getLogger(__name__)
 
-# Inicializar la interfaz Shelly
-shelly_interface = ShellyInterface()
+# 📌 Consultas OTA directas al dispositivo: (segundos frescas, segundos servidas mientras se renuevan)
+CACHE_OTA = (60.0, 600.0)
+
+# Interfaz Shelly compartida con app.py (un solo listener por adaptador)
+shelly_interface = shared_interface()
+
+# Espejo local de imágenes de firmware
+espejo = espejo_compartido()
 
 @firmware_bp.route('/firmware_global', methods=['GET'])
 def get_firmware_global():
@@ -81,9 +88,9 @@ def device_firmware_check(device_id):
         if not ip:
             return jsonify({"error": "IP del dispositivo no disponible"}), 400
         
-        # Consultar directamente al dispositivo
-        response = requests.get(f"http://{ip}/ota/check", timeout=5)
-        return jsonify(response.json())
+        # Consultar directamente al dispositivo, una sola vez por intervalo aunque lo pidan varios usuarios
+        return jsonify(shelly_interface.cache.obtener(
+            ("ota", ip), lambda: requests.get(f"http://{ip}/ota/check", timeout=5).json(), *CACHE_OTA))
     except Exception as e:
         logger.error(f"Error al verificar firmware para dispositivo {device_id}: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -103,9 +110,19 @@ def update_device_firmware(device_id):
             return jsonify({"error": "IP del dispositivo no disponible"}), 400
         
         # Obtener URL del firmware si se ha proporcionado
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         firmware_url = data.get('url')
         
+        # La imagen se baja una sola vez al espejo local y los dispositivos la toman de ahí
+        modelo = data.get('model') or device_info.get('model') or device_info.get('type')
+        if modelo and (not firmware_url or data.get('version')):
+            try:
+                imagen = espejo.asegurar(modelo, data.get('version'), firmware_url, data.get('sha256'))
+                firmware_url = espejo.url_publica(imagen['modelo'], imagen['version'], request.host_url)
+            except (FirmwareInvalido, requests.RequestException) as e:
+                # Sin espejo el dispositivo sigue pudiendo actualizarse desde la URL pedida o la nube
+                logger.warning(f"Espejo de firmware no disponible para {modelo}: {e}")
+        
         if firmware_url:
             # Actualizar con una URL específica
             payload = {"url": firmware_url}
@@ -114,6 +131,9 @@ def update_device_firmware(device_id):
             # Actualizar usando el servidor de Shelly (por defecto)
             response = requests.post(f"http://{ip}/ota/update", timeout=5)
             
+        if response.ok:
+            # Se invalida con la orden ya aceptada: antes, una consulta concurrente volvería a guardar la versión vieja
+            shelly_interface.cache.invalidar(("ota", ip), ("firmware", device_id), ("info", device_id), ("estado", device_id))
         return jsonify(response.json())
     except Exception as e:
         logger.error(f"Error al actualizar firmware para dispositivo {device_id}: {str(e)}")
@@ -0,0 +1,294 @@
+"""
+Seguimiento de disponibilidad (salud) de los dispositivos Shelly.
+
+Cada fuente de eventos (listener del adaptador, sondeo directo, anuncios
+CoIoT/mDNS) informa cuándo vio un dispositivo. Los vencimientos para marcarlo
+offline se guardan en una rueda de temporizadores: cada tick sólo recorre la
+ranura actual, así que detectar N dispositivos caídos cuesta O(N vencidos) y no
+hace falta un thread ni un timer por dispositivo.
+"""
+
+import logging
+import math
+import time
+from collections import deque
+from threading import Lock, Thread
+from typing import Any, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 📌 Segundos sin noticias de un dispositivo para darlo por offline, según la fuente
+TIMEOUTS = {
+    "adapter": 30,
+    "poll": 150,
+    "coiot": 60,
+    "mdns": 300,
+}
+TIMEOUT_DEFECTO = 90
+RESOLUCION = 1.0             # Segundos por tick de la rueda
+VENTANA_FLAPS = 3600         # Ventana para calcular cambios de estado por hora
+
+
+class RuedaTemporizadores:
+    """
+    Rueda de temporizadores (hashed timing wheel) con cancelación O(1)
+    """
+    def __init__(self, resolucion: float = RESOLUCION, ranuras: int = 512):
+        """
+        Args:
+            resolucion: Segundos por ranura
+            ranuras: Número de ranuras; con resolucion * ranuras mayor que el timeout
+                     más largo, cada ranura sólo contiene claves que vencen en ese tick
+        """
+        self.resolucion = resolucion
+        self._ranuras = [set() for _ in range(ranuras)]
+        self._vencimientos: Dict[Hashable, int] = {}
+        self._tick_actual = int(time.monotonic() // resolucion)
+
+    def __len__(self):
+        return len(self._vencimientos)
+
+    def programar(self, clave: Hashable, vencimiento: float):
+        """
+        Programa (o reprograma) el vencimiento de una clave
+
+        Args:
+            clave: Identificador del temporizador
+            vencimiento: Instante (time.monotonic) en que vence
+        """
+        tick = max(math.ceil(vencimiento / self.resolucion), self._tick_actual + 1)
+        self.cancelar(clave)
+        self._vencimientos[clave] = tick
+        self._ranuras[tick % len(self._ranuras)].add(clave)
+
+    def vencimiento(self, clave: Hashable) -> Optional[float]:
+        tick = self._vencimientos.get(clave)
+        return tick * self.resolucion if tick is not None else None
+
+    def cancelar(self, clave: Hashable):
+        tick = self._vencimientos.pop(clave, None)
+        if tick is not None:
+            self._ranuras[tick % len(self._ranuras)].discard(clave)
+
+    def avanzar(self, ahora: float) -> List[Hashable]:
+        """
+        Avanza la rueda hasta `ahora` y devuelve las claves vencidas
+        """
+        objetivo = int(ahora // self.resolucion)
+        vencidas = []
+        # Si el proceso estuvo detenido más de una vuelta basta con recorrer cada ranura una vez
+        ultimo = min(objetivo, self._tick_actual + len(self._ranuras))
+        for tick in range(self._tick_actual + 1, ultimo + 1):
+            indice = tick % len(self._ranuras)
+            ranura = self._ranuras[indice]
+            if not ranura:
+                continue
+            pendientes = set()
+            for clave in ranura:
+                if self._vencimientos[clave] <= objetivo:
+                    del self._vencimientos[clave]
+                    vencidas.append(clave)
+                else:
+                    pendientes.add(clave)  # Vence en una vuelta posterior
+            self._ranuras[indice] = pendientes
+        self._tick_actual = max(self._tick_actual, objetivo)
+        return vencidas
+
+
+class _Salud:
+    __slots__ = ("ultimo_visto", "fuente", "online", "primer_visto", "desde", "online_acumulado", "cambios")
+
+    def __init__(self, ahora: float):
+        self.ultimo_visto = ahora
+        self.fuente = None
+        self.online = True
+        self.primer_visto = ahora
+        self.desde = ahora              # Inicio del estado actual
+        self.online_acumulado = 0.0     # Segundos online antes del estado actual
+        self.cambios = deque()          # Instantes de cambios de estado dentro de la ventana
+
+
+class SaludDispositivos:
+    """
+    Registro de la última vez que se vio cada dispositivo, con detección de caídas y flapping
+    """
+    def __init__(self, timeouts: Optional[Dict[str, float]] = None):
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.rueda = RuedaTemporizadores(ranuras=int(max(self.timeouts.values()) / RESOLUCION) + 16)
+        self.dispositivos: Dict[str, _Salud] = {}
+        self.event_listeners = []
+        self._lock = Lock()
+
+    def add_event_listener(self, event_type: str, callback):
+        """
+        Agrega un listener para eventos de salud ('deviceOnline', 'deviceOffline')
+
+        Args:
+            event_type: Tipo de evento a escuchar
+            callback: Función a llamar cuando ocurra el evento
+        """
+        self.event_listeners.append((event_type, callback))
+
+    def _notify_listeners(self, event_type: str, data: Any):
+        for listener_type, callback in self.event_listeners:
+            if listener_type == event_type:
+                try:
+                    callback(data)
+                except Exception as e:
+                    logger.error(f"Error en event listener: {e}")
+
+    def iniciar(self):
+        """
+        Lanza el thread que avanza la rueda una vez por tick
+        """
+        def ticker():
+            while True:
+                time.sleep(RESOLUCION)
+                try:
+                    self.tick()
+                except Exception as e:
+                    logger.error(f"Error en el tick de salud: {e}")
+
+        thread = Thread(target=ticker, daemon=True)
+        thread.start()
+
+    def registrar_visto(self, ip: str, fuente: str, online: bool = True):
+        """
+        Registra que una fuente vio el dispositivo (o que lo reporta offline)
+
+        Args:
+            ip: IP del dispositivo (clave común a todas las fuentes)
+            fuente: "adapter", "poll", "coiot", "mdns"...
+            online: False si la fuente informa explícitamente que no responde
+        """
+        if not ip:
+            return
+        ahora = time.monotonic()
+        evento = None
+        with self._lock:
+            salud = self.dispositivos.get(ip)
+            if salud is None:
+                # Primer avistamiento: no se notifica para no inundar a los clientes al arrancar
+                salud = self.dispositivos[ip] = _Salud(ahora)
+                salud.online = online
+            elif salud.online != online:
+                self._cambiar_estado(salud, online, ahora)
+                evento = "deviceOnline" if online else "deviceOffline"
+
+            if online:
+                salud.ultimo_visto = ahora
+                salud.fuente = fuente
+                vencimiento = ahora + self.timeouts.get(fuente, TIMEOUT_DEFECTO)
+                # Si otra fuente con timeout más largo ya lo cubre, se respeta el vencimiento mayor
+                actual = self.rueda.vencimiento(ip)
+                if actual is None or actual < vencimiento:
+                    self.rueda.programar(ip, vencimiento)
+            else:
+                self.rueda.cancelar(ip)
+
+        if evento:
+            self._notify_listeners(evento, self._como_dict(ip, salud, time.monotonic()))
+
+    def exportar_estado(self) -> Dict[str, List]:
+        """
+        Estado de cada dispositivo con los instantes en hora de pared (los monotónicos no sobreviven a un reinicio)
+        """
+        desfase = time.time() - time.monotonic()
+        with self._lock:
+            return {
+                ip: [salud.online, salud.fuente, salud.ultimo_visto + desfase, salud.primer_visto + desfase,
+                     salud.desde + desfase, salud.online_acumulado, [t + desfase for t in salud.cambios]]
+                for ip, salud in self.dispositivos.items()
+            }
+
+    def restaurar_estado(self, estado: Dict[str, List]):
+        """
+        Restaura la salud guardada: los dispositivos online reciben un plazo completo para volver
+        a reportarse y los que vuelven distinto de como estaban generan eventos reales
+        """
+        ahora = time.monotonic()
+        desfase = time.time() - ahora
+        with self._lock:
+            for ip, (online, fuente, ultimo_visto, primer_visto, desde, online_acumulado, cambios) in estado.items():
+                if ip in self.dispositivos:
+                    continue
+                salud = self.dispositivos[ip] = _Salud(ahora)
+                salud.online = online
+                salud.fuente = fuente
+                salud.ultimo_visto = ultimo_visto - desfase
+                salud.primer_visto = primer_visto - desfase
+                salud.desde = desde - desfase
+                salud.online_acumulado = online_acumulado
+                salud.cambios.extend(t - desfase for t in cambios if t - desfase >= ahora - VENTANA_FLAPS)
+                if online:
+                    self.rueda.programar(ip, ahora + self.timeouts.get(fuente, TIMEOUT_DEFECTO))
+
+    def _cambiar_estado(self, salud: _Salud, online: bool, ahora: float):
+        if salud.online:
+            salud.online_acumulado += ahora - salud.desde
+        salud.online = online
+        salud.desde = ahora
+        salud.cambios.append(ahora)
+        while salud.cambios and salud.cambios[0] < ahora - VENTANA_FLAPS:
+            salud.cambios.popleft()
+
+    def tick(self) -> List[str]:
+        """
+        Marca offline los dispositivos cuyo plazo venció
+
+        Returns:
+            IPs que pasaron a offline en este tick
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            vencidas = self.rueda.avanzar(ahora)
+            for ip in vencidas:
+                self._cambiar_estado(self.dispositivos[ip], False, ahora)
+            eventos = [self._como_dict(ip, self.dispositivos[ip], ahora) for ip in vencidas]
+        for evento in eventos:
+            self._notify_listeners("deviceOffline", evento)
+        return vencidas
+
+    def _como_dict(self, ip: str, salud: _Salud, ahora: float) -> Dict[str, Any]:
+        total = ahora - salud.primer_visto
+        online = salud.online_acumulado + (ahora - salud.desde if salud.online else 0)
+        recientes = sum(1 for t in salud.cambios if t >= ahora - VENTANA_FLAPS)
+        return {
+            "ip": ip,
+            "online": salud.online,
+            "fuente": salud.fuente,
+            "ultimo_visto_hace": round(ahora - salud.ultimo_visto, 1),
+            "estado_desde_hace": round(ahora - salud.desde, 1),
+            "flaps_por_hora": round(recientes * 3600 / min(VENTANA_FLAPS, max(total, 60)), 2),
+            "disponibilidad": round(100 * online / total, 2) if total > 0 else 100.0,
+        }
+
+    def esta_online(self, ip: str) -> Optional[bool]:
+        """
+        Devuelve el estado conocido sin hacer peticiones (None si nunca se vio)
+        """
+        salud = self.dispositivos.get(ip)
+        return salud.online if salud else None
+
+    def resumen(self, solo_offline: bool = False) -> Dict[str, Any]:
+        """
+        Vista de toda la flota
+
+        Args:
+            solo_offline: Si es True sólo incluye los dispositivos offline
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            dispositivos = [
+                self._como_dict(ip, salud, ahora)
+                for ip, salud in self.dispositivos.items()
+                if not (solo_offline and salud.online)
+            ]
+            total = len(self.dispositivos)
+            online = sum(1 for s in self.dispositivos.values() if s.online)
+        return {
+            "total": total,
+            "online": online,
+            "offline": total - online,
+            "dispositivos": dispositivos,
+        }
@@ -0,0 +1,97 @@
+"""
+Seguimiento compartido de archivos de log para los streams SSE.
+
+Un único thread lee el archivo y reparte cada línea nueva a las colas de los
+suscriptores, en lugar de que cada visor abra el archivo y lo sondee por su
+cuenta. Las colas son acotadas: un cliente lento pierde líneas pero no hace
+crecer la memoria del proceso.
+
+Cuando la rotación renombra el archivo, el seguidor termina de leer el viejo y
+continúa desde el principio del nuevo.
+"""
+
+import logging
+import os
+import queue
+import time
+from threading import Lock, Thread
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del seguidor
+INTERVALO = 1.0                 # Segundos entre lecturas cuando no hay líneas nuevas
+MAX_PENDIENTES = 1000           # Líneas en cola por suscriptor antes de descartar
+
+
+class SeguidorLog:
+    """
+    Lector único de un archivo que difunde las líneas nuevas a varios suscriptores
+    """
+    def __init__(self, ruta: str, intervalo: float = INTERVALO, max_pendientes: int = MAX_PENDIENTES):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self.suscriptores = set()
+        self.descartadas = 0
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def suscribir(self) -> queue.Queue:
+        """
+        Devuelve una cola que recibirá las líneas escritas a partir de ahora
+        """
+        cola = queue.Queue(maxsize=self.max_pendientes)
+        with self._lock:
+            self.suscriptores.add(cola)
+            # El thread se lanza con el primer visor y no vuelve a abrir el archivo por cada uno
+            if self._thread is None:
+                self._thread = Thread(target=self._seguir, daemon=True)
+                self._thread.start()
+        return cola
+
+    def desuscribir(self, cola: queue.Queue):
+        with self._lock:
+            self.suscriptores.discard(cola)
+
+    def _seguir(self):
+        archivo = None
+        error_previo = False
+        while True:
+            try:
+                if archivo is None:
+                    archivo = open(self.ruta, "r")
+                    archivo.seek(0, 2)
+                    error_previo = False
+                linea = archivo.readline()
+                if not linea:
+                    if self._rotado(archivo):
+                        archivo.close()
+                        archivo = open(self.ruta, "r")
+                        continue
+                    time.sleep(self.intervalo)
+                    continue
+                with self._lock:
+                    suscriptores = list(self.suscriptores)
+                for cola in suscriptores:
+                    try:
+                        cola.put_nowait(linea)
+                    except queue.Full:
+                        self.descartadas += 1
+            except OSError as e:
+                # Se informa una sola vez mientras el archivo siga sin poder abrirse
+                if not error_previo:
+                    logger.error(f"Error siguiendo {self.ruta}: {e}")
+                error_previo = True
+                archivo = None
+                time.sleep(self.intervalo)
+
+    def _rotado(self, archivo) -> bool:
+        """
+        True si la ruta ya apunta a otro archivo (renombrado por la rotación) o fue truncada
+        """
+        try:
+            actual = os.stat(self.ruta)
+        except FileNotFoundError:
+            return False  # Entre el renombrado y la creación del nuevo: se sigue con el viejo
+        return actual.st_ino != os.fstat(archivo.fileno()).st_ino or actual.st_size < archivo.tell()
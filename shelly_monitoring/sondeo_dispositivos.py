@@ -0,0 +1,277 @@
+"""
+Sondeo directo de dispositivos Shelly por IP.
+
+Consulta /rpc/Shelly.GetStatus (Gen2) o /status (Gen1) directamente en cada
+dispositivo de la tabla `dispositivos` que el adaptador no reporta. Todo corre
+en un único loop asyncio dentro de un thread: un heap ordena los próximos
+sondeos, la concurrencia se limita por subred y el intervalo de cada
+dispositivo se adapta a su actividad (más rápido si el consumo cambia, más
+lento si está inactivo), con jitter para no sincronizar las peticiones.
+
+Las actualizaciones se publican desde un thread aparte, en orden: los listeners
+(base de datos, Socket.IO) no bloquean el loop del sondeo.
+"""
+
+import asyncio
+import heapq
+import ipaddress
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 📌 Configuración del sondeo
+INTERVALO_MIN = 2.0
+INTERVALO_MAX = 60.0
+INTERVALO_INICIAL = 10.0
+JITTER = 0.2                    # ±20% sobre cada intervalo
+TIMEOUT = 3.0
+CONCURRENCIA_POR_SUBRED = 16
+CONCURRENCIA_GLOBAL = 512
+PREFIJO_SUBRED = 24
+FALLOS_OFFLINE = 3              # Fallos seguidos para considerar el dispositivo offline
+UMBRAL_CAMBIO_W = 5.0           # Variación de potencia que se considera actividad
+SINCRONIZACION = 60.0           # Cada cuánto se recarga la lista de dispositivos
+
+
+async def http_get_json(ip: str, ruta: str, timeout: float = TIMEOUT) -> Tuple[int, Any]:
+    """
+    GET HTTP/1.1 mínimo sobre asyncio (sin dependencias externas)
+
+    Returns:
+        (código de estado, JSON decodificado o None)
+    """
+    lector, escritor = await asyncio.wait_for(asyncio.open_connection(ip, 80), timeout)
+    try:
+        escritor.write(f"GET {ruta} HTTP/1.1\r\nHost: {ip}\r\nConnection: close\r\n\r\n".encode())
+        await escritor.drain()
+        crudo = await asyncio.wait_for(lector.read(), timeout)
+    finally:
+        escritor.close()
+
+    cabecera, _, cuerpo = crudo.partition(b"\r\n\r\n")
+    lineas = cabecera.decode("latin-1").split("\r\n")
+    codigo = int(lineas[0].split(" ")[1])
+    cabeceras = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lineas[1:])}
+
+    if cabeceras.get("transfer-encoding", "").lower() == "chunked":
+        partes = []
+        while cuerpo:
+            tamano, _, resto = cuerpo.partition(b"\r\n")
+            n = int(tamano.split(b";")[0], 16)
+            if n == 0:
+                break
+            partes.append(resto[:n])
+            cuerpo = resto[n + 2:]
+        cuerpo = b"".join(partes)
+
+    if codigo != 200:
+        return codigo, None
+    return codigo, json.loads(cuerpo)
+
+
+def normalizar_estado(estado: Dict[str, Any], gen: int) -> Dict[str, Any]:
+    """
+    Convierte la respuesta de estado de un dispositivo al formato de eventos del adaptador
+
+    Returns:
+        Diccionario con 'state' y 'meters'
+    """
+    encendido = False
+    potencias = []
+    if gen == 1:
+        for clave in ("relays", "lights"):
+            if estado.get(clave):
+                encendido = bool(estado[clave][0].get("ison", False))
+                break
+        for clave in ("meters", "emeters"):
+            potencias.extend(m.get("power", 0) for m in estado.get(clave, []))
+    else:
+        for clave, valor in estado.items():
+            if not isinstance(valor, dict):
+                continue
+            componente = clave.split(":")[0]
+            if componente in ("switch", "light") and clave.endswith(":0"):
+                encendido = bool(valor.get("output", False))
+            if "apower" in valor:
+                potencias.append(valor["apower"])
+            elif componente == "em" and "total_act_power" in valor:
+                potencias.append(valor["total_act_power"])
+    return {"state": encendido, "meters": [{"power": p} for p in potencias] or [{"power": 0}]}
+
+
+class _Objetivo:
+    __slots__ = ("id", "ip", "gen", "subred", "intervalo", "fallos", "ultima_potencia", "ultimo_estado", "online", "programado")
+
+    def __init__(self, dispositivo: Dict[str, Any]):
+        self.id = dispositivo["id"]
+        self.ip = dispositivo["ip"]
+        self.gen = dispositivo.get("gen")
+        self.subred = str(ipaddress.ip_network(f"{self.ip}/{PREFIJO_SUBRED}", strict=False))
+        self.intervalo = INTERVALO_INICIAL
+        self.fallos = 0
+        self.ultima_potencia = None
+        self.ultimo_estado = None
+        self.online = None
+        self.programado = 0.0
+
+
+class SondeoDirecto:
+    """
+    Sondeo asíncrono de estado directamente contra las IPs de los dispositivos
+    """
+    def __init__(self, publicar: Callable[[Dict[str, Any]], None],
+                 proveedor: Callable[[], List[Dict[str, Any]]],
+                 visto: Optional[Callable[[str], None]] = None):
+        """
+        Inicializa el sondeo
+
+        Args:
+            publicar: Función que recibe cada actualización (mismo formato que los eventos del adaptador)
+            proveedor: Función bloqueante que devuelve los dispositivos a sondear ({'id', 'ip', 'gen'})
+            visto: Función opcional llamada con la IP tras cada sondeo exitoso, haya cambios o no
+        """
+        self.publicar = publicar
+        self.proveedor = proveedor
+        self.visto = visto
+        self.objetivos: Dict[str, _Objetivo] = {}
+        self.estados: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._semaforos: Dict[str, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._publicador = ThreadPoolExecutor(max_workers=1)
+
+    def iniciar(self):
+        """
+        Lanza el loop asyncio del sondeo en un thread propio
+        """
+        def ejecutar():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._principal())
+
+        thread = Thread(target=ejecutar, daemon=True)
+        thread.start()
+
+    def get_estados(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Devuelve el último estado conocido por IP
+        """
+        return dict(self.estados)
+
+    def sincronizar(self, dispositivos: List[Dict[str, Any]]):
+        """
+        Agrega los dispositivos nuevos y descarta los que ya no hay que sondear
+
+        Args:
+            dispositivos: Lista de dispositivos con 'id', 'ip' y opcionalmente 'gen'
+        """
+        ahora = time.monotonic()
+        vigentes = set()
+        for dispositivo in dispositivos:
+            ip = dispositivo["ip"]
+            vigentes.add(ip)
+            objetivo = self.objetivos.get(ip)
+            if objetivo is None:
+                objetivo = self.objetivos[ip] = _Objetivo(dispositivo)
+                # Repartir los primeros sondeos en el intervalo inicial
+                objetivo.programado = ahora + random.uniform(0, INTERVALO_INICIAL)
+                heapq.heappush(self._heap, (objetivo.programado, ip))
+            else:
+                objetivo.id = dispositivo["id"]
+        for ip in list(self.objetivos):
+            if ip not in vigentes:
+                # La entrada del heap se descarta sola al no coincidir con el objetivo
+                del self.objetivos[ip]
+                self.estados.pop(ip, None)
+
+    async def _principal(self):
+        global_sem = asyncio.Semaphore(CONCURRENCIA_GLOBAL)
+        proxima_sincronizacion = 0.0
+        while True:
+            ahora = time.monotonic()
+            if ahora >= proxima_sincronizacion:
+                try:
+                    dispositivos = await self._loop.run_in_executor(None, self.proveedor)
+                    self.sincronizar(dispositivos)
+                except Exception as e:
+                    logger.error(f"Error obteniendo dispositivos para el sondeo: {e}")
+                proxima_sincronizacion = ahora + SINCRONIZACION
+
+            while self._heap and self._heap[0][0] <= ahora:
+                programado, ip = heapq.heappop(self._heap)
+                objetivo = self.objetivos.get(ip)
+                if objetivo is not None and objetivo.programado == programado:
+                    asyncio.ensure_future(self._sondear(objetivo, global_sem))
+
+            espera = self._heap[0][0] - ahora if self._heap else 1.0
+            await asyncio.sleep(max(0.05, min(espera, 1.0, proxima_sincronizacion - ahora)))
+
+    async def _sondear(self, objetivo: _Objetivo, global_sem: asyncio.Semaphore):
+        semaforo = self._semaforos.setdefault(objetivo.subred, asyncio.Semaphore(CONCURRENCIA_POR_SUBRED))
+        actividad = False
+        try:
+            async with global_sem, semaforo:
+                estado = await self._consultar(objetivo)
+            objetivo.fallos = 0
+            if self.visto:
+                self.visto(objetivo.ip)
+            actualizacion = normalizar_estado(estado, objetivo.gen)
+            potencia = actualizacion["meters"][0]["power"]
+            actividad = (actualizacion["state"] != objetivo.ultimo_estado
+                         or objetivo.ultima_potencia is None
+                         or abs(potencia - objetivo.ultima_potencia) >= UMBRAL_CAMBIO_W)
+            objetivo.ultima_potencia = potencia
+            objetivo.ultimo_estado = actualizacion["state"]
+            self._emitir(objetivo, dict(actualizacion, online=True), forzar=actividad or objetivo.online is not True)
+            objetivo.online = True
+        except Exception as e:
+            objetivo.fallos += 1
+            logger.debug(f"Sondeo fallido en {objetivo.ip}: {e}")
+            if objetivo.fallos >= FALLOS_OFFLINE and objetivo.online is not False:
+                objetivo.online = False
+                self._emitir(objetivo, {"state": objetivo.ultimo_estado or False, "meters": [{"power": 0}], "online": False}, forzar=True)
+        finally:
+            self._reprogramar(objetivo, actividad)
+
+    async def _consultar(self, objetivo: _Objetivo) -> Dict[str, Any]:
+        if objetivo.gen != 1:
+            codigo, estado = await http_get_json(objetivo.ip, "/rpc/Shelly.GetStatus")
+            if estado is not None:
+                objetivo.gen = 2
+                return estado
+            if codigo != 404:
+                raise ConnectionError(f"HTTP {codigo}")
+        codigo, estado = await http_get_json(objetivo.ip, "/status")
+        if estado is None:
+            raise ConnectionError(f"HTTP {codigo}")
+        objetivo.gen = 1
+        return estado
+
+    def _emitir(self, objetivo: _Objetivo, actualizacion: Dict[str, Any], forzar: bool):
+        dispositivo = dict(actualizacion, id=objetivo.id, ip=objetivo.ip, gen=objetivo.gen, source="poll")
+        self.estados[objetivo.ip] = dispositivo
+        if forzar:
+            self._publicador.submit(self._publicar, dispositivo)
+
+    def _publicar(self, dispositivo: Dict[str, Any]):
+        try:
+            self.publicar(dispositivo)
+        except Exception as e:
+            logger.error(f"Error publicando estado de {dispositivo['ip']}: {e}")
+
+    def _reprogramar(self, objetivo: _Objetivo, actividad: bool):
+        if objetivo.fallos:
+            objetivo.intervalo = min(INTERVALO_MAX, objetivo.intervalo * 2)
+        elif actividad:
+            objetivo.intervalo = max(INTERVALO_MIN, objetivo.intervalo / 2)
+        else:
+            objetivo.intervalo = min(INTERVALO_MAX, objetivo.intervalo * 1.5)
+        espera = objetivo.intervalo * random.uniform(1 - JITTER, 1 + JITTER)
+        if self.objetivos.get(objetivo.ip) is objetivo:
+            objetivo.programado = time.monotonic() + espera
+            heapq.heappush(self._heap, (objetivo.programado, objetivo.ip))
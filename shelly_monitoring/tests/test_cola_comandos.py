@@ -0,0 +1,111 @@
+"""
+Cola de comandos: ráfagas con reintentos y latencia de la base de datos.
+"""
+
+import itertools
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cola_comandos
+from cola_comandos import ColaComandos
+
+
+class _Cursor:
+    def __init__(self, base):
+        self.base = base
+        self.filas = []
+
+    def execute(self, sentencia, parametros=()):
+        time.sleep(self.base.latencia)
+        if sentencia.startswith("WITH nuevos"):
+            claves, ids = parametros[0], parametros[1]
+            self.filas = [(next(self.base.ids), clave, id_, datetime.now()) for clave, id_ in zip(claves, ids)]
+        elif sentencia.startswith("UPDATE comandos SET status = %s"):
+            status, _, _, id_comando = parametros
+            with self.base.lock:
+                self.base.status[id_comando] = status
+            self.filas = []
+        else:
+            self.filas = []
+
+    def fetchall(self):
+        return self.filas
+
+    def close(self):
+        pass
+
+
+class _Conexion:
+    def __init__(self, base):
+        self.base = base
+
+    def cursor(self):
+        return _Cursor(self.base)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Base:
+    """
+    Tabla comandos en memoria: sólo registra el último status persistido de cada orden
+    """
+    def __init__(self, latencia):
+        self.latencia = latencia
+        self.ids = itertools.count(1)
+        self.status = {}
+        self.lock = threading.Lock()
+
+    def conectar(self):
+        return _Conexion(self)
+
+
+class TestRafagaConReintentos(unittest.TestCase):
+    def test_todas_las_ordenes_terminan(self):
+        base = _Base(latencia=0.005)
+        aplicados = {}
+        fallos = {}
+        lock = threading.Lock()
+
+        def enviar(clave, canal, estado):
+            # Los dos primeros envíos de cada dispositivo fallan: fuerza reintentos durante la ráfaga
+            with lock:
+                fallos[clave] = fallos.get(clave, 0) + 1
+                if fallos[clave] <= 2:
+                    return False
+                aplicados[(clave, canal)] = estado
+            return True
+
+        def leer_estado(clave, canal):
+            with lock:
+                return aplicados.get((clave, canal))
+
+        with mock.patch.object(cola_comandos, "BACKOFF_INICIAL", 0.01), \
+                mock.patch.object(cola_comandos, "BACKOFF_MAXIMO", 0.05), \
+                mock.patch.object(cola_comandos, "TIEMPO_CONFIRMACION", 0.05):
+            cola = ColaComandos(base.conectar, enviar, leer_estado, max_workers=8)
+            cola.iniciar()
+            for i in range(200):
+                cola.encolar(f"10.0.{i // 250}.{i % 250}", 0, True)
+
+            limite = time.monotonic() + 20
+            while cola.activos() and time.monotonic() < limite:
+                time.sleep(0.05)
+
+        self.assertEqual(cola.activos(), [])
+        self.assertEqual(len(base.status), 200)
+        self.assertEqual(set(base.status.values()), {"confirmado"})
+
+
+if __name__ == "__main__":
+    unittest.main()
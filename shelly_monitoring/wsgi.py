@@ -1,4 +1,5 @@
-from app import app, socketio
+import modo_asincrono
+from app import app, socketio, ASYNC_MODE
 
 if __name__ == "__main__":
-    socketio.run(app)
+    socketio.run(app, **modo_asincrono.opciones_servidor(ASYNC_MODE))